@@ -0,0 +1,398 @@
+'''
+Offline end-to-end DEP harness.
+
+Runs a full Dep.go (obtain -> koaxfr) over a synthetic night with local stand-ins for every
+external service and reports throughput:
+
+    - koa database: sqlite file with koatpx, koa_program, koa_pi, koa_ppp and koapi_send tables
+    - HTTP APIs: local replay server for telSchedule, proposalsAPI, koaAPI, db_api metrics,
+      the EPICS archiver (getData.json) and the IPAC ingest API
+    - koaxfr: fake rsync on PATH that copies to a local target dir
+
+The night is made by replicating a template FITS file (--template) to N frames with unique
+UTC/FRAMENO/OUTFILE values, or (by default) a synthetic HIRES mosaic.  Replay responses are
+generated to match the night, and can be replaced by recorded production responses with
+--recordings (JSON of "path:cmd" -> response, ie {"telSchedule.php:getSchedule": [...]}).
+
+Usage (from DEP root dir):
+    python cit/offline_harness.py [--instr=HIRES] [--utDate=2020-01-01] [--nfiles=1000] [--workDir=./harness_run]
+        [--template=file.fits] [--recordings=file.json] [--keywordTables=dir] [--clean]
+'''
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import threading
+import shutil
+import datetime as dt
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
+sys.path.append(ROOT_DIR)
+
+
+#stand-in koa tables (columns used by DEP)
+KOA_TABLES = {
+    'koatpx': '''create table if not exists koatpx (
+        instr varchar(15) not null, utdate date not null,
+        start_time varchar(15), files varchar(5), ondisk_stat varchar(15), ondisk_time varchar(15),
+        files_arch varchar(5), pi varchar(68), sdata varchar(15), sci_files varchar(5),
+        arch_stat varchar(15), arch_time varchar(15), size float, metadata_stat varchar(15),
+        dvdwrit_stat varchar(15), dvdsent_stat varchar(15), dvdsent_time varchar(15),
+        dvdstor_stat varchar(15), tpx_stat varchar(15),
+        primary key (instr, utdate))''',
+    'koa_program': '''create table if not exists koa_program (
+        semid varchar(15) primary key, piID int, progtitl varchar(255))''',
+    'koa_pi': '''create table if not exists koa_pi (
+        piID int primary key, pi_lastname varchar(64), pi_firstname varchar(64))''',
+    'koa_ppp': '''create table if not exists koa_ppp (
+        semid varchar(15), utdate date, propmin int)''',
+    'koapi_send': '''create table if not exists koapi_send (
+        semid varchar(15), instr varchar(15), utdate_beg date, utdate_end date,
+        send_data int, data_notified int, send_dvd int, dvd_notified int)''',
+}
+
+
+def create_standin_db(dbFile, programs=()):
+    '''
+    Creates sqlite stand-in for the koa database, seeded with programs
+    (list of dicts with semid, lastname, firstname, title, utdate, propmin).
+    '''
+    conn = sqlite3.connect(dbFile, isolation_level=None)
+    for query in KOA_TABLES.values(): conn.execute(query)
+    for i, p in enumerate(programs):
+        conn.execute('insert or replace into koa_pi values (?, ?, ?)', (i+1, p['lastname'], p['firstname']))
+        conn.execute('insert or replace into koa_program values (?, ?, ?)', (p['semid'], i+1, p['title']))
+        conn.execute('insert into koa_ppp values (?, ?, ?)', (p['semid'], p['utdate'], p['propmin']))
+    conn.close()
+    return dbFile
+
+
+def get_default_recordings(instr, utDate, telnr, program):
+    '''
+    Replay responses for a night with one scheduled program.
+    '''
+    return {
+        'telSchedule.php:getNightStaff': [{'Type': 'oa', 'Alias': 'harness'}],
+        'telSchedule.php:getSchedule'  : [{'SchedId': '1', 'Account': program['account'], 'Institution': program['inst'],
+                                           'Principal': program['lastname'], 'ProjCode': program['semid'].split('_')[-1],
+                                           'StartTime': '17:00', 'EndTime': '07:00', 'Instrument': instr,
+                                           'TelNr': str(telnr)}],
+        'telSchedule.php:getObservers' : [{'Observers': 'Harness'}],
+        'telSchedule.php:getTelnr'     : [{'TelNr': str(telnr)}],
+        'proposalsAPI.php:getAllocInst': {'success': 1, 'data': {'AllocInst': program['inst']}},
+        'koaAPI.php:getPsfr'           : [],
+        'metrics.php'                  : [{'sunset': '04:50', 'midpoint': '10:30', 'sunrise': '16:10'}],
+        'ingest'                       : {'stat': 'OK'},
+    }
+
+
+class ReplayServer:
+    '''
+    Local HTTP server that replays recorded API responses.  Responses are looked up by
+    "<last path part>:<cmd>" then "<last path part>".  Archiver getData.json requests without a
+    recording get a generated series (one sample per minute) for the requested pv and time range.
+    '''
+
+    def __init__(self, recordings, host='127.0.0.1', port=0):
+        self.recordings = recordings
+        self.counts = {}
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, body = server.get_response(self.path)
+                data = json.dumps(body).encode('utf8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.url = f'http://{host}:{self.httpd.server_address[1]}'
+        self.thread = None
+
+
+    def get_response(self, path):
+        url = urlparse(path)
+        query = parse_qs(url.query)
+        name = url.path.rstrip('/').split('/')[-1]
+        cmd = query.get('cmd', [''])[0]
+        key = f'{name}:{cmd}' if cmd else name
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+        if key in self.recordings : return 200, self.recordings[key]
+        if name in self.recordings: return 200, self.recordings[name]
+        if name == 'getData.json' : return 200, self.get_archiver_data(query)
+        return 404, {'error': f'no recording for {key}'}
+
+
+    def get_archiver_data(self, query):
+        pv = query.get('pv', [''])[0]
+        recKey = f'getData.json:{pv}'
+        if recKey in self.recordings: return self.recordings[recKey]
+        t1 = dt.datetime.strptime(query['from'][0], '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=dt.timezone.utc).timestamp()
+        t2 = dt.datetime.strptime(query['to'][0], '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=dt.timezone.utc).timestamp()
+        seed = sum(ord(c) for c in pv) % 50
+        data = [{'secs': int(t), 'nanos': 0, 'val': round(seed + (int(t) // 60) % 10 * 0.1, 2)}
+                for t in range(int(t1) - int(t1) % 60, int(t2) + 1, 60)]
+        return [{'meta': {'name': pv}, 'data': data}]
+
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+FAKE_RSYNC = '''#!{python}
+"""Fake rsync for the offline harness: copies SRC to DEST, where DEST may be [user@]host:path.
+Supports anchored --exclude=/path, --files-from=file and prints --stats totals."""
+import os, sys, shutil
+args = [a for a in sys.argv[1:] if not a.startswith('-')]
+excludes = [a.split('=', 1)[1].strip('/') for a in sys.argv[1:] if a.startswith('--exclude=')]
+filesFrom = [a.split('=', 1)[1] for a in sys.argv[1:] if a.startswith('--files-from=')]
+src, dest = args[-2], args[-1]
+if ':' in dest: dest = dest.split(':', 1)[1]
+os.makedirs(dest, exist_ok=True)
+root = src if src.endswith('/') else os.path.dirname(src.rstrip('/'))
+target = dest if src.endswith('/') else os.path.join(dest, os.path.basename(src.rstrip('/')))
+copied = []
+def ignore(path, names):
+    return [n for n in names if os.path.relpath(os.path.join(path, n), root) in excludes]
+def copy(s, d):
+    copied.append(os.path.getsize(s))
+    return shutil.copy2(s, d)
+if filesFrom:
+    for path in open(filesFrom[0]).read().split():
+        os.makedirs(os.path.dirname(os.path.join(dest, path)), exist_ok=True)
+        copy(os.path.join(src, path), os.path.join(dest, path))
+else:
+    shutil.copytree(src, target, ignore=ignore, copy_function=copy, dirs_exist_ok=True)
+print(f'sent {{len(copied)}} files')
+if '--stats' in sys.argv:
+    print(f'Number of regular files transferred: {{len(copied):,}}')
+    print(f'Total transferred file size: {{sum(copied):,}} bytes')
+    print(f'Total bytes sent: {{sum(copied):,}}')
+'''
+
+
+def write_fake_rsync(binDir):
+    '''
+    Writes fake rsync executable to binDir (put binDir first on PATH).
+    '''
+    os.makedirs(binDir, exist_ok=True)
+    rsync = os.path.join(binDir, 'rsync')
+    with open(rsync, 'w') as f: f.write(FAKE_RSYNC.format(python=sys.executable))
+    os.chmod(rsync, 0o755)
+    return rsync
+
+
+def make_synthetic_hires(outFile, hdr, size=(1024, 256)):
+    '''
+    Minimal HIRES-like mosaic: primary header plus 3 CCD image extensions.
+    '''
+    import numpy as np
+    from astropy.io import fits
+    rng = np.random.default_rng(1)
+    hdus = [fits.PrimaryHDU(header=fits.Header(hdr))]
+    for amp in range(1, 4):
+        ext = fits.ImageHDU(rng.normal(1000, 30, size).astype(np.int16))
+        ext.header['AMPLOC'] = str(amp)
+        ext.header['CCDLOC'] = str(amp)
+        hdus.append(ext)
+    fits.HDUList(hdus).writeto(outFile, overwrite=True)
+
+
+def get_hires_header(utDate, program):
+    return {
+        'INSTRUME': 'HIRES: High Resolution Echelle Spectrometer', 'DATE-OBS': utDate, 'UTC': '08:00:00.00',
+        'UTC-END': '08:05:00.00', 'OUTFILE': 'hires', 'FRAMENO': 1, 'OUTDIR': '/s/sdata125/hires1/harness',
+        'PROGNAME': program['semid'].split('_')[-1], 'OBJECT': 'harness', 'BINNING': '1,1', 'PRECOL': 12,
+        'POSTPIX': 80, 'XDISPERS': 'RED', 'TTIME': 300.0, 'ELAPTIME': 300.0, 'AUTOSHUT': True,
+        'LAMPNAME': 'none', 'LMIRRIN': False, 'HATCLOS': False, 'HATOPEN': True, 'DARKCLOS': False,
+        'DECKNAME': 'C5', 'XCOVCLOS': False, 'ECOVCLOS': False, 'TEMPDET': -130.0, 'SLITWID': 0.86,
+        'SATURATE': 65535, 'MOSMODE': 'B, G, R', 'IROT2ANG': 0.0, 'EL': 60.0, 'CCDGAIN': 'low',
+        'CATCUR1': 1.0, 'CATCUR2': 1.0, 'AMPMODE': 'SINGLE:B', 'ERAMODE': 'normal', 'IMAGETYP': 'object',
+        'PARANG': 0.0, 'PEXPTIME': 0, 'PEXPELAP': 0,
+    }
+
+
+def make_night(searchDir, instr, utDate, nfiles, program, template=None):
+    '''
+    Writes nfiles raw frames to searchDir, one every 30 secs from 06:00 UT on utDate.
+    '''
+    from astropy.io import fits
+    os.makedirs(searchDir, exist_ok=True)
+    if template:
+        tmpl = fits.open(template)
+    else:
+        assert instr == 'HIRES', 'Synthetic night is only available for HIRES.  Use --template for other instruments.'
+        tmplFile = os.path.join(searchDir, '_template.fits')
+        make_synthetic_hires(tmplFile, get_hires_header(utDate, program))
+        tmpl = fits.open(tmplFile)
+
+    start = dt.datetime.strptime(utDate + ' 06:00:00', '%Y-%m-%d %H:%M:%S')
+    for i in range(nfiles):
+        ut = start + dt.timedelta(seconds=30 * i)
+        hdr = tmpl[0].header
+        hdr['DATE-OBS'] = utDate
+        hdr['UTC'] = ut.strftime('%H:%M:%S.00')
+        hdr['UT']  = ut.strftime('%H:%M:%S.00')
+        hdr['FRAMENO'] = i + 1
+        hdr['OUTFILE'] = instr.lower()
+        if 'KOAID' in hdr: del hdr['KOAID']
+        outFile = os.path.join(searchDir, f'{instr.lower()}{i+1:04d}.fits')
+        tmpl.writeto(outFile, overwrite=True, output_verify='silentfix')
+        mtime = ut.replace(tzinfo=dt.timezone.utc).timestamp()
+        os.utime(outFile, (mtime, mtime))
+    tmpl.close()
+    if not template: os.remove(tmplFile)
+
+
+def write_keyword_table(tablesDir, instr, searchDir):
+    '''
+    Minimal KOA keyword table (KOAID plus raw header keywords) when no --keywordTables dir is given.
+    '''
+    from astropy.io import fits
+    from glob import glob
+    os.makedirs(tablesDir, exist_ok=True)
+    first = sorted(glob(os.path.join(searchDir, '*.fits')))[0]
+    keys = ['KOAID'] + [k for k in fits.getheader(first) if k and k not in ('SIMPLE', 'EXTEND', 'COMMENT', 'HISTORY', 'KOAID')]
+    cols = ['FITSKeyword', 'MetadataDatatype', 'NullsAllowed', 'MetadataWidth', 'MinValue', 'MaxValue',
+            'Source', 'InputFormat', 'ValidateFormat', 'CheckValues', 'DiscreteValues']
+    with open(os.path.join(tablesDir, f'KOA_{instr}_Keyword_Table.txt'), 'w') as f:
+        f.write('\t'.join(cols) + '\n')
+        for key in keys:
+            f.write('\t'.join([key, 'char', 'Y', '68', '', '', 'FITS', 'char', 'N', 'N', '']) + '\n')
+
+
+def write_config(workDir, instr, replayUrl, dbFile, tablesDir, searchDir, targetDir, rootDir):
+    '''
+    Writes config.live.ini (see config.ini) pointing every service at the stand-ins.
+    '''
+    import yaml
+    dbConfig = {'server': dbFile, 'user': '', 'pwd': '', 'port': 0, 'type': 'sqlite'}
+    config = {
+        'RUNTIME' : {'DEV': 1},
+        'INFO'    : {'DEP_VERSION': 'harness'},
+        'DATABASE': {'koa': dict(dbConfig), 'keckOperations': dict(dbConfig)},
+        'API'     : {
+            'TELAPI'   : f'{replayUrl}/telSchedule.php?',
+            'PROPAPI'  : f'{replayUrl}/proposalsAPI.php?',
+            'KOAAPI'   : f'{replayUrl}/koaAPI.php?',
+            'INGESTAPI': f'{replayUrl}/ingest?',
+            'DBAPI'    : f'{replayUrl}/',
+        },
+        instr     : {'ROOTDIR': rootDir},
+        'KOAXFR'  : {'EMAILTO': '', 'EMAILFROM': '', 'EMAILERROR': '', 'SERVER': 'localhost',
+                     'ACCOUNT': 'koa', 'DIR': targetDir},
+        'MISC'    : {'METADATA_TABLES_DIR': tablesDir, 'WEATHER_ARCHIVER': replayUrl, 'ASSIGN_PROGNAME': ''},
+        'LOCATE'  : {'SEARCH_DIR': searchDir, 'MODTIME_OVERRIDE': 1},
+        'REPORT'  : {'ADMIN_EMAIL': ''},
+    }
+    configFile = os.path.join(workDir, 'config.live.ini')
+    with open(configFile, 'w') as f: yaml.safe_dump(config, f)
+    return configFile
+
+
+def count_files(path, endswith):
+    return sum(1 for _, _, files in os.walk(path) for f in files if f.endswith(endswith))
+
+
+def run_harness(args):
+
+    instr = args.instr.upper()
+    workDir = os.path.abspath(args.workDir)
+    if os.path.isdir(workDir):
+        assert args.clean, f'{workDir} exists (use --clean to remove it)'
+        shutil.rmtree(workDir)
+    dirs = {d: os.path.join(workDir, d) for d in ('sdata', 'root', 'target', 'bin', 'tables')}
+    for d in dirs.values(): os.makedirs(d)
+
+    program = {'semid': '2019B_H123', 'account': 'hires1', 'inst': 'UC', 'lastname': 'Harness',
+               'firstname': 'Test', 'title': 'Offline harness program', 'utdate': args.utDate, 'propmin': 18}
+
+    #stand-ins
+    print(f'Creating {args.nfiles} {instr} frames in {dirs["sdata"]}')
+    make_night(dirs['sdata'], instr, args.utDate, args.nfiles, program, args.template)
+    dbFile = create_standin_db(os.path.join(workDir, 'koa.sqlite'), [program])
+    recordings = get_default_recordings(instr, args.utDate, args.telnr, program)
+    if args.recordings:
+        with open(args.recordings) as f: recordings.update(json.load(f))
+    replay = ReplayServer(recordings).start()
+    write_fake_rsync(dirs['bin'])
+    tablesDir = args.keywordTables if args.keywordTables else dirs['tables']
+    if not args.keywordTables: write_keyword_table(tablesDir, instr, dirs['sdata'])
+    write_config(workDir, instr, replay.url, dbFile, tablesDir, dirs['sdata'], dirs['target'], dirs['root'])
+
+    #run full DEP in work dir (config.live.ini is read from cwd)
+    os.environ['PATH'] = dirs['bin'] + os.pathsep + os.environ['PATH']
+    cwd = os.getcwd()
+    os.chdir(workDir)
+    ok = False
+    start = time.time()
+    try:
+        from dep import Dep
+        dep = Dep(instr, args.utDate, tpx=1)
+        ok = dep.go('obtain', 'koaxfr')
+    finally:
+        secs = time.time() - start
+        os.chdir(cwd)
+        replay.stop()
+
+    #report
+    conn = sqlite3.connect(dbFile)
+    conn.row_factory = sqlite3.Row
+    tpx = conn.execute('select * from koatpx where instr=? and utdate=?', (instr, args.utDate)).fetchone()
+    instrDir = os.path.join(dirs['root'], instr)
+    result = {
+        'ok'             : bool(ok),
+        'instr'          : instr,
+        'utDate'         : args.utDate,
+        'nfiles'         : args.nfiles,
+        'secs'           : round(secs, 2),
+        'files_per_sec'  : round(args.nfiles / secs, 2) if secs else None,
+        'lev0_files'     : count_files(instrDir, '.fits.gz'),
+        'udf_files'      : count_files(os.path.join(instrDir, args.utDate.replace('-', ''), 'anc', 'udf'), '.fits'),
+        'transferred'    : count_files(dirs['target'], '.fits.gz'),
+        'replay_requests': replay.counts,
+        'koatpx'         : dict(tpx) if tpx else None,
+    }
+    with open(os.path.join(workDir, 'harness_result.json'), 'w') as f: json.dump(result, f, indent=2)
+    print(json.dumps(result, indent=2))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run DEP end to end over a synthetic night with offline stand-ins.')
+    parser.add_argument('--instr'        , type=str, default='HIRES')
+    parser.add_argument('--utDate'       , type=str, default='2020-01-01')
+    parser.add_argument('--telnr'        , type=int, default=1)
+    parser.add_argument('--nfiles'       , type=int, default=1000)
+    parser.add_argument('--workDir'      , type=str, default='./harness_run')
+    parser.add_argument('--template'     , type=str, default=None, help='Raw FITS file to replicate')
+    parser.add_argument('--recordings'   , type=str, default=None, help='JSON of recorded API responses')
+    parser.add_argument('--keywordTables', type=str, default=None, help='Dir of KOA_[INSTR]_Keyword_Table.txt files')
+    parser.add_argument('--clean'        , action='store_true', help='Remove existing work dir')
+    args = parser.parse_args()
+    result = run_harness(args)
+    sys.exit(0 if result['ok'] else 1)
+
+
+if __name__ == '__main__':
+    main()
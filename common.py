@@ -8,6 +8,8 @@ import glob
 import re
 import yaml
 import db_conn
+import resource_budget
+import run_profile
 
 def get_root_dirs(rootDir, instr, utDate):
     """
@@ -75,16 +77,18 @@ def removeFilesByWildcard(wildcardPath):
 
 
 
-def get_api_data(url, getOne=False, isJson=True):
+def get_api_data(url, getOne=False, isJson=True, timeout=None):
     '''
-    Gets data for common calls to url API requests.
+    Gets data for common calls to url API requests.  Returns None on error (or timeout secs).
 
     #todo: add some better validation checks and maybe some options (ie getOne, typeCast)
     '''
     
     try:
-        data = urlopen(url)
-        data = data.read().decode('utf8')
+        run_profile.count('api')
+        with resource_budget.slot('api'):
+            data = urlopen(url, timeout=timeout) if timeout else urlopen(url)
+            data = data.read().decode('utf8')
         if isJson: data = json.loads(data)
 
         if getOne and len(data) > 0: 
@@ -125,6 +129,7 @@ def do_fatal_error(msg, instr=None, utDate=None, failStage=None, log=None):
 def update_koatpx(instr, utDate, column, value, log=''):
     """
     Sends command to update KOA data
+    NOTE: Each call is a separate database write.  Use KoaTpxRecord to batch several columns.
 
     @param instrObj: the instrument object
     @param column: column to update in koa.koatpx
@@ -132,31 +137,89 @@ def update_koatpx(instr, utDate, column, value, log=''):
     @param value: value to update column to
     @type value: string
     """
-    db = db_conn.db_conn('config.live.ini', configKey='DATABASE')
-
-    # If entry not in database, create it
-    query = f'select count(*) as num from koatpx where instr="{instr}" and utdate="{utDate}"'
-    check = db.query('koa', query, getOne=True)
-    if check is False:
-        if log: log.error(f'update_koatpx failed for: {instr}, {utDate}, {column}, {value}')
-        return False
-    if int(check['num']) == 0:
-        query = f'insert into koatpx set instr="{instr}", utdate="{utDate}"'
-        if log: log.info(query)
-        check = db.query('koa', query)
-        if check is False or int(check) == 0:
-            if log: log.error(f'update_koatpx failed for: {instr}, {utDate}, {column}, {value}')
-            return False
+    rec = KoaTpxRecord(instr, utDate, log)
+    rec.set(column, value)
+    return rec.flush()
 
-    # Now update it
-    query = f'update koatpx set {column}="{value}" where instr="{instr}" and utdate="{utDate}"'
-    if log: log.info(query)
-    check = db.query('koa', query)
-    if check is False:
-        if log: log.error(f'update_koatpx failed for: {instr}, {utDate}, {column}, {value}')
-        return False
 
-    return True
+class KoaTpxRecord:
+    """
+    Accumulates koa.koatpx column changes for one instr/utdate and writes them
+    as a single upsert on flush().  Call flush() at the end of each processing stage.
+
+    @param instr: instrument name
+    @type instr: string
+    @param utDate: UT date (yyyy-mm-dd)
+    @type utDate: string
+    @param db: optional db_conn object (ie sqlite stand-in for testing).  Default is pooled koa connection.
+    @type db: db_conn
+    """
+
+    def __init__(self, instr, utDate, log='', db=None, database='koa'):
+        self.instr    = instr
+        self.utDate   = utDate
+        self.log      = log
+        self.db       = db
+        self.database = database
+        self.pending  = {}
+
+
+    def set(self, column, value):
+        """
+        Queues column update.  Later values for the same column replace earlier ones.
+        """
+        if not re.match(r'^[a-zA-Z_][a-zA-Z0-9_]*$', column):
+            raise Exception(f'KoaTpxRecord: invalid column name "{column}"')
+        self.pending[column] = str(value)
+
+
+    def update(self, values):
+        """
+        Queues dict of column:value updates.
+        """
+        for column, value in values.items():
+            self.set(column, value)
+
+
+    def get_db(self):
+        if self.db: return self.db
+        return db_conn.get_db('config.live.ini', configKey='DATABASE')
+
+
+    def get_upsert_query(self, dbType):
+        """
+        Returns (query, params) for inserting or updating all pending columns in one statement.
+        """
+        columns = list(self.pending.keys())
+        cols = ', '.join(['instr', 'utdate'] + columns)
+        vals = ', '.join(['%s'] * (len(columns) + 2))
+        query = f'insert into koatpx ({cols}) values ({vals})'
+        if dbType == 'sqlite':
+            sets = ', '.join([f'{c}=excluded.{c}' for c in columns])
+            query += f' on conflict(instr, utdate) do update set {sets}'
+        else:
+            sets = ', '.join([f'{c}=values({c})' for c in columns])
+            query += f' on duplicate key update {sets}'
+        params = [self.instr, self.utDate] + [self.pending[c] for c in columns]
+        return query, params
+
+
+    def flush(self):
+        """
+        Writes all pending columns.  Pending values are kept if the write fails.
+        """
+        if not self.pending: return True
+
+        db = self.get_db()
+        query, params = self.get_upsert_query(db.get_type(self.database))
+        if self.log: self.log.info(f'update_koatpx: {self.instr} {self.utDate} {self.pending}')
+        check = db.query(self.database, query, params=params)
+        if check is False:
+            if self.log: self.log.error(f'update_koatpx failed for: {self.instr}, {self.utDate}, {self.pending}')
+            return False
+
+        self.pending = {}
+        return True
 
 
 def get_directory_size(dir):
@@ -205,11 +268,11 @@ def get_prog_pi(semid, default=None, log=None):
     @type semid: string
     @param semid: the program ID - consists of semester and progname (ie 2017B_U428)
     """
-    db = db_conn.db_conn('config.live.ini', configKey='DATABASE')
+    db = db_conn.get_db('config.live.ini', configKey='DATABASE')
     query = ( 'select pi.pi_lastname, pi.pi_firstname '
               ' from koa_program as p, koa_pi as pi '
-             f' where p.semid="{semid}" and p.piID=pi.piID')
-    data = db.query('koa', query, getOne=True)
+              ' where p.semid=%s and p.piID=pi.piID')
+    data = db.query('koa', query, getOne=True, params=(semid,))
     if not data or 'pi_lastname' not in data:
         if log: log.error(f'Unable to get PI name for semid {semid}')
         return default
@@ -225,9 +288,9 @@ def get_prog_title(semid, default=None, log=None):
     @type semid: string
     @param semid: the program ID - consists of semester and progname (ie 2017B_U428)
     """
-    db = db_conn.db_conn('config.live.ini', configKey='DATABASE')
-    query = f'select progtitl from koa_program where semid="{semid}"'
-    data = db.query('koa', query, getOne=True)
+    db = db_conn.get_db('config.live.ini', configKey='DATABASE')
+    query = 'select progtitl from koa_program where semid=%s'
+    data = db.query('koa', query, getOne=True, params=(semid,))
 
     if not data or 'progtitl' not in data:
         if log: log.error(f'Unable to get title for semid {semid}')
@@ -281,6 +344,13 @@ def get_proposal_api():
     '''
     Returns the proposal API url from the config file
     '''
+    return get_config_api('PROPAPI')
+
+
+def get_config_api(key, default=None):
+    '''
+    Returns an API url from the config file API section (or default if not defined)
+    '''
     with open('config.live.ini') as f: config = yaml.safe_load(f)
-    return config.get('API', {}).get('PROPAPI')
+    return config.get('API', {}).get(key, default)
 
@@ -1,17 +1,72 @@
 import os
 import yaml
+import sqlite3
+import threading
+import resource_budget
+import run_profile
 
 # import psycopg2
 # from psycopg2.extras import RealDictCursor
 
-import pymysql.cursors
+#pymysql only needed for mysql type (ie not for local sqlite stand-in)
+try:
+    import pymysql.cursors
+except ImportError:
+    pymysql = None
 
 
+#Process-wide pool of open persistent connections.
+#Keyed by (configFile, configKey, database, pid, thread) so forked or threaded workers never share a socket.
+_pool = {}
+
+#Parsed config files keyed by (configFile, configKey)
+_configs = {}
+
+#Shared db_conn objects returned by get_db()
+_shared = {}
+
+#Guards _pool, _configs and _shared (used from DEP step and DQA worker threads)
+_lock = threading.RLock()
+
+#mysql error codes that mean the connection itself is bad (gone away, lost, can't connect)
+MYSQL_CONN_ERRORS = (0, 2003, 2006, 2013)
+
+
+def evict_dead_threads():
+    '''
+    Drops pooled connections of this process's threads that have exited.  Returns number dropped.
+    '''
+    live = {t.ident for t in threading.enumerate()}
+    pid = os.getpid()
+    with _lock:
+        conns = [_pool.pop(key) for key in list(_pool.keys()) if key[3] == pid and key[4] not in live]
+    for conn in conns:
+        try:
+            conn.close()
+        except Exception:
+            #ie sqlite connections can only be closed by their thread (freed when dropped)
+            pass
+    return len(conns)
+
+
+def get_db(configFile='config.live.ini', configKey='DATABASE'):
+    '''
+    Returns a shared persistent db_conn object for config file/key.
+    Use this instead of creating a new db_conn so config is parsed once and connections are pooled.
+    '''
+    key = (configFile, configKey)
+    with _lock:
+        if key not in _shared:
+            _shared[key] = db_conn(configFile, configKey=configKey, persist=True)
+        return _shared[key]
+
 
 class db_conn(object):
     '''
-    Simple database connection and query layer.  
-    Opens and closes and new connection each query.
+    Simple database connection and query layer.
+    If persist is False, opens and closes a new connection each query.
+    If persist is True, connections come from a process-wide pool keyed by database and are opened
+    on first use.  A pooled connection is only checked (and reopened once) after a connection error.
     Define db connection params in config file.
 
     Config file follows yaml format and should contain one dict entry per database:
@@ -22,13 +77,16 @@ class db_conn(object):
             "user"   : (db username),
             "pwd"    : (db password,
             "port"   : (db server port),
-            "type"   : (db type: mysql, postgresql),
+            "type"   : (db type: mysql, postgresql, sqlite),
         },
     }
+    NOTE: For type sqlite, "server" is the path to the local database file.
     Inputs:
     - configFile: Filepath to yaml config file
     - configKey: Optionally define a config dict key if config is within a larger yaml file.
 
+    Queries should use "%s" placeholders and pass values in params rather than formatting values into the SQL.
+
     TODO: improve error/warning reporting and logging
     '''
 
@@ -36,31 +94,38 @@ class db_conn(object):
 
         self.persist = persist
         self.readOnly = 0
-        self.VALID_DB_TYPES = ('mysql', 'postgresql')
+        self.VALID_DB_TYPES = ('mysql', 'postgresql', 'sqlite')
+        self.configFile = configFile
+        self.configKey = configKey
 
-        #parse config file
-        assert os.path.isfile(configFile), f"ERROR: config file '{configFile}' does not exist.  Exiting."
-        with open(configFile) as f: self.config = yaml.safe_load(f)
-        if configKey:
-            assert configKey in self.config, f"ERROR: config key '{configKey}' does not exist in config file. Exiting." 
-            self.config = self.config[configKey]
+        #parse config file (once per process)
+        cacheKey = (configFile, configKey)
+        with _lock:
+            if cacheKey not in _configs:
+                assert os.path.isfile(configFile), f"ERROR: config file '{configFile}' does not exist.  Exiting."
+                with open(configFile) as f: config = yaml.safe_load(f)
+                if configKey:
+                    assert configKey in config, f"ERROR: config key '{configKey}' does not exist in config file. Exiting."
+                    config = config[configKey]
+                _configs[cacheKey] = config
+            self.config = _configs[cacheKey]
 
-        #keep dict of database connections
-        self.conns = {}
+
+    def pool_key(self, database):
+        return (self.configFile, self.configKey, database, os.getpid(), threading.get_ident())
 
 
     def connect(self, database):
         '''
-        Connect to the specified database.  
+        Connect to the specified database.
+        If persist, returns pooled connection if one is open.
         '''
 
-        #see if we already have a connection and if so ping it to keep alive and return it.
-        #todo: read about conn.open == False?
-        if self.persist:                
-            if database in self.conns and self.conns[database]:
-                conn = self.conns[database]
-                conn.ping(reconnect=True)
-                return conn
+        #see if we already have a pooled connection
+        if self.persist:
+            with _lock:
+                conn = _pool.get(self.pool_key(database))
+            if conn: return conn
 
 
         #get db connect data
@@ -77,93 +142,164 @@ class db_conn(object):
 
         #connect
         try:
-            if  type == 'mysql': 
+            if  type == 'mysql':
                 conv=pymysql.converters.conversions.copy()
-                conv[10]=str       # convert dates to strings        
+                conv[10]=str       # convert dates to strings
                 conn = pymysql.connect(user=user, password=pwd, host=server, database=database, autocommit=True, conv=conv)
-            elif type == 'postgresql': 
+            elif type == 'postgresql':
                 #todo: figure out conv for psycopg2
                 conn = psycopg2.connect(user=user, password=pwd, host=server, port=port, database=database)
+            elif type == 'sqlite':
+                conn = sqlite3.connect(server, isolation_level=None)
+                conn.row_factory = sqlite3.Row
         except Exception as e:
             conn = None
             print ("ERROR: Could not connect to database.")
             print ('ERROR: ', e)
 
-        #save connection
-        if self.persist:
-            self.conns[database] = conn
+        #save connection (dropping those of exited worker threads)
+        if self.persist and conn:
+            evict_dead_threads()
+            with _lock:
+                _pool[self.pool_key(database)] = conn
 
         #return
         return conn
 
 
-    def close(self, database=None):
+    def get_type(self, database):
+        '''
+        Returns the configured database type (mysql, postgresql, sqlite).
+        '''
+        return self.config[database]['type']
+
 
-        #close all connections unless they specify one
-        #todo: do we need to track the cursor and close it as well?
-        for key, conn in self.conns.items():
-            if database and key != database: 
-                continue
-            if conn:
+    def close(self, database=None):
+        '''
+        Closes this process/thread's pooled connections (all or just database).
+        They will be reopened on next use.
+        '''
+        conns = []
+        with _lock:
+            for key in list(_pool.keys()):
+                if key[0] != self.configFile or key[1] != self.configKey: continue
+                if key[3] != os.getpid() or key[4] != threading.get_ident(): continue
+                if database and key[2] != database: continue
+                conns.append(_pool.pop(key))
+        for conn in conns:
+            try:
                 conn.close()
+            except Exception:
+                pass
 
 
-    def query(self, database, query, getOne=False, getColumn=False, getInsert=False):
+    def is_conn_error(self, database, e):
+        '''
+        Determines if exception is due to a bad connection (vs bad SQL).
+        '''
+        type = self.get_type(database)
+        if type == 'mysql' and pymysql:
+            if isinstance(e, pymysql.err.InterfaceError): return True
+            if isinstance(e, pymysql.err.OperationalError):
+                return (e.args[0] if e.args else 0) in MYSQL_CONN_ERRORS
+        if type == 'sqlite':
+            return isinstance(e, sqlite3.ProgrammingError) and 'closed' in str(e)
+        return False
+
+
+    def query(self, database, query, getOne=False, getColumn=False, getInsert=False, params=None):
         '''
         Executes basic query.  Determines query type and returns fetchall on select, otherwise rowcount on other query types.
-        Returns false on any exception error.  Opens and closes a new connection each time.
+        Returns false on any exception error.
+        Optional params are passed to the driver for "%s" placeholders in query.
         '''
+        result = self.execute(database, query, params, getInsert=getInsert)
+        if result is False: return False
 
-        result = False
-        try:
-            conn = self.connect(database)
+        #requesting one result?
+        if getOne and isinstance(result, list):
+            if len(result) == 0: result = False
+            else               : result = result[0]
+
+        #requesting single column (to remove associative/dictionary key for easy query)
+        if getColumn and result:
+            if isinstance(result, list): result = [row[getColumn] for row in result]
+            else                       : result = result[getColumn]
+
+        return result
+
+
+    def query_many(self, database, query, paramsList):
+        '''
+        Executes one insert/update/delete query for each params entry in paramsList (executemany).
+        Returns total rowcount or False on any exception error.
+        '''
+        if not paramsList: return 0
+        return self.execute(database, query, paramsList, many=True)
 
-            #get database type
-            type = self.config[database]['type']
 
-            #determine query type and check for read only restriction
-            qtype = query.strip().split()[0]
-            if self.readOnly and qtype not in ('select'):
-                print ('ERROR: Attempting to write to DB in read-only mode.')
+    def execute(self, database, query, params=None, getInsert=False, many=False):
+        '''
+        Runs query on a (pooled) connection.  If the pooled connection has gone bad, it is
+        reopened and the query is retried once.
+        '''
+        #determine query type and check for read only restriction
+        qtype = query.strip().split()[0].lower()
+        if self.readOnly and qtype != 'select':
+            print ('ERROR: Attempting to write to DB in read-only mode.')
+            return False
+
+        for attempt in (1, 2):
+            conn = cursor = None
+            try:
+                run_profile.count('db')
+                with resource_budget.slot('db'):
+                    conn = self.connect(database)
+                    return self.run_cursor(database, conn, query, qtype, params, getInsert, many)
+
+            except Exception as e:
+                if self.persist and conn and attempt == 1 and self.is_conn_error(database, e):
+                    print ('WARNING: Database connection lost.  Reconnecting.')
+                    self.close(database)
+                    continue
+                print ('ERROR: ', e)
                 return False
 
-            #get cursor
-            #todo: use "with" syntax?
-            cursor = None
-            if   type == 'mysql':
-                cursor = conn.cursor(pymysql.cursors.DictCursor)
-            elif type == 'postgresql':
-                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
-                cursor = conn.cursor(cursor_factory=RealDictCursor)
-
-            #execute query and determine return value by qtype
-            if cursor:
-                cursor.execute(query)
-                if   qtype in ('select'): result = cursor.fetchall()
-                elif getInsert          : result = cursor.fetchone()
-                else                    : result = cursor.rowcount
-                cursor.close()
-
-            #requesting one result?
-            if getOne and isinstance(result, list):
-                if len(result) == 0: result = False
-                else               : result = result[0] 
-
-            #requesting single column (to remove associative/dictionary key for easy query)
-            if getColumn and result:
-                if isinstance(result, list): result = [row[getColumn] for row in result]
-                else                       : result = result[getColumn]
+            finally:
+                if not self.persist:
+                    if conn: conn.close()
 
-        except Exception as e:
-            print ('ERROR: ', e)
-            result = False
 
-        finally:
-            if not self.persist:
-                if cursor: cursor.close()
-                if conn: conn.close()
+    def run_cursor(self, database, conn, query, qtype, params, getInsert, many):
 
-        return result
+        #get database type
+        type = self.get_type(database)
+
+        #get cursor
+        cursor = None
+        if   type == 'mysql':
+            cursor = conn.cursor(pymysql.cursors.DictCursor)
+        elif type == 'postgresql':
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+        elif type == 'sqlite':
+            cursor = conn.cursor()
+            query = query.replace('%s', '?')
 
+        #execute query and determine return value by qtype
+        result = False
+        try:
+            if   many          : cursor.executemany(query, params)
+            elif params is None: cursor.execute(query)
+            else               : cursor.execute(query, params)
+            if   qtype == 'select': result = cursor.fetchall()
+            elif getInsert        : result = cursor.fetchone()
+            else                  : result = cursor.rowcount
+        finally:
+            cursor.close()
 
+        #sqlite rows to dicts
+        if type == 'sqlite' and isinstance(result, list):
+            result = [dict(row) for row in result]
 
+        return result
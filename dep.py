@@ -16,7 +16,7 @@ from dep_locate import dep_locate
 from dep_add import dep_add
 from dep_dqa import dep_dqa
 from dep_drp import dep_drp
-from dep_tar import dep_tar
+from dep_tar import dep_tar, dep_tar_anc
 from koaxfr import koaxfr
 from send_email import send_email
 from common import *
@@ -26,6 +26,11 @@ from dateutil import parser
 import db_conn
 import yaml
 from pathlib import Path
+import resource_budget
+import run_profile
+import supervisor
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 
 class Dep:
@@ -61,16 +66,8 @@ class Dep:
         instrClass = getattr(module, className)
         self.instrObj = instrClass(self.instr, self.utDate, self.config)
         
-        # Open database connection if in config
-        self.db = db_conn.db_conn('config.live.ini', configKey='DATABASE', persist=True)
-
-       
-    def __del__(self):
-        """
-        Close the database connection, if it is open
-        """
-        if self.db:
-            self.db.close()
+        # Shared pooled database connection (not closed per object, see db_conn.get_db)
+        self.db = db_conn.get_db('config.live.ini', configKey='DATABASE')
 
  
     def go(self, processStart=None, processStop=None):
@@ -94,6 +91,8 @@ class Dep:
             return False
         if processStart != None: steps = steps[steps.index(processStart):]
         if processStop  != None: steps = steps[:(steps.index(processStop)+1)]
+        #anc tar is its own step so it can overlap the lev1 DRP (lev0 gzip must wait for DRP)
+        if 'tar' in steps: steps.insert(steps.index('tar'), 'anc')
         print (f'DEP: process start: {processStart}, process stop: {processStop}')
 
         #check if full run.  Prompt if not full run and doing tpx updates
@@ -121,23 +120,26 @@ class Dep:
         #write to tpx at dep start
         if fullRun and self.tpx:
             utcTimestamp = dt.datetime.utcnow().strftime("%Y%m%d %H:%M")
-            update_koatpx(self.instrObj.instr, self.instrObj.utDate, 'start_time', utcTimestamp, self.instrObj.log)
-
-
-        #run each step in order
-        for step in steps:
-            self.instrObj.log.info('*** RUNNING DEP PROCESS STEP: ' + step + ' ***')
-
-            if   step == 'obtain': dep_obtain(self.instrObj)
-            elif step == 'locate': dep_locate(self.instrObj, self.tpx)
-            elif step == 'add'   : dep_add(self.instrObj)
-            elif step == 'dqa'   : dep_dqa(self.instrObj, self.tpx)
-            elif step == 'lev1'  : dep_drp(self.instrObj, step, self.tpx)
-            elif step == 'tar'   : dep_tar(self.instrObj, self.tpx)
-            elif step == 'koaxfr': koaxfr(self.instrObj, self.tpx)
-
-            #check for expected output
-            self.check_step_results(step)
+            tpxRec = KoaTpxRecord(self.instrObj.instr, self.instrObj.utDate, self.instrObj.log)
+            tpxRec.set('start_time', utcTimestamp)
+            tpxRec.flush()
+
+
+        #run steps as a dependency graph (independent steps overlap)
+        run_profile.get_profile().extra.update({'instr': self.instr, 'utDate': self.utDate})
+        ok = False
+        try:
+            self.run_step_graph(steps)
+            ok = True
+        finally:
+            #wait for background jobs (ie PSFR) so they are not orphaned and their status is recorded,
+            #unless DEP failed (including do_fatal_error exit) so the failure is reported right away
+            if ok:
+                jobWait = float(self.config.get('MISC', {}).get('JOB_WAIT_TIMEOUT', 3600))
+                supervisor.wait_all(timeout=jobWait)
+            if supervisor.kill_all():
+                supervisor.wait_all(timeout=30)
+            self.write_run_profile()
 
 
         #special metadata compare report for reprocessing?
@@ -165,8 +167,8 @@ class Dep:
         """
 
         self.instrObj.log.info('dep: verifying if can proceed')
-        query = f'select utdate as num from koatpx where instr="{self.instr}" and utdate="{self.utDate}"'
-        data = self.db.query('koa', query)
+        query = 'select utdate as num from koatpx where instr=%s and utdate=%s'
+        data = self.db.query('koa', query, params=(self.instr, self.utDate))
 #todo: test this
         if data is False:
             raise Exception('dep: could not query koa database. EXITING!')
@@ -178,6 +180,98 @@ class Dep:
             return True
 
 
+    def get_step_graph(self):
+        '''
+        Defines each processing step, the steps it requires, and its run function.
+        Inputs/outputs per step:
+            obtain: schedule API                     -> stage/dep_obtain[INSTR].txt
+            locate: sdata dirs                       -> stage/dep_locate[INSTR].txt
+            add   : (none)                           -> anc/nightly, anc/udf dirs
+            dqa   : obtain + locate files, anc dirs  -> stage/dep_dqa[INSTR].txt, lev0 files and tables
+            lev1  : lev0 files                       -> lev1 files (DRP run by supervisor.py)
+            anc   : anc dir                          -> anc tar + md5 (overlaps lev1)
+            tar   : lev0 and lev1 dirs               -> gzipped lev0/lev1
+            koaxfr: gzipped output dir               -> transferred data
+        NOTE: I/O heavy steps share an io budget when several DEP runs execute at once
+        '''
+        graph = {}
+        graph['obtain'] = {'requires': [],                          'budget': None, 'run': lambda: dep_obtain(self.instrObj)}
+        graph['locate'] = {'requires': [],                          'budget': 'io', 'run': lambda: dep_locate(self.instrObj, self.tpx)}
+        graph['add']    = {'requires': [],                          'budget': None, 'run': lambda: dep_add(self.instrObj)}
+        graph['dqa']    = {'requires': ['obtain', 'locate', 'add'], 'budget': None, 'run': lambda: dep_dqa(self.instrObj, self.tpx)}
+        graph['lev1']   = {'requires': ['dqa'],                     'budget': None, 'run': lambda: dep_drp(self.instrObj, 'lev1', self.tpx)}
+        graph['anc']    = {'requires': ['dqa'],                     'budget': 'io', 'run': lambda: dep_tar_anc(self.instrObj)}
+        graph['tar']    = {'requires': ['dqa', 'lev1', 'anc'],      'budget': 'io', 'run': lambda: dep_tar(self.instrObj, self.tpx, tarAnc=False)}
+        graph['koaxfr'] = {'requires': ['tar'],                     'budget': 'io', 'run': lambda: koaxfr(self.instrObj, self.tpx)}
+        return graph
+
+
+    def run_step(self, step, node):
+        self.instrObj.log.info('*** RUNNING DEP PROCESS STEP: ' + step + ' ***')
+        with resource_budget.slot(node['budget']) if node['budget'] else nullcontext():
+            with run_profile.get_profile().step(step):
+                node['run']()
+
+
+    def get_run_profile_file(self):
+        '''
+        Run profile JSON goes next to the log file (dep_[INSTR]_[yyyymmdd].profile.json)
+        '''
+        logFile = self.instrObj.log.handlers[0].baseFilename
+        return os.path.splitext(logFile)[0] + '.profile.json'
+
+
+    def write_run_profile(self):
+        '''
+        Writes step timing/resource profile for this run (see run_profile.py)
+        '''
+        try:
+            profileFile = self.get_run_profile_file()
+            run_profile.get_profile().write(profileFile)
+            self.instrObj.log.info('dep: wrote run profile to ' + profileFile)
+        except Exception as e:
+            self.instrObj.log.warning('dep: could not write run profile: ' + str(e))
+
+
+    def run_step_graph(self, steps):
+        '''
+        Runs requested steps, starting each as soon as the steps it requires (if also requested) are done.
+        Steps outside the requested range are assumed complete.  After each step, its postcondition
+        (check_step_results) must pass before dependent steps start.
+        Set MISC STEP_WORKERS to 1 to run steps one at a time.
+        '''
+        graph = self.get_step_graph()
+        workers = int(self.config.get('MISC', {}).get('STEP_WORKERS', 3))
+
+        done = set()
+        pending = list(steps)
+        running = {}
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            while pending or running:
+
+                #start all steps whose requirements are met (in pipeline order)
+                for step in list(pending):
+                    reqs = [r for r in graph[step]['requires'] if r in steps]
+                    if all(r in done for r in reqs) and len(running) < max(1, workers):
+                        running[pool.submit(self.run_step, step, graph[step])] = step
+                        pending.remove(step)
+
+                if not running:
+                    raise Exception('dep: could not schedule steps: ' + str(pending))
+
+                #wait for a step to finish, then check its output
+                finished, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    step = running.pop(future)
+                    try:
+                        future.result()
+                    except BaseException:
+                        for f in running: f.cancel()
+                        raise
+                    self.check_step_results(step)
+                    done.add(step)
+
+
     def check_runtime_vs_window(self):
         '''
         Verify that we are not starting a run within the 24 hour defined time window
@@ -214,6 +308,9 @@ class Dep:
 
 
     def check_step_results(self, step):
+        '''
+        Postcondition for a step: fatal error if any expected output file is missing.
+        '''
 
         self.instrObj.log.info('*** VERIFYING OUTPUT FOR : ' + step + ' ***')
 
@@ -244,7 +341,7 @@ class Dep:
                     checkFiles.append(dirs['lev0'] + '/' + utDateDir + '.metadata.md5sum')
                     checkFiles.append(dirs['lev0'] + '/' + utDateDir + '.FITS.md5sum.table')
                     checkFiles.append(dirs['lev0'] + '/' + utDateDir + '.JPEG.md5sum.table')
-        elif step == 'tar':
+        elif step == 'anc':
             checkFiles.append(dirs['anc'] + '/anc' + utDateDir + '.tar.gz')
             checkFiles.append(dirs['anc'] + '/anc' + utDateDir + '.md5sum')
         elif step == 'lev1':
@@ -292,6 +389,7 @@ class Dep:
         #read log file for errors and warnings
         logStr = ''
         progStr = ''
+        summaryStr = ''
         count = 0
         errCount = 0
         warnCount = 0
@@ -310,6 +408,9 @@ class Dep:
                 elif re.search('PROGID COUNT', line, re.IGNORECASE):
                     pos = line.find('PROGID COUNT') + 14
                     progStr += line[pos:].strip() + "\n"
+                elif re.search('RUN SUMMARY', line):
+                    pos = line.find('RUN SUMMARY') + 13
+                    summaryStr += line[pos:].strip() + "\n"
 
 
         #form subject
@@ -325,6 +426,12 @@ class Dep:
         msg += "===== PROGRAM ASSIGNMENT COUNTS ====\n"
         msg += progStr + "\n"
 
+        msg += "===== RUN SUMMARY ====\n"
+        msg += summaryStr + "\n"
+
+        msg += "===== RUN PROFILE ====\n"
+        msg += run_profile.get_profile().get_summary_table() + "\n\n"
+
         msg += "===== ERRORS AND WARNINGS ====\n"
         if (logStr == ''): msg += "  (none)\n"
         else:              msg += logStr + "\n"
@@ -356,12 +463,14 @@ class Dep:
         if self.tpx:
             self.instrObj.log.info('Updating KOA database with error status.')
             utcTimestamp = dt.datetime.utcnow().strftime("%Y%m%d %H:%M")
-            update_koatpx(instr, utDate, 'arch_stat', "ERROR", log)
-            update_koatpx(instr, utDate, 'arch_time', utcTimestamp, log)
+            tpxRec = KoaTpxRecord(self.instrObj.instr, self.instrObj.utDate, self.instrObj.log)
+            tpxRec.set('arch_stat', 'ERROR')
+            tpxRec.set('arch_time', utcTimestamp)
+            tpxRec.flush()
 
         #exit program
         self.instrObj.log.info('EXITING DEP!')
-        sys.exit()
+        sys.exit(1)
 
 
 #------- End dep class --------
@@ -17,11 +17,17 @@ import shutil
 from common import *
 from datetime import datetime as dt
 import metadata
+import meta_index
 import re
 import hashlib
 import configparser
 from astropy.io import fits
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 import update_koapi_send
+import run_profile
+from koaid_registry import KoaidRegistry
+from lev0_manifest import Lev0Manifest
 
 
 def dep_dqa(instrObj, tpx=0):
@@ -90,54 +96,101 @@ def dep_dqa(instrObj, tpx=0):
     progData = gpi.getProgInfo(utDate, instr, dirs['stage'], useHdrProg, splitTime, log)
 
 
+    #lev0 manifest for PSFR and other consumers (see lev0_manifest.py)
+    manifest = Lev0Manifest(dirs['lev0'], log)
+
+
     # Start the PSFR process
     instrObj.run_psfr()
 
 
-    # Loop through each entry in input_list
-    log.info('dep_dqa.py: Processing {} files'.format(len(files)))
-    for filename in files:
+    #prefetch PROPINT values for the night
+    instrObj.load_propint_cache()
+
+
+    #precompute WCS values for the night (if WCS_PREFETCH, see load_wcs_table)
+    instrObj.load_wcs_table(files)
+
+
+    #per-file timings (each DQA step is timed by run_dqa_checks, see run_profile.py)
+    profile = run_profile.get_profile()
+
+
+    #KOAIDs claimed this night (shared via stage dir with resumed/parallel runs, stale once finished)
+    koaids = KoaidRegistry(utDate, instrObj.endTime, dirs['stage'])
 
-        log.info('dep_dqa.py input file is {}'.format(filename))
 
-        #Set current file to work on and run dqa checks, etc
-        ok = True
-        if ok: ok = instrObj.set_fits_file(filename)
-        if ok: ok = instrObj.is_fits_valid()
-        if ok: ok = instrObj.run_dqa_checks(progData)
-        if ok: ok = check_koaid(instrObj, outFiles, log)
-        if ok: ok = instrObj.check_filetime_vs_window(filename)
-        if ok: ok = instrObj.write_lev0_fits_file()
-        if ok: instrObj.make_jpg()
+    #publish completed lev0 files for PSFR (end marker is written even if DQA fails)
+    try:
+        # Loop through each entry in input_list
+        log.info('dep_dqa.py: Processing {} files'.format(len(files)))
+        for filename in files:
+
+            log.info('dep_dqa.py input file is {}'.format(filename))
+            profile.start_file(os.path.basename(filename))
+
+            #Set current file to work on and run dqa checks, etc
+            ok = True
+            with profile.timer('set_fits_file'):
+                if ok: ok = instrObj.set_fits_file(filename)
+                if ok: ok = instrObj.is_fits_valid()
+            with profile.timer('run_dqa_checks'):
+                if ok: ok = instrObj.run_dqa_checks(progData)
+            if ok: ok = check_koaid(instrObj, koaids, log)
+            if ok: ok = instrObj.check_filetime_vs_window(filename)
+            with profile.timer('write_lev0_fits_file'):
+                if ok: ok = instrObj.write_lev0_fits_file()
+            with profile.timer('make_jpg'):
+                if ok: instrObj.make_jpg()
 
  
-        #If any of these steps return false then copy to udf and skip
-        if (not ok): 
-            log.warning('FITS file failed DQA.  Copying {} to {}'.format(filename, dirs['udf']))
-            shutil.copy2(filename, dirs['udf']);
-            continue
-
-        #keep list of good fits filenames
-        procFiles.append(instrObj.fitsFilepath)
-        inFiles.append(os.path.basename(instrObj.fitsFilepath))
-        koaid = instrObj.fitsHeader.get('KOAID')
-        if koaid.startswith('NC'): koaid = '/'.join(('scam', koaid))
-        elif koaid.startswith('NS'): koaid = '/'.join(('spec', koaid))
-        outFiles.append(koaid)
-#        outFiles.append(instrObj.fitsHeader.get('KOAID'))
-        semids.append(instrObj.get_semid())
-
-        #stats
-        if instrObj.is_science(): sciFiles += 1
-
-        #deal with extra metadata
-        koaid = instrObj.fitsHeader.get('KOAID')
-        extraMeta[koaid] = instrObj.extraMeta
+            #If any of these steps return false then copy to udf and skip
+            if (not ok): 
+                if instrObj.fitsHeader is not None and instrObj.fitsFilepath == filename:
+                    koaids.release(instrObj.fitsHeader.get('KOAID'), filename)
+                log.warning('FITS file failed DQA.  Copying {} to {}'.format(filename, dirs['udf']))
+                shutil.copy2(filename, dirs['udf']);
+                continue
+
+            #keep list of good fits filenames
+            procFiles.append(instrObj.fitsFilepath)
+            inFiles.append(os.path.basename(instrObj.fitsFilepath))
+            koaid = instrObj.fitsHeader.get('KOAID')
+            if koaid.startswith('NC'): koaid = '/'.join(('scam', koaid))
+            elif koaid.startswith('NS'): koaid = '/'.join(('spec', koaid))
+            outFiles.append(koaid)
+            manifest.add(os.path.basename(koaid), koaid)
+#            outFiles.append(instrObj.fitsHeader.get('KOAID'))
+            semids.append(instrObj.get_semid())
+
+            #stats
+            if instrObj.is_science(): sciFiles += 1
+
+            #deal with extra metadata
+            koaid = instrObj.fitsHeader.get('KOAID')
+            extraMeta[koaid] = instrObj.extraMeta
+
+    except:
+        manifest.end('error')
+        koaids.finish()
+        #PSFR polls until dqa.LOC is removed
+        instrObj.dqa_loc(delete=1)
+        raise
+    manifest.end('ok')
+    koaids.finish()
 
 
     # Remove the dqa.LOC files in lev0 directory
     instrObj.dqa_loc(delete=1)
 
+    #PROPINT prefetch stats
+    saved = instrObj.propintLookups - instrObj.propintQueries
+    log.info(f'dep_dqa.py: RUN SUMMARY: PROPINT lookups: {instrObj.propintLookups}, '
+             f'koa_ppp queries: {instrObj.propintQueries}, queries saved: {saved}')
+
+    #slowest DQA steps for the night
+    log_dqa_step_summary(instrObj, profile, log)
+
     #if no files passed DQA, then exit out
     if len(outFiles) == 0 :
         notify_zero_files(instrObj, dqaFile, tpx, log)
@@ -165,12 +218,14 @@ def dep_dqa(instrObj, tpx=0):
     ymd = utDate.replace('-', '')
     metaOutFile =  dirs['lev0'] + '/' + ymd + '.metadata.table'
     keywordsDefFile = tablesDir + f'/KOA_{instr.upper()}_Keyword_Table.txt'
+    columnar = int(instrObj.config.get('MISC', {}).get('METADATA_COLUMNAR', 1))
     metadata.make_metadata( keywordsDefFile, metaOutFile, dirs['lev0'], extraMeta=extraMeta, 
-                            dev=isDev, keyskips=instrObj.keywordSkips, create_md5=True)    
+                            dev=isDev, keyskips=instrObj.keywordSkips, create_md5=True, columnar=columnar)    
 
     if instr.upper() != 'KCWI':
         #Create the extension files
-        make_fits_extension_metadata_files(dirs['lev0']+ '/', md5Prepend=utDateDir+'.', log=log)
+        extWorkers = int(instrObj.config.get('MISC', {}).get('EXT_WORKERS', 4))
+        make_fits_extension_metadata_files(dirs['lev0']+ '/', md5Prepend=utDateDir+'.', log=log, workers=extWorkers)
 
 
     #Create yyyymmdd.FITS.md5sum.table
@@ -185,6 +240,17 @@ def dep_dqa(instrObj, tpx=0):
     make_dir_md5_table(dirs['lev0'], ".jpg", md5Outfile)
 
 
+    #add night to archive-wide metadata index
+    indexFile = instrObj.config.get('MISC', {}).get('META_INDEX_DB')
+    if indexFile:
+        try:
+            index = meta_index.MetaIndex(indexFile)
+            index.ingest(metaOutFile, instr.upper(), utDate, force=True, log=log)
+            index.close()
+        except Exception as e:
+            log.error(f'dep_dqa.py: could not add {metaOutFile} to metadata index {indexFile}: {str(e)}')
+
+
     #get sdata number lists and PI list strings
     piList = get_tpx_pi_str(progData)
     sdataList = get_tpx_sdata_str(progData)
@@ -195,10 +261,12 @@ def dep_dqa(instrObj, tpx=0):
     if tpx:
         log.info('dep_dqa.py: updating tpx DB records')
         utcTimestamp = dt.utcnow().strftime("%Y%m%d %H:%M")
-        update_koatpx(instr, utDate, 'files_arch', str(len(procFiles)), log)
-        update_koatpx(instr, utDate, 'pi', piList, log)
-        update_koatpx(instr, utDate, 'sdata', sdataList, log)
-        update_koatpx(instr, utDate, 'sci_files', str(sciFiles), log)
+        tpxRec = KoaTpxRecord(instr, utDate, log)
+        tpxRec.set('files_arch', len(procFiles))
+        tpxRec.set('pi', piList)
+        tpxRec.set('sdata', sdataList)
+        tpxRec.set('sci_files', sciFiles)
+        tpxRec.flush()
 
 
     #update koapi_send for all unique semids
@@ -212,9 +280,24 @@ def dep_dqa(instrObj, tpx=0):
     log.info('dep_dqa.py DQA Successful for {}'.format(instr))
 
 
-def make_fits_extension_metadata_files(inDir='./', outDir=None, endsWith='.fits', log=None, md5Prepend=''):
+
+def log_dqa_step_summary(instrObj, profile, log, num=5):
+    '''
+    Logs per-file time percentiles for the slowest DQA steps (by total time) for the night.
+    '''
+    stepNames = set(step.name for step in instrObj.get_dqa_steps())
+    summary = profile.get_file_summary()
+    steps = sorted([s for s in summary.items() if s[0] in stepNames], key=lambda s: -s[1]['total'])
+    for name, s in steps[:num]:
+        slow = instrObj.dqaStepStats.get(name, {}).get('slow', 0)
+        log.info(f"dep_dqa.py: RUN SUMMARY: DQA step {name}: total {s['total']:.1f}s, "
+                 f"p50 {s['p50']:.3f}s, p95 {s['p95']:.3f}s, max {s['max']:.3f}s, slow files {slow}")
+
+
+def make_fits_extension_metadata_files(inDir='./', outDir=None, endsWith='.fits', log=None, md5Prepend='', workers=4):
     '''
     Creates IPAC ASCII formatted data files for any extended header data found.
+    Files are processed in parallel with up to workers threads.
     '''
     #todo: put in warnings for empty ext headers
 
@@ -234,67 +317,10 @@ def make_fits_extension_metadata_files(inDir='./', outDir=None, endsWith='.fits'
             filepaths.append(inDir + '/' + file)
 
     #for each file, read extensions and write to file
-    hduNames = []
     extFullList = []
-    for filepath in filepaths:
-            file = os.path.basename(filepath)
-            hdus = fits.open(filepath)
-            for i in range(0, len(hdus)):
-                #wrap in try since some ext headers have been found to be corrupted
-                try:
-                    hdu = hdus[i]
-                    if 'TableHDU' not in str(type(hdu)): continue
-                    if hdu.name == 'Exposure Events': continue
-
-                    #keep track of hdu names processed
-                    if hdu.name not in hduNames: hduNames.append(hdu.name)
-
-                    #calc col widths
-                    dataStr = ''
-                    colWidths = []
-                    for idx, colName in enumerate(hdu.data.columns.names):
-                        try:
-                            fmtWidth = int(hdu.data.formats[idx][1:])
-                        except:
-                            fmtWidth = int(hdu.data.formats[idx][:-1])
-                            if fmtWidth < 16: fmtWidth = 16
-                        colWidth = max(fmtWidth, len(colName))
-                        colWidths.append(colWidth)
-
-                    #add hdu name as comment
-                    dataStr += '\ Extended Header Name: ' + hdu.name + "\n"
-
-                    #add header
-                    #TODO: NOTE: Found that all ext data is stored as strings regardless of type it seems to hardcoding to 'char' for now.
-                    for idx, cw in enumerate(colWidths):
-                        dataStr += '|' + hdu.data.columns.names[idx].ljust(cw)
-                    dataStr += "|\n"
-                    for idx, cw in enumerate(colWidths):
-                        dataStr += '|' + 'char'.ljust(cw)
-                    dataStr += "|\n"
-                    for idx, cw in enumerate(colWidths):
-                        dataStr += '|' + ''.ljust(cw)
-                    dataStr += "|\n"
-                    for idx, cw in enumerate(colWidths):
-                        dataStr += '|' + ''.ljust(cw)
-                    dataStr += "|\n"
-
-                    #add data rows
-                    for j in range(0, len(hdu.data)):
-                        row = hdu.data[j]
-                        for idx, cw in enumerate(colWidths):
-                            valStr = row[idx]
-                            dataStr += ' ' + str(valStr).ljust(cw)
-                        dataStr += "\n"
-
-                    #write to outfile
-                    outFile = file.replace(endsWith, '.ext' + str(i) + '.' + hdu.name + '.tbl')
-                    outFilepath = outDir + outFile
-                    extFullList.append(outFilepath)
-                    with open(outFilepath, 'w') as f:
-                        f.write(dataStr)
-                except:
-                    if log: log.error(f'Could not create extended header table for ext header index {i} for file {file}!')
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for extList in pool.map(lambda fp: write_fits_ext_tables(fp, outDir, endsWith, log), filepaths):
+            extFullList.extend(extList)
 
 
     #Create ext.md5sum.table
@@ -333,7 +359,7 @@ def check_koapi_send(semids, utDate, instr, log):
 
 
 
-def check_koaid(instrObj, koaidList, log):
+def check_koaid(instrObj, koaids, log):
 
     #sanity check
     koaid = instrObj.fitsHeader.get('KOAID')
@@ -341,27 +367,17 @@ def check_koaid(instrObj, koaidList, log):
         log.error('dep_dqa.py: BAD KOAID "{}" found for {}'.format(koaid, instrObj.fitsFilepath))
         return False
 
-    #check for duplicates
-    if (koaid in koaidList):
-        log.error('dep_dqa.py: DUPLICATE KOAID "{}" found for {}'.format(koaid, instrObj.fitsFilepath))
-        return False
-
     #check that date and time extracted from generated KOAID falls within our 24-hour processing datetime range.
-    #NOTE: Only checking outside of 1 day difference b/c file write time can cause this to trigger incorrectly
-    prefix, kdate, ktime, postfix = koaid.split('.')
-    hours, minutes, seconds = instrObj.endTime.split(":") 
-    endTimeSec = float(hours) * 3600.0 + float(minutes)*60.0 + float(seconds)
-    idate = instrObj.utDate.replace('/', '-').replace('-', '')
-
-    a = dt.strptime(kdate[:4]+'-'+kdate[4:6]+'-'+kdate[6:8], "%Y-%m-%d")
-    b = dt.strptime(idate[:4]+'-'+idate[4:6]+'-'+idate[6:8], "%Y-%m-%d")
-    delta = b - a
-    delta = abs(delta.days)
-
-    if (kdate != idate and delta > 1 and float(ktime) < endTimeSec):
+    if not koaids.is_date_ok(koaid):
+        kdate = koaid.split('.')[1]
         log.error('dep_dqa.py: KOAID "{}" has bad Date "{}" for file {}'.format(koaid, kdate, instrObj.fitsFilepath))
         return False
 
+    #check for duplicates (claims koaid for this file)
+    if not koaids.claim(koaid, instrObj.fitsFilepath):
+        log.error('dep_dqa.py: DUPLICATE KOAID "{}" found for {}'.format(koaid, instrObj.fitsFilepath))
+        return False
+
     return True
 
 
@@ -378,8 +394,10 @@ def notify_zero_files(instrObj, dqaFile, tpx, log):
     if tpx:
         log.info('dep_dqa.py: updating tpx DB records')
         utcTimestamp = dt.utcnow().strftime("%Y%m%d %H:%M")
-        update_koatpx(instrObj.instr, instrObj.utDate, 'arch_stat', 'DONE', log)
-        update_koatpx(instrObj.instr, instrObj.utDate, 'arch_time', utcTimestamp, log)
+        tpxRec = KoaTpxRecord(instrObj.instr, instrObj.utDate, log)
+        tpxRec.set('arch_stat', 'DONE')
+        tpxRec.set('arch_time', utcTimestamp)
+        tpxRec.flush()
 
 
 
@@ -388,14 +406,12 @@ def get_tpx_sdata_str(progData):
     Finds unique sdata directory numbers and creates string for DB
     ex: "123/456"
     '''
-    items = []
+    items = {}
     for row in progData:
         filepath = row['file']
         match = re.search( r'/sdata(.*?)/', filepath, re.I)
         if match:
-            item = match.groups(1)[0]
-            if item not in items:
-                items.append(item)
+            items[match.groups(1)[0]] = True
 
     text = '/'.join(items)
     if text == '': text = 'NONE'
@@ -407,14 +423,72 @@ def get_tpx_pi_str(progData):
     Finds unique PIs and creates string for DB
     ex: "Smith/Jones"
     '''
-    items = []
-    for row in progData:
-        pi = row['progpi']
-        if pi not in items:
-            items.append(pi)
+    items = dict.fromkeys(row['progpi'] for row in progData)
 
     text = '/'.join(items)
     if text == '': text = 'NONE'
     return text
 
 
+def write_fits_ext_tables(filepath, outDir, endsWith='.fits', log=None):
+    '''
+    Writes an IPAC ASCII table file for each table extension in filepath.  Returns list of files written.
+    '''
+    file = os.path.basename(filepath)
+    extList = []
+    with fits.open(filepath) as hdus:
+        for i in range(0, len(hdus)):
+            #wrap in try since some ext headers have been found to be corrupted
+            try:
+                hdu = hdus[i]
+                if 'TableHDU' not in str(type(hdu)): continue
+                if hdu.name == 'Exposure Events': continue
+
+                #calc col widths
+                names = hdu.data.columns.names
+                colWidths = []
+                for idx, colName in enumerate(names):
+                    try:
+                        fmtWidth = int(hdu.data.formats[idx][1:])
+                    except:
+                        fmtWidth = int(hdu.data.formats[idx][:-1])
+                        if fmtWidth < 16: fmtWidth = 16
+                    colWidth = max(fmtWidth, len(colName))
+                    colWidths.append(colWidth)
+
+                #add hdu name as comment and header
+                #TODO: NOTE: Found that all ext data is stored as strings regardless of type it seems to hardcoding to 'char' for now.
+                lines = ['\\ Extended Header Name: ' + hdu.name + "\n"]
+                lines.append(''.join('|' + name.ljust(cw) for name, cw in zip(names, colWidths)) + "|\n")
+                lines.append(''.join('|' + 'char'.ljust(cw) for cw in colWidths) + "|\n")
+                lines.append(''.join('|' + ''.ljust(cw) for cw in colWidths) + "|\n")
+                lines.append(''.join('|' + ''.ljust(cw) for cw in colWidths) + "|\n")
+
+                #add data rows (values are converted and padded a column at a time)
+                if len(hdu.data) > 0:
+                    cols = [get_ext_column_strings(hdu.data[name], cw).tolist() for name, cw in zip(names, colWidths)]
+                    lines.extend(''.join(' ' + val for val in row) + "\n" for row in zip(*cols))
+
+                #write to outfile
+                outFile = file.replace(endsWith, '.ext' + str(i) + '.' + hdu.name + '.tbl')
+                outFilepath = outDir + outFile
+                with open(outFilepath, 'w') as f:
+                    f.writelines(lines)
+                extList.append(outFilepath)
+            except:
+                if log: log.error(f'Could not create extended header table for ext header index {i} for file {file}!')
+    return extList
+
+
+def get_ext_column_strings(col, width):
+    '''
+    Returns table column values as strings left justified to width (same as str(val).ljust(width)).
+    '''
+    if col.ndim == 1 and col.dtype.kind == 'U':
+        #row access strips trailing spaces from FITS string values
+        vals = np.char.rstrip(np.asarray(col))
+    elif col.ndim == 1 and col.dtype.kind in 'biuf':
+        vals = col.astype(str)
+    else:
+        vals = np.array([str(val) for val in col], dtype=str)
+    return np.char.ljust(vals, width)
@@ -23,6 +23,9 @@ def dep_drp(instrObj, drpLevel, tpx):
         log.info('dep_drp.py: No DRP directive found in config.')
         return
 
+    #release FITS handles held from DQA while the DRP runs
+    instrObj.close_fits_file()
+
     #run it
     #todo: catch error?
     #todo: leave it up to instrument class to decide whether to run+wait?  Or use a DRP_WAIT config?
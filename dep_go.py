@@ -57,9 +57,12 @@ if (utDate == None): utDate = datetime.utcnow().strftime('%Y-%m-%d')
 
 # Create and run Dep (wrap in try to catch any runtime errors and email them)
 
+#NOTE: exit status is non-zero on error so wrappers (ie dep_go_reprocess.py) can detect failure
 try:
     dep = Dep(instr, utDate, tpx=tpx, configArgs=configArgs)
-    dep.go(pstart, pstop)
+    ok = dep.go(pstart, pstop)
+    if ok is False: sys.exit(1)
 except Exception as error:
     msg = traceback.format_exc()
     do_fatal_error(msg, instr, utDate, 'dep_go')
+    sys.exit(1)
@@ -1,86 +1,292 @@
 '''
-This is just a quick-and-dirty wrapper script to dep_go.py to run a range of dates specific to reprocessing old data.  
-See input array below for usage.
+Reprocessing scheduler for running dep_go.py over a range of dates.
+
+Jobs (instr, utdate) are stored in a persistent sqlite queue so a crashed or stopped run can be
+resumed by running the same command again.  Up to --workers nights are run at once, each as its own
+dep_go.py process with its own output log.  Finished (DONE) jobs are skipped on resume, as are dates
+with no search dir or (with --skipExisting) dates that already have lev0 metadata output.
+
+Shared resources can be limited across all running nights with --maxDb, --maxApi and --maxIo
+(see resource_budget.py).
+
+Usage:
+    python dep_go_reprocess.py instr startDate endDate tpx procStart procStop useHdrProg searchDirBase metaDirBase [moveDataScript]
+        [--workers=4] [--queueFile=reprocess_queue.sqlite] [--logDir=./reprocess_logs] [--skipExisting]
+        [--retryErrors] [--maxDb=4] [--maxApi=4] [--maxIo=2]
+    python dep_go_reprocess.py --status [--queueFile=reprocess_queue.sqlite]
 '''
 import sys
 import os
+import socket
+import argparse
 import datetime as dt
 import subprocess
+import sqlite3
+import threading
+import time
+import yaml
+from concurrent.futures import ThreadPoolExecutor
+from common import get_root_dirs
 
 
-# usage
-if len(sys.argv) <= 6:
-    print ("USAGE: dep_go_reprocess.py instr startDate endDate tpx procStart procStop useHdrProg searchDirBase metaDirBase")
-    sys.exit(0)
+class ReprocessQueue:
+    '''
+    Persistent queue of reprocessing jobs (sqlite file).
+    Status is one of QUEUED, RUNNING, DONE, ERROR, SKIPPED.
+    '''
 
+    def __init__(self, queueFile):
+        self.queueFile = queueFile
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(queueFile, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('''create table if not exists jobs (
+                                instr varchar(15) not null,
+                                utdate varchar(10) not null,
+                                status varchar(10) not null default 'QUEUED',
+                                attempts int not null default 0,
+                                start_time varchar(20),
+                                end_time varchar(20),
+                                duration float,
+                                returncode int,
+                                logfile varchar(255),
+                                note varchar(255),
+                                owner_host varchar(255),
+                                owner_pid int,
+                                primary key (instr, utdate))''')
 
-# Go to directory of source
-baseCodeDir = sys.argv[0].replace('dep_go_reprocess.py', '')
-if (baseCodeDir != ""): os.chdir(baseCodeDir)
+        #queue files made before owner columns were added
+        cols = [row['name'] for row in self.conn.execute('pragma table_info(jobs)')]
+        if 'owner_host' not in cols: self.conn.execute('alter table jobs add column owner_host varchar(255)')
+        if 'owner_pid'  not in cols: self.conn.execute('alter table jobs add column owner_pid int')
 
 
-# get inputs
-instr           = sys.argv[1]
-startDateStr    = sys.argv[2]
-endDateStr      = sys.argv[3]
-tpx             = sys.argv[4]
-procStart       = sys.argv[5]
-procStop        = sys.argv[6]
-useHdrProg      = sys.argv[7]  #"assist" or "force"
-searchDirBase   = sys.argv[8]
-metaDirBase     = sys.argv[9]
-moveDataScript  = sys.argv[10] if len(sys.argv) > 10 else None
+    def run(self, query, params=()):
+        with self.lock:
+            return self.conn.execute(query, params).fetchall()
 
 
-# loop dates and call 
-startDate = dt.datetime.strptime(startDateStr, '%Y-%m-%d')
-endDate   = dt.datetime.strptime(endDateStr,   '%Y-%m-%d')
-curDate   = dt.datetime.strptime(startDateStr, '%Y-%m-%d')
-while curDate <= endDate:
+    def add(self, instr, utDate):
+        self.run('insert or ignore into jobs (instr, utdate) values (?, ?)', (instr, utDate))
 
-    curDateStr = curDate.strftime('%Y-%m-%d')
-    searchDir = searchDirBase + '/' + curDateStr.replace('-', '')
-    searchDir = searchDir.replace('//', '/')
 
-    metaDir = metaDirBase + '/' + curDateStr.replace('-', '')
-    metaDir = metaDir.replace('//', '/')
+    def reset_stale(self, retryErrors=False):
+        '''
+        Jobs left RUNNING by a crashed scheduler (and ERROR jobs if requested) go back to QUEUED.
+        Only RUNNING jobs owned by a dead process on this host are reset, so jobs of another
+        scheduler still running on the same queue file are left alone.
+        '''
+        host = socket.gethostname()
+        rows = self.run("select instr, utdate, owner_host, owner_pid from jobs where status='RUNNING'")
+        for row in rows:
+            if row['owner_host'] not in (None, host): continue
+            if row['owner_pid'] is not None and pid_alive(row['owner_pid']): continue
+            self.run("update jobs set status='QUEUED', owner_host=null, owner_pid=null "
+                     "where instr=? and utdate=? and status='RUNNING' and owner_pid is ?",
+                     (row['instr'], row['utdate'], row['owner_pid']))
+        if retryErrors: self.run("update jobs set status='QUEUED' where status='ERROR'")
 
-    year, month, day = curDateStr.split('-')
 
-    print ('----------------------------------------------------')
+    def claim(self, instr, utDate):
+        '''
+        Marks a QUEUED job RUNNING and owned by this process.  Returns False if another
+        scheduler already took it.
+        '''
+        with self.lock:
+            cur = self.conn.execute("update jobs set status='RUNNING', attempts=attempts+1, owner_host=?, owner_pid=? "
+                                    "where instr=? and utdate=? and status='QUEUED'",
+                                    (socket.gethostname(), os.getpid(), instr, utDate))
+            return cur.rowcount == 1
+
+
+    def get_queued(self, instr):
+        rows = self.run("select utdate from jobs where instr=? and status='QUEUED' order by utdate", (instr,))
+        return [row['utdate'] for row in rows]
+
+
+    def set_status(self, instr, utDate, status, **cols):
+        sets = ['status=?']
+        params = [status]
+        for key, val in cols.items():
+            sets.append(f'{key}=?')
+            params.append(val)
+        params += [instr, utDate]
+        self.run(f"update jobs set {', '.join(sets)} where instr=? and utdate=?", params)
+
+
+    def get_jobs(self):
+        return self.run('select * from jobs order by instr, utdate')
+
+
+def pid_alive(pid):
+    '''
+    Checks if process pid exists on this host.
+    '''
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def print_status(queue):
+    '''
+    Prints per-job status and timing and totals by status.
+    '''
+    totals = {}
+    print(f"{'INSTR':<8} {'UTDATE':<10} {'STATUS':<8} {'TRIES':>5} {'SECS':>8}  NOTE")
+    for job in queue.get_jobs():
+        dur = f"{job['duration']:.0f}" if job['duration'] is not None else ''
+        print(f"{job['instr']:<8} {job['utdate']:<10} {job['status']:<8} {job['attempts']:>5} {dur:>8}  {job['note'] or ''}")
+        totals[job['status']] = totals.get(job['status'], 0) + 1
+    print('TOTALS: ' + ', '.join(f'{k}={v}' for k, v in sorted(totals.items())))
+
+
+def is_done(config, instr, utDate):
+    '''
+    Checks for existing lev0 metadata output for instr/utDate.
+    '''
+    rootDir = config[instr]['ROOTDIR'].rstrip('/')
+    dirs = get_root_dirs(rootDir, instr, utDate)
+    return os.path.isfile(dirs['lev0'] + '/' + utDate.replace('-', '') + '.metadata.table')
+
 
-    if not os.path.isdir(searchDir):
-        print ("NOTICE: Skipping date: " + curDateStr + ". Could not find dir for: " + searchDir)    
-
-    else:
-        # cmd = "python3 dep_go.py " + instr + ' ' + curDateStr + ' ' + tpx + ' obtain tar --modtimeOverride 1 --reprocess 1 --searchDir ' + searchDir
-        params = ['/usr/local/anaconda3-5.0.0.1/bin/python', 'dep_go.py', instr, curDateStr, tpx, procStart, procStop, 
-                    '--modtimeOverride', '1', 
-                    '--reprocess', '1', 
-                    '--useHdrProg', useHdrProg, 
-                    '--searchDir', searchDir,
-                    '--metaCompareDir', metaDir,
-                    '--emailReport', '1']
-        print ('pyDEP COMMAND: ', ' '.join(params))
-        subprocess.call(params)
-
-        if moveDataScript:
-            params = ['/usr/local/anaconda3-5.0.0.1/bin/python',
-                        moveDataScript,
-                        instr,
-                        year,
+def run_job(queue, args, instr, utDate):
+    '''
+    Runs dep_go.py (and optional move data script) for one night, logging output to its own file.
+    '''
+    ymd = utDate.replace('-', '')
+    searchDir = (args.searchDirBase + '/' + ymd).replace('//', '/')
+    metaDir   = (args.metaDirBase + '/' + ymd).replace('//', '/')
+    logFile   = os.path.join(args.logDir, f'reprocess_{instr}_{ymd}.log')
+    year, month, day = utDate.split('-')
+
+    if not queue.claim(instr, utDate):
+        print(f'NOTICE: Skipping date: {utDate}. Already claimed by another scheduler.')
+        return None
+
+    start = time.time()
+    queue.set_status(instr, utDate, 'RUNNING', start_time=dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                     logfile=logFile, note=None)
+
+    params = [sys.executable, 'dep_go.py', instr, utDate, args.tpx, args.procStart, args.procStop,
+                '--modtimeOverride', '1',
+                '--reprocess', '1',
+                '--useHdrProg', args.useHdrProg,
+                '--searchDir', searchDir,
+                '--metaCompareDir', metaDir,
+                '--emailReport', '1']
+    with open(logFile, 'a') as log:
+        log.write('pyDEP COMMAND: ' + ' '.join(params) + '\n')
+        log.flush()
+        rc = subprocess.call(params, stdout=log, stderr=subprocess.STDOUT)
+
+        if rc == 0 and args.moveDataScript:
+            params = [sys.executable, args.moveDataScript, instr, year,
                         f'--month={month}',
                         f'--day={day}',
                         '--excludeStagedFits',
                         '--confirm']
-            print ('MOVE DATA COMMAND: ', ' '.join(params))
-            subprocess.call(params)
+            log.write('MOVE DATA COMMAND: ' + ' '.join(params) + '\n')
+            log.flush()
+            rc = subprocess.call(params, stdout=log, stderr=subprocess.STDOUT)
+
+    status = 'DONE' if rc == 0 else 'ERROR'
+    duration = time.time() - start
+    queue.set_status(instr, utDate, status, end_time=dt.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                     duration=duration, returncode=rc, owner_host=None, owner_pid=None)
+    print(f'{status} with date: {utDate} ({duration:.0f} secs, rc={rc})')
+    return status
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Reprocess a range of dates with dep_go.py')
+    parser.add_argument('instr'         , type=str, nargs='?', help='Instrument name')
+    parser.add_argument('startDate'     , type=str, nargs='?', help='Start UT date (yyyy-mm-dd)')
+    parser.add_argument('endDate'       , type=str, nargs='?', help='End UT date (yyyy-mm-dd)')
+    parser.add_argument('tpx'           , type=str, nargs='?', default='0')
+    parser.add_argument('procStart'     , type=str, nargs='?', default='obtain')
+    parser.add_argument('procStop'      , type=str, nargs='?', default='tar')
+    parser.add_argument('useHdrProg'    , type=str, nargs='?', default='assist', help='"assist" or "force"')
+    parser.add_argument('searchDirBase' , type=str, nargs='?')
+    parser.add_argument('metaDirBase'   , type=str, nargs='?')
+    parser.add_argument('moveDataScript', type=str, nargs='?', default=None)
+    parser.add_argument('--workers'     , type=int, default=1,   help='Number of nights to run at once')
+    parser.add_argument('--queueFile'   , type=str, default='reprocess_queue.sqlite', help='Persistent job queue file')
+    parser.add_argument('--logDir'      , type=str, default='./reprocess_logs', help='Dir for per-job output logs')
+    parser.add_argument('--skipExisting', action='store_true', help='Skip dates that already have lev0 metadata output')
+    parser.add_argument('--retryErrors' , action='store_true', help='Requeue jobs that previously ended in ERROR')
+    parser.add_argument('--maxDb'       , type=int, default=0,   help='Max concurrent DB queries across all jobs')
+    parser.add_argument('--maxApi'      , type=int, default=0,   help='Max concurrent API requests across all jobs')
+    parser.add_argument('--maxIo'       , type=int, default=0,   help='Max concurrent I/O heavy steps across all jobs')
+    parser.add_argument('--status'      , action='store_true', help='Print queue status and exit')
+    args = parser.parse_args()
+
+    # user paths are relative to the starting dir, so resolve them before changing dir
+    for key in ('queueFile', 'logDir', 'searchDirBase', 'metaDirBase', 'moveDataScript'):
+        val = getattr(args, key)
+        if val: setattr(args, key, os.path.abspath(val))
 
-        print ("DONE with date: " + curDateStr)
+    # Go to directory of source
+    baseCodeDir = os.path.dirname(sys.argv[0])
+    if (baseCodeDir != ""): os.chdir(baseCodeDir)
 
-    curDate += dt.timedelta(days=1)
+    queue = ReprocessQueue(args.queueFile)
+    if args.status:
+        print_status(queue)
+        return
 
+    if not args.instr or not args.startDate or not args.endDate or not args.searchDirBase or not args.metaDirBase:
+        parser.print_usage()
+        sys.exit(0)
+
+    instr = args.instr.upper()
+    os.makedirs(args.logDir, exist_ok=True)
+    with open('config.live.ini') as f: config = yaml.safe_load(f)
+
+    # global budgets are passed to each dep_go.py process via environment
+    budgetDir = os.path.abspath(args.queueFile) + '.budget'
+    os.makedirs(budgetDir, exist_ok=True)
+    os.environ['DEP_BUDGET_DIR'] = budgetDir
+    if args.maxDb : os.environ['DEP_BUDGET_DB']  = str(args.maxDb)
+    if args.maxApi: os.environ['DEP_BUDGET_API'] = str(args.maxApi)
+    if args.maxIo : os.environ['DEP_BUDGET_IO']  = str(args.maxIo)
+
+    # queue dates (existing jobs keep their status) and recover from any crashed run
+    curDate = dt.datetime.strptime(args.startDate, '%Y-%m-%d')
+    endDate = dt.datetime.strptime(args.endDate,   '%Y-%m-%d')
+    while curDate <= endDate:
+        queue.add(instr, curDate.strftime('%Y-%m-%d'))
+        curDate += dt.timedelta(days=1)
+    queue.reset_stale(args.retryErrors)
+
+    # skip dates with nothing to do
+    todo = []
+    for utDate in queue.get_queued(instr):
+        if utDate < args.startDate or utDate > args.endDate: continue
+        searchDir = (args.searchDirBase + '/' + utDate.replace('-', '')).replace('//', '/')
+        if not os.path.isdir(searchDir):
+            queue.set_status(instr, utDate, 'SKIPPED', note=f'No search dir {searchDir}')
+            print ("NOTICE: Skipping date: " + utDate + ". Could not find dir for: " + searchDir)
+        elif args.skipExisting and is_done(config, instr, utDate):
+            queue.set_status(instr, utDate, 'SKIPPED', note='lev0 metadata already exists')
+            print ("NOTICE: Skipping date: " + utDate + ". Output already exists.")
+        else:
+            todo.append(utDate)
+
+    print ('----------------------------------------------------')
+    print (f'Running {len(todo)} {instr} nights with {args.workers} workers')
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = [pool.submit(run_job, queue, args, instr, utDate) for utDate in todo]
+        for f in futures: f.result()
+
+    print ('----------------------------------------------------')
+    print_status(queue)
+    print ("ALL DONE")
 
-print ('----------------------------------------------------')
-print ("ALL DONE")
 
+if __name__ == '__main__':
+    main()
@@ -7,10 +7,10 @@ from common import *
 from datetime import datetime as dt
 
 
-def dep_tar(instrObj, tpx):
+def dep_tar(instrObj, tpx, tarAnc=True):
     """
-    This function will tar the ancillary directory, gzip that
-    tarball and remove the original contents of the directory.
+    This function will gzip the lev0/lev1 FITS files, tar the ancillary directory,
+    gzip that tarball and remove the original contents of the directory.
     """
 
     #define vars to use throughout
@@ -31,67 +31,78 @@ def dep_tar(instrObj, tpx):
     gzip_dir_fits(dirs['lev1'])
 
 
-    #tar /anc/ if exists
-    if not os.path.isdir(dirs['anc']):
-        log.info('dep_tar: not /anc/ dir found.  Nothing to tar.')
-    else:
-        log.info(f'dep_tar: tar and zipping {dirs["anc"]}.')
-
-        # Tarball name
-        tarFileName = 'anc' + instrObj.utDateDir + '.tar'
-
-        # Go to anc directory
-        myCwd = os.getcwd()
-        os.chdir(dirs['anc'])
-
-        # Create tarball
-        log.info('dep_tar.py creating {}'.format(tarFileName))
-        with tarfile.open(tarFileName, 'w:gz') as tar:
-            tar.add('./')
-
-        # gzip the tarball
-        log.info('dep_tar.py gzipping {}'.format(tarFileName))
-        gzipTarFile = tarFileName + '.gz'
-        with open(tarFileName, 'rb') as fIn:
-            with gzip.open(gzipTarFile, 'wb') as fOut:
-                shutil.copyfileobj(fIn, fOut)
-
-        # Remove the original tar file
-        os.remove(tarFileName)
-
-        # Create md5sum of the tarball
-        md5sumFile = gzipTarFile.replace('tar.gz', 'md5sum')
-        log.info('dep_tar.py creating {}'.format(md5sumFile))
-        md5 = hashlib.md5(open(gzipTarFile, 'rb').read()).hexdigest()
-        with open(md5sumFile, 'w') as f:
-            md5 = ''.join((md5, '  ', gzipTarFile))
-            f.write(md5)
-
-        #remove anc dirs
-        ancDirs = ['nightly', 'udf']
-        for d in ancDirs:
-            delDir = dirs['anc'] + '/' + d
-            if not os.path.isdir(delDir): continue
-            log.info('dep_tar.py removing {}'.format(delDir))
-            shutil.rmtree(delDir)
-
-        # go back to original directory
-        os.chdir(myCwd)
+    #tar /anc/ (unless done by separate anc step, see dep.py)
+    if tarAnc: dep_tar_anc(instrObj)
 
 
     # update koatpx as archive ready
     if tpx:
         log.info('dep_dqa.py: updating tpx DB records')
         utcTimestamp = dt.utcnow().strftime("%Y%m%d %H:%M")
-        update_koatpx(instr, utDate, 'arch_stat', 'DONE', log)
-        update_koatpx(instr, utDate, 'arch_time', utcTimestamp, log)       
-        update_koatpx(instr, utDate, 'size', get_directory_size(dirs['output']), log)
+        tpxRec = KoaTpxRecord(instr, utDate, log)
+        tpxRec.set('arch_stat', 'DONE')
+        tpxRec.set('arch_time', utcTimestamp)
+        tpxRec.set('size', get_directory_size(dirs['output']))
+        tpxRec.flush()
 
 
     log.info('dep_tar.py complete.')
 
 
 
+def dep_tar_anc(instrObj):
+    """
+    Tars and gzips the ancillary directory, creates its md5sum and removes the anc subdirs.
+    Does not change the working dir so it can run alongside other steps (ie lev1 DRP).
+    """
+
+    log  = instrObj.log
+    dirs = instrObj.dirs
+
+    #tar /anc/ if exists
+    if not os.path.isdir(dirs['anc']):
+        log.info('dep_tar: not /anc/ dir found.  Nothing to tar.')
+        return
+
+    log.info(f'dep_tar: tar and zipping {dirs["anc"]}.')
+
+    # Tarball name
+    tarFileName = 'anc' + instrObj.utDateDir + '.tar'
+    tarFilePath = os.path.join(dirs['anc'], tarFileName)
+
+    # Create tarball
+    log.info('dep_tar.py creating {}'.format(tarFileName))
+    with tarfile.open(tarFilePath, 'w:gz') as tar:
+        tar.add(dirs['anc'], arcname='./')
+
+    # gzip the tarball
+    log.info('dep_tar.py gzipping {}'.format(tarFileName))
+    gzipTarFile = tarFileName + '.gz'
+    gzipTarPath = tarFilePath + '.gz'
+    with open(tarFilePath, 'rb') as fIn:
+        with gzip.open(gzipTarPath, 'wb') as fOut:
+            shutil.copyfileobj(fIn, fOut)
+
+    # Remove the original tar file
+    os.remove(tarFilePath)
+
+    # Create md5sum of the tarball
+    md5sumFile = gzipTarFile.replace('tar.gz', 'md5sum')
+    log.info('dep_tar.py creating {}'.format(md5sumFile))
+    md5 = hashlib.md5(open(gzipTarPath, 'rb').read()).hexdigest()
+    with open(os.path.join(dirs['anc'], md5sumFile), 'w') as f:
+        md5 = ''.join((md5, '  ', gzipTarFile))
+        f.write(md5)
+
+    #remove anc dirs
+    ancDirs = ['nightly', 'udf']
+    for d in ancDirs:
+        delDir = dirs['anc'] + '/' + d
+        if not os.path.isdir(delDir): continue
+        log.info('dep_tar.py removing {}'.format(delDir))
+        shutil.rmtree(delDir)
+
+
 def gzip_dir_fits(dirPath):
 
     for dirpath, dirnames, filenames in os.walk(dirPath):
@@ -4,11 +4,15 @@ import time
 from urllib.request import urlopen
 import json
 import math
+import os
+import numpy as np
+import resource_budget
+import run_profile
 
 
-def envlog(telnr, dateObs, utc):
+def envlog(telnr, dateObs, utc, timeout=60):
     '''
-    Gets weather/env data from tcsu archiver.
+    Gets weather/env data from tcsu archiver.  timeout is secs per archiver request.
     '''
 
     #define archiver api url
@@ -25,17 +29,7 @@ def envlog(telnr, dateObs, utc):
     dt2 = dt2.strftime('%Y-%m-%dT%H:%M:%SZ')
 
     #map keywords for KOA to archiver channels
-    keymap = { 
-        'wx_dewpoint'    : f'k0:met:dewpointRaw',           
-        'wx_outhum'      : f'k0:met:humidityRaw',           
-        'wx_outtmp'      : f'k0:met:tempRaw',               
-        'wx_domtmp'      : f'k{telnr}:met:tempRaw',       
-        'wx_domhum'      : f'k{telnr}:met:humidityRaw',   
-        'wx_pressure'    : f'k0:met:pressureRaw',           
-        'wx_windspeed'   : f'k{telnr}:met:windSpeedRaw',  
-        'wx_winddir'     : f'k{telnr}:met:windAzRaw',   
-        'guidfwhm'       : f'k{telnr}:dcs:pnt:cam0:fwhm'  
-    }
+    keymap = get_pv_keymap(telnr)
 
     #defaults for return data dict
     data = {}
@@ -52,7 +46,9 @@ def envlog(telnr, dateObs, utc):
         try:
             #query archiver api and make sure we found some records
             sendUrl = f'{url}pv={pv}&from={dt1}&to={dt2}'
-            d = urlopen(sendUrl).read().decode('utf8')
+            run_profile.count('http')
+            with resource_budget.slot('api'):
+                d = urlopen(sendUrl, timeout=timeout).read().decode('utf8')
             d = json.loads(d)
             if len(d) == 0:
                 warns.append(f"No records for {pv}")
@@ -82,6 +78,171 @@ def envlog(telnr, dateObs, utc):
     return data, errors, warns
 
 
+def get_pv_keymap(telnr):
+    '''
+    Maps KOA weather keywords to EPICS archiver channels.
+    '''
+    return {
+        'wx_dewpoint'    : f'k0:met:dewpointRaw',
+        'wx_outhum'      : f'k0:met:humidityRaw',
+        'wx_outtmp'      : f'k0:met:tempRaw',
+        'wx_domtmp'      : f'k{telnr}:met:tempRaw',
+        'wx_domhum'      : f'k{telnr}:met:humidityRaw',
+        'wx_pressure'    : f'k0:met:pressureRaw',
+        'wx_windspeed'   : f'k{telnr}:met:windSpeedRaw',
+        'wx_winddir'     : f'k{telnr}:met:windAzRaw',
+        'guidfwhm'       : f'k{telnr}:dcs:pnt:cam0:fwhm'
+    }
+
+
+class NightWeather:
+    '''
+    Night-level cache of EPICS archiver weather data.  Each PV is fetched once for the
+    whole window and held as sorted numpy arrays, so per-frame lookups are a searchsorted.
+    lookup() returns the same (data, errors, warns) as envlog().
+
+    @param telnr: telescope number
+    @param start: window start (UTC datetime)
+    @param end: window end (UTC datetime)
+    @param archiver: optional archiver base url (ie http://localhost:8000) or local dir of <pv>.json
+                     files in archiver getData.json format (for testing)
+    @param interval: seconds after frame time to look for samples (same as envlog window)
+    '''
+
+    def __init__(self, telnr, start, end, archiver=None, interval=30, timeout=60, log=None):
+        self.telnr    = telnr
+        self.start    = start - timedelta(seconds=interval)
+        self.end      = end + timedelta(seconds=interval)
+        self.archiver = archiver
+        self.interval = interval
+        self.timeout  = timeout
+        self.log      = log
+        self.keymap   = get_pv_keymap(telnr)
+        self.pvData   = None
+        self.pvErrors = {}
+        self.numFetches = 0
+
+
+    def in_window(self, utDatetime):
+        return self.start <= utDatetime <= self.end
+
+
+    def fetch_pv(self, pv):
+        '''
+        Gets archiver records for pv over the whole window.
+        '''
+        dt1 = self.start.strftime('%Y-%m-%dT%H:%M:%SZ')
+        dt2 = self.end.strftime('%Y-%m-%dT%H:%M:%SZ')
+        self.numFetches += 1
+
+        #file-backed stand-in archiver
+        if self.archiver and not self.archiver.startswith('http'):
+            pvFile = os.path.join(self.archiver, f'{pv}.json')
+            if not os.path.isfile(pvFile): return []
+            with open(pvFile) as f: d = json.load(f)
+            t1 = self.start.replace(tzinfo=timezone.utc).timestamp()
+            t2 = self.end.replace(tzinfo=timezone.utc).timestamp()
+            for rec in d:
+                rec['data'] = [e for e in rec['data'] if t1 <= e['secs'] <= t2]
+            return d
+
+        url = f'http://k{self.telnr}dataserver:17668/retrieval/data/getData.json?'
+        if self.archiver: url = self.archiver.rstrip('/') + '/retrieval/data/getData.json?'
+        sendUrl = f'{url}pv={pv}&from={dt1}&to={dt2}'
+        run_profile.count('http')
+        with resource_budget.slot('api'):
+            d = urlopen(sendUrl, timeout=self.timeout).read().decode('utf8')
+        return json.loads(d)
+
+
+    def load(self):
+        '''
+        Fetches each PV once and stores sorted secs, nanos and val arrays.
+        '''
+        self.pvData = {}
+        for kw, pv in self.keymap.items():
+            try:
+                d = self.fetch_pv(pv)
+                entries = d[0]['data'] if len(d) > 0 else []
+                if len(entries) == 0:
+                    self.pvData[kw] = None
+                    continue
+                secs  = np.array([e['secs'] for e in entries])
+                order = np.argsort(secs, kind='stable')
+                self.pvData[kw] = {
+                    'secs' : secs[order],
+                    'nanos': np.array([e['nanos'] for e in entries])[order],
+                    'val'  : np.array([e['val'] for e in entries], dtype=object)[order]
+                }
+            except Exception as e:
+                self.pvErrors[kw] = f"{pv}:{str(e)}"
+                if self.log: self.log.error(f'NightWeather: EPICS archiver error for {pv}: {str(e)}')
+        if self.log: self.log.info(f'NightWeather: fetched {len(self.keymap)} PVs for {self.start} to {self.end}')
+
+
+    def find_closest(self, kw, ts):
+        '''
+        Returns index of sample closest to ts (earlier sample wins a tie) or None if there are none.
+        Same samples as envlog() sees: any before ts (the archiver also returns the last sample before
+        the window, ie for PVs only archived on change) and those up to interval secs after.
+        '''
+        secs = self.pvData[kw]['secs']
+        i = np.searchsorted(secs, ts)
+        best = None
+        for j in (i-1, i):
+            if j < 0 or j >= len(secs) or secs[j] > ts + self.interval: continue
+            if best is None or abs(secs[j] - ts) < abs(secs[best] - ts): best = j
+        return best
+
+
+    def lookup(self, dateObs, utc):
+        '''
+        Gets weather data closest to frame time.
+        '''
+        if self.pvData is None: self.load()
+
+        utDatetime = dt.strptime(dateObs + ' ' + utc, '%Y-%m-%d %H:%M:%S.%f')
+        ts_utc = utDatetime.replace(tzinfo=timezone.utc).timestamp()
+
+        data = {}
+        data['wx_time'] = 'null'
+        data['fwhm_time'] = 'null'
+        errors = []
+        warns = []
+        mn = None
+        for kw, pv in self.keymap.items():
+            data[kw] = 'null'
+            if kw in self.pvErrors:
+                errors.append(self.pvErrors[kw])
+                continue
+            if self.pvData.get(kw) is None:
+                warns.append(f"No records for {pv}")
+                continue
+
+            i = self.find_closest(kw, ts_utc)
+            if i is None:
+                warns.append(f"No records for {pv}")
+                continue
+            pvd = self.pvData[kw]
+            data[kw] = pvd['val'][i]
+            secs = int(pvd['secs'][i])
+
+            #tack on decimal seconds from nanos
+            ts = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(secs))
+            nanos = str(pvd['nanos'][i])[0:2]
+            ts = f"{ts}.{nanos}"
+
+            #mark closest time
+            if kw == 'guidfwhm': data['fwhm_time'] = ts[-11:]
+            else:
+                diff = abs(secs - ts_utc)
+                if mn == None or diff < mn:
+                    data['wx_time'] = ts[-11:]
+                    mn = diff
+
+        return data, errors, warns
+
+
 def find_closest_entry(entries, ts):
     mn = None
     best = None
@@ -37,6 +37,16 @@ from dep_obtain import get_obtain_data
 from datetime import datetime, timedelta
 import re
 from astropy.io import fits
+import instrument_registry
+
+
+#observer name cleanup patterns (see get_observer_array)
+OBSV_SPACE_RE  = re.compile(r"\s+")
+OBSV_PERIOD_RE = re.compile(r"\.+")
+OBSV_SLASH_RE  = re.compile(r"\/+")
+OBSV_DASH_RE   = re.compile(r"\-+")
+OBSV_PAREN_RE  = re.compile(r"\(.+?\)")
+OBSV_COMMAS_RE = re.compile(r",+")
 
 
 class ProgSplit:
@@ -60,16 +70,7 @@ class ProgSplit:
         self.log = log
 
         #consts        
-        self.instrList = {  'DEIMOS'    :2, 
-                            'ESI'       :2, 
-                            'HIRES'     :1, 
-                            'KCWI'      :2, 
-                            'LRIS'      :1, 
-                            'MOSFIRE'   :1, 
-                            'NIRC2'     :2, 
-                            'NIRSPEC'   :2, 
-                            'OSIRIS'    :1, 
-                            'NIRES'     :2}
+        self.instrList = instrument_registry.get_instr_list()
         self.engineering = {'kcwieng'       :'outdir', 
                             'kcwirun'       :'outdir', 
                             'hireseng'      :'outdir',
@@ -87,7 +88,7 @@ class ProgSplit:
                             'moseng'        :'outdir'
                             }
         self.too = {'_ToO_':'outdir'}
-        self.api = 'https://www.keck.hawaii.edu/software/db_api/'
+        self.api = get_config_api('DBAPI', 'https://www.keck.hawaii.edu/software/db_api/')
 
         #var init
         self.fileList = []
@@ -97,6 +98,8 @@ class ProgSplit:
         self.programs = []
         self.suntimes = None
         self.semester = self.get_semester()
+        self.progObserverSets = None
+        self.observerMatches = {}
 
         #log
         self.rootDir = self.stageDir.split('/stage')[0]
@@ -332,41 +335,13 @@ class ProgSplit:
         '''
         Looks for matching observer names in header keyword and program listing.
         If good enough match and only one match to a program then it assigns it.
+        Match results are memoized per OBSERVER string (see get_observer_match).
         '''
 
         ok = False
 
-        #get array of names (first filter out garbage chars)
         file = self.fileList[filenum]
-        observers = self.get_observer_array(file['observer'])
-        # print ('assign_single_by_observer: file observer array: ', observers)
-        if len(observers) == 0: return False
-
-        #look for program with any matching names both directions
-        matchIdx = -1
-        for idx in range(len(self.programs)):
-            prog = self.programs[idx]
-            progObsvStr = prog['Observer'] + ',' + prog['Principal'] 
-            progObservers = self.get_observer_array(progObsvStr)
-            #print ('-- progObservers: ', progObservers)
-            if len(progObservers) == 0: continue
-
-            diff1 = len(set(observers) - set(progObservers))
-            perc1 = diff1 / len(observers)
-            ok1 = True if perc1 < 1.0 else False
-
-            diff2 = len(set(progObservers) - set(observers))
-            perc2 = diff2 / len(progObservers) 
-            ok2 = True if perc2 < 1.0 else False
-            #print ('-- result: ', diff1, perc1, ok1, diff2, perc2, ok2, matchIdx)
-
-            #If observers match good enough then assign, but check multi program matching not ok
-            if ok1 and ok2:
-                if matchIdx >= 0:
-                    matchIdx = -1
-                    break
-                else:
-                    matchIdx = idx
+        matchIdx = self.get_observer_match(file['observer'])
 
         if matchIdx >= 0:
             self.log.info('getProgInfo: Assigning ' + os.path.basename(file['file']) + ' by observer match.')
@@ -375,6 +350,50 @@ class ProgSplit:
 
         return ok
 
+    def get_observer_match(self, obsvStr):
+        '''
+        Returns index of the single program whose observers match obsvStr, else -1.
+        '''
+        if obsvStr in self.observerMatches: return self.observerMatches[obsvStr]
+
+        #get set of names (first filter out garbage chars)
+        observers = set(self.get_observer_array(obsvStr))
+        matchIdx = -1
+        if len(observers) > 0:
+
+            #look for program with any matching names both directions
+            for idx, progObservers in self.get_prog_observer_sets():
+                diff1 = len(observers - progObservers)
+                perc1 = diff1 / len(observers)
+                ok1 = True if perc1 < 1.0 else False
+
+                diff2 = len(progObservers - observers)
+                perc2 = diff2 / len(progObservers) 
+                ok2 = True if perc2 < 1.0 else False
+
+                #If observers match good enough then assign, but check multi program matching not ok
+                if ok1 and ok2:
+                    if matchIdx >= 0:
+                        matchIdx = -1
+                        break
+                    else:
+                        matchIdx = idx
+
+        self.observerMatches[obsvStr] = matchIdx
+        return matchIdx
+
+    def get_prog_observer_sets(self):
+        '''
+        Returns list of (program index, observer name set) for programs with observers, computed once.
+        '''
+        if self.progObserverSets is None:
+            self.progObserverSets = []
+            for idx, prog in enumerate(self.programs):
+                progObservers = set(self.get_observer_array(prog['Observer'] + ',' + prog['Principal']))
+                if len(progObservers) == 0: continue
+                self.progObserverSets.append((idx, progObservers))
+        return self.progObserverSets
+
     def get_observer_array(self, obsvStr):
         '''
         Returns a consistent array of observer names from a string of names. Examples include:
@@ -385,19 +404,19 @@ class ProgSplit:
         '''
 
         #replace whitespace, periods, slash and dash with comma
-        obsvStr = re.sub("\s+", ",", obsvStr.strip())
-        obsvStr = re.sub("\.+", ",", obsvStr.strip())
-        obsvStr = re.sub("\/+", ",", obsvStr.strip())
-        obsvStr = re.sub("\-+", ",", obsvStr.strip())
+        obsvStr = OBSV_SPACE_RE.sub(",", obsvStr.strip())
+        obsvStr = OBSV_PERIOD_RE.sub(",", obsvStr.strip())
+        obsvStr = OBSV_SLASH_RE.sub(",", obsvStr.strip())
+        obsvStr = OBSV_DASH_RE.sub(",", obsvStr.strip())
 
         #get rid of other unwanted things
-        obsvStr = re.sub("\(.+?\)", "", obsvStr.strip())
+        obsvStr = OBSV_PAREN_RE.sub("", obsvStr.strip())
         search  = ["_", "/", "&", ".", "and"]
         for s in search:
             obsvStr = obsvStr.replace(s, '')
 
         #replace multi commas with comma
-        obsvStr = re.sub(",+" , ",", obsvStr.strip())
+        obsvStr = OBSV_COMMAS_RE.sub(",", obsvStr.strip())
 
         #just keep names of length > 1
         #NOTE: We used to have cutoff at len 2, but i think this is unneccessary now.
@@ -547,6 +566,10 @@ class ProgSplit:
 
     def split_multi(self):
 
+        #observer match caches depend on final (sorted) program list
+        self.progObserverSets = None
+        self.observerMatches = {}
+
         # Loop thru all files and if we find an outdir match, assign to program
         for idx, file in enumerate(self.fileList):
             fileOutdir = self.fix_outdir(file['outdir'])
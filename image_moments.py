@@ -0,0 +1,67 @@
+'''
+One-pass image moments (mean, variance, std, excess kurtosis).
+
+The image is read in blocks of rows; each block is converted to float64 (so only a block-sized
+copy is made), reduced to count, mean and central moment sums M2, M3, M4, and merged into the
+running totals with the pairwise update formulas (Chan et al. 1979, Pebay 2008).  Results match
+np.mean, np.std and scipy.stats.kurtosis(axis=None) (Fisher, biased) to float64 rounding.
+
+Optional subsample: step > 1 uses every step-th pixel in each axis (a strided view, no copy).
+For m = n/step**2 pixels drawn from a field with std s and excess kurtosis k, the 1-sigma
+sampling errors are roughly:
+    mean     : s / sqrt(m)
+    std      : s * sqrt((k + 2) / (4 m))
+    kurtosis : sqrt(24 / m) for near-normal data, and much larger for heavy-tailed data
+ie step=4 on a 1024x1024 frame (m = 65536) gives mean to 0.004 s and std to ~0.3% for
+near-normal data.  Use step=1 wherever values are written to headers.
+'''
+
+import numpy as np
+
+
+def get_moments(data, step=1, blockRows=256):
+    '''
+    Returns dict of n, mean, var, std and kurtosis (excess) for all values of data.
+    '''
+    data = np.asarray(data)
+    if data.ndim < 2: data = data.reshape(1, -1)
+    elif data.ndim > 2: data = data.reshape(-1, data.shape[-1])
+    if step > 1: data = data[::step, ::step]
+
+    n = 0
+    mean = m2 = m3 = m4 = 0.0
+    for i in range(0, data.shape[0], blockRows):
+        block = data[i:i+blockRows].astype(np.float64)
+        nb = block.size
+        if nb == 0: continue
+        meanb = block.mean()
+        d  = block - meanb
+        d2 = d * d
+        m2b = d2.sum()
+        m3b = (d2 * d).sum()
+        m4b = (d2 * d2).sum()
+        n, mean, m2, m3, m4 = merge_moments(n, mean, m2, m3, m4, nb, meanb, m2b, m3b, m4b)
+
+    if n == 0:
+        return {'n': 0, 'mean': np.nan, 'var': np.nan, 'std': np.nan, 'kurtosis': np.nan}
+    var = m2 / n
+    kurtosis = n * m4 / (m2 * m2) - 3.0 if m2 > 0 else np.nan
+    return {'n': n, 'mean': mean, 'var': var, 'std': np.sqrt(var), 'kurtosis': kurtosis}
+
+
+def merge_moments(na, meana, m2a, m3a, m4a, nb, meanb, m2b, m3b, m4b):
+    '''
+    Combines count, mean and central moment sums of two sets.
+    '''
+    if na == 0: return nb, meanb, m2b, m3b, m4b
+    n = na + nb
+    delta = meanb - meana
+    d_n = delta / n
+    mean = meana + d_n * nb
+    m2 = m2a + m2b + delta * d_n * na * nb
+    m3 = (m3a + m3b + delta * d_n * d_n * na * nb * (na - nb)
+          + 3.0 * d_n * (na * m2b - nb * m2a))
+    m4 = (m4a + m4b + delta * d_n * d_n * d_n * na * nb * (na * na - na * nb + nb * nb)
+          + 6.0 * d_n * d_n * (na * na * m2b + nb * nb * m2a)
+          + 4.0 * d_n * (na * m3b - nb * m3a))
+    return n, mean, m2, m3, m4
@@ -6,6 +6,8 @@ DEIMOS specific DR techniques can be added to it in the future
 """
 
 import instrument
+import koaimtyp_rules
+import spectral_config
 import datetime as dt
 from common import *
 import numpy as np
@@ -22,6 +24,41 @@ from mpl_toolkits.axes_grid1 import ImageGrid
 
 class Deimos(instrument.Instrument):
 
+    #KOAIMTYP rule table (see koaimtyp_rules.py)
+    koaimtypRules = koaimtyp_rules.DEIMOS
+
+    #DQA checks run in order for each file (see Instrument.run_dqa_checks)
+    dqaSteps = [
+        'set_instr',
+        'set_fcs_date_time',
+        'set_dateObs',
+        'set_ut',
+        'set_koaimtyp',
+        'set_koaid',
+        'set_fcskoaid',
+        'set_ofName',
+        'set_semester',
+        instrument.DqaStep('set_prog_info', instrument.PROGDATA),
+        instrument.DqaStep('set_propint', instrument.PROGDATA),
+        instrument.DqaStep('set_datlevel', 0),
+        'set_weather_keywords',
+        'set_oa',
+        'set_dqa_vers',
+        'set_dqa_date',
+        'set_camera',
+        'set_filter',
+        'set_mjd',
+        'set_obsmode',
+        'set_nexten',
+        'set_detsec',
+        instrument.DqaStep('set_npixsat', satVal=65535.0),
+        'set_wavelengths',
+        'set_spatscal',
+        'set_dispscal',
+        'set_specres',
+    ]
+
+
     def __init__(self, instr, utDate, rootDir, log=None):
 
         # Call the parent init to get all the shared variables
@@ -33,9 +70,6 @@ class Deimos(instrument.Instrument):
         self.keywordMap['FRAMENO']      = ''
 
 
-        # Other vars that subclass can overwrite
-        self.endTime = '20:00:00'   # 24 hour period start/end time (UT)
-        
         # Skip warnings for these FCS-only keywords
         self.keywordSkips   = ['EXPOSURE', 'MPPMODE', 'NAXIS1', 'NAXIS2']
         self.keywordSkips.extend(['NUMAMPS', 'OBSNUM', 'PREPIX', 'SFRAMENO'])
@@ -52,62 +86,9 @@ class Deimos(instrument.Instrument):
         # """
         # # add the FCSIMGFI config file for deimos
         # self.fcsimgfi = 'FCSIMGFI'
-        self.gratingList = {}
-        self.gratingList['600ZD'] = {'wave':7500, 'dispersion':0.65, 'length':5300}
-        self.gratingList['830G']  = {'wave':8640, 'dispersion':0.47, 'length':3840}
-        self.gratingList['900ZD'] = {'wave':5500, 'dispersion':0.44, 'length':3530}
-        self.gratingList['1200G'] = {'wave':7760, 'dispersion':0.33, 'length':2630}
-        self.gratingList['1200B'] = {'wave':4500, 'dispersion':0.33, 'length':2630}
+        self.gratingList = spectral_config.DEIMOS_GRATINGS
         # Filter list for imaging wavelengths
-        self.filterList = {}
-        self.filterList['B']      = {'blue':4200, 'cntr':4400, 'red':4600}
-        self.filterList['V']      = {'blue':5150, 'cntr':5450, 'red':5750}
-        self.filterList['R']      = {'blue':6100, 'cntr':6500, 'red':6900}
-        self.filterList['I']      = {'blue':7600, 'cntr':8400, 'red':9200}
-        self.filterList['Z']      = {'blue':8600, 'cntr':9100, 'red':9600}
-        self.filterList['GG400']  = {'blue':4000, 'cntr':7250, 'red':10500}
-        self.filterList['GG455']  = {'blue':4550, 'cntr':7525, 'red':10500}
-        self.filterList['GG495']  = {'blue':4950, 'cntr':7725, 'red':10500}
-        self.filterList['OG550']  = {'blue':5500, 'cntr':8000, 'red':10500}
-        self.filterList['NG8560'] = {'blue':8400, 'cntr':8550, 'red':8700}
-        self.filterList['NG8580'] = {'blue':8550, 'cntr':8600, 'red':8650}
-
-
-    def run_dqa_checks(self, progData):
-        '''
-        Run all DQA check unique to this instrument
-        '''
-
-        ok = True
-        if ok: ok = self.set_instr()
-        if ok: ok = self.set_fcs_date_time()
-        if ok: ok = self.set_dateObs()
-        if ok: ok = self.set_ut()
-        if ok: ok = self.set_koaimtyp()
-        if ok: ok = self.set_koaid()
-        if ok: ok = self.set_fcskoaid()
-        if ok: ok = self.set_ofName()
-        if ok: ok = self.set_semester()
-        if ok: ok = self.set_prog_info(progData)
-        if ok: ok = self.set_propint(progData)
-        if ok: ok = self.set_datlevel(0)
-        if ok: ok = self.set_weather_keywords()
-        if ok: ok = self.set_oa()
-        if ok: ok = self.set_dqa_vers()
-        if ok: ok = self.set_dqa_date()
-        if ok: ok = self.set_camera()
-        if ok: ok = self.set_filter()
-        if ok: ok = self.set_mjd()
-        if ok: ok = self.set_obsmode()
-        if ok: ok = self.set_nexten()
-        if ok: ok = self.set_detsec()
-        if ok: ok = self.set_npixsat(satVal=65535.0)
-        if ok: ok = self.set_wavelengths()
-        if ok: ok = self.set_spatscal()
-        if ok: ok = self.set_dispscal()
-        if ok: ok = self.set_specres()
-
-        return ok
+        self.filterList = spectral_config.DEIMOS_FILTERS
 
 
     def get_dir_list(self):
@@ -193,10 +174,7 @@ class Deimos(instrument.Instrument):
         Creates KOAIMTYP keyword.
         '''
 
-        if '/fcs' in self.get_keyword('OUTDIR', default=''):
-            koaimtyp = 'fcscal'
-        else:
-            koaimtyp = self.get_koaimtyp()
+        koaimtyp = self.get_koaimtyp()
 
         # Warn if undefined
         if koaimtyp == 'undefined':
@@ -208,58 +186,6 @@ class Deimos(instrument.Instrument):
         return True
 
 
-    def get_koaimtyp(self):
-        '''
-        Return image type based on the algorithm provided by SA
-        '''
-
-        # Get relevant keywords from header
-        obstype  = self.get_keyword('OBSTYPE', default='').lower()
-        slmsknam = self.get_keyword('SLMSKNAM', default='').lower()
-        hatchpos = self.get_keyword('HATCHPOS', default='').lower()
-        flimagin = self.get_keyword('FLIMAGIN', default='').lower()
-        flspectr = self.get_keyword('FLSPECTR', default='').lower()
-        lamps    = self.get_keyword('LAMPS', default='').lower()
-        gratepos = self.get_keyword('GRATEPOS')
-
-        # if obstype is 'bias' we have a bias
-        if obstype == 'bias':
-            return 'bias'
-
-        # if obsmode is 'dark' we have a dark
-        if obstype == 'dark':
-            return 'dark'
-
-        # if slmsknam contains 'goh' we have a focus image
-        if slmsknam.startswith('goh'):
-            return 'focus'
-
-        # if hatch is closed and lamps are quartz, then flat
-        if hatchpos == 'closed' and 'qz' in lamps:
-            return 'flatlamp'
-
-        # if hatch is open and flimagin or flspectr are on, then flat
-        if hatchpos == 'open' and (flimagin == 'on' or flspectr == 'on'):
-            return 'flatlamp'
-
-        # if lamps are not off/qz and grating position is 3 or 4, then arc
-        if hatchpos == 'closed' and ('off' not in lamps and 'qz' not in lamps)\
-           and (gratepos == 3 or gratepos == 4):
-            return 'arclamp'
-
-        # if tracking then we must have an object science image
-        # otherwise, don't know what it is
-        if hatchpos == 'open':
-            return 'object'
-
-        # check for fcs image
-        outdir = self.get_keyword('OUTDIR', default='')
-        if 'fcs' in outdir:
-            return 'fcscal'
-
-        return 'undefined'
-
-
     def set_camera(self):
         '''
         Adds the keyword CAMERA to the header and sets its value to DEIMOS
@@ -421,29 +347,17 @@ class Deimos(instrument.Instrument):
         Adds wavelength keywords.
         '''
 
-        waveblue = wavecntr = wavered = 'null'
-
         # Is this an image or spectrum?
         obsmode = self.get_keyword('OBSMODE')
+        filter = grating = tltwav = None
         if obsmode == 'imaging':
             filter = self.get_keyword('FILTER', default='').strip()
-            if filter in self.filterList.keys():
-                waveblue = self.filterList[filter]['blue']
-                wavecntr = self.filterList[filter]['cntr']
-                wavered  = self.filterList[filter]['red']
-
         elif obsmode in ['longslit', 'mos']:
             gratepos = self.get_keyword('GRATEPOS')
-            waveKey = f'G{gratepos}TLTWAV'
             grating = self.get_keyword('GRATENAM')
-            if grating in self.gratingList.keys():
-                wavecntr = int(round(self.get_keyword(waveKey), -1))
-                delta = self.gratingList[grating]['length']/2
-                waveblue = int(round(wavecntr - delta, -1))
-                wavered = int(round(wavecntr + delta, -1))
+            tltwav = self.get_keyword(f'G{gratepos}TLTWAV')
 
-        else:
-            pass
+        waveblue, wavecntr, wavered = spectral_config.get_deimos_wavelengths(obsmode, filter, grating, tltwav)
 
         self.set_keyword('WAVEBLUE', waveblue, 'KOA: Blue end wavelength')
         self.set_keyword('WAVECNTR', wavecntr, 'KOA: Center wavelength')
@@ -489,14 +403,9 @@ class Deimos(instrument.Instrument):
         Calculates the spectral resolution and add SPECRES to header
         '''
 
-        specres = 'null'
-
         spatscal = self.get_keyword('SPATSCAL')
         grating = self.get_keyword('GRATENAM')
-
-        if grating in self.gratingList.keys():
-            specres = (self.gratingList[grating]['wave']*spatscal)/self.gratingList[grating]['dispersion']
-            specres = round(specres, -1)
+        specres = spectral_config.get_deimos_specres(grating, spatscal)
 
         self.set_keyword('SPECRES', specres, 'KOA: nominal spectral resolution')
 
@@ -6,6 +6,8 @@ ESI specific DR techniques can be added to it in the future
 '''
 
 import instrument
+import koaimtyp_rules
+import spectral_config
 import datetime as dt
 from common import *
 import numpy as np
@@ -13,6 +15,40 @@ import numpy as np
 
 class Esi(instrument.Instrument):
 
+    #KOAIMTYP rule table (see koaimtyp_rules.py)
+    koaimtypRules = koaimtyp_rules.ESI
+
+    #DQA checks run in order for each file (see Instrument.run_dqa_checks)
+    dqaSteps = [
+        'set_instr',
+        'set_dateObs',
+        'set_utc',
+        'set_filter',
+        instrument.DqaStep('get_obsmode', update=True, checkResult=False),
+        'set_camera',
+        'set_koaimtyp',
+        'set_koaid',
+        'set_ut',
+        'set_frameno',
+        'set_ofName',
+        'set_semester',
+        instrument.DqaStep('set_prog_info', instrument.PROGDATA),
+        instrument.DqaStep('set_propint', instrument.PROGDATA),
+        instrument.DqaStep('set_datlevel', 0),
+        'set_image_stats_keywords',
+        'set_weather_keywords',
+        'set_oa',
+        instrument.DqaStep('set_npixsat', 65535),
+        'set_wavelengths',
+        'set_slit_dims',
+        'set_spatscal',
+        'set_dispscal',
+        'set_specres',
+        'set_dqa_vers',
+        'set_dqa_date',
+    ]
+
+
     def __init__(self, instr, utDate, rootDir, log=None):
 
         # Call the parent init to get all the shared variables
@@ -25,7 +61,6 @@ class Esi(instrument.Instrument):
 
         # Other vars that subclass can overwrite
         #TODO: Ack! Looks like the old DEP has an hour difference between this value and the actual cron time!
-        self.endTime = '20:00:00'   # 24 hour period start/end time (UT)
         self.keywordSkips   = ['PMFM', 'RECNO', 'CHECKSUM', 'DATASUM']
 
 
@@ -33,43 +68,6 @@ class Esi(instrument.Instrument):
         self.sdataList = self.get_dir_list()
 
 
-    def run_dqa_checks(self, progData):
-        '''
-        Run all DQA checks unique to this instrument.
-        '''
-
-        #todo: check that all of these do not need a subclass version if base class func was used.
-        ok = True
-        if ok: ok = self.set_instr()
-        if ok: ok = self.set_dateObs()
-        if ok: ok = self.set_utc()
-        if ok: ok = self.set_filter()
-        self.get_obsmode(update=True)
-        if ok: ok = self.set_camera()
-        if ok: ok = self.set_koaimtyp()
-        if ok: ok = self.set_koaid()
-        if ok: ok = self.set_ut()
-        if ok: ok = self.set_frameno()
-        if ok: ok = self.set_ofName()
-        if ok: ok = self.set_semester()
-        if ok: ok = self.set_prog_info(progData)
-        if ok: ok = self.set_propint(progData)
-        if ok: ok = self.set_datlevel(0)
-        if ok: ok = self.set_image_stats_keywords()
-        if ok: ok = self.set_weather_keywords()
-        if ok: ok = self.set_oa()
-        if ok: ok = self.set_npixsat(65535)
-
-        if ok: ok = self.set_wavelengths()
-        if ok: ok = self.set_slit_dims()
-        if ok: ok = self.set_spatscal()
-        if ok: ok = self.set_dispscal()
-        if ok: ok = self.set_specres()
-        if ok: ok = self.set_dqa_vers()
-        if ok: ok = self.set_dqa_date()
-        return ok
-
-
     @staticmethod
     def get_dir_list():
         '''
@@ -162,113 +160,6 @@ class Esi(instrument.Instrument):
         return True
 
 
-    def get_koaimtyp(self):
-        """
-        Determine image type based on instrument keyword configuration
-        """
-
-        # Default KOAIMTYP value
-        koaimtyp = 'undefined'
-
-        # Check OBSTYPE first
-        obstype = self.get_keyword('OBSTYPE', default='').lower()
-
-        if obstype == 'bias': return 'bias'
-        if obstype == 'dark': return 'dark'
-
-        slmsknam = self.get_keyword('SLMSKNAM', default='').lower()
-        hatchpos = self.get_keyword('HATCHPOS', default='').lower()
-        lampqtz1 = self.get_keyword('LAMPQTZ1', default='').lower()
-        lampar1 = self.get_keyword('LAMPAR1', default='').lower()
-        lampcu1 = self.get_keyword('LAMPCU1', default='').lower()
-        lampne1 = self.get_keyword('LAMPNE1', default='').lower()
-        lampne2 = self.get_keyword('LAMPNE2', default='').lower()
-        prismnam = self.get_keyword('PRISMNAM', default='').lower()
-        imfltnam = self.get_keyword('IMFLTNAM', default='').lower()
-        axestat = self.get_keyword('AXESTAT', default='').lower()
-        domestat = self.get_keyword('DOMESTAT', default='').lower()
-        el = self.get_keyword('EL')
-        dwfilnam = self.get_keyword('DWFILNAM', default='').lower()
-        ldfltnam = self.get_keyword('LDFLTNAM', default='').lower()
-
-        # Hatch
-        hatchOpen = 1
-        if hatchpos == 'closed': hatchOpen = 0
-
-        # Is flat lamp on?
-        flat = 0
-        if lampqtz1 == 'on': flat = 1
-
-        # Is telescope pointed at flat screen?
-        flatPos = 0
-        if el != None and el >= 44.0 and el <= 46.01: flatPos = 1
-
-        # Is an arc lamp on?
-        arc = 0
-        if lampar1 == 'on' or lampcu1 == 'on' or lampne1 == 'on' or lampne2 == 'on':
-            arc = 1
-
-        # Dome/Axes tracking
-        axeTracking = domeTracking = 0
-        if axestat == 'tracking': axeTracking = 1
-        if domestat == 'tracking': domeTracking = 1
-
-        # This is a trace or focus
-        if 'hole' in slmsknam:
-            if not hatchOpen:
-                if flat and not arc and prismnam == 'in' and imfltnam == 'out': 
-                    return 'trace'
-                if flat and not arc and prismnam != 'in' and imfltnam != 'out': 
-                    return 'focus'
-                if not flat and arc and prismnam == 'in' and imfltnam == 'out': 
-                    return 'focus'
-            else:
-                if prismnam == 'in' and imfltnam == 'out':
-                    if obstype == 'dmflat' and not domeTracking and flatPos: 
-                        return 'trace'
-                    if not axeTracking and not domeTracking and flatPos: 
-                        return 'trace'
-                    if obstype == 'dmflat' and not axeTracking and not domeTracking and flatPos: 
-                        return 'trace'
-                    if obstype == 'dmflat' and not axeTracking and flatPos: 
-                        return 'trace'
-                else:
-                    if obstype == 'dmflat' and not domeTracking and flatPos: 
-                        return 'focus'
-                    if not axeTracking and not domeTracking and flatPos: 
-                        return 'focus'
-                    if obstype == 'dmflat' and not axeTracking and not domeTracking and flatPos: 
-                        return 'focus'
-                    if obstype == 'dmflat' and not axeTracking and flatPos: 
-                        return 'focus'
-            if prismnam == 'out' and imfltnam == 'in' and ldfltnam == 'out': 
-                return 'focus'
-            if prismnam == 'in' and imfltnam == 'out' and dwfilnam == 'clear_s': 
-                return 'focus'
-        #if not hole in slmsknam
-        else:
-            #if hatch closed
-            if not hatchOpen:
-                if flat and not arc: 
-                    return 'flatlamp'
-                if not flat and arc and prismnam == 'in' and imfltnam == 'out': 
-                    return 'arclamp'
-            #if hatch open
-            else:
-                if obstype == 'dmflat' and not domeTracking and flatPos: 
-                    return 'flatlamp'
-                if not axeTracking and not domeTracking and flatPos: 
-                    return 'flatlamp'
-                if obstype == 'dmflat' and not axeTracking and not domeTracking: 
-                    return 'flatlamp'
-                if obstype == 'dmflat' and not axeTracking and flatPos: 
-                    return 'flatlamp'
-                if not flat and not arc: 
-                    return 'object'
-
-        return 'undefined'
-
-
     def set_filter(self):
         '''
         Add filter which is copy of DWFILNAM
@@ -286,36 +177,9 @@ class Esi(instrument.Instrument):
 
         # self.log.info('set_wavelengths: setting wavelength keyword values')
 
-        # Default null values
-        wavered = wavecntr = waveblue = 'null'
-
         obsmode  = self.get_keyword('OBSMODE')
-
-        #imaging:
-        if obsmode == 'image':
-            esifilter = self.get_keyword('DWFILNAM')
-            if esifilter == 'B':
-                wavered  = 5400
-                wavecntr = 4400
-                waveblue = 3700
-            elif esifilter == 'V':
-                wavered  = 6450  
-                wavecntr = 5200
-                waveblue = 4900
-            elif esifilter == 'R':
-                wavered  = 7400  
-                wavecntr = 6500
-                waveblue = 6000
-            elif esifilter == 'I':
-                wavered  = 9000
-                wavecntr = 8000
-                waveblue = 7000
-
-        #spec:
-        elif obsmode in ('low', 'high'):
-            wavered = 10900
-            wavecntr =  7400
-            waveblue =  3900
+        esifilter = self.get_keyword('DWFILNAM') if obsmode == 'image' else None
+        waveblue, wavecntr, wavered = spectral_config.get_esi_wavelengths(obsmode, esifilter)
 
         self.set_keyword('WAVERED' , wavered, 'KOA: Red end wavelength')
         self.set_keyword('WAVECNTR', wavecntr, 'KOA: Center wavelength')
@@ -331,26 +195,20 @@ class Esi(instrument.Instrument):
 
         # self.log.info('set_specres: setting SPECRES keyword values')
 
-        specres = 'null'
+        #spectral resolution R found over all wavelengths and dispersions between orders 6-15
+        #
+        #           wavelength           0.1542[arcsec/pixel] * wavelength[angstroms]
+        # R    =   -----------     =    ---------------------------------------------
+        #         deltawavelength       slitwidth[arcsec] * dispersion[angstroms/pixel]
+        # 
+        #           MEAN(0.1542*wavelength/dispersion)         4125.406
+        # R    =    -----------------------------------   =   -----------
+        #                       slitwidth                      slitwidth
+        #
+        #from echellette table https://www.keck.hawaii.edu/realpublic/inst/esi/Sensitivities.html
         obsmode   = self.get_keyword("OBSMODE")
-        if obsmode in ('low', 'high'):
-            #spectral resolution R found over all wavelengths and dispersions between orders 6-15
-            #
-            #           wavelength           0.1542[arcsec/pixel] * wavelength[angstroms]
-            # R    =   -----------     =    ---------------------------------------------
-            #         deltawavelength       slitwidth[arcsec] * dispersion[angstroms/pixel]
-            # 
-            #           MEAN(0.1542*wavelength/dispersion)         4125.406
-            # R    =    -----------------------------------   =   -----------
-            #                       slitwidth                      slitwidth
-            #
-            #from echellette table https://www.keck.hawaii.edu/realpublic/inst/esi/Sensitivities.html
-            try:
-                slitwidt = self.get_keyword('SLITWIDT')
-                specres = 4125.406 / slitwidt
-                specres = np.round(specres,-1)
-            except:
-                pass
+        slitwidt  = self.get_keyword('SLITWIDT') if obsmode in ('low', 'high') else None
+        specres   = spectral_config.get_esi_specres(obsmode, slitwidt)
         self.set_keyword('SPECRES' , specres,  'KOA: Nominal spectral resolution')
         return True
 
@@ -6,6 +6,8 @@ HIRES specific DR techniques can be added to it in the future
 '''
 
 import instrument
+import koaimtyp_rules
+import spectral_config
 import datetime as dt
 from common import *
 from math import ceil, floor
@@ -19,6 +21,45 @@ from astropy.visualization.mpl_normalize import ImageNormalize
 import scipy
 
 class Hires(instrument.Instrument):
+
+    #KOAIMTYP rule table (see koaimtyp_rules.py)
+    koaimtypRules = koaimtyp_rules.HIRES
+
+    #DQA checks run in order for each file (see Instrument.run_dqa_checks)
+    dqaSteps = [
+        'set_dqa_date',
+        'set_dqa_vers',
+        instrument.DqaStep('set_datlevel', 0),
+        'set_instr',
+        'set_dateObs',
+        'set_utc',
+        'set_ut', # may need to delete duplicate UTC?
+        'set_utend',
+#        'set_numamps',
+#        'set_numccds', # needed?
+        'set_koaimtyp', # imagetyp
+        'set_koaid',
+#        'set_blank',
+        'fix_binning',
+        'set_ofName',
+        'set_semester',
+        'set_wavelengths',
+        'set_instrument_status', # inststat
+        'set_weather_keywords',
+        'set_image_stats_keywords', # IM* and PST*, imagestat
+        instrument.DqaStep('set_npixsat', satVal=65535.0), # npixsat
+        'set_sig2nois',
+        'set_slit_values',
+        'set_gain_and_readnoise', # ccdtype
+        'set_skypa', # skypa
+        'set_subexp',
+        'set_roqual',
+        'set_oa',
+        instrument.DqaStep('set_prog_info', instrument.PROGDATA),
+        instrument.DqaStep('set_propint', instrument.PROGDATA),
+        'fix_propint',
+    ]
+
     def __init__(self, instr, utDate, rootDir, log=None):
 
         # Call the parent init to get all the shared variables
@@ -28,53 +69,10 @@ class Hires(instrument.Instrument):
         self.keywordMap['OFNAME'] = ''
         self.keywordMap['FRAMENO'] = ''
 
-        # Other vars that subclass can overwrite
-        self.endTime = '20:00:00'  # 24 hour period start/end time (UT)
-
         # Generate the paths to the HIRES datadisk accounts
         self.paths = self.get_dir_list()
 
 
-    def run_dqa_checks(self, progData):
-        '''
-        Run all DQA checks unique to this instrument
-        '''
-        ok = True
-        if ok: ok = self.set_dqa_date()
-        if ok: ok = self.set_dqa_vers()
-        if ok: ok = self.set_datlevel(0)
-        if ok: ok = self.set_instr()
-        if ok: ok = self.set_dateObs()
-        if ok: ok = self.set_utc()
-        if ok: ok = self.set_ut() # may need to delete duplicate UTC?
-        if ok: ok = self.set_utend()
-#        if ok: ok = self.set_numamps()
-#        if ok: ok = self.set_numccds() # needed?
-        if ok: ok = self.set_koaimtyp() # imagetyp
-        if ok: ok = self.set_koaid()
-#        if ok: ok = self.set_blank()
-        if ok: ok = self.fix_binning()
-        if ok: ok = self.set_ofName()
-        if ok: ok = self.set_semester()
-        if ok: ok = self.set_wavelengths()
-        if ok: ok = self.set_instrument_status() # inststat
-        if ok: ok = self.set_weather_keywords()
-        if ok: ok = self.set_image_stats_keywords() # IM* and PST*, imagestat
-        if ok: ok = self.set_npixsat(satVal=65535.0) # npixsat
-        if ok: ok = self.set_sig2nois()
-        if ok: ok = self.set_slit_values()
-        if ok: ok = self.set_gain_and_readnoise() # ccdtype
-        if ok: ok = self.set_skypa() # skypa
-        if ok: ok = self.set_subexp()
-        if ok: ok = self.set_roqual()
-        if ok: ok = self.set_oa()
-        if ok: ok = self.set_prog_info(progData)
-        if ok: ok = self.set_propint(progData)
-        if ok: ok = self.fix_propint()
-
-        return ok
-
-
     def get_dir_list(self):
         '''
         Function to generate the paths to all the HIRES accounts, including engineering
@@ -126,72 +124,6 @@ class Hires(instrument.Instrument):
         return True
 
         
-    def get_koaimtyp(self):
-        '''
-        Sets koaimtyp based on keyword values
-        '''
-        
-        koaimtyp = 'undefined'
-        if self.get_keyword('AUTOSHUT', False) == None: return koaimtyp
-        if self.get_keyword('LAMPNAME', False) == None: return koaimtyp
-        if self.get_keyword('LMIRRIN', False) == None:  return koaimtyp
-        if self.get_keyword('DARKCLOS', False) == None: return koaimtyp
-        if self.get_keyword('TTIME', False) == None:    return koaimtyp
-
-        lampname = self.get_keyword('LAMPNAME', False)
-        ttime = self.get_keyword('TTIME', False)
-        lmirrin = self.get_keyword('LMIRRIN', False)
-        darkclos = self.get_keyword('DARKCLOS', False)
-        
-        if self.get_keyword('AUTOSHUT', False) == 0:
-            lampOn = ''
-            if lampname != 'none' and (lmirrin != 0 or darkclos != 1):
-                lampOn = '_lamp_on'
-            if ttime == 0: koaimtyp = ''.join(('bias', lampOn))
-            else:          koaimtyp = ''.join(('dark', lampOn))
-            return koaimtyp
-
-        deckname = self.get_keyword('DECKNAME', False)
-        catcur1 = self.get_keyword('CATCUR1', False)
-        catcur2 = self.get_keyword('CATCUR2', False)
-        hatclos = self.get_keyword('HATCLOS', False)
-
-        if deckname == None or catcur1 == None or catcur2 == None or hatclos == None:
-            return koaimtyp
-
-        xcovclos = self.get_keyword('XCOVCLOS', False)
-        ecovclos = self.get_keyword('ECOVCLOS', False)
-
-        if 'quartz' in lampname:
-            if deckname == 'D5':              koaimtyp = 'trace'
-            else:                             koaimtyp = 'flatlamp'
-            if lmirrin == 0 and hatclos == 0: koaimtyp = 'object_lamp_on'
-            if lmirrin == 0 and hatclos == 1: koaimtyp = 'undefined'
-            return koaimtyp
-        elif 'ThAr' in lampname:
-            catcur = catcur1
-            if lampname == 'ThAr2': catcur = catcur2
-            if catcur >= 5.0:
-                koaimtyp = 'arclamp'
-                if deckname == 'D5': koaimtyp = 'focus'
-            else: koaimtyp = 'undefined'
-            if lmirrin == 0 and hatclos == 0:   koaimtyp = 'object_lamp_on'
-            if lmirrin == 0 and hatclos == 1:   koaimtyp = 'undefined'
-            if xcovclos == 1 and ecovclos == 1: koaimtyp = 'undefined'
-            return koaimtyp
-        elif 'undefined' in lampname:
-            return 'undefined'
-
-        if hatclos == 1:
-            koaimtyp = 'dark'
-            if ttime == 0: koaimtyp = 'bias'
-            return koaimtyp
-        
-        if ttime == 0: return 'bias'
-        
-        return 'object'
-
-
 #    def set_blank(self):
 #        '''
 #        If BLANK keyword does not exist, create and set to -32768
@@ -246,142 +178,28 @@ class Hires(instrument.Instrument):
 
     def set_wavelengths(self):
         '''
-        Determine and set wavelength range of spectum
+        Determine and set wavelength range of spectum (see spectral_config.get_hires_wavelengths)
         '''
 
-        #set pixel and CCD size
-        psize = 0.015
-        npix = 3072.0
-
         #make sure stages are homed
         if not self.get_keyword('XDISPERS'):
             xdispers = 'RED'
         else:
             xdispers = self.get_keyword('XDISPERS').strip()
 
-        keyflag=1
-        keyvars = ['','','','','']
-        for key_i,key_val in enumerate(['XDCAL','ECHCAL','XDSIGMAI','XDANGL','ECHANGL']):
-            if ((key_val != 'ECHANGL' and key_val != 'XDANGL') and 
-                (not self.get_keyword(key_val) or self.get_keyword(key_val) == 0)):
+        keyflag = 1
+        for key in ['XDCAL','ECHCAL','XDSIGMAI']:
+            if not self.get_keyword(key) or self.get_keyword(key) == 0:
                 keyflag = 0
-            else:
-                keyvars[key_i] = self.get_keyword(key_val)
-            
-        xdcal = keyvars[0]
-        echcal = keyvars[1]
-        xdsigmai = keyvars[2]
-        xdangl = keyvars[3]
-        echangl = keyvars[4]
-            
+
         if keyflag == 1:
-            #specifications, camera-collimator, blaze, cal offset angles
-            camcol = 40.*np.pi/180.
-            blaze = -4.38*np.pi/180.
-            offset = 25.0-0.63 #0-order + 5deg for home
-
-            #grating equation
-            alpha = (xdangl+offset)*np.pi/180.
-            d = 10.**7/xdsigmai #microns
-            waveeq = lambda x,y,z: x*((1.+np.cos(y))*np.sin(z)-np.sin(y)*np.cos(z))
-            wavecntr = waveeq(d,camcol,alpha)
-            ccdangle = np.arctan2(npix*psize,(1.92*762.0)) #f = 762mm, psize u pix, 1.92 amag
-
-            #blue end
-            alphab = alpha - ccdangle
-            waveblue = waveeq(d,camcol,alphab) 
-
-            #red end
-            alphar = alpha + ccdangle
-            wavered = waveeq(d,camcol,alphar)
-
-            #center, get non-decimal part of number
-            wavecntr = np.fix(wavecntr)
-            waveblue = np.fix(waveblue)
-            wavered = np.fix(wavered)
-
-            #get the correct equation constants
-            if xdispers == 'RED':
-                #order 62, 5748 A, order*wave = const
-                const = 62.0 * 5748.0
-                a = float(1.4088)
-                b = float(-306.6910)
-                c = float(16744.1946)
-                
-            if xdispers == 'UV':
-                #order 97, 3677 A, order*wave = const
-                const = 97.0 * 3677.0
-                a = float(0.9496)
-                b = float(-266.2792)
-                c = float(19943.7496)
-                
-            if xdispers == '':
+            waves = spectral_config.get_hires_wavelengths(xdispers, self.get_keyword('XDSIGMAI'),
+                                                          self.get_keyword('XDANGL'), self.get_keyword('ECHANGL'))
+            if waves is None:
                 return
-
-
-            #correct wavelength values
-            for i in [wavecntr,waveblue,wavered]:
-                #find order for wavecntr
-                wave = i
-                order = np.floor(const/wave)
-                trycount = 1
-                okflag = 0
-                while okflag == 0:
-                    #find shift in Y: order 62 =npix with XD=ECH=0(red)
-                    #                 order 97 =npix with XD=ECH=0(blue)
-                    if i == wavecntr:
-                        shift = a*order**2 + b*order + c
-                        newy = npix - shift
-                        newy = -newy
-                        okflag = 1
-                        
-                    else:
-                        shift2 = a*order**2 + b*order + c
-                        
-                        newy2 = shift2 - newy
-                        if newy2 < 120:
-                            order = order -1
-                            trycount += 1
-                            okflag=0
-                            if trycount < 100:
-                                continue
-                        npix2 = 2*npix
-
-                        if newy2 > npix2:
-                            order = order + 1
-                            trycount += 1
-                            okflag=0
-                            if trycount < 100:
-                                continue
-                        if trycount > 100 or newy2 > 120 or newy2 > npix2:
-                            okflag=1
-                            break
-
-                #find delta wave for order
-                dlamb = -0.1407*order + 18.005
-                #new wavecenter = central wavelength for this order
-                wave = const/order
-                #correct for echangl
-                wave = wave + (4*dlamb*echangl)
-                #round to nearest 10 A
-                wave2 = wave % 10 # round(wave,-1)
-                if wave2 < 5:
-                    wave = wave - wave2
-                else:
-                    wave = wave + (10-wave2)
-                if wave < 1000 or wave > 20000:
-                    wave = 'null'
-                    self.log.error(f'Wavelength out of range.')
-                if i == wavecntr:
-                    wavecntr = wave
-                elif i == waveblue:
-                    waveblue = wave
-                elif i == wavered:
-                    wavered = wave
-
-            if wavecntr != 'null': wavecntr = int(round(wavecntr,-1))
-            if waveblue != 'null': waveblue = int(round(waveblue,-1))
-            if wavered  != 'null': wavered  = int(round(wavered,-1))
+            wavecntr, waveblue, wavered = waves
+            for wave in waves:
+                if wave == 'null': self.log.error(f'Wavelength out of range.')
         else:
             wavecntr = 'null'
             waveblue = 'null'
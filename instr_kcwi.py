@@ -7,6 +7,8 @@ KCWI specific DR techniques can be added to it in the future
 '''
 
 import instrument
+import koaimtyp_rules
+import wcs_batch
 import datetime as dt
 import numpy as np
 from astropy.io import fits
@@ -18,12 +20,41 @@ import math
 from skimage import exposure
 
 class Kcwi(instrument.Instrument):
+
+    #KOAIMTYP rule table (see koaimtyp_rules.py)
+    koaimtypRules = koaimtyp_rules.KCWI
+
+    #DQA checks run in order for each file (see Instrument.run_dqa_checks)
+    dqaSteps = [
+        'set_instr',
+        'set_telescope',
+        'set_filename',
+        'set_elaptime',
+        'set_dateObs',
+        'set_utc',
+        'set_ut',
+        'set_koaid',
+        'set_koaimtyp',
+        'set_frameno',
+        'set_semester',
+        instrument.DqaStep('set_prog_info', instrument.PROGDATA),
+        instrument.DqaStep('set_propint', instrument.PROGDATA),
+        instrument.DqaStep('set_datlevel', 0),
+        'set_image_stats_keywords',
+        'set_weather_keywords',
+        'set_oa',
+        instrument.DqaStep('set_npixsat', satVal=65535),
+        'set_slitdims_wavelengths',
+        'set_wcs',
+        'set_dqa_vers',
+        'set_dqa_date',
+    ]
+
     def __init__(self, instr, utDate, rootDir, log=None):
         # Call the parent init to get all the shared variables
         super().__init__(instr, utDate, rootDir, log)
 
         # Other vars that subclass can overwrite
-        self.endTime = '20:00:00'   # 24 hour period start/end time (UT)
         self.sdataList = self.get_dir_list()
         self.keywordMap['UTC'] = 'UT'
 
@@ -63,35 +94,6 @@ class Kcwi(instrument.Instrument):
         else:
             prefix = ''
         return prefix
-
-    def run_dqa_checks(self, progData):
-        '''
-        Run all DQA checks unique to this instrument.
-        '''
-        ok = True
-        if ok: ok = self.set_instr()
-        if ok: ok = self.set_telescope()
-        if ok: ok = self.set_filename()
-        if ok: ok = self.set_elaptime()
-        if ok: ok = self.set_dateObs()
-        if ok: ok = self.set_utc()
-        if ok: ok = self.set_ut()
-        if ok: ok = self.set_koaid()
-        if ok: ok = self.set_koaimtyp()
-        if ok: ok = self.set_frameno()
-        if ok: ok = self.set_semester()
-        if ok: ok = self.set_prog_info(progData)
-        if ok: ok = self.set_propint(progData)
-        if ok: ok = self.set_datlevel(0)
-        if ok: ok = self.set_image_stats_keywords()
-        if ok: ok = self.set_weather_keywords()
-        if ok: ok = self.set_oa()
-        if ok: ok = self.set_npixsat(satVal=65535)
-        if ok: ok = self.set_slitdims_wavelengths()
-        if ok: ok = self.set_wcs()
-        if ok: ok = self.set_dqa_vers()
-        if ok: ok = self.set_dqa_date()
-        return ok
     
     def set_filename(self):
         '''
@@ -152,23 +154,6 @@ class Kcwi(instrument.Instrument):
         return True
 
         
-    def get_koaimtyp(self):
-        '''
-        Sets koaimtyp based on keyword values
-        '''
-        koaimtyp = 'undefined'
-        try:
-            camera = self.get_keyword('CAMERA').lower()
-        except:
-            camera = ''
-        if camera == 'fpc':
-            koaimtyp = 'fpc'
-        elif self.get_keyword('XPOSURE') == 0.0:
-            koaimtyp = 'bias'
-        elif self.get_keyword('IMTYPE'):
-            koaimtyp = self.get_keyword('IMTYPE').lower()
-        return koaimtyp
-
     def set_elaptime(self):
         '''
         Fixes missing ELAPTIME keyword.
@@ -271,6 +256,33 @@ class Kcwi(instrument.Instrument):
         return True
 
 
+    def get_wcs_cd_inputs(self):
+        '''
+        Returns (sky PA, pixel scale) for the FPC CD matrix, or None if not FPC or rotator mode is unknown.
+        '''
+        if self.get_keyword('CAMERA') != 'fpc': return None
+        pa = self.get_keyword('ROTPOSN')
+        rotmode = self.get_keyword('ROTMODE')
+        parantel = self.get_keyword('PARANTEL')
+        parang = self.get_keyword('PARANG')
+        el = self.get_keyword('EL')
+        binning = self.get_keyword('BINNING')
+        #special PA calculation determined by rotmode
+        #pa = rotposn + parantel - el
+        mode = rotmode[0:4]
+        if parantel == '' or parantel == None:
+            parantel = parang
+        if mode == 'posi':
+            pa1 = float(pa)
+        elif mode == 'vert':
+            pa1 = float(pa)+float(parantel)
+        elif mode == 'stat':
+            pa1 = float(pa)+float(parantel)-float(el)
+        else:
+            return None
+        return pa1 - wcs_batch.KCWI_PAZERO, wcs_batch.KCWI_PIXSCALE * float(binning)
+
+
     def set_wcs(self):
         '''
         Set world coordinate system values
@@ -295,40 +307,21 @@ class Kcwi(instrument.Instrument):
         equinox = self.get_keyword('EQUINOX')
         naxis1 = self.get_keyword('NAXIS1')
         naxis2 = self.get_keyword('NAXIS2')
-        pa = self.get_keyword('ROTPOSN')
-        rotmode = self.get_keyword('ROTMODE')
-        parantel = self.get_keyword('PARANTEL')
-        parang = self.get_keyword('PARANG')
-        el = self.get_keyword('EL')
         binning = self.get_keyword('BINNING')
         self.set_keyword('BINNING',str(binning),'Binning: serial/axis1, parallel/axis2')
-        #special PA calculation determined by rotmode
-        #pa = rotposn + parantel - el
-        mode = rotmode[0:4]
-        if parantel == '' or parantel == None:
-            parantel = parang
-        if mode == 'posi':
-            pa1 = float(pa)
-        elif mode == 'vert':
-            pa1 = float(pa)+float(parantel)
-        elif mode == 'stat':
-            pa1 = float(pa)+float(parantel)-float(el)
-        else:
+        inputs = self.get_wcs_cd_inputs()
+        if inputs is None:
+            mode = self.get_keyword('ROTMODE')[0:4]
             self.log.error(f'set_wcs: indeterminate mode {mode}')
             return False
 
         #get correct units and formatting
-        raindeg = 1
-        pixscale = 0.0075 * float(binning)
-        pa0 = 0.7
+        pa, pixscale = inputs
         crval1 = rakey
         crval2 = deckey
 
-        pa = -(pa1 - pa0)*np.pi/180.0
-        cd1_1 = -pixscale*np.cos(pa)/3600.0
-        cd2_2 = pixscale*np.cos(pa)/3600.0
-        cd1_2 = -pixscale*np.sin(pa)/3600.0
-        cd2_1 = -pixscale*np.sin(pa)/3600.0
+        #CD matrix from the night's WCS table (see wcs_batch.py)
+        cd1_1, cd1_2, cd2_1, cd2_2 = self.wcsTable.get_cd_matrix(pa, pixscale)
 
         cd1_1 = '%18.7e' % cd1_1
         cd2_2 = '%18.7e' % cd2_2
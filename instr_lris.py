@@ -7,6 +7,9 @@ https://www2.keck.hawaii.edu/inst/lris/instrument_key_list.html
 '''
 
 import instrument
+import koaimtyp_rules
+import spectral_config
+import wcs_batch
 import datetime as dt
 import numpy as np
 import math
@@ -31,6 +34,48 @@ from skimage import exposure
 
 class Lris(instrument.Instrument):
 
+    #KOAIMTYP rule table (see koaimtyp_rules.py)
+    koaimtypRules = koaimtyp_rules.LRIS
+
+    #DQA checks run in order for each file (see Instrument.run_dqa_checks)
+    dqaSteps = [
+        'set_instr',
+        'set_dateObs',
+        'set_utc',
+        'set_koaimtyp',
+        'set_koaid',
+        'set_ut',
+        'set_elaptime',
+        'set_ofname',
+        'set_frameno',
+        'set_semester',
+        instrument.DqaStep('set_prog_info', instrument.PROGDATA),
+        instrument.DqaStep('set_propint', instrument.PROGDATA),
+        instrument.DqaStep('set_datlevel', 0),
+        'get_nexten',
+#        'set_image_stats_keywords',
+        'set_weather_keywords',
+        'set_oa',
+        instrument.DqaStep('set_npixsat', satVal=65535),
+        'set_obsmode',
+        'set_wavelengths',
+#        'set_sig2nois',
+        'set_ccdtype',
+        'set_slit_dims',
+        'set_wcs',
+        'set_skypa',
+        'set_dqa_vers',
+        'set_dqa_date',
+        'fix_datebeg',
+        'set_mjd_obs',
+#        self.set_keyword('ADCLIM', 'null', f"VAL: {self.get_keyword('ADCLIM')}")
+#        self.set_keyword('ADCMOD', 'null', f"VAL: {self.get_keyword('ADCMOD')}")
+#        self.set_keyword('ADCPRENA', 'null', f"VAL: {self.get_keyword('ADCPRENA')}")
+#        self.set_keyword('ADCSTA', 'null', f"VAL: {self.get_keyword('ADCSTA')}")
+#        self.set_keyword('DISP0STA', 'null', f"VAL: {self.get_keyword('DISP0STA')}")
+    ]
+
+
     def __init__(self, instr, utDate, rootDir, log=None):
 
         # Call the parent init to get all the shared variables
@@ -39,7 +84,6 @@ class Lris(instrument.Instrument):
         # Set any unique keyword index values here with self.keywordMap
 
         # Other vars that subclass can overwrite
-        self.endTime = '19:00:00'   # 24 hour period start/end time (UT)
         self.keywordSkips   = ['CCDGN00', 'CCDRN00']
         #self.keywordSkips = ['IM01MN00', 'IM01SD00', 'IM01MD00', 'PT01MN00', 'PT01SD00', 'PT01MD00', 'IM01MN01', 'IM01SD01', 'IM01MD01', 'PT01MN01', 'PT01SD01', 'PT01MD01', 'IM02MN02', 'IM02SD02', 'IM02MD02', 'PT02MN02', 'PT02SD02', 'PT02MD02', 'IM02MN03', 'IM02SD03', 'IM02MD03', 'PT02MN03', 'PT02SD03', 'PT02MD03']
 
@@ -48,50 +92,6 @@ class Lris(instrument.Instrument):
         self.sdataList = self.get_dir_list()
 
 
-    def run_dqa_checks(self, progData):
-        '''
-        Run all DQA checks unique to this instrument.
-        '''
-
-        #todo: check that all of these do not need a subclass version if base class func was used.
-        ok = True
-        if ok: ok = self.set_instr()
-        if ok: ok = self.set_dateObs()
-        if ok: ok = self.set_utc()
-        if ok: ok = self.set_koaimtyp()
-        if ok: ok = self.set_koaid()
-        if ok: ok = self.set_ut()
-        if ok: ok = self.set_elaptime()
-        if ok: ok = self.set_ofname()
-        if ok: ok = self.set_frameno()
-        if ok: ok = self.set_semester()
-        if ok: ok = self.set_prog_info(progData)
-        if ok: ok = self.set_propint(progData)
-        if ok: ok = self.set_datlevel(0)
-        if ok: ok = self.get_nexten()
-#        if ok: ok = self.set_image_stats_keywords()
-        if ok: ok = self.set_weather_keywords()
-        if ok: ok = self.set_oa()
-        if ok: ok = self.set_npixsat(satVal=65535)
-        if ok: ok = self.set_obsmode()
-        if ok: ok = self.set_wavelengths()
-#        if ok: ok = self.set_sig2nois()
-        if ok: ok = self.set_ccdtype()
-        if ok: ok = self.set_slit_dims()
-        if ok: ok = self.set_wcs()
-        if ok: ok = self.set_skypa()        
-        if ok: ok = self.set_dqa_vers()
-        if ok: ok = self.set_dqa_date()
-        if ok: ok = self.fix_datebeg()
-        if ok: ok = self.set_mjd_obs()
-#        self.set_keyword('ADCLIM', 'null', f"VAL: {self.get_keyword('ADCLIM')}")
-#        self.set_keyword('ADCMOD', 'null', f"VAL: {self.get_keyword('ADCMOD')}")
-#        self.set_keyword('ADCPRENA', 'null', f"VAL: {self.get_keyword('ADCPRENA')}")
-#        self.set_keyword('ADCSTA', 'null', f"VAL: {self.get_keyword('ADCSTA')}")
-#        self.set_keyword('DISP0STA', 'null', f"VAL: {self.get_keyword('DISP0STA')}")
-        return ok
-
-
     @staticmethod
     def get_dir_list():
         '''
@@ -165,103 +165,6 @@ class Lris(instrument.Instrument):
         return True
 
 
-    def get_koaimtyp(self):
-
-        #if instrument not defined, return
-        imagetyp = 'undefined'
-        try:
-            instrume = self.get_keyword('INSTRUME')
-        except:
-            return 'undefined'
-
-        #focus
-        slitname = self.get_keyword('SLITNAME')
-        outfile = self.get_keyword('OUTFILE')
-        if (slitname == 'GOH_LRIS') or (outfile == 'rfoc') or (outfile == 'bfoc'):
-            return 'focus'
-
-        #bias
-        elaptime = self.get_keyword('ELAPTIME')
-        if elaptime == 0:
-            return 'bias'
-
-        #flat, dark, wave, object
-        try:
-            trapdoor = self.get_keyword('TRAPDOOR')
-        except:
-            return 'undefined'
-        graname = self.get_keyword('GRANAME')
-        grisname = self.get_keyword('GRISNAME')
-        if trapdoor == 'open':
-            #is lamp on?
-            flimagin = self.get_keyword('FLIMAGIN')
-            flspectr = self.get_keyword('FLSPECTR')
-            flat1 = self.get_keyword('FLAMP1')
-            flat2 = self.get_keyword('FLAMP2')
-            #a lamp is on
-            if 'on' in [flimagin,flspectr,flat1,flat2]:
-                return 'flatlamp'
-            else:
-                #no lamp on
-                # this is no longer working for red side
-                # autoshut and calname do not exist
-                # AXESTAT check works for most cases
-                if self.get_keyword('AUTOSHUT'):
-                    calname = self.get_keyword('CALNAME')
-                    if calname in ['ir','hnpb','uv']:
-                        return 'polcal'
-                    else:
-                        return 'object'
-                elif self.get_keyword('AXESTAT') == 'tracking':
-                    return 'object'
-                else:
-                    return 'undefined'
-        elif trapdoor == 'closed':
-            #is lamp on?
-            # lamps does not exist in lris red now, others do
-            lamps = self.get_keyword('LAMPS')
-            if lamps not in ['','0',None]:
-                if '1' in lamps:
-                    if lamps == '0,0,0,0,0,1':
-                        return 'flatlamp'
-                    else:
-                        if instrume == 'LRIS':
-                            if graname != 'mirror':
-                                return 'arclamp'
-                        elif instrume == 'LRISBLUE':
-                            if grisname != 'clear':
-                                return 'arclamp'
-                else:
-                    if lamps == '0,0,0,0,0,0':
-                        return 'dark'
-            else:
-                mercury = self.get_keyword('MERCURY')
-                neon = self.get_keyword('NEON')
-                argon = self.get_keyword('ARGON')
-                cadmium = self.get_keyword('CADMIUM')
-                zinc = self.get_keyword('ZINC')
-                halogen = self.get_keyword('HALOGEN')
-                krypton = self.get_keyword('KRYPTON')
-                xenon = self.get_keyword('XENON')
-                feargon = self.get_keyword('FEARGON')
-                deuterium = self.get_keyword('DEUTERI')
-
-                if halogen == 'on':
-                    return 'flatlamp'
-                elif 'on' in [neon,argon,cadmium,zinc,krypton,xenon,feargon,deuterium]:
-                    if instrume == 'LRIS':
-                        if graname != 'mirror':
-                            return 'arclamp'
-                    elif instrume == 'LRISBLUE':
-                        if grisname != 'clear':
-                            return 'arclamp'
-                elif all(element == 'off' for element in [neon,argon,cadmium,zinc,halogen,krypton,xenon,feargon,deuterium]):
-                    return 'dark'
-
-        #undefined
-        return 'undefined'
-
-
     def set_obsmode(self):
         '''
         Determine observation mode
@@ -295,127 +198,31 @@ class Lris(instrument.Instrument):
     def set_wavelengths(self):
         '''
         Get blue, center, and red wavelengths [WAVEBLUE,WAVECNTR,WAVERED]
+        (see spectral_config.get_lris_wavelengths)
         '''
-        is_null = False
-
         instr = self.get_keyword('INSTRUME')
-        slitname = self.get_keyword('SLITNAME')
         obsmode = self.get_keyword('OBSMODE').upper()
-        grating = self.get_keyword('GRANAME')
-        grism = self.get_keyword('GRISNAME')
-        slitmask = str(self.get_keyword('SLITMASK', default=''))
 
-        #Imaging mode
+        #only values used by this instr and mode, so the memo key is the configuration
+        redfilt = blufilt = grating = grism = wlen = dateobs = slitmask = None
         if obsmode == 'IMAGING':
-            if instr == 'LRIS':
-                flt = self.get_keyword('REDFILT')
-                wavearr = dict({'clear':[3500,9000],
-                                'B':[3800,5300],
-                                'V':[4800,6600],
-                                'R':[5500,8200],
-                                'Rs':[6000,7500],
-                                'I':[6800,8400],
-                                'GG495':[4800,4950],
-                                'OG570':[5500,5700],
-                                'RG850':[8200,8500],
-                                'NB4000':[3800,4200],
-                                'NB5390':[5350,5400],
-                                'NB6741':[6700,6800],
-                                'NB8185':[8150,8250],
-                                'NB8560':[8500,8650],
-                                'NB9135':[9100,9200],
-                                'NB9148':[9050,9250],
-                                'NB4325':[9050,9520]})
-            elif instr == 'LRISBLUE':
-                flt = self.get_keyword('BLUFILT')
-                wavearr = dict({'clear':[3000,6500],
-                                'U':[3050,4000],
-                                'B':[3900,4900],
-                                'V':[5800,6600],
-                                'G':[4100,5300],
-                                'SP580':[0,0],
-                                'NB4170':[0,0]})
-            if flt == 'Clear':
-                flt = 'clear'
-
-        #Spectroscopy mode
+            if   instr == 'LRIS'    : redfilt = self.get_keyword('REDFILT')
+            elif instr == 'LRISBLUE': blufilt = self.get_keyword('BLUFILT')
         else:
+            grating = self.get_keyword('GRANAME')
+            grism = self.get_keyword('GRISNAME')
             if instr == 'LRIS':
                 wlen = self.get_keyword('WAVELEN')
                 if not wlen: return True
-                wavearr = dict({'150/7500':[wlen-12288/2,wlen+12288/2],
-                                '300/5000':[wlen-6525/2,wlen+6525/2],
-                                '400/8500':[wlen-4762/2,wlen+4762/2],
-                                '600/5000':[wlen-3275/2,wlen+3275/2],
-                                '600/7500':[wlen-3275/2,wlen+3275/2],
-                                '600/10000':[wlen-3275/2,wlen+3275/2],
-                                '831/8200':[wlen-2375/2,wlen+2375/2],
-                                '900/5500':[wlen-2175/2,wlen+2175/2],
-                                '1200/7500':[wlen-1638/2,wlen+1638/2],
-                                '1200/9000':[wlen-1638/2,wlen+1638/2]})
                 dateobs = self.get_keyword('DATE-OBS')
-                date = dt.datetime.strptime(dateobs,'%Y-%M-%d')
-                newthreshold = dt.datetime(2015,5,14)
-                #if observing date before May 14th, 2015, use different set of gratings
-                if date < newthreshold:
-                    wavearr = dict({'150/7500':[wlen-9830/2,wlen+9830/2],
-                                    '158/8500':[wlen-9830/2,wlen+9830/2],
-                                    '300/5000':[wlen-5220/2,wlen+5220/2],
-                                    '400/8500':[wlen-3810/2,wlen+3810/2],
-                                    '600/5000':[wlen-2620/2,wlen+2620/2],
-                                    '600/7500':[wlen-2620/2,wlen+2620/2],
-                                    '600/10000':[wlen-2620/2,wlen+2620/2],
-                                    '831/8200':[wlen-1900/2,wlen+1900/2],
-                                    '900/5500':[wlen-1740/2,wlen+1740/2],
-                                    '1200/7500':[wlen-1310/2,wlen+1310/2]})
             elif instr == 'LRISBLUE':
-                #longslit
-                if 'long_' in slitmask or 'pol_' in slitmask:
-                    wavearr = dict({'300/5000':[1570,7420],
-                                    '400/3400':[1270,5740],
-                                    '600/4000':[3010,5600],
-                                    '1200/3400':[2910,3890]})
-                else:
-                    wavearr = dict({'300/5000':[2210,8060],
-                                    '400/3400':[1760,6220],
-                                    '600/4000':[3300,5880],
-                                    '1200/3400':[3010,4000]})
-            else:
-                return True
-
-        #dichroic cutoff
-        #NOTE: Elysia fixed bug in IDL code was incorrectly not truncating the wavelength range 
-        #bc the dichroic wavelength is in nanometers and the wavelength range is in angstroms.
+                slitmask = str(self.get_keyword('SLITMASK', default=''))
         dichname = self.get_keyword('DICHNAME')
-        if   dichname == '460': minmax = 4874
-        elif dichname == '500': minmax = 5091
-        elif dichname == '560': minmax = 5696
-        elif dichname == '680': minmax = 6800
-        else                  : minmax = 0
 
-        #determine wavelength range
-        if obsmode == 'IMAGING':
-            if flt in wavearr: waveblue, wavered = wavearr.get(flt)
-            else             : return True
-        elif 'SPEC' in obsmode:
-            if   grating in wavearr: waveblue, wavered = wavearr.get(grating)
-            elif grism in wavearr  : waveblue, wavered = wavearr.get(grism)
-            else                   : return True
-
-        #if wavelength range encompasses dichroic cutoff
-        #LRIS: minmax to wavered
-        #LRISBLUE: waveblue to minmax
-        if instr == 'LRIS':
-            if waveblue < minmax:
-                waveblue = minmax
-        elif instr == 'LRISBLUE':
-            if wavered > minmax:
-                wavered = minmax
-
-        #round to the nearest 10 angstroms
-        wavered  = int(round(np.round(wavered,-1)))
-        waveblue = int(round(np.round(waveblue,-1)))
-        wavecntr = int(round((waveblue + wavered)/2))
+        waves = spectral_config.get_lris_wavelengths(instr, obsmode, redfilt, blufilt, grating, grism,
+                                                     wlen, dateobs, slitmask, dichname)
+        if waves is None: return True
+        waveblue, wavecntr, wavered = waves
 
         self.set_keyword('WAVERED', wavered, 'KOA: Red wavelength')
         self.set_keyword('WAVEBLUE',waveblue,'KOA: Blue wavelength')
@@ -539,7 +346,6 @@ class Lris(instrument.Instrument):
         if obsmode != 'IMAGING': 
             return True        
 
-        pixelscale = 0.135 #arcsec
         rotposn = self.get_keyword('ROTPOSN')
         poname  = self.get_keyword('PONAME')
         ra      = self.get_keyword('RA')
@@ -548,61 +354,33 @@ class Lris(instrument.Instrument):
             self.log.warning('set_wcs: Could not set WCS')
             return True
 
-        pixcorrect = lambda x: (x/pixelscale) + 1024
-
-        #dictionary of xim and yim only
-        podict = dict({'REF':[380.865,71.44],
-                       'REFO':[-377.22,72.52],
-                       'LRIS':[3.97,-309.82],
-                       'slitb':[-14.41,-263.74],
-                       'slitc':[31.85,-262.58],
-                       'POL':[3.91,-273.12],
-                       'LRISB':[-53.11,-310.54],
-                       'PICKOFF':[27.95,-260.63],
-                       'MIRA':[3.67,-300.34],
-                       'BEDGE':[20.25,-260.68],
-                       'TEDGE':[-0.65,-263.68],
-                       'UNDEFINED':[-53.11,-320.54]})
-        if poname not in podict.keys():
-            poname = 'UNDEFINED'
-        xim,yim = podict.get(poname)
-        if poname == 'REF':
-            xcen = 485
-            ycen = 520
-        elif poname == 'REFO':
-            xcen = 512
-            ycen = 512
-        else:
-            xcen = pixcorrect(yim+308.1)
-            ycen = pixcorrect(3.4-xim)
-
-        #for each FITS header extension, calculate CRPIX1/2 and CDELT1/2
-        for i in range(1,self.nexten+1):
-            crpix1 = self.get_keyword('CRPIX1',ext=i)
-            crpix2 = self.get_keyword('CRPIX2',ext=i)
-            crval1 = self.get_keyword('CRVAL1',ext=i)
-            crval2 = self.get_keyword('CRVAL2',ext=i)
-            cd11   = self.get_keyword('CD1_1',ext=i)
-            cd22   = self.get_keyword('CD2_2',ext=i)
-            naxis1 = self.get_keyword('NAXIS1',ext=i)
-            naxis2 = self.get_keyword('NAXIS2',ext=i)            
-
-            crpix1_new = crpix1 + ((xcen - crval1)/cd11)
-            crpix2_new = crpix2 + ((ycen - crval2)/cd22)
-            cdelt1_new = cd11 * pixelscale
-            cdelt2_new = cd22 * pixelscale
-            self.set_keyword('CRPIX1',crpix1_new,'KOA: CRPIX1',ext=i)
-            self.set_keyword('CRPIX2',crpix2_new,'KOA: CRPIX2',ext=i)
-            self.set_keyword('CDELT1',cdelt1_new,'KOA: CDELT1',ext=i)
-            self.set_keyword('CDELT2',cdelt2_new,'KOA: CDELT2',ext=i)
+        #pointing origin in pixels (see wcs_batch.py)
+        xcen, ycen = wcs_batch.get_lris_center(poname)
+
+        #same CRVAL1/2 for each extension
+        coord = SkyCoord(f'{ra} {dec}', unit=(u.hourangle, u.deg))
+        ra_deg  = coord.ra.degree
+        dec_deg = coord.dec.degree
+
+        #calculate CRPIX1/2 and CDELT1/2 for all FITS header extensions at once
+        exts = range(1,self.nexten+1)
+        values = {}
+        for key in ('CRPIX1', 'CRPIX2', 'CRVAL1', 'CRVAL2', 'CD1_1', 'CD2_2'):
+            values[key] = [self.get_keyword(key,ext=i) for i in exts]
+        wcs = wcs_batch.get_lris_ext_wcs(xcen, ycen, values['CRPIX1'], values['CRPIX2'], values['CRVAL1'],
+                                         values['CRVAL2'], values['CD1_1'], values['CD2_2'], xp=np)
+        crpix1, crpix2, cdelt1, cdelt2 = (v.tolist() for v in wcs)
+
+        for j, i in enumerate(exts):
+            self.set_keyword('CRPIX1',crpix1[j],'KOA: CRPIX1',ext=i)
+            self.set_keyword('CRPIX2',crpix2[j],'KOA: CRPIX2',ext=i)
+            self.set_keyword('CDELT1',cdelt1[j],'KOA: CDELT1',ext=i)
+            self.set_keyword('CDELT2',cdelt2[j],'KOA: CDELT2',ext=i)
             self.set_keyword('CTYPE1','RA---TAN','KOA: CTYPE1',ext=i)
             self.set_keyword('CTYPE2','DEC--TAN','KOA: CTYPE2',ext=i)
             self.set_keyword('CROTA2',rotposn,'KOA: Rotator position',ext=i)
 
             #set crval1/2 after we have used their original values
-            coord = SkyCoord(f'{ra} {dec}', unit=(u.hourangle, u.deg))
-            ra_deg  = coord.ra.degree
-            dec_deg = coord.dec.degree
             self.set_keyword('CRVAL1',ra_deg,'KOA: CRVAL1',ext=i)
             self.set_keyword('CRVAL2',dec_deg,'KOA: CRVAL2',ext=i)
 
@@ -7,14 +7,46 @@ NIRC2 specific DR techniques can be added to it in the future
 '''
 
 import instrument
+import koaimtyp_rules
+import wcs_batch
 import datetime as dt
 import numpy as np
-import scipy.stats
 import os
-import subprocess
 from socket import gethostname
 
 class Nirc2(instrument.Instrument):
+
+    #KOAIMTYP rule table (see koaimtyp_rules.py)
+    koaimtypRules = koaimtyp_rules.NIRC2
+
+    #DQA checks run in order for each file (see Instrument.run_dqa_checks)
+    dqaSteps = [
+        'set_dqa_date',
+        'set_dqa_vers',
+        instrument.DqaStep('set_datlevel', 0),
+        'set_instr',
+        'set_dateObs',
+        'set_ut', # may need to delete duplicate UTC?
+        'set_koaimtyp', # imagetyp
+        'set_koaid',
+        'set_semester',
+        'set_wavelengths',
+        'set_detdisp',
+        'set_wcs',
+        'set_elaptime',
+        'set_ofname',
+        'set_instrument_status', # inststat
+        'set_weather_keywords',
+        'set_image_stats_keywords', # IM* and PST*, imagestat
+        instrument.DqaStep('set_npixsat', satVal=lambda self: self.get_keyword('COADDS')*18000.0), # npixsat
+        instrument.DqaStep('set_nlinear', satVal=lambda self: self.get_keyword('COADDS')*5000.0),
+        'set_sig2nois',
+        'set_isao',
+        'set_oa',
+        instrument.DqaStep('set_prog_info', instrument.PROGDATA),
+        instrument.DqaStep('set_propint', instrument.PROGDATA),
+    ]
+
     def __init__(self, instr, utDate, rootDir, log=None):
 
         # Call parent init to get all the shared variables
@@ -23,40 +55,6 @@ class Nirc2(instrument.Instrument):
         # NIRC2 uses ROOTNAME instead of OUTDIR
         self.ofName = 'FILENAME'
 
-        # set endtime to 9AM
-        self.endTime = '19:00:00' #UT
-
-    def run_dqa_checks(self, progData):
-        '''
-        Run all DQA checks unique to this instrument
-        '''
-        ok=True
-        if ok: ok = self.set_dqa_date()
-        if ok: ok = self.set_dqa_vers()
-        if ok: ok = self.set_datlevel(0)
-        if ok: ok = self.set_instr()
-        if ok: ok = self.set_dateObs()
-        if ok: ok = self.set_ut() # may need to delete duplicate UTC?
-        if ok: ok = self.set_koaimtyp() # imagetyp
-        if ok: ok = self.set_koaid()
-        if ok: ok = self.set_semester()
-        if ok: ok = self.set_wavelengths()
-        if ok: ok = self.set_detdisp()
-        if ok: ok = self.set_wcs()
-        if ok: ok = self.set_elaptime()
-        if ok: ok = self.set_ofname()
-        if ok: ok = self.set_instrument_status() # inststat
-        if ok: ok = self.set_weather_keywords()
-        if ok: ok = self.set_image_stats_keywords() # IM* and PST*, imagestat
-        if ok: ok = self.set_npixsat(satVal = self.get_keyword('COADDS')*18000.0) # npixsat
-        if ok: ok = self.set_nlinear(satVal = self.get_keyword('COADDS')*5000.0)
-        if ok: ok = self.set_sig2nois()
-        if ok: ok = self.set_isao()
-        if ok: ok = self.set_oa()
-        if ok: ok = self.set_prog_info(progData)
-        if ok: ok = self.set_propint(progData)
-        return ok
-
 
     def get_dir_list(self):
         '''
@@ -115,88 +113,6 @@ class Nirc2(instrument.Instrument):
         return True
 
         
-    def get_koaimtyp(self):
-        '''
-        Sets koaimtyp based on keyword values
-        '''
-        #define python replica of IDL strtrim
-        #strtrim = lambda x: x.replace(' ','')
-
-        grsname = self.get_keyword('GRSNAME')
-        shrname = self.get_keyword('SHRNAME')
-        obsfname = self.get_keyword('OBSFNAME')
-        domestat = self.get_keyword('DOMESTAT')
-        axestat = self.get_keyword('AXESTAT')
-        imagetyp = 'undefined'
-        #shutter open
-        if shrname == 'open':
-            if obsfname == 'telescope' or obsfname == 'pws':
-                imagetyp = 'object'
-            if (obsfname == 'telescope' or obsfname == 'pws') and (domestat != 'tracking') and (axestat != 'tracking'):
-                if grsname != 'clear':
-                    imagetyp = 'telTBD'
-                    return imagetyp
-                #if domelamps keyword exists
-                if self.get_keyword('FLIMAGIN'):
-                    flspectr = self.get_keyword('FLSPECTR')
-                    flimagin = self.get_keyword('FLIMAGIN')
-                    if flimagin == 'on' or flspectr == 'on':
-                        imagetyp = 'flatlamp'
-                    else:
-                        if self.get_keyword('OBJECT') == 'ao_confirmation_pw':
-                            imagetyp = 'undefined'                            
-                        else:                            
-                            imagetyp = 'flatlampoff'
-                #else check EL, AXESTAT, and DOMESTAT instead
-                else:
-                    el = float(self.get_keyword('EL'))
-                    if (el > 44.99 and el < 45.01) and (domestat != 'tracking' and axestat != 'tracking'):
-                        imagetyp = 'flatTBD'
-
-            #arclamp
-            elif obsfname == 'telsim':
-                if self.get_keyword('ARGONPWR'):
-                    #get element power boolean
-                    argonpwr = self.get_keyword('ARGONPWR')
-                    xenonpwr = self.get_keyword('XENONPWR')
-                    kryptpwr = self.get_keyword('KRYPTPWR')
-                    neonpwr = self.get_keyword('NEONPWR')
-                    lamppwr = self.get_keyword('LAMPPWR')
-                    #compare dates for special logic after 2011-10-10
-                    dateobs = self.get_keyword('DATE-OBS')
-                    date = dateobs.split('-')
-                    dateval = dt.date(int(date[0]),int(date[1]),int(date[2]))
-                    dlmpvalid = dt.date(2011,10,10)
-                    if dateval > dlmpvalid:
-                        if lamppwr == 1:
-                            print("lamppower")
-                            imagetyp = 'flatlamp'
-                        elif 1 in [argonpwr,xenonpwr,kryptpwr,neonpwr]:
-                            imagetyp = 'arclamp'
-                        else:
-                            imagetyp = 'specTBD'
-                        print('Image Type: ',imagetyp)
-                        print('Lamp Power: ',lamppwr)
-                        print('Ne: ',neonpwr)
-                        print('Ar: ',argonpwr)
-                        print('Kr: ',kryptpwr)
-                        print('Xe: ',xenonpwr)
-            #use grsname keyword instead
-            else:
-                if grsname in ['lowres','medres','GRS1','GRS2']:
-                    imagetyp = 'specTBD'
-        #dark or bias
-        elif shrname == 'closed':
-            itime = self.get_keyword('ITIME')
-            if itime == 0.0:
-                imagetyp = 'bias'
-            else:
-                imagetyp = 'dark'
-            print('Image Type: ',imagetyp)
-
-#        self.log.info('get_koaimtyp: getting KOAIMTYP')
-        return imagetyp
-
     def set_wavelengths(self):
         '''
         Sets WAVERED, WAVEBLUE, and WAVECEN
@@ -250,28 +166,11 @@ class Nirc2(instrument.Instrument):
         self.log.info('set_detdisp: setting DETMODE, DETGAIN, DETRN, DISPERS')
         return True
 
-    def set_wcs(self):
+    def get_wcs_cd_inputs(self):
         '''
-        Set the WCS keywords for NIRC2 images
+        Returns (sky PA, pixel scale) for the CD matrix, or None if PA or camera is unknown.
         '''
-
-        self.log.info('set_wcs: Setting WCS keywords')
-
-        pixscale = radecsys = wcsdim = 'null'
-        crval1 = crval2 = crpix1 = crpix2 = 'null'
-        cd1_1 = cd1_2 = cd2_1 = cd2_2 = 'null'
-        ltm1_1 = ltm2_2 = 'null'
-        ctype1 = ctype2 = 'null'
-        wat0_001 = wat1_001 = wat2_001 = 'null'
-
-        # Get header keywords
-
-        rakey    = self.get_keyword('RA')
-        deckey   = self.get_keyword('DEC')
-        equinox  = self.get_keyword('EQUINOX')
         camname  = self.get_keyword('CAMNAME', default='')
-        naxis1   = self.get_keyword('NAXIS1')
-        naxis2   = self.get_keyword('NAXIS2')
         pa       = self.get_keyword('ROTPOSN')
         rotmode  = self.get_keyword('ROTMODE')
         parantel = self.get_keyword('PARANTEL', default='')
@@ -281,12 +180,6 @@ class Nirc2(instrument.Instrument):
         if isinstance(parantel, str) and (parantel == '' or 'error' in parantel.lower()): parantel = parang 
         mode = rotmode[0:4]
 
-        # Pixel scale and PA offset by camera name
-        pixscale = None
-        pixscale_dict = {'narrow': 0.009952, 'medium': 0.019829, 'wide': 0.039686}
-        if camname in pixscale_dict:
-            pixscale = pixscale_dict[camname]
-
         pa1 = None
         paCalc = lambda x, y, z: float(x) + float(y) - float(z)
 
@@ -297,29 +190,49 @@ class Nirc2(instrument.Instrument):
         elif mode == 'stat' and parantel and el:
             pa1 = paCalc(pa, parantel, el)
 
-        # narrow = 0.7-0.252, correction from Yelda etal 2010
-        pazero = None
-        pazero_dict = {'narrow': 0.448, 'medium': 0.7, 'wide': 0.7}
-        if camname in pazero_dict:
-            pazero = pazero_dict[camname]
-
         # Logic added 4/16/2012 
         # special PA calculation determine by rotmode below  
         # instead of one formula   pa = double ( rotpposn + parantel - el )
-        if pa1 and pixscale and pazero:
+        pixscale = wcs_batch.NIRC2_PIXSCALE.get(camname)
+        pazero = wcs_batch.NIRC2_PAZERO.get(camname)
+        if not (pa1 and pixscale and pazero): return None
+        return pa1 - pazero, pixscale
+
+
+    def set_wcs(self):
+        '''
+        Set the WCS keywords for NIRC2 images
+        '''
+
+        self.log.info('set_wcs: Setting WCS keywords')
+
+        pixscale = radecsys = wcsdim = 'null'
+        crval1 = crval2 = crpix1 = crpix2 = 'null'
+        cd1_1 = cd1_2 = cd2_1 = cd2_2 = 'null'
+        ltm1_1 = ltm2_2 = 'null'
+        ctype1 = ctype2 = 'null'
+        wat0_001 = wat1_001 = wat2_001 = 'null'
+
+        # Get header keywords
+
+        rakey    = self.get_keyword('RA')
+        deckey   = self.get_keyword('DEC')
+        equinox  = self.get_keyword('EQUINOX')
+        camname  = self.get_keyword('CAMNAME', default='')
+        naxis1   = self.get_keyword('NAXIS1')
+        naxis2   = self.get_keyword('NAXIS2')
+
+        # Pixel scale by camera name
+        pixscale = wcs_batch.NIRC2_PIXSCALE.get(camname)
+
+        # CD matrix from the night's WCS table (see wcs_batch.py)
+        inputs = self.get_wcs_cd_inputs()
+        if inputs:
 
             crval1 = rakey
             crval2 = deckey
 
-            sign = 1
-            pa = pa1 - pazero
-            pa *= np.pi / 180.0
-            pa *= -1.0
-
-            cd1_1 = -sign * pixscale * np.cos(pa) / 3600.0
-            cd2_2 = sign * pixscale * np.cos(pa) / 3600.0
-            cd1_2 = -sign * pixscale * np.sin(pa) / 3600.0
-            cd2_1 = -sign * pixscale * np.sin(pa) / 3600.0
+            cd1_1, cd1_2, cd2_1, cd2_2 = self.wcsTable.get_cd_matrix(*inputs)
 
             cd1_1 = '%0.12lf' % round(cd1_1, 12)
             cd1_2 = '%0.12lf' % round(cd1_2, 12)
@@ -460,18 +373,18 @@ class Nirc2(instrument.Instrument):
         return True
 
     def set_caltype(self,imagetyp):
-        image = self.fitsHdu[0].data
-        imgmean = np.mean(image)
-        imgstdv = np.std(image)
-        krtosis = scipy.stats.kurtosis(image, axis=None)
-        print(imgmean,imgstdv,krtosis)
+        moments = self.get_image_moments()
+        imgmean = moments['mean']
+        imgstdv = moments['std']
+        krtosis = moments['kurtosis']
+        self.log.info(f'set_caltype: mean {imgmean:.2f}, std {imgstdv:.2f}, kurtosis {krtosis:.2f}')
         #determine lamp when 'flatTBD'
         if imagetyp == "flatTBD":
             if imgmean > 500:
                 imagetyp = 'flatlamp'
             else:
                 imagetyp = 'flatlampoff'
-            print('flatTBD => '+imagetyp)
+            self.log.info('set_caltype: flatTBD => '+imagetyp)
         #determine lamp for spectra when 'specTBD'
         elif imagetyp == "specTBD":
             imagetyp = 'undefined'
@@ -482,7 +395,7 @@ class Nirc2(instrument.Instrument):
                     imagetyp = 'flatlampoff'
             elif imgmean < 10000:
                 imagetyp = 'flatlamp'
-            print('specTBD => '+imagetyp)
+            self.log.info('set_caltype: specTBD => '+imagetyp)
         #determine lamp for spectra when 'telTBD'
         elif imagetyp == "telTBD":
             imagetyp = 'undefined'
@@ -491,7 +404,7 @@ class Nirc2(instrument.Instrument):
                     imagetyp = 'flatlampoff'
             elif imgmean < 10000:
                 imagetyp = 'flatlamp'
-            print('telTBD => '+imagetyp)
+            self.log.info('set_caltype: telTBD => '+imagetyp)
 
         return imagetyp
 
@@ -534,15 +447,14 @@ class Nirc2(instrument.Instrument):
         drp = self.config[self.instr]['DRP']
         if os.path.isfile(drp):
             drp = f"{drp} {self.dirs['output']}"
-            print(drp)
 
             cmd = []
             for word in drp.split(' '):
                 cmd.append(word)
 
             self.log.info(f'run_drp: Running DRP command: {" ".join(cmd)}')
-            p = subprocess.Popen(cmd)
-            p.wait()
+            job = self.start_job('drp', cmd)
+            job.wait()
             self.log.info('run_drp: DRP finished')
 
         return True
@@ -568,7 +480,7 @@ class Nirc2(instrument.Instrument):
         cmd.append(f"/net/{host}{self.dirs['lev0']}")
 
         self.log.info(f'run_psfr: Starting PSFR command: {" ".join(cmd)}')
-        p = subprocess.Popen(cmd)
+        self.start_job('psfr', cmd)
 
         return True
 
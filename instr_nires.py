@@ -11,6 +11,36 @@ from common import *
 
 class Nires(instrument.Instrument):
 
+    #DQA checks run in order for each file (see Instrument.run_dqa_checks)
+    dqaSteps = [
+        'set_instr',
+        'set_dateObs',
+        'set_utc',
+        'set_elaptime',
+        'set_koaimtyp',
+        'set_koaid',
+        'set_ut',
+        'set_frameno',
+        'set_ofName',
+        'set_semester',
+        instrument.DqaStep('set_prog_info', instrument.PROGDATA),
+        instrument.DqaStep('set_propint', instrument.PROGDATA),
+        'set_wavelengths',
+        'set_specres',
+        'set_weather_keywords',
+        instrument.DqaStep('set_datlevel', 0),
+        'set_filter',
+        'set_slit_dims',
+        'set_spatscal',
+        'set_dispscal',
+        'set_image_stats_keywords',
+        'set_npixsat',
+        'set_oa',
+        'set_dqa_date',
+        'set_dqa_vers',
+    ]
+
+
     def __init__(self, instr, utDate, rootDir, log=None):
 
         # Call the parent init to get all the shared variables
@@ -22,48 +52,10 @@ class Nires(instrument.Instrument):
         self.keywordMap['FRAMENO']      = 'FRAMENUM'
 
 
-        # Other vars that subclass can overwrite
-        self.endTime = '19:00:00'   # 24 hour period start/end time (UT)
-
-
         # Generate the paths to the NIRES datadisk accounts
         self.sdataList = self.get_dir_list()
 
 
-    def run_dqa_checks(self, progData):
-        '''
-        Run all DQA checks unique to this instrument.
-        '''
-
-        ok = True
-        if ok: ok = self.set_instr()
-        if ok: ok = self.set_dateObs()
-        if ok: ok = self.set_utc()
-        if ok: ok = self.set_elaptime()
-        if ok: ok = self.set_koaimtyp()
-        if ok: ok = self.set_koaid()
-        if ok: ok = self.set_ut()
-        if ok: ok = self.set_frameno()
-        if ok: ok = self.set_ofName()
-        if ok: ok = self.set_semester()
-        if ok: ok = self.set_prog_info(progData)
-        if ok: ok = self.set_propint(progData)
-        if ok: ok = self.set_wavelengths()
-        if ok: ok = self.set_specres()
-        if ok: ok = self.set_weather_keywords()
-        if ok: ok = self.set_datlevel(0)
-        if ok: ok = self.set_filter()
-        if ok: ok = self.set_slit_dims()
-        if ok: ok = self.set_spatscal()
-        if ok: ok = self.set_dispscal()
-        if ok: ok = self.set_image_stats_keywords()
-        if ok: ok = self.set_npixsat()
-        if ok: ok = self.set_oa()
-        if ok: ok = self.set_dqa_date()
-        if ok: ok = self.set_dqa_vers()
-        return ok
-
-
 
     @staticmethod
     def get_dir_list():
@@ -6,12 +6,45 @@ NIRSPEC specific DR techniques can be added to it in the future
 '''
 
 import instrument
+import koaimtyp_rules
+import spectral_config
 import datetime as dt
 from common import *
 from math import ceil
 
 class Nirspec(instrument.Instrument):
 
+    #KOAIMTYP rule table (see koaimtyp_rules.py)
+    koaimtypRules = koaimtyp_rules.NIRSPEC
+
+    #DQA checks run in order for each file (see Instrument.run_dqa_checks)
+    dqaSteps = [
+        'set_dqa_date',
+        'set_dqa_vers',
+        instrument.DqaStep('set_datlevel', 0),
+        'set_instr',
+        'set_dateObs',
+        'set_elaptime',
+        'set_koaimtyp',
+        'set_koaid',
+        'set_frameno',
+        'set_ofName',
+        'set_semester',
+        'set_isao',
+        'set_dispers',
+        'set_slit_values',
+        'set_filter',
+        'set_wavelengths',
+        'set_weather_keywords',
+        'set_image_stats_keywords',
+        'set_gain_and_readnoise',
+        instrument.DqaStep('set_npixsat', lambda self: self.get_keyword('COADDS')*25000),
+        'set_oa',
+        instrument.DqaStep('set_prog_info', instrument.PROGDATA),
+        instrument.DqaStep('set_propint', instrument.PROGDATA),
+    ]
+
+
     def __init__(self, instr, utDate, rootDir, log=None):
 
         #call the parent init to get all the shared variables
@@ -21,46 +54,10 @@ class Nirspec(instrument.Instrument):
         self.keywordMap['OFNAME'] = 'DATAFILE'
         self.keywordMap['FRAMENO'] = 'FRAMENUM'
 
-        #other vars that subclass can overwrite
-        self.endTime = '19:00:00'   # 24 hour period start/end time (UT)
-
         #generate the paths to the NIRSPEC datadisk accounts
         self.sdataList = self.get_dir_list()
 
 
-    def run_dqa_checks(self, progData):
-        '''
-        Run all DQA checks unique to this instrument
-        '''
-
-        ok = True
-        if ok: ok = self.set_dqa_date()
-        if ok: ok = self.set_dqa_vers()
-        if ok: ok = self.set_datlevel(0)
-        if ok: ok = self.set_instr()
-        if ok: ok = self.set_dateObs()
-        if ok: ok = self.set_elaptime()
-        if ok: ok = self.set_koaimtyp()
-        if ok: ok = self.set_koaid()
-        if ok: ok = self.set_frameno()
-        if ok: ok = self.set_ofName()
-        if ok: ok = self.set_semester()
-        if ok: ok = self.set_isao()
-        if ok: ok = self.set_dispers()
-        if ok: ok = self.set_slit_values()
-        if ok: ok = self.set_filter()
-        if ok: ok = self.set_wavelengths()
-        if ok: ok = self.set_weather_keywords()
-        if ok: ok = self.set_image_stats_keywords()
-        if ok: ok = self.set_gain_and_readnoise()
-        if ok: ok = self.set_npixsat(self.get_keyword('COADDS') * 25000)
-        if ok: ok = self.set_oa()
-        if ok: ok = self.set_prog_info(progData)
-        if ok: ok = self.set_propint(progData)
-
-        return ok
-
-
     def get_dir_list(self):
         '''
         Function to generate the paths to all the NIRSPEC accounts, including engineering
@@ -178,78 +175,12 @@ class Nirspec(instrument.Instrument):
     def set_koaimtyp(self):
         '''
         Fixes missing KOAIMTYP keyword.
-        This is derived from OBSTYPE keyword.
+        This is derived from OBSTYPE keyword, else from lamp and calibration unit keywords.
         '''
 
-        self.log.info('set_koaimtyp: setting KOAIMTYP keyword value from OBSTYPE')
-
-        #get obstype value
-        obstype = self.get_keyword('OBSTYPE')
-
-        #map to KOAIMTYP value
-        koaimtyp = 'undefined'
-        validValsMap = {
-            'object'  : 'object',
-            'standard': 'object',   #NOTE: old val
-            'telluric': 'object',
-            'bias'    : 'bias',
-            'dark'    : 'dark',
-            'domeflat': 'domeflat',
-            'domearc' : 'domearc',
-            'arclamp' : 'arclamp',
-            'flatlamp': 'flatlamp',
-#            'astro'   : 'object',   #NOTE: old val
-#            'star'    : 'object',   #NOTE: old val
-#            'calib'   : 'undefined' #NOTE: old val
-        }
-
-        #first use OBSTYPE value
-        if (obstype != None and obstype.lower() in validValsMap):
-            koaimtyp = validValsMap[obstype.lower()]
-
-        #use algorithm
-        else:
-            self.log.info('set_koaimtyp: setting KOAIMTYP keyword value from algorithm')
-
-            calmpos = self.get_keyword('CALMPOS', default='').lower()
-            calppos = self.get_keyword('CALPPOS', default='').lower()
-            #calcpos doesn't exist in header
-#            calcpos = self.get_keyword('CALCPOS', default='').lower()
-            xenon = self.get_keyword('XENON', default='').lower()
-            krypton = self.get_keyword('KRYPTON', default='').lower()
-            argon = self.get_keyword('ARGON', default='').lower()
-            neon = self.get_keyword('NEON', default='').lower()
-#flat doesn't exist
-#            flat = self.get_keyword('FLAT')
-            flimagin = self.get_keyword('FLIMAGIN', default='').lower()
-            flspectr = self.get_keyword('FLSPECTR', default='').lower()
-            flat = 0
-            if flimagin == 'on' or flspectr == 'on':
-                flat = 1
-
-            #arclamp
-            if argon == 'on' or krypton == 'on' or neon == 'on' or xenon == 'on':
-                if calmpos == 'in' and calppos == 'out':
-                    koaimtyp = 'arclamp'
-                else:
-                    koaimtyp = 'undefined'
-
-            #flats
-            elif flat == 0 and calmpos == 'in':
-                koaimtyp = 'flatlampoff'
-            elif flat == 1 and calmpos == 'in' and calppos == 'out':
-                koaimtyp = 'flatlamp'
-
-            #darks
-            elif int(self.get_keyword('ITIME')) == 0:
-                koaimtyp = 'bias'
+        self.log.info('set_koaimtyp: setting KOAIMTYP keyword value')
 
-            #object
-            elif calmpos == 'out' and calppos == 'out':
-                koaimtyp = 'object'
-
-            else:
-                koaimtyp = 'undefined'
+        koaimtyp = self.get_koaimtyp()
 
         #warn if undefined
         if (koaimtyp == 'undefined'):
@@ -290,39 +221,8 @@ class Nirspec(instrument.Instrument):
 
         self.log.info('set_wavelengths: setting WAVE keyword values from FILTER')
 
-        filters = {}
-        filters['UNKNOWN']   = {'blue':'null', 'cntr':'null', 'red':'null'}
-        filters['BLANK']     = {'blue':'null', 'cntr':'null', 'red':'null'}
-        filters['NIRSPEC-1'] = {'blue':0.9470, 'cntr':1.0340, 'red':1.1210}
-        filters['NIRSPEC-2'] = {'blue':1.0890, 'cntr':1.1910, 'red':1.2930}
-        filters['NIRSPEC-3'] = {'blue':1.1430, 'cntr':1.2590, 'red':1.3750}
-        filters['NIRSPEC-4'] = {'blue':1.2410, 'cntr':1.4170, 'red':1.5930}
-        filters['NIRSPEC-5'] = {'blue':1.4310, 'cntr':1.6195, 'red':1.8080}
-        filters['NIRSPEC-6'] = {'blue':1.5580, 'cntr':1.9365, 'red':2.3150}
-        filters['NIRSPEC-7'] = {'blue':1.8390, 'cntr':2.2345, 'red':2.6300}
-        filters['Br-Gamma']  = {'blue':2.1550, 'cntr':2.1650, 'red':2.1750}
-        filters['BR-GAMMA']  = {'blue':2.1550, 'cntr':2.1650, 'red':2.1750}
-        filters['CO']        = {'blue':2.2810, 'cntr':2.2930, 'red':2.3050}
-        filters['K-PRIME']   = {'blue':1.9500, 'cntr':2.1225, 'red':2.2950}
-        filters['KL']        = {'blue':2.1340, 'cntr':3.1810, 'red':4.2280}
-        filters['K']         = {'blue':1.9960, 'cntr':2.1890, 'red':2.3820}
-        filters['L-PRIME']   = {'blue':3.4200, 'cntr':3.7700, 'red':4.1200}
-        filters['M-PRIME']   = {'blue':4.5700, 'cntr':4.6900, 'red':4.8100}
-        filters['HEI']       = {'blue':1.0776, 'cntr':1.0830, 'red':1.0884}
-        filters['PA-BETA']   = {'blue':1.2757, 'cntr':1.2823, 'red':1.2888}
-        filters['FEII']      = {'blue':1.6390, 'cntr':1.6465, 'red':1.6540}
-        filters['H2']        = {'blue':2.1100, 'cntr':2.1195, 'red':2.1290}
-        filters['M-WIDE']    = {'blue':4.4200, 'cntr':4.9750, 'red':5.5300}
-
         filter = self.get_keyword('FILTER', default='')
-
-        waveblue = wavecntr = wavered = 'null'
-        for filt, waves in filters.items():
-            if filt in filter.upper():
-                waveblue = waves['blue']
-                wavecntr = waves['cntr']
-                wavered = waves['red']
-                break
+        waveblue, wavecntr, wavered = spectral_config.get_nirspec_wavelengths(filter)
 
         self.set_keyword('WAVEBLUE', waveblue, 'KOA: Approximate blue end wavelength (u)')
         self.set_keyword('WAVECNTR', wavecntr, 'KOA: Approximate central wavelength (u)')
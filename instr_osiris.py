@@ -5,6 +5,8 @@ OSIRIS specific DR techniques can be added to it in the future
 12/14/2017 M. Brown - Created initial file
 '''
 import instrument
+import koaimtyp_rules
+import wcs_batch
 import datetime as dt
 from common import *
 from math import ceil
@@ -12,6 +14,43 @@ import numpy as np
 
 class Osiris(instrument.Instrument):
 
+    #KOAIMTYP rule table (see koaimtyp_rules.py)
+    koaimtypRules = koaimtyp_rules.OSIRIS
+
+    #DQA checks run in order for each file (see Instrument.run_dqa_checks)
+    dqaSteps = [
+        'set_dqa_date',
+        'set_dqa_vers',
+        instrument.DqaStep('set_datlevel', 0),
+        'set_instr',
+        'set_dateObs',
+        'set_ut',
+        'set_elaptime',
+        'set_filter',
+        'set_koaimtyp',
+        'set_koaid',
+        'set_frameno',
+        'set_ofName',
+        'set_semester',
+#        'set_dispers',
+#        'set_slit_values',
+        'set_wavelengths',
+        'set_weather_keywords',
+        'set_wcs_keywords',
+        'set_image_stats_keywords',
+#        'set_gain_and_readnoise',
+        instrument.DqaStep('set_npixsat', lambda self: self.get_keyword('COADDS')*self.get_keyword('SATURATE')),
+        'set_nlinear',
+        'set_scale',
+        'check_noninteger_values',
+        'set_oa',
+        instrument.DqaStep('set_prog_info', instrument.PROGDATA),
+        instrument.DqaStep('set_propint', instrument.PROGDATA),
+        'check_propint',
+        'check_ra',
+    ]
+
+
     def __init__(self, instr, utDate, rootDir, log=None):
 
         # Call the parent init to get all the shared variables
@@ -21,51 +60,10 @@ class Osiris(instrument.Instrument):
         self.keywordMap['OFNAME']       = 'DATAFILE'
         self.keywordMap['FRAMENO']      = 'FRAMENUM'
 
-        #other vars that subclass can overwrite
-        self.endTime = '19:00:00'   # 24 hour period start/end time (UT)
-
         # Generate the paths to the OSIRIS datadisk accounts
         self.paths = self.get_dir_list()
 
 
-    def run_dqa_checks(self, progData):
-        '''
-        Run all DQA checks unique to this instrument
-        '''
-        ok = True
-        if ok: ok = self.set_dqa_date()
-        if ok: ok = self.set_dqa_vers()
-        if ok: ok = self.set_datlevel(0)
-        if ok: ok = self.set_instr()
-        if ok: ok = self.set_dateObs()
-        if ok: ok = self.set_ut()
-        if ok: ok = self.set_elaptime()
-        if ok: ok = self.set_filter()
-        if ok: ok = self.set_koaimtyp()
-        if ok: ok = self.set_koaid()
-        if ok: ok = self.set_frameno()
-        if ok: ok = self.set_ofName()
-        if ok: ok = self.set_semester()
-#        if ok: ok = self.set_dispers()
-#        if ok: ok = self.set_slit_values()
-        if ok: ok = self.set_wavelengths()
-        if ok: ok = self.set_weather_keywords()
-        if ok: ok = self.set_wcs_keywords()
-        if ok: ok = self.set_image_stats_keywords()
-#        if ok: ok = self.set_gain_and_readnoise()
-        if ok: ok = self.set_npixsat(self.get_keyword('COADDS')*self.get_keyword('SATURATE'))
-        if ok: ok = self.set_nlinear()
-        if ok: ok = self.set_scale()
-        if ok: ok = self.check_noninteger_values()
-        if ok: ok = self.set_oa()
-        if ok: ok = self.set_prog_info(progData)
-        if ok: ok = self.set_propint(progData)
-        if ok: ok = self.check_propint()
-        if ok: ok = self.check_ra()
-
-        return ok
-
-
     def get_dir_list(self):
         '''
         Function to generate the paths to all the OSIRIS accounts, including engineering
@@ -149,70 +147,16 @@ class Osiris(instrument.Instrument):
         return True
 
 
-    def get_koaimtyp(self):
+    def get_wcs_offset_inputs(self):
         '''
-        Adds KOAIMTYP keyword
+        Returns (RA, Dec, ROTPOSN) for the imager offset if spec is the pointing origin, else None.
         '''
-        self.log.info('set_koaimtyp: setting KOAIMTYP keyword from algorithm')
-
-        koaimtyp = 'undefined'
-        pcsfname = str(self.get_keyword('PCSFNAME', default=''))
-        pcsfx    = self.get_keyword('PCSFX')
-        pcsfy    = self.get_keyword('PCSFY')
-        pcsflz   = self.get_keyword('PCSFLZ')
-        pcsfx, pcsfy, pcsflz = self.check_type_str([pcsfx, pcsfy, pcsflz], 0)
-        if pcsfx != 0 and pcsfy != 0 and pcsflz != 0:
-            return 'calib'
-
-        # dark if filter is Drk (set_filter() previously called)
-        instr = self.get_keyword('INSTR', default='')
-        ifilter = self.get_keyword('IFILTER', default='')
-        sfilter = self.get_keyword('SFILTER', default='')
-
-        filter = ''
-        if instr.lower() == 'imag':
-            filter = ifilter
-        elif instr.lower() == 'spec':
-            filter = sfilter
-
-        if 'drk' in filter.lower():
-            return 'dark'
-
-        axestat  = self.get_keyword('AXESTAT', default='')
-        domestat = self.get_keyword('DOMESTAT', default='')
-        stat = ['tracking', 'slewing']
-
-        el = self.get_keyword('EL', default=0)
-        az = self.get_keyword('AZ', default=0)
-        domeposn = self.get_keyword('DOMEPOSN', default=0)
-        el, az, domeposn = self.check_type_str([el, az, domeposn], 0)
-
-        # Imager
-        if instr.lower() == 'imag':
-            flamp1 = self.get_keyword('FLAMP1', default='')
-            flamp2 = self.get_keyword('FLAMP2', default='')
-            if flamp1.lower() == 'on' or flamp2.lower() == 'on':
-                if (45.11 > el > 44.89) and (80.0 < abs(domeposn - az) < 100.0):
-                    return 'flatlamp'
-                else:
-                    return 'undefined'
-            if domestat in stat and axestat in stat:
-                return 'object'
-            else:
-                if (45.11 > el > 44.89) and (80.0 < abs(domeposn - az) < 100.0):
-                    return 'flatlampoff' # check for tel position?
-            return 'object'
-
-        # Spectrograph
-        if instr.lower() == 'spec':
-            # recmat files
-            datafile = self.get_keyword('DATAFILE')
-            if 'c' in datafile:
-                return 'calib'
-            if domestat in stat and axestat in stat:
-                return 'object'
-
-        return 'undefined'
+        instr = self.get_keyword('INSTR')
+        rotmode = self.get_keyword('ROTMODE')
+        poname = self.get_keyword('PONAME')
+        if instr.lower() != 'imag' or 'position angle' not in rotmode or 'ospec' not in poname.lower():
+            return None
+        return self.get_keyword('RA'), self.get_keyword('DEC'), self.get_keyword('ROTPOSN')
 
 
     def set_wcs_keywords(self):
@@ -237,8 +181,6 @@ class Osiris(instrument.Instrument):
         ra = self.get_keyword('RA')
         dec = self.get_keyword('DEC')
 
-        pi = np.pi
-
         if instr.lower() == 'imag' and 'position angle' in rotmode:
             self.log.info('set_wcs_keywords: setting WCS keyword values')
             ctype1 = 'RA---TAN'
@@ -251,23 +193,19 @@ class Osiris(instrument.Instrument):
             ltm1_1 = 1.000
             ltm2_2 = 1.000
             if 'ospec' in poname.lower():
-                offset = 47.5
-                theta = (offset - (rotposn+90)) * pi / 180.0
-                deltaRA = (15.42 * np.cos(theta) + 14.12 * np.sin(theta)) / (np.cos(dec*pi/180.0)*3600.0)
-                deltaDEC = (15.42 * np.sin(theta) - 14.12 * np.cos(theta)) / 3600.0
-                crval1 = round(ra + deltaRA, 5)
-                crval2 = round(dec + deltaDEC, 5)
+                #offset from the night's WCS table (see wcs_batch.py)
+                crval1, crval2 = self.wcsTable.get_osiris_spec_crval(ra, dec, rotposn)
+                crval1 = round(crval1, 5)
+                crval2 = round(crval2, 5)
             elif 'osimg' in poname.lower():
-                deltaRA = 0.0
-                deltaDEC = 0.0
                 crval1 = round(ra, 5)
                 crval2 = round(dec, 5)
 
             if crval1 != 'null':
                 crota2 = -(rotposn+90)
                 while crota2 < 0: crota2 += 360.0
-                cdelt1 = -0.0000055555556
-                cdelt2 = 0.0000055555556
+                cdelt1 = -wcs_batch.OSIRIS_CDELT
+                cdelt2 = wcs_batch.OSIRIS_CDELT
                 crpix1 = 512.5
                 crpix2 = 512.5
 
@@ -479,16 +417,14 @@ class Osiris(instrument.Instrument):
         Run the OSIRIS DRP on vm-koaserver2
         '''
 
-        import subprocess
-
         cmd = []
         for word in self.config[self.instr]['DRP'].split(' '):
             cmd.append(word)
         cmd.append(self.utDate)
 
         self.log.info(f'run_drp: Running DRP command: {" ".join(cmd)}')
-        p = subprocess.Popen(cmd)
-        p.wait()
+        job = self.start_job('drp', cmd)
+        job.wait()
         self.log.info('run_drp: DRP finished')
 
         return True
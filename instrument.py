@@ -22,6 +22,13 @@ import re
 from dep_obtain import get_obtain_data
 import math
 import db_conn
+import instrument_registry
+import run_profile
+import image_moments
+import supervisor
+import wcs_batch
+import time
+import cProfile
 
 import matplotlib as mpl
 mpl.use('Agg')
@@ -31,7 +38,43 @@ from astropy.visualization import ZScaleInterval, AsinhStretch
 from astropy.visualization.mpl_normalize import ImageNormalize
 
 
+#placeholder arg for a DqaStep that is replaced by the night's progData
+PROGDATA = object()
+
+
+class DqaStep:
+    '''
+    One registered DQA check: an Instrument method name plus the args to call it with.
+    Callable args are called with the instrument object when the step runs (ie for values that
+    depend on the current header) and PROGDATA is replaced by the night's program data.
+    Set checkResult=False for a step whose return value is not a pass/fail result.
+    '''
+    def __init__(self, name, *args, checkResult=True, **kwargs):
+        self.name        = name
+        self.args        = args
+        self.kwargs      = kwargs
+        self.checkResult = checkResult
+
+    def get_arg(self, instrObj, arg):
+        if arg is PROGDATA: return instrObj.progData
+        if callable(arg)  : return arg(instrObj)
+        return arg
+
+    def run(self, instrObj):
+        args   = [self.get_arg(instrObj, a) for a in self.args]
+        kwargs = {k: self.get_arg(instrObj, v) for k, v in self.kwargs.items()}
+        result = getattr(instrObj, self.name)(*args, **kwargs)
+        return result if self.checkResult else True
+
+
 class Instrument:
+
+    #ordered DQA checks run by run_dqa_checks (str method name or DqaStep), defined by each instrument
+    dqaSteps = []
+
+    #KOAIMTYP rule table used by get_koaimtyp (see koaimtyp_rules.py), defined by each instrument
+    koaimtypRules = None
+
     def __init__(self, instr, utDate, config, log=None):
         """
         Base Instrument class to hold all the values common between
@@ -71,7 +114,9 @@ class Instrument:
 
 
         # Other values that can be overwritten in instr-*.py
-        self.endHour = '20:00:00'   # 24 hour period start/end time (UT)
+        self.endHour = '20:00:00'
+        instrument_registry.seed(self.config)
+        self.endTime = instrument_registry.get_end_time(self.instr, self.config)   # 24 hour period start/end time (UT)
 
 
         # Values to be populated by subclass
@@ -82,11 +127,41 @@ class Instrument:
         self.extraMeta      = {}
         self.keywordSkips   = []
 
+        #night-level weather cache (see set_weather_keywords)
+        self.nightWeather   = None
+
+        #koa_ppp propmin by semid for utDate (see load_propint_cache)
+        self.propintCache   = None
+        self.propintLookups = 0
+        self.propintQueries = 0
+
         #init fits specific vars
         self.fitsHdu        = None
         self.fitsHeader     = None
         self.fitsFilepath   = None
 
+        #per-file keyword lookup cache (see get_keyword)
+        self.useKeywordCache = True
+        self.keywordIndex    = {}
+        self.keywordCache    = {}
+        self.mappedKeyCache  = {}
+
+        #DQA step timing (see run_dqa_checks)
+        self.progData        = None
+        self.dqaStepStats    = {}
+        misc = self.config.get('MISC', {})
+        self.dqaSlowFactor   = float(misc.get('DQA_SLOW_FACTOR', 5))
+        self.dqaSlowMinSecs  = float(misc.get('DQA_SLOW_MIN_SECS', 1.0))
+        self.dqaProfileKoaid = misc.get('DQA_PROFILE_KOAID')
+
+        #per-file image moments cache (see get_image_moments)
+        self.imageMoments    = {}
+        self.momentsStep     = int(misc.get('MOMENTS_STEP', 1))
+
+        #night table of WCS values (see load_wcs_table)
+        self.wcsTable        = wcs_batch.WcsTable()
+        self.wcsPrefetch     = int(misc.get('WCS_PREFETCH', 0))
+
 
         #other helpful vars
         self.rootDir = self.config[self.instr]['ROOTDIR']
@@ -99,16 +174,8 @@ class Instrument:
         verify_date(self.utDate)
         assert os.path.isdir(self.rootDir), 'rootDir does not exist'
 
-        #create db conn obj
-        self.db = db_conn.db_conn('config.live.ini', configKey='DATABASE', persist=True)
-
-
-    def __del__(self):
-        """
-        Close the database connection, if it is open
-        """
-        if self.db:
-            self.db.close()
+        #shared pooled db conn obj (not closed per object, see db_conn.get_db)
+        self.db = db_conn.get_db('config.live.ini', configKey='DATABASE')
 
 
     #abstract methods that must be implemented by inheriting classes
@@ -117,6 +184,88 @@ class Instrument:
     def set_koaimtyp(self) : raise NotImplementedError("Abstract method not implemented!")
 
 
+    def get_koaimtyp(self):
+        '''
+        Returns image type from this instrument's KOAIMTYP rule table.
+        '''
+        if self.koaimtypRules is None:
+            raise NotImplementedError(f'get_koaimtyp: no KOAIMTYP rules defined for {self.instr}')
+        return self.koaimtypRules.classify_instrument(self)
+
+
+    def get_dqa_steps(self):
+        '''
+        Returns this instrument's registered DQA steps as DqaStep objects.
+        '''
+        return [s if isinstance(s, DqaStep) else DqaStep(s) for s in self.dqaSteps]
+
+
+    def run_dqa_checks(self, progData):
+        '''
+        Runs the registered DQA steps (dqaSteps) in order for the current file, stopping at the first
+        step that returns False.  Each step is timed (see run_profile.py) and unusually slow steps are
+        logged.  If MISC DQA_PROFILE_KOAID is set, a cProfile dump is written for that KOAID.
+        '''
+        self.progData = progData
+
+        #optional cProfile for one KOAID (stopped as soon as the file's KOAID is known not to match)
+        profiler = None
+        if self.dqaProfileKoaid:
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        ok = True
+        profile = run_profile.get_profile()
+        for step in self.get_dqa_steps():
+            t1 = time.perf_counter()
+            ok = step.run(self)
+            secs = time.perf_counter() - t1
+            profile.add_time(step.name, secs)
+            self.check_dqa_step_time(step.name, secs)
+
+            if profiler:
+                koaid = self.get_keyword('KOAID', False)
+                if koaid and koaid != self.dqaProfileKoaid:
+                    profiler.disable()
+                    profiler = None
+            if not ok: break
+
+        if profiler:
+            profiler.disable()
+            koaid = self.get_keyword('KOAID', False)
+            if koaid == self.dqaProfileKoaid: self.write_dqa_profile(profiler, koaid)
+
+        return ok
+
+
+    def check_dqa_step_time(self, name, secs):
+        '''
+        Keeps running mean time per DQA step and logs a step that takes more than
+        DQA_SLOW_FACTOR times its mean (and at least DQA_SLOW_MIN_SECS).
+        '''
+        stats = self.dqaStepStats.setdefault(name, {'count': 0, 'total': 0.0, 'slow': 0})
+        if stats['count'] >= 5:
+            mean = stats['total'] / stats['count']
+            if secs >= self.dqaSlowMinSecs and secs > self.dqaSlowFactor * mean:
+                stats['slow'] += 1
+                self.log.info(f'run_dqa_checks: slow DQA step {name} for {os.path.basename(str(self.fitsFilepath))}: '
+                              f'{secs:.2f}s (mean {mean:.2f}s)')
+        stats['count'] += 1
+        stats['total'] += secs
+
+
+    def write_dqa_profile(self, profiler, koaid):
+        '''
+        Writes cProfile stats for DQA of koaid to stage dir.
+        '''
+        outFile = os.path.join(self.dirs['stage'], f'dqa_{koaid}.prof')
+        try:
+            profiler.dump_stats(outFile)
+            self.log.info(f'run_dqa_checks: wrote cProfile stats for {koaid} to {outFile}')
+        except Exception as e:
+            self.log.warning(f'run_dqa_checks: could not write cProfile stats for {koaid}: {e}')
+
+
     def dep_init(self, fullRun=True):
         '''
         Perform specific initialization tasks for DEP processing.
@@ -195,10 +344,16 @@ class Instrument:
             self.log.warning('set_fits_file: Could not read FITS file "' + filename + '"!')
             return False
 
+        #reset keyword cache and index the primary header once for this file
+        self.clear_keyword_cache()
+        if self.useKeywordCache:
+            self.keywordIndex[None] = self.make_header_index(self.fitsHeader)
+
         self.koaid = '';
         self.rawfile = ''
         self.prefix = ''
         self.extraMeta = {}
+        self.imageMoments = {}
 
         return True
 
@@ -206,6 +361,7 @@ class Instrument:
         '''
         Gets keyword value from the FITS header as defined in keywordMap class variable.  
         NOTE: FITS file must be loaded first with self.set_fits_file
+        NOTE: Resolved values are cached per file.  Cache is reset by set_fits_file and set_keyword.
 
         @param keyword: keyword value or ordered list of keyword values to search for
         @type instr: string or list
@@ -219,17 +375,16 @@ class Instrument:
              if not self.fitsHdu[ext].header:
                  raise Exception('get_keyword: ERROR: no FITS header loaded')
                  return default
-        #use keyword mapping?
-        if useMap:
-    
-            #if keyword is mapped, then use mapped value(s)        
-            if isinstance(keyword, str) and keyword in self.keywordMap:
-                keyword = self.keywordMap[keyword]
 
-        #We allow an array of mapped keys, so if keyword is still a string then put in array
-        mappedKeys = keyword
-        if isinstance(mappedKeys, str):
-            mappedKeys = [mappedKeys]
+        #resolve keyword mapping to an ordered tuple of header keys
+        mappedKeys = self.get_mapped_keys(keyword, useMap)
+
+        #cached lookup?
+        if self.useKeywordCache:
+            cacheKey = (ext, mappedKeys)
+            if cacheKey in self.keywordCache:
+                val = self.keywordCache[cacheKey]
+                return default if val is None else val
 
         #loop
         if ext is None:
@@ -237,15 +392,91 @@ class Instrument:
         else:
             fitshead = self.fitsHdu[ext].header
 
+        val = None
         for mappedKey in mappedKeys:
             try:
-                val = fitshead.get(mappedKey)
-                if self._chk_valid(val):
-                    return val
+                if self.useKeywordCache:
+                    check = self.get_indexed_value(fitshead, mappedKey, ext)
+                else:
+                    check = fitshead.get(mappedKey)
+                if self._chk_valid(check):
+                    val = check
+                    break
+            except fits.verify.VerifyError:
+                continue
+
+        if self.useKeywordCache:
+            self.keywordCache[cacheKey] = val
+
+        return default if val is None else val
+
+
+    def get_mapped_keys(self, keyword, useMap=True):
+        '''
+        Returns tuple of header keys for keyword, using keywordMap if useMap.
+        Results are memoized, but are re-resolved if the keywordMap entry changes.
+        '''
+        #lists are not hashable, so no memo for those
+        if not isinstance(keyword, str):
+            return tuple(keyword)
+
+        source = self.keywordMap.get(keyword) if useMap else None
+        memoKey = (keyword, useMap)
+        memo = self.mappedKeyCache.get(memoKey)
+        if memo and memo[0] is source:
+            return memo[1]
+
+        keys = keyword if source is None else source
+        keys = (keys,) if isinstance(keys, str) else tuple(keys)
+        self.mappedKeyCache[memoKey] = (source, keys)
+        return keys
+
+
+    @staticmethod
+    def make_header_index(header):
+        '''
+        Builds dict of uppercase keyword to value for a header in one pass.
+        First occurrence wins (same as Header.get).  Commentary and unparsable cards are skipped.
+        '''
+        index = {}
+        for card in header.cards:
+            try:
+                key = card.keyword.upper()
+                if key in ('', 'COMMENT', 'HISTORY') or key in index: continue
+                index[key] = card.value
             except fits.verify.VerifyError:
                 continue
+        return index
+
+
+    def get_indexed_value(self, fitshead, keyword, ext=None):
+        '''
+        Looks up keyword in the header index, building the index for ext if needed.
+        Keys with special forms (ie HIERARCH) fall back to a normal header lookup.
+        '''
+        #ext 0 is the primary header
+        if ext == 0: ext = None
+        index = self.keywordIndex.get(ext)
+        if index is None:
+            index = self.make_header_index(fitshead)
+            self.keywordIndex[ext] = index
+
+        key = keyword.upper()
+        if key in index: return index[key]
+        if ' ' in key or '.' in key: return fitshead.get(keyword)
+        return None
+
+
+    def clear_keyword_cache(self, ext=False):
+        '''
+        Clears resolved keyword values.  If ext is given, the header index for that ext is also dropped.
+        '''
+        self.keywordCache = {}
+        if ext is False:
+            self.keywordIndex = {}
+        else:
+            self.keywordIndex.pop(ext, None)
 
-        return default
 
     @staticmethod
     def _chk_valid(val):
@@ -293,6 +524,16 @@ class Instrument:
         else:
             (self.fitsHdu[ext].header).update({keyword : (value, comment)})
 
+        #invalidate cached lookups and refresh indexed value
+        self.keywordCache = {}
+        index = self.keywordIndex.get(None if ext == 0 else ext)
+        if index is not None:
+            fitshead = self.fitsHeader if ext == None else self.fitsHdu[ext].header
+            try:
+                index[keyword.upper()] = fitshead.get(keyword)
+            except fits.verify.VerifyError:
+                index.pop(keyword.upper(), None)
+
 
     def is_fits_valid(self):
         '''
@@ -748,15 +989,12 @@ class Instrument:
         if progid == 'ENG':
             propint = 18
         else:
-            #create url and get data
-#todo: test this
-            query = f'select propmin from koa_ppp where semid="{semid}" and utdate="{self.utDate}"'
-            data = self.db.query('koa', query, getOne=True)
-            if not data:
+            propmin = self.get_propmin(semid)
+            if propmin is None:
                 self.log.info('set_propint: PROPINT not found for ' + semid + ' and ' + self.utDate + ', defaulting to 18 months')
                 propint = 18
             else:
-                propint = int(data['propmin'])
+                propint = int(propmin)
 
         #NOTE: PROPINT goes in metadata but not in header so we store in temp dict for later
         self.extraMeta['PROPINT'] = propint
@@ -764,6 +1002,87 @@ class Instrument:
         return True
 
 
+    def load_propint_cache(self):
+        '''
+        Loads all koa_ppp propmin values for this utDate in one query.
+        If the query fails, get_propmin falls back to a query per semid.
+        '''
+        query = 'select semid, propmin from koa_ppp where utdate=%s'
+        data = self.db.query('koa', query, params=(self.utDate,))
+        self.propintQueries += 1
+        if data is False:
+            self.log.warning('load_propint_cache: Could not query koa_ppp for ' + self.utDate)
+            self.propintCache = False
+            return False
+
+        #NOTE: semid match is case insensitive as in the db query; first row wins
+        self.propintCache = {}
+        for row in data:
+            self.propintCache.setdefault(row['semid'].upper(), row['propmin'])
+        self.log.info(f'load_propint_cache: {len(self.propintCache)} koa_ppp semids for {self.utDate}')
+        return True
+
+
+    def get_propmin(self, semid):
+        '''
+        Returns koa_ppp propmin for semid on this utDate, or None if not found.
+        '''
+        if self.propintCache is None: self.load_propint_cache()
+        self.propintLookups += 1
+
+        if self.propintCache is not False:
+            return self.propintCache.get(semid.upper())
+
+        query = 'select propmin from koa_ppp where semid=%s and utdate=%s'
+        data = self.db.query('koa', query, getOne=True, params=(semid, self.utDate))
+        self.propintQueries += 1
+        return data['propmin'] if data else None
+
+
+    def get_wcs_cd_inputs(self):
+        '''
+        Returns (sky PA, pixel scale) for the CD matrix of the current file, or None.  See wcs_batch.py.
+        '''
+        return None
+
+
+    def get_wcs_offset_inputs(self):
+        '''
+        Returns (RA, Dec, ROTPOSN) for the pointing offset of the current file, or None.  See wcs_batch.py.
+        '''
+        return None
+
+
+    def load_wcs_table(self, files):
+        '''
+        Reads the WCS inputs from the primary header of each of the night's files and computes
+        their WCS values in one call (see wcs_batch.WcsTable).  Only done if WCS_PREFETCH is set,
+        since it reads every header an extra time; otherwise the table fills as files are processed.
+        '''
+        if not self.wcsPrefetch: return True
+
+        cdRows = []
+        offsetRows = []
+        for filename in files:
+            try:
+                self.fitsHeader = fits.getheader(filename, ignore_missing_end=True)
+                self.clear_keyword_cache()
+                cd = self.get_wcs_cd_inputs()
+                offset = self.get_wcs_offset_inputs()
+            except Exception:
+                continue
+            if cd: cdRows.append(cd)
+            if offset: offsetRows.append(offset)
+        self.fitsHeader = None
+        self.clear_keyword_cache()
+        if not cdRows and not offsetRows: return True
+
+        numCd = self.wcsTable.add_cd(*zip(*cdRows)) if cdRows else 0
+        numOffset = self.wcsTable.add_offsets(*zip(*offsetRows)) if offsetRows else 0
+        self.log.info(f'load_wcs_table: {numCd} CD matrices, {numOffset} offsets for {len(files)} files')
+        return True
+
+
     def set_datlevel(self, datlevel):
         '''
         Adds "DATLEVEL" keyword to header
@@ -790,6 +1109,18 @@ class Instrument:
         return True
 
 
+    def get_image_moments(self, ext=0, step=None):
+        '''
+        Returns mean, var, std and kurtosis of image data (see image_moments.py), cached per file.
+        Step is the subsample stride (default MISC MOMENTS_STEP, 1 is exact).
+        '''
+        if step is None: step = self.momentsStep
+        key = (ext, step)
+        if key not in self.imageMoments:
+            self.imageMoments[key] = image_moments.get_moments(self.fitsHdu[ext].data, step=step)
+        return self.imageMoments[key]
+
+
     def set_image_stats_keywords(self):
         '''
         Adds mean, median, std keywords to header
@@ -798,8 +1129,9 @@ class Instrument:
         # self.log.info('set_image_stats_keywords: setting image statistics keyword values')
 
         image = self.fitsHdu[0].data     
-        imageStd    = float("%0.2f" % np.std(image))
-        imageMean   = float("%0.2f" % np.mean(image))
+        moments = self.get_image_moments(step=1)
+        imageStd    = float("%0.2f" % moments['std'])
+        imageMean   = float("%0.2f" % moments['mean'])
         imageMedian = float("%0.2f" % np.median(image))
 
         self.set_keyword('IMAGEMN' ,  imageMean,   'KOA: Image data mean')
@@ -881,10 +1213,16 @@ class Instrument:
         #get input vars
         dateobs = self.get_keyword('DATE-OBS')
         utc     = self.get_keyword('UTC', False)
-        telnr   = self.get_telnr()
 
         #get data but continue even if there were errors for certain keywords
-        data, errors, warns = envlog(telnr, dateobs, utc)
+        #NOTE: frames outside the night window (ie test data) are fetched individually
+        if self.nightWeather is None:
+            self.nightWeather = self.get_night_weather()
+        utDatetime = dt.strptime(dateobs + ' ' + utc, '%Y-%m-%d %H:%M:%S.%f')
+        if self.nightWeather.in_window(utDatetime):
+            data, errors, warns = self.nightWeather.lookup(dateobs, utc)
+        else:
+            data, errors, warns = envlog(self.nightWeather.telnr, dateobs, utc, timeout=self.nightWeather.timeout)
         if type(data) is not dict: 
             self.log.error(f"Could not get weather data for {dateobs} {utc}")
             return True
@@ -908,18 +1246,22 @@ class Instrument:
         return True
 
 
-    def get_telnr(self):
+    def get_night_weather(self):
         '''
-        Gets telescope number for instrument via API
-        #todo: store this and skip api call if exists?  Would need to clear var on fits reload.
-        #todo: Replace API call with hard-coded?
+        Creates weather cache for the 24 hour window ending at utDate endTime.
+        Set MISC WEATHER_ARCHIVER to a local dir of <pv>.json files or an archiver base url to use a stand-in archiver.
         '''
+        endTime = dt.strptime(self.utDate + ' ' + self.endTime, '%Y-%m-%d %H:%M:%S')
+        archiver = self.config.get('MISC', {}).get('WEATHER_ARCHIVER')
+        return NightWeather(self.get_telnr(), endTime - timedelta(days=1), endTime, archiver=archiver, log=self.log)
 
-        url = self.telUrl + 'cmd=getTelnr&instr=' + self.instr.upper()
-        data = get_api_data(url, getOne=True)
-        telNr = int(data['TelNr'])
-        assert telNr in [1, 2], 'telNr "' + telNr + '"" not allowed'
-        return telNr
+
+    def get_telnr(self):
+        '''
+        Gets telescope number for instrument from instrument_registry (API only if not known)
+        '''
+        telUrl = getattr(self, 'telUrl', None)
+        return instrument_registry.get_telnr(self.instr, self.config, telUrl)
 
 
     def write_lev0_fits_file(self):
@@ -1127,6 +1469,26 @@ class Instrument:
         self.log.info('run_psfr: no PSFR defined for {}'.format(self.instr))
         return True
 
+    def start_job(self, name, cmd):
+        '''
+        Starts supervised external job (see supervisor.py).  Timeout is [INSTR] [NAME]_TIMEOUT secs
+        (default 6 hours), and resource limits are MISC JOB_MAX_MEM_MB, JOB_MAX_CPU_SECS and JOB_NICE.
+        '''
+        misc = self.config.get('MISC', {})
+        timeout = self.config[self.instr].get(f'{name.upper()}_TIMEOUT', 21600)
+        return supervisor.start(name, cmd, self.log, timeout=float(timeout) if timeout else None,
+                                maxMemMb=misc.get('JOB_MAX_MEM_MB'), maxCpuSecs=misc.get('JOB_MAX_CPU_SECS'),
+                                nice=misc.get('JOB_NICE', 0))
+
+    def close_fits_file(self):
+        '''
+        Closes current FITS file (ie before long running external jobs).
+        '''
+        if self.fitsHdu is not None: self.fitsHdu.close()
+        self.fitsHdu = None
+        self.fitsHeader = None
+        self.fitsFilepath = None
+
     def set_numccds(self):
         try:
             panelist = self.get_keyword('PANELIST')
@@ -1176,7 +1538,8 @@ class Instrument:
     def dqa_loc(self, delete=0):
         '''
         Creates or deletes the dqa.LOC file.
-        This file is needed for the PSF/TRS process.
+        This file is needed for the PSF/TRS process.  New consumers should tail
+        lev0.manifest instead (see lev0_manifest.py).
         '''
 
         dqaLoc = f"{self.dirs['lev0']}/dqa.LOC"
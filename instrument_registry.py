@@ -0,0 +1,146 @@
+'''
+Static instrument values used throughout DEP (telescope number, 24 hour window end time).
+
+Values are seeded from the defaults below, which can be overridden per instrument in the config
+file (ie NIRC2: {TELNR: 2, ENDTIME: '19:00:00'}).  An instrument not listed here can be added by
+giving it a config section with TELNR or ENDTIME.  Its telescope number, if not in config, is looked
+up once via the telSchedule API (getTelnr) and saved to a disk cache so later runs do not need the
+API.  The cache only fills in missing values for instruments known from the defaults or config, so
+it can never add an allowed instrument.  After startup, every lookup is a dict read.
+'''
+
+import os
+import json
+from common import get_api_data
+
+
+#defaults for each supported instrument
+INSTRUMENTS = {
+    'DEIMOS'  : {'TELNR': 2, 'ENDTIME': '20:00:00'},
+    'ESI'     : {'TELNR': 2, 'ENDTIME': '20:00:00'},
+    'HIRES'   : {'TELNR': 1, 'ENDTIME': '20:00:00'},
+    'KCWI'    : {'TELNR': 2, 'ENDTIME': '20:00:00'},
+    'LRIS'    : {'TELNR': 1, 'ENDTIME': '19:00:00'},
+    'MOSFIRE' : {'TELNR': 1, 'ENDTIME': '19:00:00'},
+    'NIRC2'   : {'TELNR': 2, 'ENDTIME': '19:00:00'},
+    'NIRES'   : {'TELNR': 2, 'ENDTIME': '19:00:00'},
+    'NIRSPEC' : {'TELNR': 2, 'ENDTIME': '19:00:00'},
+    'OSIRIS'  : {'TELNR': 1, 'ENDTIME': '19:00:00'},
+}
+
+DEFAULT_ENDTIME = '20:00:00'
+DEFAULT_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instruments.cache.json')
+
+#resolved values (instr -> dict)
+_registry = {}
+_seeded = False
+
+
+def seed(config=None):
+    '''
+    Builds registry from defaults, disk cache and config overrides.  Safe to call more than once.
+    '''
+    global _seeded
+
+    for instr, vals in INSTRUMENTS.items():
+        _registry.setdefault(instr, {}).update(vals)
+
+    #instruments added in config
+    if config:
+        for instr, section in config.items():
+            if not isinstance(section, dict): continue
+            if section.get('TELNR') or section.get('ENDTIME'): _registry.setdefault(instr.upper(), {})
+
+    #cached API values fill in missing values of known instruments only
+    for instr, vals in load_cache(config).items():
+        if instr not in _registry or not isinstance(vals, dict): continue
+        for key in ('TELNR', 'ENDTIME'):
+            if key in vals: _registry[instr].setdefault(key, vals[key])
+
+    #config overrides
+    if config:
+        for instr in list(_registry.keys()):
+            section = config.get(instr)
+            if not isinstance(section, dict): continue
+            if section.get('TELNR')  : _registry[instr]['TELNR']   = int(section['TELNR'])
+            if section.get('ENDTIME'): _registry[instr]['ENDTIME'] = str(section['ENDTIME'])
+
+    _seeded = True
+
+
+def get_cache_file(config=None):
+    if config and config.get('MISC', {}).get('INSTR_CACHE_FILE'):
+        return config['MISC']['INSTR_CACHE_FILE']
+    return DEFAULT_CACHE_FILE
+
+
+def load_cache(config=None):
+    cacheFile = get_cache_file(config)
+    if not os.path.isfile(cacheFile): return {}
+    try:
+        with open(cacheFile) as f: return json.load(f)
+    except Exception:
+        return {}
+
+
+def save_cache(instr, vals, config=None):
+    '''
+    Adds API-resolved values for instr to disk cache (written atomically).
+    '''
+    cache = load_cache(config)
+    cache.setdefault(instr, {}).update(vals)
+    cacheFile = get_cache_file(config)
+    try:
+        tmpFile = f'{cacheFile}.{os.getpid()}.tmp'
+        with open(tmpFile, 'w') as f: json.dump(cache, f, indent=2)
+        os.replace(tmpFile, cacheFile)
+    except Exception:
+        pass
+
+
+def get_instruments(config=None):
+    '''
+    Returns list of allowed instrument names.
+    '''
+    if not _seeded: seed(config)
+    return list(_registry.keys())
+
+
+def get_instr_list(config=None):
+    '''
+    Returns dict of instrument name to telescope number for all known instruments.
+    '''
+    if not _seeded: seed(config)
+    return {instr: vals['TELNR'] for instr, vals in _registry.items() if 'TELNR' in vals}
+
+
+def get_end_time(instr, config=None):
+    '''
+    Returns 24 hour period start/end time (UT) for instrument.
+    '''
+    if not _seeded: seed(config)
+    return _registry.get(instr.upper(), {}).get('ENDTIME', DEFAULT_ENDTIME)
+
+
+def get_telnr(instr, config=None, telUrl=None):
+    '''
+    Returns telescope number for instrument.  Falls back to telSchedule API (and caches result)
+    for instruments without a known value.
+    '''
+    if not _seeded: seed(config)
+    instr = instr.upper()
+    telnr = _registry.get(instr, {}).get('TELNR')
+    if telnr: return telnr
+
+    if not telUrl and config: telUrl = config['API']['TELAPI']
+    assert telUrl, f'get_telnr: no TELNR for {instr} and no API url'
+    url = telUrl + 'cmd=getTelnr&instr=' + instr
+    data = get_api_data(url, getOne=True)
+    assert data and 'TelNr' in data, f'get_telnr: could not get TelNr for {instr} from API'
+    telnr = int(data['TelNr'])
+    assert telnr in [1, 2], 'telNr "' + str(telnr) + '" not allowed'
+
+    if instr in _registry:
+        _registry[instr]['TELNR'] = telnr
+        save_cache(instr, {'TELNR': telnr}, config)
+    return telnr
@@ -0,0 +1,140 @@
+'''
+Night-scoped KOAID registry for DQA.
+
+Claimed KOAIDs are kept in a set for O(1) duplicate checks.  If a stage dir is given, each claim is
+also written as an empty-create file (O_CREAT|O_EXCL) under <stage>/koaids/ holding the run id and
+source file path, so resumed or parallel DQA workers for the same night share claims atomically.
+Re-claiming a KOAID from the same source file (ie a resumed run) is allowed.
+
+When a run finishes it writes <stage>/koaids/<run id>.done.  Claims of finished runs are stale and
+are taken over by the next run, so a fresh DQA run of the night does not see them as duplicates.
+Claims of runs that did not finish (parallel workers, or a crashed run being resumed) still count.
+
+NOTE: KOAIDs are registered without the scam/spec subdir so duplicates across subdirs are found.
+'''
+
+import os
+import time
+import fcntl
+import calendar
+import threading
+from datetime import datetime
+
+
+class KoaidRegistry:
+
+    def __init__(self, utDate, endTime, stageDir=None, runId=None):
+        self.lock   = threading.Lock()
+        self.claims = {}
+        self.runId  = runId or f'{os.getpid()}.{int(time.time() * 1000)}'
+        self.dir    = os.path.join(stageDir, 'koaids') if stageDir else None
+        if self.dir: os.makedirs(self.dir, exist_ok=True)
+
+        #precomputed window values (epoch secs)
+        self.idate      = utDate.replace('/', '-').replace('-', '')
+        self.utDateSecs = get_date_secs(self.idate)
+        hours, minutes, seconds = endTime.split(':')
+        self.endTimeSec = float(hours) * 3600.0 + float(minutes) * 60.0 + float(seconds)
+        self.dateSecs   = {self.idate: self.utDateSecs}
+
+
+    def __contains__(self, koaid):
+        return koaid in self.claims
+
+
+    def __len__(self):
+        return len(self.claims)
+
+
+    def claim(self, koaid, source=''):
+        '''
+        Claims koaid for source file.  Returns False if already claimed by another file.
+        '''
+        with self.lock:
+            if koaid in self.claims: return self.claims[koaid] == source and source != ''
+            if self.dir and not self.claim_file(koaid, source): return False
+            self.claims[koaid] = source
+            return True
+
+
+    def release(self, koaid, source=''):
+        '''
+        Releases claim (ie file failed a later DQA step) so another file can use koaid.
+        '''
+        with self.lock:
+            if self.claims.get(koaid) != source: return
+            del self.claims[koaid]
+            if self.dir:
+                try:
+                    os.remove(os.path.join(self.dir, koaid))
+                except FileNotFoundError:
+                    pass
+
+
+    def finish(self):
+        '''
+        Marks this run finished so its claims are stale for later runs.
+        '''
+        if not self.dir: return
+        with open(os.path.join(self.dir, f'{self.runId}.done'), 'w') as f: f.write(str(len(self.claims)))
+
+
+    def claim_file(self, koaid, source):
+        path = os.path.join(self.dir, koaid)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return self.reclaim_file(path, source)
+        with os.fdopen(fd, 'w') as f: f.write(f'{self.runId}\n{source}')
+        return True
+
+
+    def reclaim_file(self, path, source):
+        '''
+        Checks existing claim file.  Takes it over if it is for source or stale.
+        '''
+        #lock so only one worker takes over a stale claim
+        with open(os.path.join(self.dir, '.lock'), 'w') as lockFile:
+            fcntl.flock(lockFile, fcntl.LOCK_EX)
+            runId, claimSource = self.read_claim_file(path)
+            if claimSource != source or source == '':
+                #claims without a run id are from before run ids were written
+                if runId and not os.path.isfile(os.path.join(self.dir, f'{runId}.done')): return False
+            tmpFile = f'{path}.{self.runId}.tmp'
+            with open(tmpFile, 'w') as f: f.write(f'{self.runId}\n{source}')
+            os.replace(tmpFile, path)
+            return True
+
+
+    def read_claim_file(self, path):
+        '''
+        Returns (run id, source) of claim file.
+        '''
+        try:
+            with open(path) as f: data = f.read()
+        except FileNotFoundError:
+            return None, None
+        if '\n' not in data: return None, data
+        return tuple(data.split('\n', 1))
+
+
+    def is_date_ok(self, koaid):
+        '''
+        Checks that date and time in KOAID falls within the 24-hour processing range.
+        NOTE: Only checking outside of 1 day difference b/c file write time can cause this to trigger incorrectly
+        '''
+        prefix, kdate, ktime, postfix = koaid.split('.')
+        if kdate == self.idate: return True
+        secs = self.dateSecs.get(kdate)
+        if secs is None:
+            secs = get_date_secs(kdate)
+            self.dateSecs[kdate] = secs
+        delta = abs(self.utDateSecs - secs) // 86400
+        return not (delta > 1 and float(ktime) < self.endTimeSec)
+
+
+def get_date_secs(ymd):
+    '''
+    Epoch seconds for YYYYMMDD (UTC midnight).
+    '''
+    return calendar.timegm(datetime.strptime(ymd, '%Y%m%d').timetuple())
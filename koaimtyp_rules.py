@@ -0,0 +1,500 @@
+'''
+Declarative KOAIMTYP (image type) rules per instrument.
+
+Each instrument's image type algorithm is written as an ordered rule table: the first rule whose
+conditions all hold gives KOAIMTYP, else the table default ('undefined').  Tables are compiled once
+into a decision tree (consecutive rules sharing leading conditions test them only once) and are
+evaluated against a tuple of pre-extracted field values, so a night can be classified in batch
+from headers, and the same tuple (ie repeated calibrations) is only evaluated once.
+
+Fields are header keywords (optionally lowercased or converted to float) or small derived values
+computed from keywords.  Conditions are (field, op, operand) where field is a field name or a tuple
+of field names for the multi-field ops:
+
+    eq, ne, in, notin       : value == / != / in / not in operand
+    has, nothas, startswith : operand substring of str value
+    true, false             : truthiness of value
+    ge, lt                  : numeric compare (False if value is None)
+    between, within         : lo < value < hi, lo <= value <= hi (False if value is None)
+    any, notany, all, notall: multi-field, any/all fields == operand (or per-field operand tuple)
+
+Usage:
+    Instrument.get_koaimtyp:  self.koaimtypRules.classify_instrument(self)
+    batch:                    koaimtyp_rules.LRIS.classify_headers(headers, keywordMap)
+'''
+
+import datetime as dt
+
+
+class Field:
+    '''
+    One value in the field tuple.  Uses func(get) if defined, else get(keyword, default).
+    '''
+    def __init__(self, name, keyword=None, default=None, lower=False, num=False, badNum=None, useMap=True, func=None):
+        self.name    = name
+        self.keyword = keyword if keyword else name
+        self.default = default
+        self.lower   = lower
+        self.num     = num
+        self.badNum  = badNum
+        self.useMap  = useMap
+        self.func    = func
+
+    def get_value(self, get):
+        if self.func:
+            try:
+                return self.func(get)
+            except Exception:
+                return None
+        val = get(self.keyword, default=self.default, useMap=self.useMap)
+        if self.lower and isinstance(val, str):
+            val = val.lower()
+        if self.num and isinstance(val, str):
+            try:
+                val = float(val)
+            except ValueError:
+                val = self.badNum
+        return val
+
+
+class FromField:
+    '''
+    Rule result taken from a field value (ie KCWI IMTYPE).
+    '''
+    def __init__(self, name):
+        self.name = name
+
+
+def is_num(val):
+    return val is not None and not isinstance(val, str)
+
+
+OPS = {
+    'eq'        : lambda v, x: v == x,
+    'ne'        : lambda v, x: v != x,
+    'in'        : lambda v, x: v in x,
+    'notin'     : lambda v, x: v not in x,
+    'has'       : lambda v, x: isinstance(v, str) and x in v,
+    'nothas'    : lambda v, x: isinstance(v, str) and x not in v,
+    'startswith': lambda v, x: isinstance(v, str) and v.startswith(x),
+    'true'      : lambda v, x: bool(v),
+    'false'     : lambda v, x: not v,
+    'ge'        : lambda v, x: is_num(v) and v >= x,
+    'lt'        : lambda v, x: is_num(v) and v < x,
+    'between'   : lambda v, x: is_num(v) and x[0] < v < x[1],
+    'within'    : lambda v, x: is_num(v) and x[0] <= v <= x[1],
+}
+
+MULTI_OPS = {
+    'any'   : lambda vals, xs: any(v == x for v, x in zip(vals, xs)),
+    'notany': lambda vals, xs: not any(v == x for v, x in zip(vals, xs)),
+    'all'   : lambda vals, xs: all(v == x for v, x in zip(vals, xs)),
+    'notall': lambda vals, xs: not all(v == x for v, x in zip(vals, xs)),
+}
+
+
+class RuleTable:
+
+    def __init__(self, instr, fields, rules, default='undefined'):
+        self.instr   = instr
+        self.fields  = fields
+        self.rules   = rules
+        self.default = default
+        self.index   = {f.name: i for i, f in enumerate(fields)}
+        self.tree    = self.compile_rules([(conds, result) for result, conds in rules])
+        self.results = {}
+
+
+    def compile_cond(self, cond):
+        '''
+        Returns predicate on the field tuple for (field, op, operand).
+        '''
+        name, op, x = cond
+        if isinstance(name, tuple):
+            idx = [self.index[n] for n in name]
+            xs = x if isinstance(x, tuple) else (x,) * len(idx)
+            func = MULTI_OPS[op]
+            return lambda vals: func([vals[i] for i in idx], xs)
+        i = self.index[name]
+        func = OPS[op]
+        return lambda vals: func(vals[i], x)
+
+
+    def compile_result(self, result):
+        if isinstance(result, FromField):
+            i = self.index[result.name]
+            return lambda vals: vals[i]
+        return lambda vals: result
+
+
+    def compile_rules(self, rules):
+        '''
+        Returns list of (predicate, subtree) and (None, result) nodes.  Consecutive rules with the same
+        first condition are grouped under one node, which keeps first-match order.
+        '''
+        tree = []
+        i = 0
+        while i < len(rules):
+            conds, result = rules[i]
+            if not conds:
+                tree.append((None, self.compile_result(result)))
+                i += 1
+                continue
+            j = i + 1
+            while j < len(rules) and rules[j][0] and rules[j][0][0] == conds[0]:
+                j += 1
+            subRules = [(c[1:], r) for c, r in rules[i:j]]
+            tree.append((self.compile_cond(conds[0]), self.compile_rules(subRules)))
+            i = j
+        return tree
+
+
+    def eval_tree(self, tree, vals):
+        for pred, node in tree:
+            if pred is None:
+                return node(vals)
+            if pred(vals):
+                result = self.eval_tree(node, vals)
+                if result is not None: return result
+        return None
+
+
+    def extract(self, get):
+        '''
+        Returns field tuple.  get(keyword, default=None, useMap=True) returns header value.
+        '''
+        return tuple(f.get_value(get) for f in self.fields)
+
+
+    def classify(self, vals):
+        '''
+        Returns KOAIMTYP for field tuple.  Results are memoized by tuple.
+        '''
+        try:
+            return self.results[vals]
+        except KeyError:
+            pass
+        except TypeError:
+            return self.eval(vals)
+        if len(self.results) > 100000: self.results.clear()
+        result = self.results[vals] = self.eval(vals)
+        return result
+
+
+    def eval(self, vals):
+        result = self.eval_tree(self.tree, vals)
+        return self.default if result is None else result
+
+
+    def classify_instrument(self, instrObj):
+        get = lambda keyword, default=None, useMap=True: instrObj.get_keyword(keyword, useMap, default=default)
+        return self.classify(self.extract(get))
+
+
+    def classify_headers(self, headers, keywordMap=None):
+        '''
+        Batch classify list of headers (dict-like, ie astropy Header).  Returns list of KOAIMTYP.
+        '''
+        return [self.classify(self.extract(get_header_getter(h, keywordMap))) for h in headers]
+
+
+def get_header_getter(header, keywordMap=None):
+    '''
+    Returns get function for a dict-like header, resolving keywords with keywordMap like
+    Instrument.get_keyword (first mapped key with a non-None value).
+    '''
+    keywordMap = keywordMap or {}
+    def get(keyword, default=None, useMap=True):
+        keys = keywordMap.get(keyword, keyword) if useMap else keyword
+        if isinstance(keys, str): keys = [keys]
+        for key in keys:
+            val = header.get(key)
+            if val is not None: return val
+        return default
+    return get
+
+
+#----------------------------------------------------------------------------------------------------
+#Instrument rule tables.  Order matters: first matching rule wins.
+#----------------------------------------------------------------------------------------------------
+
+DEIMOS = RuleTable('DEIMOS',
+    fields=[
+        Field('OUTDIR',   default=''),
+        Field('OBSTYPE',  default='', lower=True),
+        Field('SLMSKNAM', default='', lower=True),
+        Field('HATCHPOS', default='', lower=True),
+        Field('FLIMAGIN', default='', lower=True),
+        Field('FLSPECTR', default='', lower=True),
+        Field('LAMPS',    default='', lower=True),
+        Field('GRATEPOS'),
+    ],
+    rules=[
+        ('fcscal',   [('OUTDIR', 'has', '/fcs')]),
+        ('bias',     [('OBSTYPE', 'eq', 'bias')]),
+        ('dark',     [('OBSTYPE', 'eq', 'dark')]),
+        ('focus',    [('SLMSKNAM', 'startswith', 'goh')]),
+        ('flatlamp', [('HATCHPOS', 'eq', 'closed'), ('LAMPS', 'has', 'qz')]),
+        ('flatlamp', [('HATCHPOS', 'eq', 'open'), (('FLIMAGIN', 'FLSPECTR'), 'any', 'on')]),
+        ('arclamp',  [('HATCHPOS', 'eq', 'closed'), ('LAMPS', 'nothas', 'off'), ('LAMPS', 'nothas', 'qz'),
+                      ('GRATEPOS', 'in', (3, 4))]),
+        ('object',   [('HATCHPOS', 'eq', 'open')]),
+        ('fcscal',   [('OUTDIR', 'has', 'fcs')]),
+    ])
+
+
+ESI_ARCS = ('LAMPAR1', 'LAMPCU1', 'LAMPNE1', 'LAMPNE2')
+ESI_FLATPOS = ('EL', 'within', (44.0, 46.01))
+
+ESI = RuleTable('ESI',
+    fields=[Field('EL')] +
+           [Field(k, default='', lower=True) for k in ('OBSTYPE', 'SLMSKNAM', 'HATCHPOS', 'LAMPQTZ1',
+            'LAMPAR1', 'LAMPCU1', 'LAMPNE1', 'LAMPNE2', 'PRISMNAM', 'IMFLTNAM', 'AXESTAT', 'DOMESTAT',
+            'DWFILNAM', 'LDFLTNAM')],
+    rules=[
+        ('bias',     [('OBSTYPE', 'eq', 'bias')]),
+        ('dark',     [('OBSTYPE', 'eq', 'dark')]),
+        #trace or focus: hatch closed
+        ('trace',    [('SLMSKNAM', 'has', 'hole'), ('HATCHPOS', 'eq', 'closed'), ('LAMPQTZ1', 'eq', 'on'),
+                      (ESI_ARCS, 'notany', 'on'), ('PRISMNAM', 'eq', 'in'), ('IMFLTNAM', 'eq', 'out')]),
+        ('focus',    [('SLMSKNAM', 'has', 'hole'), ('HATCHPOS', 'eq', 'closed'), ('LAMPQTZ1', 'eq', 'on'),
+                      (ESI_ARCS, 'notany', 'on'), ('PRISMNAM', 'ne', 'in'), ('IMFLTNAM', 'ne', 'out')]),
+        ('focus',    [('SLMSKNAM', 'has', 'hole'), ('HATCHPOS', 'eq', 'closed'), ('LAMPQTZ1', 'ne', 'on'),
+                      (ESI_ARCS, 'any', 'on'), ('PRISMNAM', 'eq', 'in'), ('IMFLTNAM', 'eq', 'out')]),
+        #trace or focus: hatch open, on flat screen
+        ('trace',    [('SLMSKNAM', 'has', 'hole'), ('HATCHPOS', 'ne', 'closed'),
+                      (('PRISMNAM', 'IMFLTNAM'), 'all', ('in', 'out')),
+                      ('OBSTYPE', 'eq', 'dmflat'), ('DOMESTAT', 'ne', 'tracking'), ESI_FLATPOS]),
+        ('trace',    [('SLMSKNAM', 'has', 'hole'), ('HATCHPOS', 'ne', 'closed'),
+                      (('PRISMNAM', 'IMFLTNAM'), 'all', ('in', 'out')),
+                      ('AXESTAT', 'ne', 'tracking'), ('DOMESTAT', 'ne', 'tracking'), ESI_FLATPOS]),
+        ('trace',    [('SLMSKNAM', 'has', 'hole'), ('HATCHPOS', 'ne', 'closed'),
+                      (('PRISMNAM', 'IMFLTNAM'), 'all', ('in', 'out')),
+                      ('OBSTYPE', 'eq', 'dmflat'), ('AXESTAT', 'ne', 'tracking'), ESI_FLATPOS]),
+        ('focus',    [('SLMSKNAM', 'has', 'hole'), ('HATCHPOS', 'ne', 'closed'),
+                      (('PRISMNAM', 'IMFLTNAM'), 'notall', ('in', 'out')),
+                      ('OBSTYPE', 'eq', 'dmflat'), ('DOMESTAT', 'ne', 'tracking'), ESI_FLATPOS]),
+        ('focus',    [('SLMSKNAM', 'has', 'hole'), ('HATCHPOS', 'ne', 'closed'),
+                      (('PRISMNAM', 'IMFLTNAM'), 'notall', ('in', 'out')),
+                      ('AXESTAT', 'ne', 'tracking'), ('DOMESTAT', 'ne', 'tracking'), ESI_FLATPOS]),
+        ('focus',    [('SLMSKNAM', 'has', 'hole'), ('HATCHPOS', 'ne', 'closed'),
+                      (('PRISMNAM', 'IMFLTNAM'), 'notall', ('in', 'out')),
+                      ('OBSTYPE', 'eq', 'dmflat'), ('AXESTAT', 'ne', 'tracking'), ESI_FLATPOS]),
+        #trace or focus: any hatch
+        ('focus',    [('SLMSKNAM', 'has', 'hole'), ('PRISMNAM', 'eq', 'out'), ('IMFLTNAM', 'eq', 'in'),
+                      ('LDFLTNAM', 'eq', 'out')]),
+        ('focus',    [('SLMSKNAM', 'has', 'hole'), ('PRISMNAM', 'eq', 'in'), ('IMFLTNAM', 'eq', 'out'),
+                      ('DWFILNAM', 'eq', 'clear_s')]),
+        ('undefined',[('SLMSKNAM', 'has', 'hole')]),
+        #no hole: hatch closed
+        ('flatlamp', [('HATCHPOS', 'eq', 'closed'), ('LAMPQTZ1', 'eq', 'on'), (ESI_ARCS, 'notany', 'on')]),
+        ('arclamp',  [('HATCHPOS', 'eq', 'closed'), ('LAMPQTZ1', 'ne', 'on'), (ESI_ARCS, 'any', 'on'),
+                      ('PRISMNAM', 'eq', 'in'), ('IMFLTNAM', 'eq', 'out')]),
+        ('undefined',[('HATCHPOS', 'eq', 'closed')]),
+        #no hole: hatch open
+        ('flatlamp', [('OBSTYPE', 'eq', 'dmflat'), ('DOMESTAT', 'ne', 'tracking'), ESI_FLATPOS]),
+        ('flatlamp', [('AXESTAT', 'ne', 'tracking'), ('DOMESTAT', 'ne', 'tracking'), ESI_FLATPOS]),
+        ('flatlamp', [('OBSTYPE', 'eq', 'dmflat'), ('AXESTAT', 'ne', 'tracking'), ('DOMESTAT', 'ne', 'tracking')]),
+        ('flatlamp', [('OBSTYPE', 'eq', 'dmflat'), ('AXESTAT', 'ne', 'tracking'), ESI_FLATPOS]),
+        ('object',   [('LAMPQTZ1', 'ne', 'on'), (ESI_ARCS, 'notany', 'on')]),
+    ])
+
+
+def get_hires_catcur(get):
+    if get('LAMPNAME', useMap=False) == 'ThAr2': return get('CATCUR2', useMap=False)
+    return get('CATCUR1', useMap=False)
+
+HIRES_LAMPON = [('LAMPNAME', 'ne', 'none'), (('LMIRRIN', 'DARKCLOS'), 'notall', (0, 1))]
+
+HIRES = RuleTable('HIRES',
+    fields=[Field(k, useMap=False) for k in ('AUTOSHUT', 'LAMPNAME', 'LMIRRIN', 'DARKCLOS', 'TTIME',
+            'DECKNAME', 'CATCUR1', 'CATCUR2', 'HATCLOS', 'XCOVCLOS', 'ECOVCLOS')] +
+           [Field('CATCUR', func=get_hires_catcur)],
+    rules=[
+        ('undefined',      [(('AUTOSHUT', 'LAMPNAME', 'LMIRRIN', 'DARKCLOS', 'TTIME'), 'any', None)]),
+        #shutter not in auto mode
+        ('bias_lamp_on',   [('AUTOSHUT', 'eq', 0)] + HIRES_LAMPON + [('TTIME', 'eq', 0)]),
+        ('bias',           [('AUTOSHUT', 'eq', 0), ('TTIME', 'eq', 0)]),
+        ('dark_lamp_on',   [('AUTOSHUT', 'eq', 0)] + HIRES_LAMPON),
+        ('dark',           [('AUTOSHUT', 'eq', 0)]),
+        ('undefined',      [(('DECKNAME', 'CATCUR1', 'CATCUR2', 'HATCLOS'), 'any', None)]),
+        #quartz lamp
+        ('object_lamp_on', [('LAMPNAME', 'has', 'quartz'), (('LMIRRIN', 'HATCLOS'), 'all', (0, 0))]),
+        ('undefined',      [('LAMPNAME', 'has', 'quartz'), (('LMIRRIN', 'HATCLOS'), 'all', (0, 1))]),
+        ('trace',          [('LAMPNAME', 'has', 'quartz'), ('DECKNAME', 'eq', 'D5')]),
+        ('flatlamp',       [('LAMPNAME', 'has', 'quartz')]),
+        #ThAr lamp
+        ('undefined',      [('LAMPNAME', 'has', 'ThAr'), (('XCOVCLOS', 'ECOVCLOS'), 'all', 1)]),
+        ('undefined',      [('LAMPNAME', 'has', 'ThAr'), (('LMIRRIN', 'HATCLOS'), 'all', (0, 1))]),
+        ('object_lamp_on', [('LAMPNAME', 'has', 'ThAr'), (('LMIRRIN', 'HATCLOS'), 'all', (0, 0))]),
+        ('focus',          [('LAMPNAME', 'has', 'ThAr'), ('CATCUR', 'ge', 5.0), ('DECKNAME', 'eq', 'D5')]),
+        ('arclamp',        [('LAMPNAME', 'has', 'ThAr'), ('CATCUR', 'ge', 5.0)]),
+        ('undefined',      [('LAMPNAME', 'has', 'ThAr')]),
+        ('undefined',      [('LAMPNAME', 'has', 'undefined')]),
+        #no lamp
+        ('bias',           [('HATCLOS', 'eq', 1), ('TTIME', 'eq', 0)]),
+        ('dark',           [('HATCLOS', 'eq', 1)]),
+        ('bias',           [('TTIME', 'eq', 0)]),
+        ('object',         []),
+    ])
+
+
+KCWI = RuleTable('KCWI',
+    fields=[
+        Field('CAMERA', default='', lower=True),
+        Field('XPOSURE'),
+        Field('IMTYPE', lower=True),
+    ],
+    rules=[
+        ('fpc',              [('CAMERA', 'eq', 'fpc')]),
+        ('bias',             [('XPOSURE', 'eq', 0.0)]),
+        (FromField('IMTYPE'), [('IMTYPE', 'true', None)]),
+    ])
+
+
+LRIS_ARCS = ('NEON', 'ARGON', 'CADMIUM', 'ZINC', 'KRYPTON', 'XENON', 'FEARGON', 'DEUTERI')
+LRIS_NOLAMPS = ('', '0', None)
+
+LRIS = RuleTable('LRIS',
+    fields=[Field(k) for k in ('INSTRUME', 'SLITNAME', 'OUTFILE', 'ELAPTIME', 'TRAPDOOR', 'GRANAME',
+            'GRISNAME', 'FLIMAGIN', 'FLSPECTR', 'FLAMP1', 'FLAMP2', 'AUTOSHUT', 'CALNAME', 'AXESTAT',
+            'LAMPS', 'HALOGEN') + LRIS_ARCS],
+    rules=[
+        ('focus',    [('SLITNAME', 'eq', 'GOH_LRIS')]),
+        ('focus',    [('OUTFILE', 'in', ('rfoc', 'bfoc'))]),
+        ('bias',     [('ELAPTIME', 'eq', 0)]),
+        #trapdoor open
+        ('flatlamp', [('TRAPDOOR', 'eq', 'open'), (('FLIMAGIN', 'FLSPECTR', 'FLAMP1', 'FLAMP2'), 'any', 'on')]),
+        ('polcal',   [('TRAPDOOR', 'eq', 'open'), ('AUTOSHUT', 'true', None), ('CALNAME', 'in', ('ir', 'hnpb', 'uv'))]),
+        ('object',   [('TRAPDOOR', 'eq', 'open'), ('AUTOSHUT', 'true', None)]),
+        ('object',   [('TRAPDOOR', 'eq', 'open'), ('AXESTAT', 'eq', 'tracking')]),
+        #trapdoor closed, LAMPS keyword
+        ('flatlamp', [('TRAPDOOR', 'eq', 'closed'), ('LAMPS', 'notin', LRIS_NOLAMPS), ('LAMPS', 'eq', '0,0,0,0,0,1')]),
+        ('arclamp',  [('TRAPDOOR', 'eq', 'closed'), ('LAMPS', 'notin', LRIS_NOLAMPS), ('LAMPS', 'has', '1'),
+                      ('INSTRUME', 'eq', 'LRIS'), ('GRANAME', 'ne', 'mirror')]),
+        ('arclamp',  [('TRAPDOOR', 'eq', 'closed'), ('LAMPS', 'notin', LRIS_NOLAMPS), ('LAMPS', 'has', '1'),
+                      ('INSTRUME', 'eq', 'LRISBLUE'), ('GRISNAME', 'ne', 'clear')]),
+        ('dark',     [('TRAPDOOR', 'eq', 'closed'), ('LAMPS', 'notin', LRIS_NOLAMPS), ('LAMPS', 'eq', '0,0,0,0,0,0')]),
+        ('undefined',[('TRAPDOOR', 'eq', 'closed'), ('LAMPS', 'notin', LRIS_NOLAMPS)]),
+        #trapdoor closed, lamp keywords
+        ('flatlamp', [('TRAPDOOR', 'eq', 'closed'), ('HALOGEN', 'eq', 'on')]),
+        ('arclamp',  [('TRAPDOOR', 'eq', 'closed'), (LRIS_ARCS, 'any', 'on'),
+                      ('INSTRUME', 'eq', 'LRIS'), ('GRANAME', 'ne', 'mirror')]),
+        ('arclamp',  [('TRAPDOOR', 'eq', 'closed'), (LRIS_ARCS, 'any', 'on'),
+                      ('INSTRUME', 'eq', 'LRISBLUE'), ('GRISNAME', 'ne', 'clear')]),
+        ('dark',     [('TRAPDOOR', 'eq', 'closed'), (LRIS_ARCS + ('HALOGEN',), 'all', 'off')]),
+    ])
+
+
+def get_nirc2_lampdate(get):
+    '''
+    True if DATE-OBS is after 2011-10-10 (lamp power keywords are valid).
+    '''
+    year, month, day = get('DATE-OBS').split('-')
+    return dt.date(int(year), int(month), int(day)) > dt.date(2011, 10, 10)
+
+NIRC2_FLAT = [('SHRNAME', 'eq', 'open'), ('OBSFNAME', 'in', ('telescope', 'pws')),
+              ('DOMESTAT', 'ne', 'tracking'), ('AXESTAT', 'ne', 'tracking')]
+NIRC2_ARC = [('SHRNAME', 'eq', 'open'), ('OBSFNAME', 'eq', 'telsim'), ('ARGONPWR', 'true', None),
+             ('LAMPDATE', 'true', None)]
+
+NIRC2 = RuleTable('NIRC2',
+    fields=[Field(k) for k in ('GRSNAME', 'SHRNAME', 'OBSFNAME', 'DOMESTAT', 'AXESTAT', 'FLIMAGIN',
+            'FLSPECTR', 'OBJECT', 'ARGONPWR', 'XENONPWR', 'KRYPTPWR', 'NEONPWR', 'LAMPPWR', 'ITIME')] +
+           [Field('EL', num=True), Field('LAMPDATE', func=get_nirc2_lampdate)],
+    rules=[
+        #shutter open, on sky or flat screen
+        ('telTBD',      NIRC2_FLAT + [('GRSNAME', 'ne', 'clear')]),
+        ('flatlamp',    NIRC2_FLAT + [('FLIMAGIN', 'true', None), (('FLIMAGIN', 'FLSPECTR'), 'any', 'on')]),
+        ('undefined',   NIRC2_FLAT + [('FLIMAGIN', 'true', None), ('OBJECT', 'eq', 'ao_confirmation_pw')]),
+        ('flatlampoff', NIRC2_FLAT + [('FLIMAGIN', 'true', None)]),
+        ('flatTBD',     NIRC2_FLAT + [('EL', 'between', (44.99, 45.01))]),
+        ('object',      NIRC2_FLAT),
+        #shutter open, arc lamps, or other (NOTE: on-sky frames with a grism fall through to specTBD)
+        ('flatlamp',    NIRC2_ARC + [('LAMPPWR', 'eq', 1)]),
+        ('arclamp',     NIRC2_ARC + [(('ARGONPWR', 'XENONPWR', 'KRYPTPWR', 'NEONPWR'), 'any', 1)]),
+        ('specTBD',     NIRC2_ARC),
+        ('undefined',   [('SHRNAME', 'eq', 'open'), ('OBSFNAME', 'eq', 'telsim')]),
+        ('specTBD',     [('SHRNAME', 'eq', 'open'), ('GRSNAME', 'in', ('lowres', 'medres', 'GRS1', 'GRS2'))]),
+        ('object',      [('SHRNAME', 'eq', 'open'), ('OBSFNAME', 'in', ('telescope', 'pws'))]),
+        #shutter closed
+        ('bias',        [('SHRNAME', 'eq', 'closed'), ('ITIME', 'eq', 0.0)]),
+        ('dark',        [('SHRNAME', 'eq', 'closed')]),
+    ])
+
+
+NIRSPEC_LAMPS = ('XENON', 'KRYPTON', 'ARGON', 'NEON')
+
+NIRSPEC = RuleTable('NIRSPEC',
+    fields=[Field('OBSTYPE', lower=True), Field('ITIME', num=True)] +
+           [Field(k, default='', lower=True) for k in ('CALMPOS', 'CALPPOS', 'FLIMAGIN', 'FLSPECTR') + NIRSPEC_LAMPS],
+    rules=[
+        #OBSTYPE value first
+        ('object',      [('OBSTYPE', 'in', ('object', 'standard', 'telluric'))]),
+        ('bias',        [('OBSTYPE', 'eq', 'bias')]),
+        ('dark',        [('OBSTYPE', 'eq', 'dark')]),
+        ('domeflat',    [('OBSTYPE', 'eq', 'domeflat')]),
+        ('domearc',     [('OBSTYPE', 'eq', 'domearc')]),
+        ('arclamp',     [('OBSTYPE', 'eq', 'arclamp')]),
+        ('flatlamp',    [('OBSTYPE', 'eq', 'flatlamp')]),
+        #arc lamps
+        ('arclamp',     [(NIRSPEC_LAMPS, 'any', 'on'), ('CALMPOS', 'eq', 'in'), ('CALPPOS', 'eq', 'out')]),
+        ('undefined',   [(NIRSPEC_LAMPS, 'any', 'on')]),
+        #flats
+        ('flatlampoff', [(('FLIMAGIN', 'FLSPECTR'), 'notany', 'on'), ('CALMPOS', 'eq', 'in')]),
+        ('flatlamp',    [(('FLIMAGIN', 'FLSPECTR'), 'any', 'on'), ('CALMPOS', 'eq', 'in'), ('CALPPOS', 'eq', 'out')]),
+        #int(ITIME) == 0
+        ('bias',        [('ITIME', 'between', (-1, 1))]),
+        ('object',      [('CALMPOS', 'eq', 'out'), ('CALPPOS', 'eq', 'out')]),
+    ])
+
+
+def get_osiris_filter(get):
+    instr = get('INSTR', default='').lower()
+    if instr == 'imag': return get('IFILTER', default='').lower()
+    if instr == 'spec': return get('SFILTER', default='').lower()
+    return ''
+
+def get_osiris_domeoff(get):
+    vals = []
+    for k in ('DOMEPOSN', 'AZ'):
+        val = get(k, default=0)
+        if isinstance(val, str):
+            try:
+                val = float(val)
+            except ValueError:
+                val = 0
+        vals.append(val)
+    return abs(vals[0] - vals[1])
+
+OSIRIS_STAT = ('tracking', 'slewing')
+OSIRIS_FLATPOS = [('EL', 'between', (44.89, 45.11)), ('DOMEOFF', 'between', (80.0, 100.0))]
+
+OSIRIS = RuleTable('OSIRIS',
+    fields=[
+        Field('PCSFX',    num=True, badNum=0),
+        Field('PCSFY',    num=True, badNum=0),
+        Field('PCSFLZ',   num=True, badNum=0),
+        Field('INSTR',    default='', lower=True),
+        Field('FILTER',   func=get_osiris_filter),
+        Field('AXESTAT',  default=''),
+        Field('DOMESTAT', default=''),
+        Field('EL',       num=True, default=0, badNum=0),
+        Field('DOMEOFF',  func=get_osiris_domeoff),
+        Field('FLAMP1',   default='', lower=True),
+        Field('FLAMP2',   default='', lower=True),
+        Field('DATAFILE'),
+    ],
+    rules=[
+        ('calib',       [(('PCSFX', 'PCSFY', 'PCSFLZ'), 'notany', 0)]),
+        ('dark',        [('FILTER', 'has', 'drk')]),
+        #imager
+        ('flatlamp',    [('INSTR', 'eq', 'imag'), (('FLAMP1', 'FLAMP2'), 'any', 'on')] + OSIRIS_FLATPOS),
+        ('undefined',   [('INSTR', 'eq', 'imag'), (('FLAMP1', 'FLAMP2'), 'any', 'on')]),
+        ('object',      [('INSTR', 'eq', 'imag'), ('DOMESTAT', 'in', OSIRIS_STAT), ('AXESTAT', 'in', OSIRIS_STAT)]),
+        ('flatlampoff', [('INSTR', 'eq', 'imag')] + OSIRIS_FLATPOS),
+        ('object',      [('INSTR', 'eq', 'imag')]),
+        #spectrograph (recmat files are calib)
+        ('calib',       [('INSTR', 'eq', 'spec'), ('DATAFILE', 'has', 'c')]),
+        ('object',      [('INSTR', 'eq', 'spec'), ('DOMESTAT', 'in', OSIRIS_STAT), ('AXESTAT', 'in', OSIRIS_STAT)]),
+    ])
@@ -1,9 +1,29 @@
 from send_email import *
-from common import update_koatpx, get_api_data
+from common import KoaTpxRecord, get_api_data
 from datetime import datetime as dt
 import os
+import re
+import time
 import yaml
 import json
+import threading
+import supervisor
+import run_profile
+import koaxfr_manifest
+
+
+#output subdirs sent as parallel rsync streams (after the top level files)
+XFR_SUBDIRS = ('lev0', 'lev1', 'anc')
+
+#suffixes that rsync -z should not recompress (gzipped FITS, anc tarball, jpgs)
+SKIP_COMPRESS = 'gz/tgz/jpg/jpeg/png'
+
+#rsync --stats lines to total over streams
+RSYNC_STATS = {
+    'files': re.compile(r'^Number of (?:regular )?files transferred: ([\d,]+)'),
+    'bytes': re.compile(r'^Total transferred file size: ([\d,]+)'),
+    'sent' : re.compile(r'^Total bytes sent: ([\d,]+)'),
+}
 
 
 def koaxfr(instrObj, tpx=0):
@@ -13,7 +33,11 @@ def koaxfr(instrObj, tpx=0):
         KOAXFR:server
         KOAXFR:account
         KOAXFR:dir
-    Email is sent to KOAXFR:emailto upon successful completion
+    If KOAXFR:server is empty, KOAXFR:dir is a local directory (ie for tests).
+    Only files that are new or changed since the last successful transfer to the same
+    target are sent, unless KOAXFR:delta is 0 (see koaxfr_manifest.py).
+    IPAC ingest API is called when the transfer is complete.
+    Email is sent to KOAXFR:emailfrom if the ingest API call fails
     Email is sent to KOAXFR:emailerror if an error occurs
     """
 
@@ -32,14 +56,14 @@ def koaxfr(instrObj, tpx=0):
 
     # Read config file
     with open('config.live.ini') as f: config = yaml.safe_load(f)
-    emailFrom = config['KOAXFR']['EMAILFROM']
-    emailTo = config['KOAXFR']['EMAILTO']
-    api     = config['API']['INGESTAPI']
-    url     = f"{api}instrument={instr}&ingestType=lev0&date={utDate.replace('-', '')}"
+    xfr       = config['KOAXFR']
+    emailFrom = xfr['EMAILFROM']
+    emailTo   = xfr['EMAILTO']
+    api       = config['API']['INGESTAPI']
+    url       = f"{api}instrument={instr}&ingestType=lev0&date={utDate.replace('-', '')}"
 
     # If no FITS files then email IPAC verifying (empty) transfer complete
 
-#    count = len([name for name in os.listdir(instrObj.dirs['lev0']) if name.endswith('.fits.gz')])
     count = 0
     for dirpath, dirnames, filenames in os.walk(instrObj.dirs['lev0']):
         for f in filenames:
@@ -48,83 +72,217 @@ def koaxfr(instrObj, tpx=0):
 
     if count == 0:
         log.info('koaxfr.py no FITS files to transfer')
-#        subject = ''.join((utDate.replace('-', ''), ' ', instr))
-#        message = ''.join(('No metadata for ', utDate.replace('-', '')))
-#        log.info('koaxfr.py sending no data email to {}'.format(emailTo))
-#        send_email(emailTo, emailFrom, subject, message)
-        # Send ingestionAPI request - need extra json.loads() for IPAC call
-        url = f"{url}&numFiles=0"
-        log.info('koaxfr.py sending API call to {}'.format(url))
-        data = get_api_data(url)
-        try: # incase None returned
-            data = json.loads(data)
-        except:
-            pass
-        # Success?
-        if not data or data.get('stat').lower() != 'ok':
-            subject = 'IPAC API FAILURE'
-            message = f"IPAC API failure\n\n{url}"
-            send_email(emailFrom, emailFrom, subject, message)
+        notify_ingest(f"{url}&numFiles=0", xfr, log)
         # Update koatpx
         if tpx:
-            update_koatpx(instr, utDate, 'files_arch', '0', log)
-            update_koatpx(instr, utDate, 'sci_files', '0', log)
-            update_koatpx(instr, utDate, 'ondisk_stat', 'N/A', log)
-            update_koatpx(instr, utDate, 'arch_stat', 'N/A', log)
-            update_koatpx(instr, utDate, 'metadata_stat', 'N/A', log)
-            update_koatpx(instr, utDate, 'dvdwrit_stat', 'N/A', log)
-            update_koatpx(instr, utDate, 'dvdsent_stat', 'N/A', log)
-            update_koatpx(instr, utDate, 'dvdstor_stat', 'N/A', log)
-            #update_koatpx(instr, utDate, 'tpx_stat', 'N/A', log)
+            tpxRec = KoaTpxRecord(instr, utDate, log)
+            tpxRec.set('files_arch', '0')
+            tpxRec.set('sci_files', '0')
+            tpxRec.set('ondisk_stat', 'N/A')
+            tpxRec.set('arch_stat', 'N/A')
+            tpxRec.set('metadata_stat', 'N/A')
+            tpxRec.set('dvdwrit_stat', 'N/A')
+            tpxRec.set('dvdsent_stat', 'N/A')
+            tpxRec.set('dvdstor_stat', 'N/A')
+            #tpxRec.set('tpx_stat', 'N/A')
+            tpxRec.flush()
 
         return True
 
-    # Configure the transfer command
+    # Compare against the last transfer to this target
 
-    server = config['KOAXFR']['SERVER']
-    account = config['KOAXFR']['ACCOUNT']
-    toDir = config['KOAXFR']['DIR']
-    toLocation = ''.join((account, '@', server, ':', toDir, '/', instr))
-    log.info('koaxfr.py transferring directory {} to {}'.format(fromDir, toLocation))
-    log.info('koaxfr.py rsync -avz --no-t {} {}'.format(fromDir, toLocation))
+    toLocation, isLocal = get_target(xfr, instr)
+    stageDir = instrObj.dirs['stage']
+    last = koaxfr_manifest.load(stageDir) if int(xfr.get('DELTA', 1)) else None
+    if last and last.get('target') != toLocation: last = None
+    prevFiles = last['files'] if last else {}
+    files = koaxfr_manifest.get_night_manifest(fromDir, instrObj.utDateDir, prevFiles)
+    receipt = {'target': toLocation, 'mode': 'delta' if last else 'full'}
+
+    changed = None
+    if last:
+        changed, removed = koaxfr_manifest.get_changes(files, prevFiles)
+        receipt.update(changed=len(changed), removed=len(removed))
+        log.info(f'koaxfr.py {len(changed)} new or changed files since last transfer to {toLocation}')
+        if removed:
+            log.warning(f'koaxfr.py {len(removed)} files removed since last transfer are not removed from target')
+        if not changed:
+            log.info('koaxfr.py no changes since last transfer, nothing to transfer')
+            receipt.update(mode='noop', status='ok')
+            # Resend ingestionAPI request if it failed after the last transfer
+            ingestOk = last.get('ingest', True)
+            if not ingestOk:
+                log.info('koaxfr.py ingest API call failed after last transfer, resending')
+                ingestOk = notify_ingest(f"{url}&numFiles={count}", xfr, log)
+                receipt['ingest'] = ingestOk
+                if ingestOk: koaxfr_manifest.save(stageDir, toLocation, files, ingestOk)
+            # Update koatpx (the night is already at the target)
+            if tpx:
+                receipt['tpx'] = 'DONE' if ingestOk else 'ERROR'
+                set_tpx_sent(instr, utDate, log, receipt['tpx'])
+            koaxfr_manifest.add_receipt(stageDir, receipt)
+            return True
 
     # Transfer the data
 
-    import subprocess as sp
-    xfrCmd = sp.Popen(["rsync -avz --no-t " + fromDir + ' ' + toLocation],
-                      stdout=sp.PIPE, stderr=sp.PIPE, shell=True)
-    output, error = xfrCmd.communicate()
-    if not error:
-        # Send email verifying transfer complete and update koatpx
-#        log.info('koaxfr.py sending email to {}'.format(emailTo))
-#        subject = ''.join(('lev0 ', utDate.replace('-', ''), ' ', instr))
-#        message = 'lev0 data successfully transferred to koaxfr'
-#        send_email(emailTo, emailFrom, subject, message)
-        # Send ingestionAPI request - need extra json.loads() for IPAC call
-        url = f"{url}&numFiles={count}"
-        log.info('koaxfr.py sending API call to {}'.format(url))
-        data = get_api_data(url)
-        try: # incase None returned
-            data = json.loads(data)
-        except:
-            pass
-        if not data or data.get('stat').lower() != 'ok':
-            subject = 'IPAC API FAILURE'
-            message = f"IPAC API failure\n\n{url}"
-            send_email(emailFrom, emailFrom, subject, message)
+    log.info('koaxfr.py transferring directory {} to {}'.format(fromDir, toLocation))
+    timeout = xfr.get('TIMEOUT')
+    ok, stats = transfer(fromDir, toLocation, isLocal, log, float(timeout) if timeout else None,
+                         files=changed, listDir=stageDir)
+    receipt.update(status='ok' if ok else 'error', files=stats['files'], bytes=stats['bytes'],
+                   sent=stats['sent'], secs=stats['secs'])
+
+    if ok:
+        # Send ingestionAPI request (saved with the manifest so a failed call is resent by the next run)
+        ingestOk = notify_ingest(f"{url}&numFiles={count}", xfr, log)
+        koaxfr_manifest.save(stageDir, toLocation, files, ingestOk)
+        receipt['ingest'] = ingestOk
         # Update koatpx
         if tpx:
-            utcTimestamp = dt.utcnow().strftime("%Y%m%d %H:%M")
-            val = 'ERROR' if not data or data.get('stat').lower() != 'ok' else 'DONE'
-            update_koatpx(instr, utDate, 'dvdsent_stat', val, log)
-            update_koatpx(instr, utDate, 'dvdsent_time', utcTimestamp, log)
+            receipt['tpx'] = 'DONE' if ingestOk else 'ERROR'
+            set_tpx_sent(instr, utDate, log, receipt['tpx'])
+        koaxfr_manifest.add_receipt(stageDir, receipt)
         return True
     else:
+        koaxfr_manifest.add_receipt(stageDir, receipt)
         # Send email notifying of error
-        emailError = config['KOAXFR']['EMAILERROR']
+        emailError = xfr['EMAILERROR']
         log.error('koaxfr.py error transferring directory ({}) to {}'.format(fromDir, toLocation))
         log.error('koaxfr.py sending email to {}'.format(emailError))
-        message = ''.join(('Error transferring directory', fromDir, ' to ', toDir, '\n\n'))
+        message = ''.join(('Error transferring directory', fromDir, ' to ', toLocation, '\n\n'))
         send_email(emailError, emailFrom, 'Error - koaxfr transfer', message)
         return False
 
+
+def set_tpx_sent(instr, utDate, log, stat):
+    '''
+    Sets koatpx dvdsent_stat to stat and dvdsent_time to now.
+    '''
+    utcTimestamp = dt.utcnow().strftime("%Y%m%d %H:%M")
+    tpxRec = KoaTpxRecord(instr, utDate, log)
+    tpxRec.set('dvdsent_stat', stat)
+    tpxRec.set('dvdsent_time', utcTimestamp)
+    tpxRec.flush()
+
+
+def get_target(xfr, instr):
+    '''
+    Returns (rsync destination, isLocal) for KOAXFR config.  Empty SERVER means DIR is local.
+    '''
+    if not xfr.get('SERVER'):
+        return os.path.join(xfr['DIR'], instr), True
+    return ''.join((xfr['ACCOUNT'], '@', xfr['SERVER'], ':', xfr['DIR'], '/', instr)), False
+
+
+def get_rsync_cmds(fromDir, toLocation, isLocal, files=None, listDir=None):
+    '''
+    Returns list of (name, rsync command) for the top level of fromDir and each of its XFR_SUBDIRS.
+    The top level stream must finish first since it creates the destination dir for the others.
+    If files (paths relative to fromDir) is given, each stream sends only its files with
+    --files-from lists written to listDir, and the streams can all run at once.
+    '''
+    fromDir = fromDir.rstrip('/')
+    base = os.path.basename(fromDir)
+    opts = ['-av', '--no-t', '--stats']
+    if not isLocal: opts += ['-z', f'--skip-compress={SKIP_COMPRESS}']
+
+    if files is not None:
+        #list paths include the night dir so it is created on the target
+        lists = {}
+        for path in files:
+            subdir = path.split('/', 1)[0]
+            name = f'koaxfr_{subdir}' if subdir in XFR_SUBDIRS and '/' in path else 'koaxfr'
+            lists.setdefault(name, []).append(f'{base}/{path}')
+        cmds = []
+        for name, paths in lists.items():
+            listFile = os.path.join(listDir, f'{name}.files')
+            with open(listFile, 'w') as f: f.write('\n'.join(paths) + '\n')
+            cmds.append((name, ['rsync'] + opts + [f'--files-from={listFile}', os.path.dirname(fromDir), toLocation]))
+        return cmds
+
+    subdirs = [d for d in XFR_SUBDIRS if os.path.isdir(os.path.join(fromDir, d))]
+    excludes = [f'--exclude=/{base}/{d}' for d in subdirs]
+    cmds = [('koaxfr', ['rsync'] + opts + excludes + [fromDir, toLocation])]
+    for d in subdirs:
+        cmds.append((f'koaxfr_{d}', ['rsync'] + opts + [os.path.join(fromDir, d), f'{toLocation}/{base}']))
+    return cmds
+
+
+class RsyncStats:
+    '''
+    Totals of rsync --stats output, parsed line by line from all streams.
+    '''
+
+    def __init__(self):
+        self.lock  = threading.Lock()
+        self.stats = {key: 0 for key in RSYNC_STATS}
+
+
+    def parse(self, line):
+        line = line.strip()
+        for key, regex in RSYNC_STATS.items():
+            match = regex.match(line)
+            if match:
+                with self.lock:
+                    self.stats[key] += int(match.group(1).replace(',', ''))
+
+
+def transfer(fromDir, toLocation, isLocal, log, timeout=None, files=None, listDir=None):
+    '''
+    Transfers fromDir (or only files in it, see get_rsync_cmds) to toLocation with one rsync stream
+    per subdir.  rsync output is streamed into the log (see supervisor.py).  Returns (ok, stats) where
+    stats has files, bytes, sent and secs.
+    '''
+    if isLocal: os.makedirs(toLocation, exist_ok=True)
+    cmds = get_rsync_cmds(fromDir, toLocation, isLocal, files, listDir)
+    rsyncStats = RsyncStats()
+    start = time.time()
+
+    #top level first (unless sending a file list), then subdirs in parallel
+    first = cmds[:1] if files is None else []
+    ok = all(supervisor.start(name, cmd, log, timeout=timeout, onOutput=rsyncStats.parse).wait()
+             for name, cmd in first)
+    if ok:
+        jobs = [supervisor.start(name, cmd, log, timeout=timeout, onOutput=rsyncStats.parse)
+                for name, cmd in cmds[len(first):]]
+        for job in jobs:
+            if not job.wait(): ok = False
+
+    stats = dict(rsyncStats.stats, streams=len(cmds), secs=round(time.time() - start, 3))
+    mb = stats['bytes'] / 1e6
+    rate = mb / stats['secs'] if stats['secs'] else 0
+    log.info(f"koaxfr.py transferred {stats['files']} files, {mb:.1f} MB in {stats['secs']} secs "
+             f"({rate:.1f} MB/s, {stats['sent'] / 1e6:.1f} MB sent, {len(cmds)} streams)")
+    run_profile.get_profile().add_extra('koaxfr', dict(stats, ok=ok))
+    return ok, stats
+
+
+def send_ingest(url, log, retries=3, timeout=60, waitSecs=30):
+    '''
+    Sends ingest API request, retrying if there is no response.  Returns response data or None.
+    '''
+    for attempt in range(1, retries+1):
+        log.info('koaxfr.py sending API call to {}'.format(url))
+        data = get_api_data(url, timeout=timeout)
+        try: # need extra json.loads() for IPAC call
+            data = json.loads(data)
+        except:
+            pass
+        if data: return data
+        log.warning(f'koaxfr.py no response from ingest API (attempt {attempt} of {retries})')
+        if attempt < retries: time.sleep(waitSecs * 2**(attempt-1))
+    return None
+
+
+def notify_ingest(url, xfr, log):
+    '''
+    Sends ingest API request.  Emails KOAXFR:emailfrom if it fails.  Returns True if IPAC returned ok.
+    '''
+    data = send_ingest(url, log, int(xfr.get('API_RETRIES', 3)), float(xfr.get('API_TIMEOUT', 60)),
+                       float(xfr.get('API_RETRY_SECS', 30)))
+    if isinstance(data, dict) and str(data.get('stat')).lower() == 'ok':
+        return True
+    subject = 'IPAC API FAILURE'
+    message = f"IPAC API failure\n\n{url}"
+    send_email(xfr['EMAILFROM'], xfr['EMAILFROM'], subject, message)
+    return False
@@ -0,0 +1,129 @@
+'''
+Manifests of a night's output dir for delta transfers (see koaxfr.py).
+
+A manifest maps each file path (relative to the output dir) to its md5, size and mtime.  lev0 FITS
+and JPEG md5s are read from the md5sum tables written by DQA.  FITS md5s are of the uncompressed file,
+so a lev0 file that was re-gzipped but is otherwise unchanged is not resent.  Other files are hashed,
+reusing the previous manifest's md5 when size and mtime are unchanged.
+
+After each successful transfer the manifest is saved to <stage>/koaxfr.manifest along with the
+target and whether the IPAC ingest call succeeded, and every transfer appends a receipt to <stage>/koaxfr.receipts (JSON lines):
+
+    {"time": ..., "target": "koa@server:/koadata/HIRES", "mode": "delta", "status": "ok",
+     "changed": 12, "removed": 0, "files": 12, "bytes": 48211, "sent": 50112, "secs": 2.1, "ingest": true}
+
+The next transfer to the same target only ships new or changed files.  If nothing changed the receipt
+has mode "noop" (the ingest call is resent if it failed after the last transfer); when koatpx is updated, the dvdsent_stat that was set is recorded as "tpx".
+'''
+
+import os
+import json
+import time
+from lev0_manifest import get_md5
+
+
+MANIFEST_FILE = 'koaxfr.manifest'
+RECEIPTS_FILE = 'koaxfr.receipts'
+
+
+def read_md5_table(filepath):
+    '''
+    Returns dict of path to md5 from a "md5  path" table (see common.make_dir_md5_table).
+    '''
+    md5s = {}
+    if not os.path.isfile(filepath): return md5s
+    with open(filepath) as f:
+        for line in f:
+            parts = line.rstrip('\n').split('  ', 1)
+            if len(parts) == 2: md5s[parts[1]] = parts[0]
+    return md5s
+
+
+def get_table_md5s(outputDir, utDateDir):
+    '''
+    Returns dict of output dir path to md5 from the lev0 FITS and JPEG md5sum tables.
+    FITS md5s are also used for the gzipped file.
+    '''
+    lev0Dir = os.path.join(outputDir, 'lev0')
+    md5s = {}
+    for table in ('FITS', 'JPEG'):
+        filepath = os.path.join(lev0Dir, f'{utDateDir}.{table}.md5sum.table')
+        for name, md5 in read_md5_table(filepath).items():
+            md5s['lev0/' + name] = md5
+            if name.endswith('.fits'): md5s['lev0/' + name + '.gz'] = md5
+    return md5s
+
+
+def get_night_manifest(outputDir, utDateDir, prev=None):
+    '''
+    Returns manifest (dict of path to md5, size and mtime) of all files in outputDir.  Files not in
+    the md5sum tables are hashed unless their size and mtime match the prev manifest.
+    '''
+    prev = prev or {}
+    tableMd5s = get_table_md5s(outputDir, utDateDir)
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(outputDir):
+        for f in filenames:
+            filepath = os.path.join(dirpath, f)
+            path = os.path.relpath(filepath, outputDir)
+            st = os.stat(filepath)
+            rec = {'size': st.st_size, 'mtime': st.st_mtime_ns}
+            old = prev.get(path)
+            if path in tableMd5s:
+                rec['md5'] = tableMd5s[path]
+            elif old and old['size'] == rec['size'] and old['mtime'] == rec['mtime']:
+                rec['md5'] = old['md5']
+            else:
+                rec['md5'] = get_md5(filepath)
+            files[path] = rec
+    return files
+
+
+def get_changes(files, prev):
+    '''
+    Returns (sorted new or changed paths, sorted removed paths) of manifest files vs prev.
+    '''
+    changed = [path for path, rec in files.items() if path not in prev or prev[path]['md5'] != rec['md5']]
+    removed = [path for path in prev if path not in files]
+    return sorted(changed), sorted(removed)
+
+
+def load(stageDir):
+    '''
+    Returns last transferred manifest record ({'time', 'target', 'ingest', 'files'}) or None.
+    '''
+    filepath = os.path.join(stageDir, MANIFEST_FILE)
+    if not os.path.isfile(filepath): return None
+    try:
+        with open(filepath) as f: return json.load(f)
+    except ValueError:
+        return None
+
+
+def save(stageDir, target, files, ingest=True):
+    '''
+    Saves manifest of a successful transfer (written to a temp file and renamed into place).
+    ingest is whether the IPAC ingest API call for it succeeded.
+    '''
+    filepath = os.path.join(stageDir, MANIFEST_FILE)
+    tmpFile = f'{filepath}.{os.getpid()}.tmp'
+    with open(tmpFile, 'w') as f:
+        json.dump({'time': round(time.time(), 3), 'target': target, 'ingest': ingest, 'files': files}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmpFile, filepath)
+
+
+def add_receipt(stageDir, rec):
+    '''
+    Appends transfer receipt to the receipts file.  Returns record.
+    '''
+    rec = dict(rec, time=round(time.time(), 3))
+    line = (json.dumps(rec) + '\n').encode()
+    fd = os.open(os.path.join(stageDir, RECEIPTS_FILE), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    return rec
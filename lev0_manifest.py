@@ -0,0 +1,169 @@
+'''
+Append-only manifest of lev0 files completed by DQA.
+
+DQA publishes one JSON record per line to <lev0>/lev0.manifest as each lev0 file is written,
+and an explicit end record when the night is done (status 'ok', or 'error' if DQA failed), so
+consumers like PSFR can tail the manifest instead of scanning the lev0 dir for new files and
+polling for dqa.LOC:
+
+    {"event": "start", "seq": 0, "time": ..., "pid": ...}
+    {"event": "file", "seq": 1, "koaid": "NC.20200101.12345.fits", "path": "scam/NC...fits",
+     "size": 2108160, "md5": "...", "time": ...}
+    {"event": "end", "seq": 2, "status": "ok", "count": 1, "time": ...}
+
+Each record is written with a single O_APPEND write and fsync'd, so readers never see a partial
+record except possibly the last line while it is being written (readers only consume complete
+lines).  The manifest is resumable: a resumed DQA run reloads the existing records, starts a new
+segment with a start record, and skips files already published with the same md5.  Consumers see
+a start record after an end record as the night being reopened.
+
+Usage (consumer):
+    reader = lev0_manifest.ManifestReader(lev0Dir)
+    for rec in reader.follow(pollSecs=5, timeout=3600):
+        process(rec['path'])
+'''
+
+import os
+import json
+import time
+import hashlib
+
+
+MANIFEST_FILE = 'lev0.manifest'
+
+
+def get_manifest_file(lev0Dir):
+    return os.path.join(lev0Dir, MANIFEST_FILE)
+
+
+def get_md5(filepath, blockSize=1<<20):
+    md5 = hashlib.md5()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(blockSize), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def read_records(filepath, offset=0):
+    '''
+    Returns list of complete records after byte offset, and new offset.
+    '''
+    records = []
+    if not os.path.isfile(filepath): return records, offset
+    with open(filepath, 'rb') as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b'\n'): break
+            offset += len(line)
+            line = line.strip()
+            if line: records.append(json.loads(line))
+    return records, offset
+
+
+class Lev0Manifest:
+
+    def __init__(self, lev0Dir, log=None):
+        self.lev0Dir  = lev0Dir
+        self.filepath = get_manifest_file(lev0Dir)
+        self.log      = log
+        self.files    = {}
+        self.seq      = -1
+        self.ended    = False
+
+        #resume from existing manifest
+        records, offset = read_records(self.filepath)
+        for rec in records:
+            self.seq = max(self.seq, rec.get('seq', -1))
+            if rec['event'] == 'file': self.files[rec['koaid']] = rec
+        self.truncate_partial(offset)
+        if records and self.log:
+            self.log.info(f'lev0_manifest: resuming {self.filepath} with {len(self.files)} files')
+        self.write({'event': 'start', 'pid': os.getpid()})
+
+
+    def truncate_partial(self, offset):
+        '''
+        Drops partial last line left by a crashed writer.
+        '''
+        if os.path.isfile(self.filepath) and os.path.getsize(self.filepath) > offset:
+            if self.log: self.log.warning(f'lev0_manifest: dropping partial record in {self.filepath}')
+            os.truncate(self.filepath, offset)
+
+
+    def write(self, rec):
+        self.seq += 1
+        rec = dict(rec, seq=self.seq, time=round(time.time(), 3))
+        line = (json.dumps(rec) + '\n').encode()
+        fd = os.open(self.filepath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        return rec
+
+
+    def add(self, koaid, path):
+        '''
+        Publishes completed lev0 file (path relative to lev0 dir).  Returns record.
+        '''
+        filepath = os.path.join(self.lev0Dir, path)
+        md5 = get_md5(filepath)
+        prev = self.files.get(koaid)
+        if prev and prev['md5'] == md5 and prev['path'] == path:
+            return prev
+        rec = self.write({'event': 'file', 'koaid': koaid, 'path': path,
+                          'size': os.path.getsize(filepath), 'md5': md5})
+        self.files[koaid] = rec
+        return rec
+
+
+    def end(self, status='ok'):
+        '''
+        Writes end-of-night marker.
+        '''
+        if self.ended: return
+        self.write({'event': 'end', 'status': status, 'count': len(self.files)})
+        self.ended = True
+        if self.log: self.log.info(f'lev0_manifest: {self.filepath} ended ({status}, {len(self.files)} files)')
+
+
+class ManifestReader:
+    '''
+    Tails the manifest.  Pass offset to resume from a previous reader position.
+    '''
+
+    def __init__(self, lev0Dir, offset=0):
+        self.filepath = get_manifest_file(lev0Dir)
+        self.offset   = offset
+        self.status   = None
+
+
+    def read_new(self):
+        '''
+        Returns new file records since last call.  Sets status when end record is seen.
+        '''
+        records, self.offset = read_records(self.filepath, self.offset)
+        files = []
+        for rec in records:
+            if   rec['event'] == 'file' : files.append(rec)
+            elif rec['event'] == 'end'  : self.status = rec['status']
+            elif rec['event'] == 'start': self.status = None
+        return files
+
+
+    def follow(self, pollSecs=5, timeout=None):
+        '''
+        Yields file records until end record is seen.  Raises TimeoutError if there is no new record
+        for timeout secs.
+        '''
+        last = time.time()
+        while True:
+            offset = self.offset
+            for rec in self.read_new():
+                yield rec
+            if self.offset != offset: last = time.time()
+            if self.status is not None: return
+            if timeout is not None and time.time() - last > timeout:
+                raise TimeoutError(f'no new records in {self.filepath} for {timeout} secs')
+            time.sleep(pollSecs)
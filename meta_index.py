@@ -0,0 +1,284 @@
+'''
+Archive-wide metadata index.
+
+Each night's lev0 metadata.table is ingested into a local sqlite file so metadata can be queried
+across nights without re-reading fixed-width tables.  Rows are indexed by instrument, UT date,
+KOAID and semid, and every keyword value is stored with an index on (keyword, numeric value) and
+(keyword, string value) so keyword conditions like NPIXSAT > 1000 are index lookups.
+
+Ingest is incremental: a night is skipped if its table file is unchanged since the last ingest and
+replaced otherwise.  dep_dqa ingests each night if MISC META_INDEX_DB is set.
+
+Usage:
+    python meta_index.py ingest [dbFile] [metadata.table files or dirs to search]
+    python meta_index.py query [dbFile] --instr=HIRES --from=2019-01-01 --to=2019-12-31 --where="NPIXSAT>1000" --keywords=OBJECT,NPIXSAT
+'''
+import os
+import re
+import sys
+import sqlite3
+import argparse
+import threading
+from pathlib import Path
+import metadata
+
+
+SCHEMA = [
+    '''create table if not exists nights (
+        id integer primary key, instr text not null, utdate text not null,
+        path text, mtime real, nrows integer, unique (instr, utdate))''',
+    '''create table if not exists files (
+        koaid text primary key, night_id integer not null, instr text not null, utdate text not null, semid text)''',
+    '''create table if not exists vals (
+        koaid text not null, keyword text not null, num real, str text, primary key (koaid, keyword))''',
+    'create index if not exists files_instr_utdate on files (instr, utdate)',
+    'create index if not exists files_semid on files (semid)',
+    'create index if not exists files_night on files (night_id)',
+    'create index if not exists vals_keyword_num on vals (keyword, num)',
+    'create index if not exists vals_keyword_str on vals (keyword, str)',
+]
+
+#KOAID prefix to instrument
+INSTR_PREFIXES = {
+    'DE': 'DEIMOS', 'DF': 'DEIMOS', 'ES': 'ESI', 'HI': 'HIRES', 'KB': 'KCWI', 'KR': 'KCWI', 'KF': 'KCWI',
+    'LB': 'LRIS', 'LR': 'LRIS', 'MF': 'MOSFIRE', 'N2': 'NIRC2', 'NI': 'NIRES', 'NR': 'NIRES',
+    'NC': 'NIRSPEC', 'NS': 'NIRSPEC', 'OI': 'OSIRIS', 'OS': 'OSIRIS',
+}
+
+#allowed keyword condition operators
+OPS = ('<=', '>=', '!=', '=', '<', '>', ' like ')
+
+#allowed keyword names
+KEYWORD_RE = re.compile(r'[\w\-]+')
+
+
+class MetaIndex:
+
+    def __init__(self, dbFile):
+        self.dbFile = dbFile
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(dbFile, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        for query in SCHEMA: self.conn.execute(query)
+        self.conn.commit()
+
+
+    def close(self):
+        self.conn.close()
+
+
+    def ingest(self, metaFile, instr=None, utDate=None, force=False, log=None):
+        '''
+        Adds or replaces one night's metadata.table.  Instr and utDate default to the first KOAID.
+        Returns number of rows ingested (0 if unchanged).
+        '''
+        mtime = os.path.getmtime(metaFile)
+        df = None
+        if not instr or not utDate:
+            df = metadata.load_metadata_file_as_df(metaFile)
+            instr, utDate = get_instr_utdate(df, instr, utDate)
+
+        with self.lock:
+            row = self.conn.execute('select id, path, mtime from nights where instr=? and utdate=?',
+                                    (instr, utDate)).fetchone()
+            if row and not force and row['path'] == os.path.abspath(metaFile) and row['mtime'] == mtime:
+                return 0
+
+        if df is None: df = metadata.load_metadata_file_as_df(metaFile)
+        if df is False or df is None or 'KOAID' not in df.columns:
+            if log: log.warning(f'meta_index: no KOAID rows in {metaFile}')
+            return 0
+
+        files = []
+        vals = []
+        cols = [c for c in df.columns if c != 'KOAID']
+        for rec in df.to_dict('records'):
+            koaid = str(rec['KOAID']).strip()
+            semid = rec.get('SEMID')
+            files.append((koaid, instr, utDate, None if is_null(semid) else str(semid).strip()))
+            for col in cols:
+                val = rec[col]
+                if is_null(val): continue
+                vals.append((koaid, col, get_num(val), str(val).strip()))
+
+        with self.lock, self.conn:
+            if row:
+                self.conn.execute('delete from vals where koaid in (select koaid from files where night_id=?)', (row['id'],))
+                self.conn.execute('delete from files where night_id=?', (row['id'],))
+                self.conn.execute('delete from nights where id=?', (row['id'],))
+            cur = self.conn.execute('insert into nights (instr, utdate, path, mtime, nrows) values (?, ?, ?, ?, ?)',
+                                    (instr, utDate, os.path.abspath(metaFile), mtime, len(files)))
+            nightId = cur.lastrowid
+            self.conn.executemany('insert or replace into files (koaid, night_id, instr, utdate, semid) values (?, ?, ?, ?, ?)',
+                                  [(f[0], nightId, f[1], f[2], f[3]) for f in files])
+            self.conn.executemany('insert or replace into vals (koaid, keyword, num, str) values (?, ?, ?, ?)', vals)
+
+        if log: log.info(f'meta_index: ingested {len(files)} rows for {instr} {utDate} into {self.dbFile}')
+        return len(files)
+
+
+    def query(self, instr=None, utDateFrom=None, utDateTo=None, semid=None, where=[], keywords=[]):
+        '''
+        Returns list of dicts (koaid, instr, utdate, semid plus requested keywords) for files matching
+        all filters.  Where is a list of (keyword, op, value) or "KEYWORD>value" strings.
+        '''
+        query = 'select f.koaid, f.instr, f.utdate, f.semid'
+        joins = []
+        conds = []
+        params = []
+        condParams = []
+
+        for i, kw in enumerate(keywords):
+            check_keyword(kw)
+            query += f', k{i}.str as "{kw}"'
+            joins.append(f'left join vals k{i} on k{i}.koaid=f.koaid and k{i}.keyword=?')
+            params.append(kw)
+
+        for i, cond in enumerate(where):
+            keyword, op, value = parse_condition(cond) if isinstance(cond, str) else cond
+            check_keyword(keyword)
+            op = check_op(op)
+            col = 'num' if op != 'like' and get_num(value) is not None else 'str'
+            joins.append(f'join vals w{i} on w{i}.koaid=f.koaid and w{i}.keyword=?')
+            params.append(keyword)
+            conds.append(f'w{i}.{col} {op} ?')
+            condParams.append(get_num(value) if col == 'num' else value)
+
+        if instr     : conds.append('f.instr=?')  ; condParams.append(instr.upper())
+        if utDateFrom: conds.append('f.utdate>=?'); condParams.append(utDateFrom)
+        if utDateTo  : conds.append('f.utdate<=?'); condParams.append(utDateTo)
+        if semid     : conds.append('f.semid=?')  ; condParams.append(semid)
+
+        #join params come before all where params in the query
+        params += condParams
+
+        query += ' from files f ' + ' '.join(joins)
+        if conds: query += ' where ' + ' and '.join(conds)
+        query += ' order by f.utdate, f.koaid'
+        with self.lock:
+            return [dict(r) for r in self.conn.execute(query, params).fetchall()]
+
+
+    def get_night_df(self, instr, utDate, keywords=None):
+        '''
+        Returns one night's metadata as a dataframe (KOAID index, one column per keyword) for
+        vectorized cross-night compares.
+        '''
+        import pandas as pd
+        query = ('select v.koaid, v.keyword, v.num, v.str from vals v join files f on f.koaid=v.koaid '
+                 'where f.instr=? and f.utdate=?')
+        params = [instr.upper(), utDate]
+        if keywords:
+            query += ' and v.keyword in (' + ','.join('?' * len(keywords)) + ')'
+            params += list(keywords)
+        with self.lock:
+            rows = self.conn.execute(query, params).fetchall()
+        df = pd.DataFrame([(r['koaid'], r['keyword'], r['num'] if r['num'] is not None else r['str']) for r in rows],
+                          columns=['KOAID', 'keyword', 'val'])
+        return df.pivot(index='KOAID', columns='keyword', values='val')
+
+
+    def get_nights(self, instr=None):
+        query = 'select instr, utdate, path, nrows from nights'
+        params = []
+        if instr:
+            query += ' where instr=?'
+            params.append(instr.upper())
+        with self.lock:
+            return [dict(r) for r in self.conn.execute(query + ' order by instr, utdate', params).fetchall()]
+
+
+def get_instr_utdate(df, instr=None, utDate=None):
+    '''
+    Gets instrument and UT date from first KOAID (ie HI.20200101.12345.fits).
+    '''
+    koaid = str(df['KOAID'].iloc[0]).strip()
+    prefix, ymd = koaid.split('.')[0:2]
+    if not utDate: utDate = f'{ymd[0:4]}-{ymd[4:6]}-{ymd[6:8]}'
+    if not instr: instr = INSTR_PREFIXES[prefix]
+    return instr.upper(), utDate
+
+
+def parse_condition(cond):
+    '''
+    Parses "KEYWORD<op>value" string into (keyword, op, value).
+    '''
+    for op in OPS:
+        if op in cond:
+            keyword, value = cond.split(op, 1)
+            return keyword.strip(), op, value.strip()
+    raise ValueError(f'meta_index: bad condition "{cond}"')
+
+
+def check_keyword(keyword):
+    '''
+    Raises ValueError if keyword is not a valid keyword name.
+    '''
+    if not isinstance(keyword, str) or not KEYWORD_RE.fullmatch(keyword):
+        raise ValueError(f'meta_index: bad keyword "{keyword}"')
+
+
+def check_op(op):
+    '''
+    Returns condition operator as used in SQL (ie ' LIKE ' -> 'like').  Raises ValueError if not in OPS.
+    '''
+    sqlOp = op.strip().lower() if isinstance(op, str) else None
+    if sqlOp not in [o.strip() for o in OPS]:
+        raise ValueError(f'meta_index: bad condition operator "{op}"')
+    return sqlOp
+
+
+def is_null(val):
+    if val is None: return True
+    if isinstance(val, float) and val != val: return True
+    return isinstance(val, str) and val.strip() in ('', 'null')
+
+
+def get_num(val):
+    if isinstance(val, bool): return None
+    try:
+        num = float(val)
+        return None if num != num else num
+    except (TypeError, ValueError):
+        return None
+
+
+def find_metadata_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path): files += [str(p) for p in Path(path).rglob('*.metadata.table')]
+        else                  : files.append(path)
+    return sorted(files)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Archive-wide metadata index.')
+    parser.add_argument('cmd'       , type=str, choices=['ingest', 'query'])
+    parser.add_argument('dbFile'    , type=str)
+    parser.add_argument('paths'     , type=str, nargs='*', help='(ingest) metadata.table files or dirs to search')
+    parser.add_argument('--force'   , action='store_true', help='(ingest) re-ingest unchanged nights')
+    parser.add_argument('--instr'   , type=str, default=None)
+    parser.add_argument('--from'    , type=str, default=None, dest='utDateFrom')
+    parser.add_argument('--to'      , type=str, default=None, dest='utDateTo')
+    parser.add_argument('--semid'   , type=str, default=None)
+    parser.add_argument('--where'   , type=str, default=[], action='append', help='ie "NPIXSAT>1000" (repeatable)')
+    parser.add_argument('--keywords', type=str, default='', help='comma list of keywords to output')
+    args = parser.parse_args()
+
+    index = MetaIndex(args.dbFile)
+    if args.cmd == 'ingest':
+        for metaFile in find_metadata_files(args.paths):
+            num = index.ingest(metaFile, force=args.force)
+            print(f'{metaFile}: {num} rows' if num else f'{metaFile}: unchanged')
+    else:
+        keywords = [k.strip() for k in args.keywords.split(',') if k.strip()]
+        rows = index.query(args.instr, args.utDateFrom, args.utDateTo, args.semid, args.where, keywords)
+        cols = ['koaid', 'instr', 'utdate', 'semid'] + keywords
+        print('\t'.join(cols))
+        for r in rows: print('\t'.join(str(r[c]) for c in cols))
+        print(f'{len(rows)} rows', file=sys.stderr)
+    index.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -23,13 +23,20 @@ import hashlib
 import json
 import logging
 from pathlib import Path
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
 
 log = logging.getLogger("koa_dep")
 
 def make_metadata(keywordsDefFile, metaOutFile, searchdir=None, filepath=None, 
-                  extraMeta=dict(), dev=False, keyskips=[], create_md5=False):
+                  extraMeta=dict(), dev=False, keyskips=[], create_md5=False, columnar=False):
     """
     Creates the archiving metadata file as part of the DQA process.
+    If columnar, also writes the same validated values as a typed Parquet sidecar
+    (see get_columnar_file).
 
     @param keywordsDefFile: keywords format definition input file path
     @type keywordsDefFile: string
@@ -39,6 +46,8 @@ def make_metadata(keywordsDefFile, metaOutFile, searchdir=None, filepath=None,
     @type searchdir: string
     @param extraMeta: dictionary of any extra key val pairs not in header
     @type extraMeta: dictionary
+    @param columnar: also write Parquet sidecar (requires pyarrow)
+    @type columnar: bool
     """
 
     #open keywords format file and read data
@@ -69,13 +78,14 @@ def make_metadata(keywordsDefFile, metaOutFile, searchdir=None, filepath=None,
         fitsFiles.append(filepath)
     if len(fitsFiles) == 0:
         log.info(f'No fits file(s) found')
+    rows = [] if columnar else None
     for fitsFile in sorted(fitsFiles):
         extra = {}
         baseName = os.path.basename(fitsFile)
         if baseName in extraMeta:
             extra = extraMeta[baseName]
         log.info("Creating metadata record for: " + fitsFile)
-        warns = add_fits_metadata_line(fitsFile, metaOutFile, keyDefs, extra, warns, dev, keyskips)
+        warns = add_fits_metadata_line(fitsFile, metaOutFile, keyDefs, extra, warns, dev, keyskips, rows)
 
     #warn only if counts
     for warn, numWarns in warns.items():
@@ -88,6 +98,10 @@ def make_metadata(keywordsDefFile, metaOutFile, searchdir=None, filepath=None,
     if create_md5: 
         create_md5_checksum_file(metaOutFile)
 
+    #columnar sidecar option
+    if columnar:
+        create_columnar_file(metaOutFile, keyDefs, rows)
+
     return True
 
 def format_keyDefs(keyDefs):
@@ -114,6 +128,54 @@ def create_md5_checksum_file(metaOutFile):
         fp.flush()
 
 
+def get_columnar_file(metaOutFile):
+    '''Parquet sidecar path for a metadata.table file.'''
+    return re.sub(r'\.table$', '', metaOutFile) + '.parquet'
+
+
+def create_columnar_file(metaOutFile, keyDefs, rows):
+    '''
+    Writes metadata rows to a Parquet file with one typed column per keyword
+    (integer -> int64, double -> float64, others -> string; null values are null).
+    The file is only a cache of metadata.table, so errors are logged and any partial file
+    is removed (readers then fall back to the table).
+    '''
+    if pa is None:
+        log.warning('metadata.py: pyarrow not installed, skipping columnar metadata file')
+        return False
+
+    outFile = get_columnar_file(metaOutFile)
+    log.info('metadata.py writing columnar metadata file: {}'.format(outFile))
+    try:
+        types = {'integer': pa.int64(), 'double': pa.float64()}
+        fields = []
+        columns = []
+        for index, row in keyDefs.iterrows():
+            keyword  = row['keyword']
+            dataType = row['metaDataType']
+            fields.append(pa.field(keyword, types.get(dataType, pa.string())))
+            columns.append([get_columnar_value(r.get(keyword), dataType) for r in rows])
+        schema = pa.schema(fields)
+        pq.write_table(pa.Table.from_arrays(columns, schema=schema), outFile)
+    except Exception as e:
+        log.warning(f'metadata.py: could not write columnar metadata file {outFile}: {str(e)}')
+        if os.path.isfile(outFile): os.remove(outFile)
+        return False
+    return True
+
+
+def get_columnar_value(val, dataType):
+    '''Converts metadata table value to columnar type (None for null or bad values).'''
+    if val is None or (isinstance(val, str) and val in ('null', '')):
+        return None
+    try:
+        if   dataType == 'integer': return int(val)
+        elif dataType == 'double':  return None if is_none(float(val)) else float(val)
+    except (TypeError, ValueError):
+        return None
+    return str(val)
+
+
 def create_metadata_file(filename, keyDefs):
     #add header to output file
     with open(filename, 'w+') as out:
@@ -140,9 +202,10 @@ def create_metadata_file(filename, keyDefs):
         out.flush()
 
 
-def add_fits_metadata_line(fitsFile, metaOutFile, keyDefs, extra, warns, dev, keyskips):
+def add_fits_metadata_line(fitsFile, metaOutFile, keyDefs, extra, warns, dev, keyskips, rows=None):
     """
     Adds a line to metadata file for one FITS file.
+    If rows list is given, the validated values are also appended to it as a dict.
     """
 
     #get header object using astropy
@@ -150,6 +213,7 @@ def add_fits_metadata_line(fitsFile, metaOutFile, keyDefs, extra, warns, dev, ke
     #check keywords
     check_keyword_existance(header, keyDefs, dev, keyskips, extra)
     #write all keywords vals for image to a line
+    vals = {}
     with open(metaOutFile, 'a') as out:
 
         for index, row in keyDefs.iterrows():
@@ -193,7 +257,9 @@ def add_fits_metadata_line(fitsFile, metaOutFile, keyDefs, extra, warns, dev, ke
             out.write(' ')
             out.write(str(val).ljust(colSize))
             out.flush()
+            vals[keyword] = val
         out.write("\n")
+    if rows is not None: rows.append(vals)
     return warns
 
 
@@ -494,9 +560,19 @@ def val_smart_diff(val0, val1, col=None):
     return isDiff
 
 def load_metadata_file_as_df(filepath):
+    '''
+    Loads metadata.table file as a dataframe.  Uses the typed Parquet sidecar if it exists
+    and is not older than the table.
+    '''
 
     if not os.path.isfile(filepath): return False
 
+    colFile = get_columnar_file(filepath)
+    if pa is not None and os.path.isfile(colFile) and os.path.getmtime(colFile) >= os.path.getmtime(filepath):
+        data = pd.read_parquet(colFile)
+        data.name = os.path.basename(filepath)
+        return data
+
     with open(filepath, 'r', errors='replace') as f:
 
         # Read first line of header and find all column widths using '|' split
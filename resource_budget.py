@@ -0,0 +1,56 @@
+'''
+Cross-process concurrency budget for shared resources (db, api, io).
+
+When several DEP runs execute at once (see dep_go_reprocess.py), each resource type can be limited
+to N concurrent users across all processes.  Limits are read from the environment:
+
+    DEP_BUDGET_DIR   directory for slot lock files
+    DEP_BUDGET_DB    max concurrent database queries
+    DEP_BUDGET_API   max concurrent API/HTTP requests
+    DEP_BUDGET_IO    max concurrent I/O heavy steps (locate, tar, koaxfr)
+
+If DEP_BUDGET_DIR or the resource limit is not set, slot() does nothing.
+'''
+
+import os
+import time
+import fcntl
+from contextlib import contextmanager
+
+
+def get_limit(name):
+    try:
+        return int(os.environ.get(f'DEP_BUDGET_{name.upper()}', 0))
+    except ValueError:
+        return 0
+
+
+@contextmanager
+def slot(name, wait=0.05):
+    '''
+    Holds one of the N slots for resource name for the duration of the with block.
+    '''
+    limit = get_limit(name)
+    budgetDir = os.environ.get('DEP_BUDGET_DIR')
+    if limit <= 0 or not budgetDir:
+        yield
+        return
+
+    #try each slot lock file until we get one
+    f = None
+    while f is None:
+        for i in range(limit):
+            lockFile = open(os.path.join(budgetDir, f'{name.lower()}.{i}.lock'), 'a')
+            try:
+                fcntl.flock(lockFile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                f = lockFile
+                break
+            except OSError:
+                lockFile.close()
+        if f is None: time.sleep(wait)
+
+    try:
+        yield
+    finally:
+        fcntl.flock(f, fcntl.LOCK_UN)
+        f.close()
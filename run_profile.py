@@ -0,0 +1,220 @@
+'''
+Timing and resource instrumentation for a DEP run.
+
+Records per step: wall time, CPU time, peak RSS and bytes read/written, plus per-file DQA timings,
+counts of DB queries, API requests and HTTP requests, and external job (DRP/PSFR) results.  Dep writes the profile as JSON next to
+the log file and includes a summary table in the process report email.
+
+NOTE: Peak RSS and bytes read/written are process-wide (from getrusage and /proc/self/io), so
+values for steps that overlap in time include each other's usage.
+'''
+
+import json
+import time
+import resource
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+
+class RunProfile:
+
+    def __init__(self):
+        self.lock    = threading.Lock()
+        self.start   = time.time()
+        self.steps   = {}
+        self.counts  = {}
+        self.files   = {}
+        self.extra   = {}
+        self.jobs    = {}
+        self.local   = threading.local()
+
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+
+    @contextmanager
+    def step(self, name):
+        '''
+        Records wall, CPU, peak RSS and I/O for the with block as step name.
+        '''
+        io1 = get_proc_io()
+        wall1 = time.time()
+        cpu1 = time.thread_time()
+        try:
+            yield
+        finally:
+            io2 = get_proc_io()
+            rec = {
+                'start'        : datetime.fromtimestamp(wall1).strftime('%Y-%m-%d %H:%M:%S'),
+                'wall'         : round(time.time() - wall1, 3),
+                'cpu'          : round(time.thread_time() - cpu1, 3),
+                'peak_rss_mb'  : round(get_peak_rss_mb(), 1),
+                'bytes_read'   : io2.get('rchar', 0) - io1.get('rchar', 0),
+                'bytes_written': io2.get('wchar', 0) - io1.get('wchar', 0),
+            }
+            with self.lock:
+                self.steps[name] = rec
+
+
+    def add_job(self, name, rec):
+        '''
+        Records external job result (see supervisor.py).
+        '''
+        with self.lock:
+            self.jobs[name] = rec
+
+
+    def add_extra(self, name, rec):
+        '''
+        Records other step results (ie koaxfr transfer stats).
+        '''
+        with self.lock:
+            self.extra[name] = rec
+
+
+    def start_file(self, name):
+        '''
+        Sets current file for per-file timings (per thread).
+        '''
+        self.local.file = name
+        with self.lock:
+            self.files.setdefault(name, {})
+
+
+    @contextmanager
+    def timer(self, substep):
+        '''
+        Adds duration of the with block to current file's substep time.
+        '''
+        t1 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(substep, time.perf_counter() - t1)
+
+
+    def add_time(self, substep, secs):
+        name = getattr(self.local, 'file', None)
+        if name is None: return
+        with self.lock:
+            times = self.files.setdefault(name, {})
+            times[substep] = times.get(substep, 0) + secs
+
+
+    def get_file_summary(self):
+        '''
+        Returns per substep count, total, mean, p50, p95 and max seconds across files.
+        '''
+        bySub = {}
+        for times in self.files.values():
+            for sub, secs in times.items():
+                bySub.setdefault(sub, []).append(secs)
+        summary = {}
+        for sub, vals in bySub.items():
+            vals = sorted(vals)
+            summary[sub] = {
+                'count': len(vals),
+                'total': round(sum(vals), 4),
+                'mean' : round(sum(vals) / len(vals), 4),
+                'p50'  : round(percentile(vals, 50), 4),
+                'p95'  : round(percentile(vals, 95), 4),
+                'max'  : round(vals[-1], 4),
+            }
+        return summary
+
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'start'       : datetime.fromtimestamp(self.start).strftime('%Y-%m-%d %H:%M:%S'),
+                'wall'        : round(time.time() - self.start, 3),
+                'cpu'         : round(time.process_time(), 3),
+                'peak_rss_mb' : round(get_peak_rss_mb(), 1),
+                'steps'       : dict(self.steps),
+                'counts'      : dict(self.counts),
+                'jobs'        : dict(self.jobs),
+                'dqa_summary' : self.get_file_summary(),
+                'dqa_files'   : {k: {s: round(v, 4) for s, v in t.items()} for k, t in self.files.items()},
+                'extra'       : dict(self.extra),
+            }
+
+
+    def write(self, outfile):
+        with open(outfile, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+    def get_summary_table(self):
+        '''
+        Returns text table of step timings, call counts and DQA substep timings for reports.
+        '''
+        d = self.to_dict()
+        lines = []
+        lines.append(f"{'STEP':<8} {'WALL(s)':>9} {'CPU(s)':>9} {'RSS(MB)':>9} {'READ(MB)':>9} {'WRITE(MB)':>9}")
+        for step, r in d['steps'].items():
+            lines.append(f"{step:<8} {r['wall']:>9.1f} {r['cpu']:>9.1f} {r['peak_rss_mb']:>9.1f} "
+                         f"{r['bytes_read']/1e6:>9.1f} {r['bytes_written']/1e6:>9.1f}")
+        lines.append(f"{'TOTAL':<8} {d['wall']:>9.1f} {d['cpu']:>9.1f} {d['peak_rss_mb']:>9.1f}")
+        if d['counts']:
+            lines.append('')
+            lines.append('CALLS: ' + ', '.join(f'{k}={v}' for k, v in sorted(d['counts'].items())))
+        if d['jobs']:
+            lines.append('')
+            for name, j in d['jobs'].items():
+                lines.append(f"JOB {name}: {j['status']}, exit code {j['returncode']}, {j['secs']} secs")
+        if d['dqa_summary']:
+            lines.append('')
+            lines.append(f"{'DQA SUBSTEP':<28} {'N':>5} {'TOTAL(s)':>9} {'MEAN':>8} {'P95':>8} {'MAX':>8}")
+            items = sorted(d['dqa_summary'].items(), key=lambda x: -x[1]['total'])
+            for sub, s in items:
+                lines.append(f"{sub:<28} {s['count']:>5} {s['total']:>9.2f} {s['mean']:>8.3f} {s['p95']:>8.3f} {s['max']:>8.3f}")
+        return '\n'.join(lines)
+
+
+def percentile(sortedVals, pct):
+    if not sortedVals: return 0
+    k = (len(sortedVals) - 1) * pct / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sortedVals) - 1)
+    return sortedVals[lo] + (sortedVals[hi] - sortedVals[lo]) * (k - lo)
+
+
+def get_peak_rss_mb():
+    #NOTE: ru_maxrss is KB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def get_proc_io():
+    '''
+    Returns dict of /proc/self/io counters (empty if not available).
+    '''
+    io = {}
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                key, val = line.split(':')
+                io[key.strip()] = int(val)
+    except Exception:
+        pass
+    return io
+
+
+#process-wide profile for the current run
+_profile = RunProfile()
+
+
+def get_profile():
+    return _profile
+
+
+def reset():
+    global _profile
+    _profile = RunProfile()
+    return _profile
+
+
+def count(name, n=1):
+    _profile.count(name, n)
@@ -0,0 +1,377 @@
+'''
+Wavelength and spectral resolution calculators as pure functions of an instrument configuration.
+
+A night typically uses a handful of distinct configurations, so each calculator is memoized on its
+configuration key (the header values it depends on) and the per-file setters (ie Hires.set_wavelengths)
+only do the lookup.  get_batch() evaluates a calculator for a whole night of configurations at once
+(one evaluation per unique key), and get_hires_wavelengths_batch() additionally runs the HIRES grating
+equation as one NumPy call over all frames.
+
+Return values match the previous per-frame code, including 'null' for unknown values.
+'''
+
+import math
+import datetime as dt
+from functools import lru_cache
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+CACHE_SIZE = 4096
+
+
+def get_batch(func, *columns):
+    '''
+    Returns list of func(*key) for each row of columns, evaluating each unique key once.
+    '''
+    results = {}
+    out = []
+    for key in zip(*columns):
+        if key not in results: results[key] = func(*key)
+        out.append(results[key])
+    return out
+
+
+def clear_caches():
+    for func in (get_hires_order_waves, get_lris_wavelengths, get_deimos_wavelengths, get_deimos_specres,
+                 get_esi_wavelengths, get_esi_specres, get_nirspec_wavelengths):
+        func.cache_clear()
+
+
+#----------------------------------------------------------------------------------------------------
+#HIRES
+#----------------------------------------------------------------------------------------------------
+
+HIRES_PSIZE  = 0.015                  #pixel size (mm)
+HIRES_NPIX   = 3072.0                 #CCD size (pix)
+HIRES_CAMCOL = 40. * math.pi / 180.   #camera-collimator angle
+HIRES_OFFSET = 25.0 - 0.63            #0-order + 5deg for home
+
+#order*wave constant and order to Y shift polynomial for each cross disperser
+#RED: order 62, 5748 A; UV: order 97, 3677 A
+HIRES_XD = {
+    'RED': (62.0 * 5748.0, 1.4088, -306.6910, 16744.1946),
+    'UV' : (97.0 * 3677.0, 0.9496, -266.2792, 19943.7496),
+}
+
+
+def get_hires_grating_waves(xdsigmai, xdangl, xp=math):
+    '''
+    Returns uncorrected (center, blue, red) wavelengths from the cross disperser grating equation.
+    Pass xp=np to evaluate arrays of XDSIGMAI and XDANGL.
+    '''
+    alpha = (xdangl + HIRES_OFFSET) * math.pi / 180.
+    d = 10.**7 / xdsigmai #microns
+    ccdangle = math.atan2(HIRES_NPIX * HIRES_PSIZE, (1.92 * 762.0)) #f = 762mm, psize u pix, 1.92 amag
+    waves = []
+    for a in (alpha, alpha - ccdangle, alpha + ccdangle):
+        wave = d * ((1. + math.cos(HIRES_CAMCOL)) * xp.sin(a) - math.sin(HIRES_CAMCOL) * xp.cos(a))
+        waves.append(np.fix(wave) if xp is np else float(math.trunc(wave)))
+    return tuple(waves)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def get_hires_order_waves(xdispers, echangl, wavecntr, waveblue, wavered):
+    '''
+    Corrects grating wavelengths to the echelle order and ECHANGL.  Returns (center, blue, red)
+    rounded to 10 A, with 'null' for values out of range.
+    '''
+    const, a, b, c = HIRES_XD[xdispers]
+    npix = HIRES_NPIX
+    for i in [wavecntr, waveblue, wavered]:
+        #find order for wavecntr
+        wave = i
+        order = float(math.floor(const / wave))
+        trycount = 1
+        okflag = 0
+        while okflag == 0:
+            #find shift in Y: order 62 =npix with XD=ECH=0(red)
+            #                 order 97 =npix with XD=ECH=0(blue)
+            if i == wavecntr:
+                shift = a*order**2 + b*order + c
+                newy = npix - shift
+                newy = -newy
+                okflag = 1
+            else:
+                shift2 = a*order**2 + b*order + c
+                newy2 = shift2 - newy
+                if newy2 < 120:
+                    order = order - 1
+                    trycount += 1
+                    okflag = 0
+                    if trycount < 100:
+                        continue
+                npix2 = 2*npix
+                if newy2 > npix2:
+                    order = order + 1
+                    trycount += 1
+                    okflag = 0
+                    if trycount < 100:
+                        continue
+                if trycount > 100 or newy2 > 120 or newy2 > npix2:
+                    okflag = 1
+                    break
+
+        #find delta wave for order
+        dlamb = -0.1407*order + 18.005
+        #new wavecenter = central wavelength for this order, corrected for echangl
+        wave = const/order
+        wave = wave + (4*dlamb*echangl)
+        #round to nearest 10 A
+        wave2 = wave % 10
+        if wave2 < 5: wave = wave - wave2
+        else        : wave = wave + (10-wave2)
+        if wave < 1000 or wave > 20000:
+            wave = 'null'
+        if i == wavecntr:
+            wavecntr = wave
+        elif i == waveblue:
+            waveblue = wave
+        elif i == wavered:
+            wavered = wave
+
+    if wavecntr != 'null': wavecntr = int(round(wavecntr, -1))
+    if waveblue != 'null': waveblue = int(round(waveblue, -1))
+    if wavered  != 'null': wavered  = int(round(wavered, -1))
+    return wavecntr, waveblue, wavered
+
+
+def get_hires_wavelengths(xdispers, xdsigmai, xdangl, echangl):
+    '''
+    Returns (center, blue, red) wavelengths for a HIRES configuration, or None if XDISPERS is blank.
+    '''
+    if xdispers == '': return None
+    waves = get_hires_grating_waves(xdsigmai, xdangl)
+    return get_hires_order_waves(xdispers, echangl, *waves)
+
+
+def get_hires_wavelengths_batch(xdispers, xdsigmai, xdangl, echangl):
+    '''
+    Vectorized get_hires_wavelengths for arrays of a night's values.  Returns list of results.
+    '''
+    xdsigmai = np.asarray(xdsigmai, dtype=np.float64)
+    xdangl   = np.asarray(xdangl, dtype=np.float64)
+    cntr, blue, red = get_hires_grating_waves(xdsigmai, xdangl, xp=np)
+    return get_batch(lambda xd, ech, c, b, r: None if xd == '' else get_hires_order_waves(xd, ech, c, b, r),
+                     xdispers, echangl, cntr.tolist(), blue.tolist(), red.tolist())
+
+
+#----------------------------------------------------------------------------------------------------
+#LRIS
+#----------------------------------------------------------------------------------------------------
+
+LRIS_RED_FILTERS = {'clear':[3500,9000], 'B':[3800,5300], 'V':[4800,6600], 'R':[5500,8200], 'Rs':[6000,7500],
+                    'I':[6800,8400], 'GG495':[4800,4950], 'OG570':[5500,5700], 'RG850':[8200,8500],
+                    'NB4000':[3800,4200], 'NB5390':[5350,5400], 'NB6741':[6700,6800], 'NB8185':[8150,8250],
+                    'NB8560':[8500,8650], 'NB9135':[9100,9200], 'NB9148':[9050,9250], 'NB4325':[9050,9520]}
+LRIS_BLUE_FILTERS = {'clear':[3000,6500], 'U':[3050,4000], 'B':[3900,4900], 'V':[5800,6600], 'G':[4100,5300],
+                     'SP580':[0,0], 'NB4170':[0,0]}
+
+#red grating wavelength coverage (A), centered on WAVELEN; before 2015-05-14 the old red CCDs
+LRIS_RED_GRATINGS = {'150/7500':12288, '300/5000':6525, '400/8500':4762, '600/5000':3275, '600/7500':3275,
+                     '600/10000':3275, '831/8200':2375, '900/5500':2175, '1200/7500':1638, '1200/9000':1638}
+LRIS_RED_GRATINGS_OLD = {'150/7500':9830, '158/8500':9830, '300/5000':5220, '400/8500':3810, '600/5000':2620,
+                         '600/7500':2620, '600/10000':2620, '831/8200':1900, '900/5500':1740, '1200/7500':1310}
+LRIS_RED_NEW_DATE = dt.datetime(2015, 5, 14)
+
+#blue grism wavelength ranges for longslit and other masks
+LRIS_BLUE_GRISMS_LONG = {'300/5000':[1570,7420], '400/3400':[1270,5740], '600/4000':[3010,5600], '1200/3400':[2910,3890]}
+LRIS_BLUE_GRISMS = {'300/5000':[2210,8060], '400/3400':[1760,6220], '600/4000':[3300,5880], '1200/3400':[3010,4000]}
+
+#dichroic cutoff (A)
+LRIS_DICHROICS = {'460':4874, '500':5091, '560':5696, '680':6800}
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def get_lris_wavelengths(instr, obsmode, redfilt, blufilt, grating, grism, wlen, dateobs, slitmask, dichname):
+    '''
+    Returns (blue, center, red) wavelengths for an LRIS configuration, or None if undetermined.
+    OBSMODE must be uppercase.
+    '''
+    #Imaging mode
+    if obsmode == 'IMAGING':
+        if   instr == 'LRIS'    : flt, wavearr = redfilt, LRIS_RED_FILTERS
+        elif instr == 'LRISBLUE': flt, wavearr = blufilt, LRIS_BLUE_FILTERS
+        else                    : return None
+        if flt == 'Clear':
+            flt = 'clear'
+
+    #Spectroscopy mode
+    else:
+        if instr == 'LRIS':
+            if not wlen: return None
+            #NOTE: %M (minutes) is kept as in the original IDL port
+            date = dt.datetime.strptime(dateobs, '%Y-%M-%d')
+            widths = LRIS_RED_GRATINGS_OLD if date < LRIS_RED_NEW_DATE else LRIS_RED_GRATINGS
+            wavearr = {k: [wlen-w/2, wlen+w/2] for k, w in widths.items()}
+        elif instr == 'LRISBLUE':
+            #longslit
+            if 'long_' in slitmask or 'pol_' in slitmask: wavearr = LRIS_BLUE_GRISMS_LONG
+            else                                        : wavearr = LRIS_BLUE_GRISMS
+        else:
+            return None
+
+    #dichroic cutoff
+    #NOTE: Elysia fixed bug in IDL code was incorrectly not truncating the wavelength range
+    #bc the dichroic wavelength is in nanometers and the wavelength range is in angstroms.
+    minmax = LRIS_DICHROICS.get(dichname, 0)
+
+    #determine wavelength range
+    if obsmode == 'IMAGING':
+        if flt in wavearr: waveblue, wavered = wavearr.get(flt)
+        else             : return None
+    elif 'SPEC' in obsmode:
+        if   grating in wavearr: waveblue, wavered = wavearr.get(grating)
+        elif grism in wavearr  : waveblue, wavered = wavearr.get(grism)
+        else                   : return None
+    else:
+        #NOTE: previous code failed here (no range for other modes)
+        return None
+
+    #if wavelength range encompasses dichroic cutoff
+    #LRIS: minmax to wavered
+    #LRISBLUE: waveblue to minmax
+    if instr == 'LRIS':
+        if waveblue < minmax:
+            waveblue = minmax
+    elif instr == 'LRISBLUE':
+        if wavered > minmax:
+            wavered = minmax
+
+    #round to the nearest 10 angstroms
+    wavered  = int(round(round(wavered, -1)))
+    waveblue = int(round(round(waveblue, -1)))
+    wavecntr = int(round((waveblue + wavered)/2))
+    return waveblue, wavecntr, wavered
+
+
+#----------------------------------------------------------------------------------------------------
+#DEIMOS
+#----------------------------------------------------------------------------------------------------
+
+DEIMOS_GRATINGS = {
+    '600ZD': {'wave':7500, 'dispersion':0.65, 'length':5300},
+    '830G' : {'wave':8640, 'dispersion':0.47, 'length':3840},
+    '900ZD': {'wave':5500, 'dispersion':0.44, 'length':3530},
+    '1200G': {'wave':7760, 'dispersion':0.33, 'length':2630},
+    '1200B': {'wave':4500, 'dispersion':0.33, 'length':2630},
+}
+
+#filter list for imaging wavelengths
+DEIMOS_FILTERS = {
+    'B'     : {'blue':4200, 'cntr':4400, 'red':4600},
+    'V'     : {'blue':5150, 'cntr':5450, 'red':5750},
+    'R'     : {'blue':6100, 'cntr':6500, 'red':6900},
+    'I'     : {'blue':7600, 'cntr':8400, 'red':9200},
+    'Z'     : {'blue':8600, 'cntr':9100, 'red':9600},
+    'GG400' : {'blue':4000, 'cntr':7250, 'red':10500},
+    'GG455' : {'blue':4550, 'cntr':7525, 'red':10500},
+    'GG495' : {'blue':4950, 'cntr':7725, 'red':10500},
+    'OG550' : {'blue':5500, 'cntr':8000, 'red':10500},
+    'NG8560': {'blue':8400, 'cntr':8550, 'red':8700},
+    'NG8580': {'blue':8550, 'cntr':8600, 'red':8650},
+}
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def get_deimos_wavelengths(obsmode, filt, grating, tltwav):
+    '''
+    Returns (blue, center, red) wavelengths.  tltwav is the G[GRATEPOS]TLTWAV value.
+    '''
+    waveblue = wavecntr = wavered = 'null'
+    if obsmode == 'imaging':
+        if filt in DEIMOS_FILTERS:
+            waveblue = DEIMOS_FILTERS[filt]['blue']
+            wavecntr = DEIMOS_FILTERS[filt]['cntr']
+            wavered  = DEIMOS_FILTERS[filt]['red']
+    elif obsmode in ['longslit', 'mos']:
+        if grating in DEIMOS_GRATINGS:
+            wavecntr = int(round(tltwav, -1))
+            delta = DEIMOS_GRATINGS[grating]['length']/2
+            waveblue = int(round(wavecntr - delta, -1))
+            wavered = int(round(wavecntr + delta, -1))
+    return waveblue, wavecntr, wavered
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def get_deimos_specres(grating, spatscal):
+    if grating not in DEIMOS_GRATINGS: return 'null'
+    specres = (DEIMOS_GRATINGS[grating]['wave']*spatscal)/DEIMOS_GRATINGS[grating]['dispersion']
+    return round(specres, -1)
+
+
+#----------------------------------------------------------------------------------------------------
+#ESI
+#----------------------------------------------------------------------------------------------------
+
+#imaging filter (blue, center, red)
+ESI_FILTERS = {'B': (3700, 4400, 5400), 'V': (4900, 5200, 6450), 'R': (6000, 6500, 7400), 'I': (7000, 8000, 9000)}
+ESI_SPEC_WAVES = (3900, 7400, 10900)
+
+#MEAN(0.1542*wavelength/dispersion) over orders 6-15, see Esi.set_specres
+ESI_SPECRES_CONST = 4125.406
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def get_esi_wavelengths(obsmode, dwfilnam):
+    '''
+    Returns (blue, center, red) wavelengths.
+    '''
+    if obsmode == 'image':
+        return ESI_FILTERS.get(dwfilnam, ('null', 'null', 'null'))
+    if obsmode in ('low', 'high'):
+        return ESI_SPEC_WAVES
+    return 'null', 'null', 'null'
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def get_esi_specres(obsmode, slitwidt):
+    if obsmode not in ('low', 'high'): return 'null'
+    try:
+        return round(ESI_SPECRES_CONST / slitwidt, -1)
+    except Exception:
+        return 'null'
+
+
+#----------------------------------------------------------------------------------------------------
+#NIRSPEC
+#----------------------------------------------------------------------------------------------------
+
+#filter (blue, center, red) in microns, in match order (first substring match of FILTER wins)
+NIRSPEC_FILTERS = {
+    'UNKNOWN'  : ('null', 'null', 'null'),
+    'BLANK'    : ('null', 'null', 'null'),
+    'NIRSPEC-1': (0.9470, 1.0340, 1.1210),
+    'NIRSPEC-2': (1.0890, 1.1910, 1.2930),
+    'NIRSPEC-3': (1.1430, 1.2590, 1.3750),
+    'NIRSPEC-4': (1.2410, 1.4170, 1.5930),
+    'NIRSPEC-5': (1.4310, 1.6195, 1.8080),
+    'NIRSPEC-6': (1.5580, 1.9365, 2.3150),
+    'NIRSPEC-7': (1.8390, 2.2345, 2.6300),
+    'Br-Gamma' : (2.1550, 2.1650, 2.1750),
+    'BR-GAMMA' : (2.1550, 2.1650, 2.1750),
+    'CO'       : (2.2810, 2.2930, 2.3050),
+    'K-PRIME'  : (1.9500, 2.1225, 2.2950),
+    'KL'       : (2.1340, 3.1810, 4.2280),
+    'K'        : (1.9960, 2.1890, 2.3820),
+    'L-PRIME'  : (3.4200, 3.7700, 4.1200),
+    'M-PRIME'  : (4.5700, 4.6900, 4.8100),
+    'HEI'      : (1.0776, 1.0830, 1.0884),
+    'PA-BETA'  : (1.2757, 1.2823, 1.2888),
+    'FEII'     : (1.6390, 1.6465, 1.6540),
+    'H2'       : (2.1100, 2.1195, 2.1290),
+    'M-WIDE'   : (4.4200, 4.9750, 5.5300),
+}
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def get_nirspec_wavelengths(filt):
+    '''
+    Returns (blue, center, red) wavelengths (microns) for FILTER value.
+    '''
+    filt = filt.upper()
+    for name, waves in NIRSPEC_FILTERS.items():
+        if name in filt: return waves
+    return 'null', 'null', 'null'
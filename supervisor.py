@@ -0,0 +1,208 @@
+'''
+Supervisor for external jobs (DRP, PSFR) started by DEP.
+
+Each job runs in its own process group with optional resource limits (address space, CPU time,
+nice level).  Limits are set by the prlimit and nice commands the job is exec'd through, so no Python
+runs in the forked child (DEP is multithreaded).  If prlimit is not installed, rlimits are set on the
+job's pid right after it starts.  Its stdout/stderr is streamed line by line into the DEP log, and a watchdog kills
+the process group if the job runs past its timeout.  Exit status and duration are recorded in
+the run profile (see run_profile.py).
+
+Usage:
+    job = supervisor.start('drp', ['/path/drp', outdir], log, timeout=3600)
+    ok = job.wait()
+    ...
+    supervisor.wait_all(timeout=3600)    #before exit, so background jobs (PSFR) are not orphaned
+    supervisor.kill_all()                #or if DEP failed, so it does not wait on them
+'''
+
+import os
+import time
+import signal
+import shutil
+import resource
+import threading
+import subprocess
+import run_profile
+
+
+#jobs started by this process
+_jobs = []
+_lock = threading.Lock()
+
+
+class Job:
+
+    def __init__(self, name, cmd, log=None, timeout=None, maxMemMb=None, maxCpuSecs=None, nice=0, onOutput=None):
+        self.name       = name
+        self.cmd        = cmd
+        self.log        = log
+        self.timeout    = timeout
+        self.maxMemMb   = maxMemMb
+        self.maxCpuSecs = maxCpuSecs
+        self.nice       = nice
+        self.onOutput   = onOutput
+        self.proc       = None
+        self.start      = None
+        self.secs       = None
+        self.returncode = None
+        self.status     = 'new'
+        self.done       = threading.Event()
+        self.reader     = None
+        self.watchdog   = None
+
+
+    def get_rlimits(self):
+        '''
+        Returns list of (resource, prlimit option, value) for the job's limits.
+        '''
+        rlimits = []
+        if self.maxMemMb:
+            rlimits.append((resource.RLIMIT_AS, '--as', int(self.maxMemMb) * 1024 * 1024))
+        if self.maxCpuSecs:
+            rlimits.append((resource.RLIMIT_CPU, '--cpu', int(self.maxCpuSecs)))
+        return rlimits
+
+
+    def get_cmd(self, prlimit=None):
+        '''
+        Returns cmd wrapped with nice and prlimit (path to the prlimit command) for the job's limits.
+        '''
+        cmd = list(self.cmd)
+        if self.nice:
+            cmd = ['nice', '-n', str(int(self.nice)), '--'] + cmd
+        rlimits = self.get_rlimits()
+        if rlimits and prlimit:
+            cmd = [prlimit] + [f'{opt}={val}' for res, opt, val in rlimits] + ['--'] + cmd
+        return cmd
+
+
+    def run(self):
+        self.info(f'starting: {" ".join(self.cmd)}')
+        self.start = time.time()
+        prlimit = shutil.which('prlimit')
+        try:
+            self.proc = subprocess.Popen(self.get_cmd(prlimit), stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                         stdin=subprocess.DEVNULL, start_new_session=True,
+                                         universal_newlines=True, errors='replace')
+        except Exception as e:
+            self.finish('error', None)
+            self.error(f'could not start: {str(e)}')
+            return self
+        if not prlimit:
+            for res, opt, val in self.get_rlimits():
+                try:
+                    resource.prlimit(self.proc.pid, res, (val, val))
+                except (OSError, ValueError) as e:
+                    self.error(f'could not set {opt[2:]} limit: {str(e)}')
+        self.status   = 'running'
+        self.reader   = threading.Thread(target=self.read_output, daemon=True)
+        self.watchdog = threading.Thread(target=self.watch, daemon=True)
+        self.reader.start()
+        self.watchdog.start()
+        return self
+
+
+    def read_output(self):
+        for line in self.proc.stdout:
+            self.info(line.rstrip())
+            if self.onOutput: self.onOutput(line)
+        self.proc.stdout.close()
+
+
+    def watch(self):
+        try:
+            self.proc.wait(timeout=self.timeout)
+            status = 'ok' if self.proc.returncode == 0 else 'failed'
+        except subprocess.TimeoutExpired:
+            self.error(f'timeout after {self.timeout} secs, killing')
+            self.kill()
+            status = 'timeout'
+        self.reader.join(5)
+        self.finish(status, self.proc.returncode)
+
+
+    def kill(self, grace=10):
+        '''
+        SIGTERM then SIGKILL to the job's process group.
+        '''
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            try:
+                os.killpg(self.proc.pid, sig)
+            except ProcessLookupError:
+                return
+            try:
+                self.proc.wait(timeout=grace)
+                return
+            except subprocess.TimeoutExpired:
+                pass
+
+
+    def finish(self, status, returncode):
+        self.secs = round(time.time() - self.start, 3)
+        self.returncode = returncode
+        self.status = status
+        run_profile.get_profile().add_job(self.name, self.to_dict())
+        msg = f'finished: status {status}, exit code {returncode}, {self.secs} secs'
+        if status == 'ok': self.info(msg)
+        else             : self.error(msg)
+        self.done.set()
+
+
+    def wait(self, timeout=None):
+        '''
+        Waits for job to finish.  Returns True if it exited with status 0.
+        '''
+        self.done.wait(timeout)
+        return self.status == 'ok'
+
+
+    def to_dict(self):
+        return {'cmd': ' '.join(self.cmd), 'status': self.status, 'returncode': self.returncode,
+                'secs': self.secs, 'timeout': self.timeout}
+
+
+    def info(self, msg):
+        if self.log: self.log.info(f'supervisor: {self.name}: {msg}')
+
+
+    def error(self, msg):
+        if self.log: self.log.error(f'supervisor: {self.name}: {msg}')
+
+
+def start(name, cmd, log=None, timeout=None, maxMemMb=None, maxCpuSecs=None, nice=0, onOutput=None):
+    '''
+    Starts supervised job and returns Job object.  onOutput is called with each line of output.
+    '''
+    job = Job(name, cmd, log, timeout, maxMemMb, maxCpuSecs, nice, onOutput)
+    with _lock:
+        _jobs.append(job)
+    return job.run()
+
+
+def get_jobs():
+    with _lock:
+        return list(_jobs)
+
+
+def wait_all(timeout=None):
+    '''
+    Waits up to timeout secs total for all started jobs.  Returns True if all exited with status 0.
+    '''
+    end = time.time() + timeout if timeout is not None else None
+    ok = True
+    for job in get_jobs():
+        remaining = max(0, end - time.time()) if end is not None else None
+        if not job.wait(remaining): ok = False
+    return ok
+
+
+def kill_all():
+    '''
+    Kills all running jobs (see Job.kill).  Returns number killed.
+    '''
+    jobs = [job for job in get_jobs() if job.proc and not job.done.is_set()]
+    for job in jobs:
+        job.error('killing')
+        job.kill()
+    return len(jobs)
@@ -0,0 +1,80 @@
+"""
+Profiles the share of DQA time spent in Instrument.get_keyword, with and without the per-file keyword cache.
+
+Runs run_dqa_checks on each FITS file in a directory under cProfile (nothing is written to lev0).
+Requires a config.live.ini in the DEP root dir, as for a normal dep_go.py run.
+
+Usage (from DEP root dir):
+    python test/bench_get_keyword.py [instr] [utDate] [fits dir] --repeat=3
+"""
+import os
+import sys
+import argparse
+import cProfile
+import pstats
+import importlib
+import logging
+import yaml
+from glob import glob
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir)))
+
+
+def profile_dqa(instrObj, files, repeat=1):
+    '''
+    Runs run_dqa_checks on each file under cProfile and returns (total secs, get_keyword secs, get_keyword calls).
+    '''
+    prof = cProfile.Profile()
+    for i in range(repeat):
+        for filename in files:
+            if not instrObj.set_fits_file(filename): continue
+            prof.enable()
+            try:
+                instrObj.run_dqa_checks([])
+            except Exception as e:
+                instrObj.log.warning(f'bench: run_dqa_checks failed for {filename}: {e}')
+            prof.disable()
+
+    stats = pstats.Stats(prof)
+    total = stats.total_tt
+    kwTime = kwCalls = 0
+    for (path, line, func), (cc, nc, tt, ct, callers) in stats.stats.items():
+        if func == 'get_keyword' and path.endswith('instrument.py'):
+            kwTime += ct
+            kwCalls += nc
+    return total, kwTime, kwCalls
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Profile get_keyword share of DQA time.')
+    parser.add_argument('instr', type=str, help='Instrument name')
+    parser.add_argument('utDate', type=str, help='UT date (YYYY-MM-DD)')
+    parser.add_argument('fitsDir', type=str, help='Directory of sample FITS files')
+    parser.add_argument('--repeat', type=int, default=1, help='Number of passes over files')
+    args = parser.parse_args()
+
+    instr = args.instr.upper()
+    files = sorted(glob(os.path.join(args.fitsDir, '*.fits')))
+    if not files:
+        print(f'No FITS files found in {args.fitsDir}')
+        return
+
+    with open('config.live.ini') as f: config = yaml.safe_load(f)
+    module = importlib.import_module('instr_' + instr.lower())
+    instrClass = getattr(module, instr.capitalize())
+
+    log = logging.getLogger('koa_dep_bench')
+    logging.basicConfig(level=logging.ERROR)
+
+    print(f'{instr}: {len(files)} files x {args.repeat}')
+    print(f"{'cache':<6} {'total(s)':>10} {'get_keyword(s)':>15} {'calls':>8} {'share':>7}")
+    for useCache in (False, True):
+        instrObj = instrClass(instr, args.utDate, config, log)
+        instrObj.useKeywordCache = useCache
+        total, kwTime, kwCalls = profile_dqa(instrObj, files, args.repeat)
+        share = kwTime / total * 100 if total else 0
+        print(f"{str(useCache):<6} {total:>10.3f} {kwTime:>15.3f} {kwCalls:>8} {share:>6.1f}%")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,293 @@
+"""
+Benchmark suite for DEP pipeline stages (pytest-benchmark).
+
+Sample FITS files under cit/fits_files and test/ (.fits or .fits.gz) are replicated to N files with
+unique KOAIDs in a temp lev0 dir.  Instruments without a sample file get a synthetic one with the
+layout and keywords their stages read (see SYNTHETIC).  Every external service is stubbed: the DB is
+a local sqlite file, and any API/EPICS archiver request fails the benchmark.
+
+Not collected by a plain pytest run.  Usage (from test dir):
+    pytest bench_pipeline.py --benchmark-autosave
+    pytest bench_pipeline.py --benchmark-compare          (compare to last saved run)
+Options (environment):
+    DEP_BENCH_NFILES          number of replicated files (default 20)
+    DEP_BENCH_KEYWORD_TABLE   KOA keyword table to use for make_metadata (default: built from headers)
+"""
+import pytest
+import sys
+import os
+import shutil
+import gzip
+import logging
+import importlib
+from glob import glob
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir, 'cit'))
+
+pytest.importorskip('pytest_benchmark')
+np = pytest.importorskip('numpy')
+fits = pytest.importorskip('astropy.io.fits')
+
+import yaml
+import common
+import envlog
+import metadata
+import offline_harness
+from common import make_dir_md5_table
+from dep_dqa import make_fits_extension_metadata_files
+from dep_tar import gzip_dir_fits
+from dep_locate import find_24hr_fits
+from instrument import Instrument
+
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.path.pardir))
+NFILES = int(os.environ.get('DEP_BENCH_NFILES', 20))
+UTDATE = '2020-01-01'
+INSTRUMENTS = ['DEIMOS', 'ESI', 'HIRES', 'KCWI', 'LRIS', 'MOSFIRE', 'NIRC2', 'NIRES', 'NIRSPEC', 'OSIRIS']
+log = logging.getLogger('koa_dep_bench')
+
+
+def find_samples():
+    samples = []
+    for d in (os.path.join(ROOT_DIR, 'cit', 'fits_files'), os.path.dirname(__file__)):
+        for ext in ('*.fits', '*.fits.gz'):
+            samples += glob(os.path.join(d, '**', ext), recursive=True)
+    return sorted(samples)
+
+
+#synthetic sample per instrument: INSTRUME, KOAID prefix and layout ('image' is a primary image plus a
+#binary table extension, 'mosaic' is a primary header plus CCD extensions tiled by DETSEC)
+SYNTHETIC = {
+    'DEIMOS'  : ('DEIMOS',   'DE', 'mosaic'),
+    'ESI'     : ('ESI',      'EI', 'image'),
+    'HIRES'   : ('HIRES',    'HI', 'hires'),
+    'KCWI'    : ('KCWI',     'KB', 'image'),
+    'LRIS'    : ('LRIS',     'LR', 'image'),
+    'LRISBLUE': ('LRISBLUE', 'LB', 'mosaic'),
+    'MOSFIRE' : ('MOSFIRE',  'MF', 'image'),
+    'NIRC2'   : ('NIRC2',    'N2', 'image'),
+    'NIRES'   : ('NIRES',    'NR', 'image'),
+    'NIRSPEC' : ('NIRSPEC',  'NS', 'image'),
+    'OSIRIS'  : ('OSIRIS',   'OI', 'image'),
+}
+
+
+def make_synthetic_sample(name, outFile, size=256, nrows=200):
+    '''
+    Writes synthetic sample for SYNTHETIC entry name.
+    '''
+    instrume, prefix, layout = SYNTHETIC[name]
+    rng = np.random.default_rng(1)
+    hdr = {'INSTRUME': instrume, 'DATE-OBS': UTDATE, 'UTC': '10:00:00.00', 'KOAID': f'{prefix}.20200101.36000.fits',
+           'OBJECT': 'bench', 'ELAPTIME': 300.0, 'RA': '12:00:00.00', 'DEC': '+20:00:00.0'}
+
+    if layout == 'hires':
+        hdr = dict(offline_harness.get_hires_header(UTDATE, {'semid': '2020A_U001'}), **hdr)
+        hdr['INSTRUME'] = 'HIRES: High Resolution Echelle Spectrometer'
+        offline_harness.make_synthetic_hires(outFile, hdr)
+        return outFile
+
+    if layout == 'mosaic':
+        #2 rows of 2 CCDs (DEIMOS tiles rows by DETSEC y > 4096), pre/post scan columns per CCD
+        hdr.update({'BINNING': '1,1', 'PRECOL': 12, 'POSTPIX': 40, 'PRELINE': 0, 'POSTLINE': 0})
+        hdus = [fits.PrimaryHDU(header=fits.Header(hdr))]
+        for row in range(2):
+            for col in range(2):
+                ext = fits.ImageHDU(rng.normal(1000, 30, (size, size + 52)).astype(np.int16))
+                ext.header['DETSEC'] = f'[{col*2048+1}:{col*2048+2048},{row*4096+1}:{row*4096+4096}]'
+                hdus.append(ext)
+        fits.HDUList(hdus).writeto(outFile, overwrite=True)
+        return outFile
+
+    data = rng.normal(1000, 30, (size, size)).astype(np.float32)
+    cols = [fits.Column(name=f'COL{i}', format='20A', array=np.array([f'val{i}_{j}' for j in range(nrows)]))
+            for i in range(8)]
+    hdus = fits.HDUList([fits.PrimaryHDU(data, fits.Header(hdr)), fits.BinTableHDU.from_columns(cols, name='TABLE1')])
+    hdus.writeto(outFile, overwrite=True)
+    return outFile
+
+
+def get_instrume(path):
+    with open_sample(path) as hdus:
+        return str(hdus[0].header.get('INSTRUME', '')).strip().upper()
+
+
+def open_sample(path):
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as f: return fits.HDUList.fromstring(f.read())
+    return fits.open(path)
+
+
+@pytest.fixture(scope='session')
+def samples(tmp_path_factory):
+    samples = find_samples()
+    instrumes = [get_instrume(path) for path in samples]
+    synthDir = tmp_path_factory.mktemp('synth')
+    for name, (instrume, prefix, layout) in SYNTHETIC.items():
+        if any(i.startswith(instrume) for i in instrumes): continue
+        samples.append(make_synthetic_sample(name, str(synthDir / f'synth_{name.lower()}.fits')))
+    return samples
+
+
+@pytest.fixture(scope='session')
+def lev0_dir(tmp_path_factory, samples):
+    '''
+    Replicates samples to NFILES files with unique KOAIDs.
+    '''
+    outDir = tmp_path_factory.mktemp('lev0')
+    for i in range(NFILES):
+        hdus = open_sample(samples[i % len(samples)])
+        hdr = hdus[0].header
+        prefix = str(hdr.get('KOAID', 'XX.')).split('.')[0] or 'XX'
+        koaid = f'{prefix}.{UTDATE.replace("-", "")}.{i:05d}.fits'
+        hdr['KOAID'] = koaid
+        hdus.writeto(str(outDir / koaid), overwrite=True, output_verify='silentfix')
+        hdus.close()
+    return str(outDir)
+
+
+@pytest.fixture(scope='session')
+def keyword_table(tmp_path_factory, lev0_dir):
+    '''
+    KOA keyword definition table (tab separated) with KOAID first and every primary header keyword.
+    '''
+    if os.environ.get('DEP_BENCH_KEYWORD_TABLE'): return os.environ['DEP_BENCH_KEYWORD_TABLE']
+
+    keys = {'KOAID': 'char'}
+    for path in sorted(glob(os.path.join(lev0_dir, '*.fits'))):
+        for key, val in fits.getheader(path).items():
+            if not key or key in keys or key in ('COMMENT', 'HISTORY', 'SIMPLE', 'EXTEND'): continue
+            if isinstance(val, bool) or not isinstance(val, (int, float)): keys[key] = 'char'
+            elif isinstance(val, int): keys[key] = 'integer'
+            else: keys[key] = 'double'
+
+    outFile = str(tmp_path_factory.mktemp('tables') / 'KOA_BENCH_Keyword_Table.txt')
+    cols = ['FITSKeyword', 'MetadataDatatype', 'NullsAllowed', 'MetadataWidth', 'MinValue', 'MaxValue',
+            'Source', 'InputFormat', 'ValidateFormat', 'CheckValues', 'DiscreteValues']
+    with open(outFile, 'w') as f:
+        f.write('\t'.join(cols) + '\n')
+        for key, dtype in keys.items():
+            f.write('\t'.join([key, dtype, 'Y', '68', '', '', 'FITS', dtype, 'N', 'N', '']) + '\n')
+    return outFile
+
+
+@pytest.fixture(scope='session')
+def metadata_table(tmp_path_factory, lev0_dir, keyword_table):
+    outFile = str(tmp_path_factory.mktemp('meta') / '20200101.metadata.table')
+    metadata.make_metadata(keyword_table, outFile, lev0_dir, dev=True)
+    return outFile
+
+
+@pytest.fixture(scope='session', autouse=True)
+def stub_services(tmp_path_factory):
+    '''
+    Local sqlite DB in config.live.ini (in a temp working dir) and no network requests.
+    '''
+    workDir = tmp_path_factory.mktemp('work')
+    config = {
+        'DATABASE': {'koa': {'server': str(workDir / 'koa.db'), 'user': '', 'pwd': '', 'type': 'sqlite'}},
+        'API'     : {'TELAPI': 'http://localhost.invalid/', 'METAPI': 'http://localhost.invalid/'},
+        'INFO'    : {'DEP_VERSION': 'bench'},
+        'RUNTIME' : {'DEV': 1},
+        'MISC'    : {'METADATA_TABLES_DIR': str(workDir)},
+    }
+    for instr in INSTRUMENTS: config[instr] = {'ROOTDIR': str(workDir)}
+    with open(workDir / 'config.live.ini', 'w') as f: yaml.safe_dump(config, f)
+
+    def no_network(*args, **kwargs):
+        raise AssertionError(f'bench: external request not allowed: {args[0] if args else ""}')
+
+    mp = pytest.MonkeyPatch()
+    mp.chdir(workDir)
+    mp.setattr(common, 'urlopen', no_network)
+    mp.setattr(envlog, 'urlopen', no_network)
+    yield config
+    mp.undo()
+
+
+def get_instr_obj(instr, config):
+    module = importlib.import_module('instr_' + instr.lower())
+    instrClass = getattr(module, instr.capitalize())
+    return instrClass(instr, UTDATE, config, log)
+
+
+def get_instr_files(instr, lev0Dir):
+    '''
+    Replicated files whose INSTRUME matches instr (skips benchmark if none).
+    '''
+    files = [p for p in sorted(glob(os.path.join(lev0Dir, '*.fits'))) if get_instrume(p).startswith(instr)]
+    if not files: pytest.skip(f'no sample FITS files for {instr}')
+    return files
+
+
+#-------------------- benchmarks --------------------
+
+def test_make_metadata(benchmark, lev0_dir, keyword_table, tmp_path):
+    outFile = str(tmp_path / '20200101.metadata.table')
+    benchmark(metadata.make_metadata, keyword_table, outFile, lev0_dir, dev=True, create_md5=True)
+    assert os.path.isfile(outFile)
+
+
+def test_make_fits_extension_metadata_files(benchmark, lev0_dir, tmp_path):
+    outDir = str(tmp_path) + '/'
+    benchmark(make_fits_extension_metadata_files, lev0_dir + '/', outDir=outDir, md5Prepend='20200101.')
+
+
+def test_make_dir_md5_table(benchmark, lev0_dir, tmp_path):
+    outFile = str(tmp_path / '20200101.FITS.md5sum.table')
+    benchmark(make_dir_md5_table, lev0_dir, '.fits', outFile)
+    with open(outFile) as f: assert len(f.readlines()) == NFILES
+
+
+def test_gzip_dir_fits(benchmark, lev0_dir, tmp_path):
+    runs = []
+    def setup():
+        gzDir = str(tmp_path / f'gz{len(runs)}')
+        shutil.copytree(lev0_dir, gzDir)
+        runs.append(gzDir)
+        return (gzDir,), {}
+    benchmark.pedantic(gzip_dir_fits, setup=setup, rounds=3)
+    assert len(glob(runs[-1] + '/*.fits.gz')) == NFILES
+
+
+def test_find_24hr_fits(benchmark, lev0_dir):
+    files = benchmark(find_24hr_fits, [lev0_dir], UTDATE, '20:00:00', modtimeOverride=1)
+    assert len(files) == NFILES
+
+
+def test_compare_meta_files(benchmark, metadata_table, tmp_path):
+    copyFile = str(tmp_path / '20200101.copy.metadata.table')
+    shutil.copy(metadata_table, copyFile)
+    benchmark(metadata.compare_meta_files, [metadata_table, copyFile])
+
+
+@pytest.mark.parametrize('instr', INSTRUMENTS)
+def test_create_jpg_from_fits(benchmark, instr, lev0_dir, stub_services, tmp_path):
+    files = get_instr_files(instr, lev0_dir)
+    instrObj = get_instr_obj(instr, stub_services)
+    if type(instrObj).make_jpg is Instrument.make_jpg:
+        def run():
+            for path in files: instrObj.create_jpg_from_fits(path, str(tmp_path))
+    else:
+        #instrument converts the current file itself (ie HIRES), writing next to it in the lev0 dir
+        for path in files: shutil.copy(path, str(tmp_path))
+        files = sorted(glob(str(tmp_path / '*.fits')))
+        instrObj.dirs = {'lev0': str(tmp_path)}
+        def run():
+            for path in files:
+                assert instrObj.set_fits_file(path)
+                assert instrObj.make_jpg()
+    benchmark.pedantic(run, rounds=3)
+
+
+@pytest.mark.parametrize('instr', INSTRUMENTS)
+def test_set_image_stats_keywords(benchmark, instr, lev0_dir, stub_services):
+    files = get_instr_files(instr, lev0_dir)
+    instrObj = get_instr_obj(instr, stub_services)
+    if 'set_image_stats_keywords' not in [step.name for step in instrObj.get_dqa_steps()]:
+        pytest.skip(f'set_image_stats_keywords is not a DQA step for {instr}')
+    def run():
+        for path in files:
+            assert instrObj.set_fits_file(path)
+            instrObj.set_image_stats_keywords()
+    benchmark.pedantic(run, rounds=3)
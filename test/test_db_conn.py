@@ -0,0 +1,74 @@
+import pytest
+import sys
+import os
+import yaml
+import threading
+sys.path.append(os.path.pardir)
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+import db_conn
+"""
+test_db_conn.py tests connection pooling and batch queries using a local sqlite database.
+"""
+
+
+@pytest.fixture
+def configFile(tmp_path):
+    config = {'DATABASE': {'koa': {'server': str(tmp_path / 'koa.db'), 'user': '', 'pwd': '', 'type': 'sqlite'}}}
+    configFile = str(tmp_path / 'config.yaml')
+    with open(configFile, 'w') as f: yaml.safe_dump(config, f)
+    yield configFile
+    db_conn.get_db(configFile).close()
+
+
+def test_shared_pool(configFile):
+    db1 = db_conn.get_db(configFile)
+    db2 = db_conn.db_conn(configFile, configKey='DATABASE', persist=True)
+    assert db1 is db_conn.get_db(configFile)
+    assert db1.connect('koa') is db2.connect('koa')
+
+
+def test_query_many_and_params(configFile):
+    db = db_conn.get_db(configFile)
+    db.query('koa', 'create table koa_ppp (semid varchar(15), utdate date, propmin int)')
+    rows = [('2020A_U001', '2020-03-01', 12), ('2020A_U002', '2020-03-01', 18), ("2020A_'; --", '2020-03-01', 6)]
+    assert db.query_many('koa', 'insert into koa_ppp (semid, utdate, propmin) values (%s, %s, %s)', rows) == 3
+    data = db.query('koa', 'select propmin from koa_ppp where semid=%s', getOne=True, params=("2020A_'; --",))
+    assert data['propmin'] == 6
+
+
+def test_reconnect_after_close(configFile):
+    db = db_conn.get_db(configFile)
+    db.connect('koa').close()
+    assert db.query('koa', 'select 1 as one', getOne=True) == {'one': 1}
+
+
+def test_evict_dead_threads(configFile):
+    db = db_conn.get_db(configFile)
+    threads = [threading.Thread(target=db.query, args=('koa', 'select 1 as one')) for i in range(3)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert any(key[4] == threads[0].ident for key in db_conn._pool)
+    db.connect('koa')
+    assert db_conn.evict_dead_threads() == 0
+    assert not any(key[4] in {t.ident for t in threads} for key in db_conn._pool)
+
+
+def test_pool_threads(configFile):
+    #connections made and evicted from many threads at once
+    db = db_conn.get_db(configFile)
+    errors = []
+    def work():
+        try:
+            for i in range(20):
+                assert db.query('koa', 'select 1 as one', getOne=True) == {'one': 1}
+                db_conn.evict_dead_threads()
+        except Exception as e:
+            errors.append(e)
+    for n in range(3):
+        threads = [threading.Thread(target=work) for i in range(8)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+    assert errors == []
+    db_conn.evict_dead_threads()
+    live = {t.ident for t in threading.enumerate()}
+    assert all(key[4] in live for key in db_conn._pool)
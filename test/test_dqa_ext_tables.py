@@ -0,0 +1,71 @@
+import pytest
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+np = pytest.importorskip('numpy')
+fits = pytest.importorskip('astropy.io.fits')
+from dep_dqa import make_fits_extension_metadata_files
+"""
+test_dqa_ext_tables.py checks the .ext*.tbl files match the original row by row format.
+"""
+
+
+def make_ext_file(outFile, nrows=25):
+    cols = [
+        fits.Column(name='NAME',  format='12A', array=np.array([f'star {j}  ' for j in range(nrows)])),
+        fits.Column(name='VALUE', format='1E',  array=np.arange(nrows, dtype=np.float32) / 3),
+        fits.Column(name='NUM',   format='1J',  array=np.arange(nrows, dtype=np.int32)),
+        fits.Column(name='FLAG',  format='1L',  array=np.arange(nrows) % 2 == 0),
+        fits.Column(name='VEC',   format='2E',  array=np.ones((nrows, 2), dtype=np.float32)),
+        fits.Column(name='DBL',   format='1D',  array=np.arange(nrows, dtype=np.float64) / 7),
+    ]
+    bare = [fits.Column(name='BARE', format='E', array=np.arange(nrows, dtype=np.float32))]
+    hdus = fits.HDUList([fits.PrimaryHDU(), fits.BinTableHDU.from_columns(cols, name='TABLE1'),
+                         fits.BinTableHDU.from_columns(cols[:1], name='Exposure Events'),
+                         fits.BinTableHDU.from_columns(bare, name='BARE')])
+    hdus.writeto(outFile, overwrite=True)
+
+
+def get_expected(filepath, ext):
+    '''
+    Original cell by cell format for ext.
+    '''
+    with fits.open(filepath) as hdus:
+        hdu = hdus[ext]
+        colWidths = []
+        for idx, colName in enumerate(hdu.data.columns.names):
+            try:
+                fmtWidth = int(hdu.data.formats[idx][1:])
+            except:
+                fmtWidth = int(hdu.data.formats[idx][:-1])
+                if fmtWidth < 16: fmtWidth = 16
+            colWidths.append(max(fmtWidth, len(colName)))
+        dataStr = '\\ Extended Header Name: ' + hdu.name + "\n"
+        dataStr += ''.join('|' + n.ljust(cw) for n, cw in zip(hdu.data.columns.names, colWidths)) + "|\n"
+        dataStr += ''.join('|' + 'char'.ljust(cw) for cw in colWidths) + "|\n"
+        dataStr += ''.join('|' + ''.ljust(cw) for cw in colWidths) + "|\n"
+        dataStr += ''.join('|' + ''.ljust(cw) for cw in colWidths) + "|\n"
+        for j in range(0, len(hdu.data)):
+            row = hdu.data[j]
+            for idx, cw in enumerate(colWidths):
+                dataStr += ' ' + str(row[idx]).ljust(cw)
+            dataStr += "\n"
+    return dataStr
+
+
+def test_ext_tables(tmp_path):
+    inDir = tmp_path / 'lev0'
+    inDir.mkdir()
+    for name in ('HI.20200101.00001.fits', 'HI.20200101.00002.fits'):
+        make_ext_file(str(inDir / name))
+
+    make_fits_extension_metadata_files(str(inDir) + '/', md5Prepend='20200101.', workers=2)
+
+    #same files as the original: extension names are upper case so EXPOSURE EVENTS is written,
+    #and tables with bare column formats (no repeat count) are not
+    for name in ('HI.20200101.00001', 'HI.20200101.00002'):
+        for ext, extName in ((1, 'TABLE1'), (2, 'EXPOSURE EVENTS')):
+            with open(inDir / f'{name}.ext{ext}.{extName}.tbl') as f:
+                assert f.read() == get_expected(str(inDir / f'{name}.fits'), ext)
+    assert not list(inDir.glob('*.ext3.*'))
+    with open(inDir / '20200101.ext.md5sum.table') as f: assert len(f.readlines()) == 4
@@ -0,0 +1,61 @@
+import pytest
+import sys
+import os
+import json
+sys.path.append(os.path.pardir)
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+from datetime import datetime as dt, timezone
+from envlog import NightWeather, get_pv_keymap
+"""
+test_envlog.py tests the night-level weather cache against a file-backed stand-in archiver.
+"""
+
+
+def write_pv(archiver, pv, samples):
+    data = [{'meta': {'name': pv}, 'data': [{'secs': s, 'nanos': 250000000, 'val': v} for s, v in samples]}]
+    with open(os.path.join(archiver, f'{pv}.json'), 'w') as f: json.dump(data, f)
+
+
+@pytest.fixture
+def weather(tmp_path):
+    start = dt(2020, 1, 1, 19, 0, 0)
+    end = dt(2020, 1, 2, 19, 0, 0)
+    t0 = int(dt(2020, 1, 2, 8, 0, 0).replace(tzinfo=timezone.utc).timestamp())
+    keymap = get_pv_keymap(1)
+    for kw, pv in keymap.items():
+        if kw == 'wx_winddir': continue
+        #written out of order on purpose
+        write_pv(str(tmp_path), pv, [(t0 + 20, 3.0), (t0, 1.0), (t0 + 10, 2.0)])
+    return NightWeather(1, start, end, archiver=str(tmp_path)), t0
+
+
+def test_lookup_closest(weather):
+    nw, t0 = weather
+    data, errors, warns = nw.lookup('2020-01-02', '08:00:12.00')
+    assert errors == []
+    assert data['wx_outtmp'] == 2.0
+    assert data['wx_time'] == '08:00:10.25'
+    assert data['fwhm_time'] == '08:00:10.25'
+    assert data['wx_winddir'] == 'null'
+    assert len(warns) == 1
+
+
+def test_pv_fetched_once(weather):
+    nw, t0 = weather
+    nw.lookup('2020-01-02', '08:00:01.00')
+    nw.lookup('2020-01-02', '08:00:19.00')
+    assert nw.numFetches == len(nw.keymap)
+
+
+def test_outside_interval(weather):
+    nw, t0 = weather
+    #last sample before the frame is used however old (ie PVs archived on change)
+    data, errors, warns = nw.lookup('2020-01-02', '09:00:00.00')
+    assert data['wx_outtmp'] == 3.0
+    #samples more than interval secs after the frame are not
+    data, errors, warns = nw.lookup('2020-01-02', '07:59:20.00')
+    assert data['wx_outtmp'] == 'null'
+    data, errors, warns = nw.lookup('2020-01-02', '07:59:40.00')
+    assert data['wx_outtmp'] == 1.0
+    assert nw.in_window(dt(2020, 1, 2, 9, 0, 0))
+    assert not nw.in_window(dt(2020, 1, 3, 9, 0, 0))
@@ -0,0 +1,35 @@
+import pytest
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+np = pytest.importorskip('numpy')
+import image_moments
+"""
+test_image_moments.py checks one-pass moments against numpy/scipy and the subsample error bound.
+"""
+
+
+def test_moments():
+    rng = np.random.default_rng(1)
+    image = (rng.gamma(2.0, 300.0, (1024, 1024)) + 100).astype(np.int16)
+    m = image_moments.get_moments(image, blockRows=100)
+    assert m['n'] == image.size
+    assert m['mean'] == pytest.approx(np.mean(image), rel=1e-12)
+    assert m['std'] == pytest.approx(np.std(image), rel=1e-12)
+    stats = pytest.importorskip('scipy.stats')
+    assert m['kurtosis'] == pytest.approx(stats.kurtosis(image, axis=None), rel=1e-9)
+
+
+def test_subsample():
+    rng = np.random.default_rng(2)
+    image = rng.normal(1000.0, 30.0, (1024, 1024)).astype(np.float32)
+    m = image_moments.get_moments(image, step=4)
+    assert m['n'] == 256 * 256
+    #within 5 sigma of documented bounds
+    assert abs(m['mean'] - 1000.0) < 5 * 30.0 / 256
+    assert abs(m['std'] / 30.0 - 1) < 5 * np.sqrt(2 / (4 * 256 * 256))
+    assert abs(m['kurtosis']) < 5 * np.sqrt(24 / (256 * 256))
+
+
+def test_empty():
+    assert np.isnan(image_moments.get_moments(np.zeros((0, 10)))['mean'])
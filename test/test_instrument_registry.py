@@ -0,0 +1,31 @@
+import pytest
+import sys
+import os
+import json
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+import instrument_registry
+"""
+test_instrument_registry.py checks the instrument list is built from defaults and config, and the disk cache only fills in values.
+"""
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(instrument_registry, '_registry', {})
+    monkeypatch.setattr(instrument_registry, '_seeded', False)
+    return instrument_registry
+
+
+def test_cache_does_not_add_instruments(registry, tmp_path):
+    cacheFile = str(tmp_path / 'instruments.cache.json')
+    with open(cacheFile, 'w') as f:
+        json.dump({'EVIL': {'TELNR': 1}, 'NEWCAM': {'TELNR': 2}, 'HIRES': {'TELNR': 2}}, f)
+    config = {'MISC': {'INSTR_CACHE_FILE': cacheFile}, 'API': {'TELAPI': ''},
+              'NEWCAM': {'ENDTIME': '19:00:00'}, 'NIRC2': {'ENDTIME': '18:00:00'}}
+
+    instrs = registry.get_instruments(config)
+    assert 'NEWCAM' in instrs and 'EVIL' not in instrs and 'MISC' not in instrs
+    assert registry.get_telnr('NEWCAM', config) == 2
+    assert registry.get_telnr('HIRES', config) == 1
+    assert registry.get_end_time('NIRC2', config) == '18:00:00'
+    assert 'EVIL' not in registry.get_instr_list(config)
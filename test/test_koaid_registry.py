@@ -0,0 +1,54 @@
+import pytest
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+from koaid_registry import KoaidRegistry
+"""
+test_koaid_registry.py checks KOAID duplicate claims (in memory and shared via stage dir) and the date window check.
+"""
+
+
+def test_claims(tmp_path):
+    reg = KoaidRegistry('2020-01-01', '20:00:00', str(tmp_path))
+    assert reg.claim('NC.20200101.00001.fits', '/sdata/scam/a.fits')
+    assert not reg.claim('NC.20200101.00001.fits', '/sdata/spec/b.fits')
+    assert reg.claim('NC.20200101.00001.fits', '/sdata/scam/a.fits')
+    assert 'NC.20200101.00001.fits' in reg and len(reg) == 1
+
+    #second worker sharing the stage dir
+    reg2 = KoaidRegistry('2020-01-01', '20:00:00', str(tmp_path))
+    assert not reg2.claim('NC.20200101.00001.fits', '/sdata/spec/b.fits')
+    assert reg2.claim('NC.20200101.00001.fits', '/sdata/scam/a.fits')
+
+    #released claims can be taken by another file
+    reg.release('NC.20200101.00001.fits', '/sdata/scam/a.fits')
+    reg3 = KoaidRegistry('2020-01-01', '20:00:00', str(tmp_path))
+    assert reg3.claim('NC.20200101.00001.fits', '/sdata/spec/b.fits')
+
+
+def test_stale_claims(tmp_path):
+    reg = KoaidRegistry('2020-01-01', '20:00:00', str(tmp_path), runId='run1')
+    assert reg.claim('NC.20200101.00001.fits', '/sdata/scam/a.fits')
+
+    #unfinished run's claims still count
+    reg2 = KoaidRegistry('2020-01-01', '20:00:00', str(tmp_path), runId='run2')
+    assert not reg2.claim('NC.20200101.00001.fits', '/sdata/spec/b.fits')
+
+    #finished run's claims are taken over by the next run, then count against others
+    reg.finish()
+    reg3 = KoaidRegistry('2020-01-01', '20:00:00', str(tmp_path), runId='run3')
+    assert reg3.claim('NC.20200101.00001.fits', '/sdata/spec/b.fits')
+    assert not reg2.claim('NC.20200101.00001.fits', '/sdata/scam/a.fits')
+
+    #claims from before run ids were stored are stale
+    with open(tmp_path / 'koaids' / 'NC.20200101.00002.fits', 'w') as f: f.write('/sdata/scam/c.fits')
+    assert reg3.claim('NC.20200101.00002.fits', '/sdata/spec/d.fits')
+
+
+def test_date_ok():
+    reg = KoaidRegistry('2020-01-01', '20:00:00')
+    assert reg.is_date_ok('HI.20200101.12345.fits')
+    assert reg.is_date_ok('HI.20191231.80000.fits')
+    assert reg.is_date_ok('HI.20191230.80000.fits')
+    assert not reg.is_date_ok('HI.20191230.12345.fits')
+    assert not reg.is_date_ok('HI.20200105.00010.fits')
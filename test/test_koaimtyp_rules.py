@@ -0,0 +1,117 @@
+import pytest
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+import koaimtyp_rules
+"""
+test_koaimtyp_rules.py checks the KOAIMTYP rule engine and each instrument's rule table against a small header corpus.
+"""
+
+
+CORPUS = {
+    'DEIMOS': [
+        ({'OUTDIR': '/sdata/fcs/dmoseng', 'OBSTYPE': 'Object'}, 'fcscal'),
+        ({'OBSTYPE': 'Bias'}, 'bias'),
+        ({'SLMSKNAM': 'GOH_X', 'HATCHPOS': 'open'}, 'focus'),
+        ({'HATCHPOS': 'closed', 'LAMPS': 'Qz'}, 'flatlamp'),
+        ({'HATCHPOS': 'closed', 'LAMPS': 'Ne Ar Kr', 'GRATEPOS': 3}, 'arclamp'),
+        ({'HATCHPOS': 'open', 'FLSPECTR': 'on'}, 'flatlamp'),
+        ({'HATCHPOS': 'open'}, 'object'),
+        ({'HATCHPOS': 'closed', 'LAMPS': 'Off'}, 'undefined'),
+    ],
+    'ESI': [
+        ({'OBSTYPE': 'Dark'}, 'dark'),
+        ({'SLMSKNAM': 'MultiHoles', 'HATCHPOS': 'closed', 'LAMPQTZ1': 'on', 'PRISMNAM': 'in', 'IMFLTNAM': 'out'}, 'trace'),
+        ({'SLMSKNAM': 'MultiHoles', 'HATCHPOS': 'closed', 'LAMPNE1': 'on', 'PRISMNAM': 'in', 'IMFLTNAM': 'out'}, 'focus'),
+        ({'SLMSKNAM': 'MultiHoles', 'HATCHPOS': 'open', 'PRISMNAM': 'in', 'IMFLTNAM': 'out', 'EL': 45.0}, 'trace'),
+        ({'SLMSKNAM': '0.75_arcsec', 'HATCHPOS': 'closed', 'LAMPCU1': 'on', 'PRISMNAM': 'in', 'IMFLTNAM': 'out'}, 'arclamp'),
+        ({'SLMSKNAM': '0.75_arcsec', 'HATCHPOS': 'open', 'OBSTYPE': 'DmFlat', 'AXESTAT': 'tracking', 'EL': 45.0}, 'flatlamp'),
+        ({'SLMSKNAM': '0.75_arcsec', 'HATCHPOS': 'open', 'AXESTAT': 'tracking', 'DOMESTAT': 'tracking', 'EL': 60.0}, 'object'),
+    ],
+    'HIRES': [
+        ({'AUTOSHUT': 1, 'LAMPNAME': 'none', 'LMIRRIN': 0, 'DARKCLOS': 0}, 'undefined'),
+        ({'AUTOSHUT': 0, 'LAMPNAME': 'none', 'LMIRRIN': 0, 'DARKCLOS': 1, 'TTIME': 0}, 'bias'),
+        ({'AUTOSHUT': 0, 'LAMPNAME': 'quartz1', 'LMIRRIN': 1, 'DARKCLOS': 1, 'TTIME': 300}, 'dark_lamp_on'),
+        ({'AUTOSHUT': 1, 'LAMPNAME': 'quartz1', 'LMIRRIN': 1, 'DARKCLOS': 0, 'TTIME': 1, 'DECKNAME': 'D5',
+          'CATCUR1': 0.0, 'CATCUR2': 0.0, 'HATCLOS': 1}, 'trace'),
+        ({'AUTOSHUT': 1, 'LAMPNAME': 'ThAr2', 'LMIRRIN': 1, 'DARKCLOS': 0, 'TTIME': 1, 'DECKNAME': 'C1',
+          'CATCUR1': 0.0, 'CATCUR2': 10.0, 'HATCLOS': 1}, 'arclamp'),
+        ({'AUTOSHUT': 1, 'LAMPNAME': 'ThAr1', 'LMIRRIN': 1, 'DARKCLOS': 0, 'TTIME': 1, 'DECKNAME': 'C1',
+          'CATCUR1': 0.0, 'CATCUR2': 10.0, 'HATCLOS': 1}, 'undefined'),
+        ({'AUTOSHUT': 1, 'LAMPNAME': 'none', 'LMIRRIN': 0, 'DARKCLOS': 0, 'TTIME': 600, 'DECKNAME': 'C2',
+          'CATCUR1': 0.0, 'CATCUR2': 0.0, 'HATCLOS': 0}, 'object'),
+    ],
+    'KCWI': [
+        ({'CAMERA': 'FPC', 'XPOSURE': 0.0}, 'fpc'),
+        ({'CAMERA': 'BLUE', 'XPOSURE': 0.0}, 'bias'),
+        ({'CAMERA': 'BLUE', 'XPOSURE': 10.0, 'IMTYPE': 'ARCLAMP'}, 'arclamp'),
+        ({'CAMERA': 'BLUE', 'XPOSURE': 10.0}, 'undefined'),
+    ],
+    'LRIS': [
+        ({'INSTRUME': 'LRIS', 'OUTFILE': 'rfoc'}, 'focus'),
+        ({'INSTRUME': 'LRIS', 'ELAPTIME': 0}, 'bias'),
+        ({'INSTRUME': 'LRIS', 'TRAPDOOR': 'open', 'FLAMP1': 'on'}, 'flatlamp'),
+        ({'INSTRUME': 'LRIS', 'TRAPDOOR': 'open', 'AUTOSHUT': True, 'CALNAME': 'ir'}, 'polcal'),
+        ({'INSTRUME': 'LRIS', 'TRAPDOOR': 'open', 'AXESTAT': 'tracking'}, 'object'),
+        ({'INSTRUME': 'LRIS', 'TRAPDOOR': 'closed', 'LAMPS': '0,0,0,0,0,1'}, 'flatlamp'),
+        ({'INSTRUME': 'LRISBLUE', 'TRAPDOOR': 'closed', 'LAMPS': '1,0,0,0,0,0', 'GRISNAME': '600/4000'}, 'arclamp'),
+        ({'INSTRUME': 'LRIS', 'TRAPDOOR': 'closed', 'NEON': 'on', 'GRANAME': '600/7500'}, 'arclamp'),
+        ({'INSTRUME': 'LRIS', 'TRAPDOOR': 'closed', **{k: 'off' for k in koaimtyp_rules.LRIS_ARCS + ('HALOGEN',)}}, 'dark'),
+    ],
+    'NIRC2': [
+        ({'SHRNAME': 'open', 'OBSFNAME': 'telescope', 'DOMESTAT': 'tracking', 'AXESTAT': 'tracking'}, 'object'),
+        ({'SHRNAME': 'open', 'OBSFNAME': 'telescope', 'GRSNAME': 'lowres', 'DOMESTAT': 'tracking'}, 'specTBD'),
+        ({'SHRNAME': 'open', 'OBSFNAME': 'telescope', 'GRSNAME': 'clear', 'FLIMAGIN': 'on'}, 'flatlamp'),
+        ({'SHRNAME': 'open', 'OBSFNAME': 'telescope', 'GRSNAME': 'clear', 'EL': '45.0'}, 'flatTBD'),
+        ({'SHRNAME': 'open', 'OBSFNAME': 'telsim', 'ARGONPWR': 1, 'DATE-OBS': '2015-01-01'}, 'arclamp'),
+        ({'SHRNAME': 'open', 'OBSFNAME': 'telsim', 'ARGONPWR': 1, 'DATE-OBS': '2010-01-01'}, 'undefined'),
+        ({'SHRNAME': 'closed', 'ITIME': 0.0}, 'bias'),
+        ({'SHRNAME': 'closed', 'ITIME': 10.0}, 'dark'),
+    ],
+    'NIRSPEC': [
+        ({'OBSTYPE': 'Telluric'}, 'object'),
+        ({'OBSTYPE': 'calib', 'NEON': 'on', 'CALMPOS': 'In', 'CALPPOS': 'Out'}, 'arclamp'),
+        ({'OBSTYPE': 'calib', 'CALMPOS': 'in'}, 'flatlampoff'),
+        ({'OBSTYPE': 'calib', 'ITIME': 0.5, 'CALMPOS': 'out', 'CALPPOS': 'in'}, 'bias'),
+        ({'ITIME': 5.0, 'CALMPOS': 'out', 'CALPPOS': 'out'}, 'object'),
+    ],
+    'OSIRIS': [
+        ({'PCSFX': '1.0', 'PCSFY': 2.0, 'PCSFLZ': 3.0}, 'calib'),
+        ({'PCSFX': 0, 'INSTR': 'imag', 'IFILTER': 'Drk'}, 'dark'),
+        ({'PCSFX': 0, 'INSTR': 'imag', 'FLAMP1': 'On', 'EL': 45.0, 'AZ': 10.0, 'DOMEPOSN': 100.0}, 'flatlamp'),
+        ({'PCSFX': 0, 'INSTR': 'imag', 'FLAMP1': 'On', 'EL': 60.0}, 'undefined'),
+        ({'PCSFX': 0, 'INSTR': 'imag', 'AXESTAT': 'tracking', 'DOMESTAT': 'slewing'}, 'object'),
+        ({'PCSFX': 0, 'INSTR': 'spec', 'DATAFILE': 'c1234.fits'}, 'calib'),
+        ({'PCSFX': 0, 'INSTR': 'spec', 'DATAFILE': 's1234.fits'}, 'undefined'),
+    ],
+}
+
+
+@pytest.mark.parametrize('instr', sorted(CORPUS))
+def test_corpus(instr):
+    table = getattr(koaimtyp_rules, instr)
+    headers = [h for h, expected in CORPUS[instr]]
+    assert table.classify_headers(headers) == [expected for h, expected in CORPUS[instr]]
+
+
+def test_first_match_and_memo():
+    table = koaimtyp_rules.RuleTable('TEST',
+        fields=[koaimtyp_rules.Field('A', lower=True), koaimtyp_rules.Field('B', num=True)],
+        rules=[
+            ('a1', [('A', 'eq', 'x'), ('B', 'ge', 1)]),
+            ('a2', [('A', 'eq', 'x'), ('B', 'lt', 1)]),
+            ('b',  [('B', 'between', (5, 10))]),
+            ('a3', [('A', 'eq', 'x')]),
+        ])
+    #leading A == x condition is shared by the first two rules only (a3 comes after b)
+    assert len(table.tree) == 3
+    assert table.classify_headers([{'A': 'X', 'B': '2'}, {'A': 'x', 'B': 0}, {'A': 'x', 'B': 'bad'},
+                                   {'A': 'y', 'B': 7}, {}]) == ['a1', 'a2', 'a3', 'b', 'undefined']
+    assert len(table.results) == 5
+    assert table.classify(('x', 2.0)) == 'a1'
+    assert len(table.results) == 5
+
+
+def test_keyword_map():
+    headers = [{'TTIME2': 0}, {'ELAPTIME': 0}]
+    assert koaimtyp_rules.LRIS.classify_headers(headers, {'ELAPTIME': ['ELAPTIME', 'TTIME2']}) == ['bias', 'bias']
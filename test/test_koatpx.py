@@ -0,0 +1,71 @@
+import pytest
+import sys
+import os
+import yaml
+sys.path.append(os.path.pardir)
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+import db_conn
+from common import KoaTpxRecord
+"""
+test_koatpx.py runs KoaTpxRecord batched upserts against a local sqlite stand-in for koa.koatpx.
+"""
+
+KOATPX_TABLE = '''create table koatpx (
+    instr varchar(15) not null,
+    utdate date not null,
+    files varchar(5), ondisk_stat varchar(15), ondisk_time varchar(15),
+    files_arch varchar(5), pi varchar(68), sdata varchar(15), sci_files varchar(5),
+    arch_stat varchar(15), arch_time varchar(15), size float,
+    primary key (instr, utdate)
+)'''
+
+
+@pytest.fixture
+def db(tmp_path):
+    config = {'DATABASE': {'koa': {'server': str(tmp_path / 'koa.db'), 'user': '', 'pwd': '', 'type': 'sqlite'}}}
+    configFile = tmp_path / 'config.yaml'
+    with open(configFile, 'w') as f: yaml.safe_dump(config, f)
+    db = db_conn.db_conn(str(configFile), configKey='DATABASE', persist=True)
+    db.query('koa', KOATPX_TABLE)
+    yield db
+    db.close()
+
+
+def test_flush_inserts_then_updates(db):
+    rec = KoaTpxRecord('HIRES', '2020-01-01', db=db)
+    rec.set('files', 10)
+    rec.set('ondisk_stat', 'DONE')
+    assert rec.flush()
+    assert rec.pending == {}
+
+    rec.update({'ondisk_stat': 'ERROR', 'sci_files': 4})
+    assert rec.flush()
+
+    rows = db.query('koa', 'select * from koatpx')
+    assert len(rows) == 1
+    assert rows[0]['files'] == '10'
+    assert rows[0]['ondisk_stat'] == 'ERROR'
+    assert rows[0]['sci_files'] == '4'
+
+
+def test_records_are_independent(db):
+    KoaTpxRecord('HIRES', '2020-01-01', db=db).flush()
+    for instr in ('HIRES', 'NIRC2'):
+        rec = KoaTpxRecord(instr, '2020-01-02', db=db)
+        rec.set('arch_stat', 'DONE')
+        assert rec.flush()
+    rows = db.query('koa', 'select instr from koatpx where utdate=%s', params=['2020-01-02'])
+    assert sorted(r['instr'] for r in rows) == ['HIRES', 'NIRC2']
+
+
+def test_failed_flush_keeps_pending(db):
+    rec = KoaTpxRecord('HIRES', '2020-01-01', db=db)
+    rec.set('no_such_column', 'x')
+    assert rec.flush() is False
+    assert rec.pending == {'no_such_column': 'x'}
+
+
+def test_invalid_column_name(db):
+    rec = KoaTpxRecord('HIRES', '2020-01-01', db=db)
+    with pytest.raises(Exception):
+        rec.set('files="1"; drop table koatpx', 1)
@@ -0,0 +1,156 @@
+import pytest
+import sys
+import os
+import logging
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir, 'cit'))
+import koaxfr
+import offline_harness
+"""
+test_koaxfr.py checks the koaxfr transfer engine against a local target using the offline harness fake rsync.
+"""
+
+
+@pytest.fixture
+def log():
+    log = logging.getLogger('test_koaxfr')
+    log.setLevel(logging.INFO)
+    return log
+
+
+@pytest.fixture
+def outputDir(tmp_path, monkeypatch):
+    binDir = tmp_path / 'bin'
+    offline_harness.write_fake_rsync(str(binDir))
+    monkeypatch.setenv('PATH', str(binDir) + os.pathsep + os.environ['PATH'])
+    outputDir = tmp_path / 'HIRES' / '20200101'
+    for sub, name, size in (('lev0', 'HI.20200101.1.fits.gz', 100), ('lev0', 'HI.20200101.2.fits.gz', 50),
+                            ('anc', 'anc20200101.tar.gz', 10), ('', 'README', 5)):
+        os.makedirs(outputDir / sub, exist_ok=True)
+        (outputDir / sub / name).write_bytes(b'x' * size)
+    return str(outputDir)
+
+
+def test_rsync_cmds(outputDir):
+    cmds = dict(koaxfr.get_rsync_cmds(outputDir, 'koa@host:/koa/HIRES', False))
+    assert list(cmds) == ['koaxfr', 'koaxfr_lev0', 'koaxfr_anc']
+    assert '--exclude=/20200101/lev0' in cmds['koaxfr'] and '--exclude=/20200101/lev1' not in cmds['koaxfr']
+    assert f'--skip-compress={koaxfr.SKIP_COMPRESS}' in cmds['koaxfr_lev0']
+    assert cmds['koaxfr_lev0'][-2:] == [os.path.join(outputDir, 'lev0'), 'koa@host:/koa/HIRES/20200101']
+    cmds = dict(koaxfr.get_rsync_cmds(outputDir, '/koa/HIRES', True))
+    assert '-z' not in cmds['koaxfr_anc']
+
+
+def test_get_target():
+    xfr = {'SERVER': 'host', 'ACCOUNT': 'koa', 'DIR': '/koa'}
+    assert koaxfr.get_target(xfr, 'HIRES') == ('koa@host:/koa/HIRES', False)
+    assert koaxfr.get_target(dict(xfr, SERVER=''), 'HIRES') == (os.path.join('/koa', 'HIRES'), True)
+
+
+def test_transfer_local(outputDir, tmp_path, log):
+    target = str(tmp_path / 'target' / 'HIRES')
+    ok, stats = koaxfr.transfer(outputDir, target, True, log, timeout=60)
+    assert ok
+    assert os.path.getsize(os.path.join(target, '20200101', 'lev0', 'HI.20200101.2.fits.gz')) == 50
+    assert os.path.isfile(os.path.join(target, '20200101', 'anc', 'anc20200101.tar.gz'))
+    assert (stats['files'], stats['bytes'], stats['streams']) == (4, 165, 3)
+
+
+def test_rsync_stats():
+    rsyncStats = koaxfr.RsyncStats()
+    for line in ('Number of regular files transferred: 1,234\n', 'Total transferred file size: 2,000,000 bytes',
+                 'Number of files transferred: 6', 'Total bytes sent: 12', 'Total file size: 99 bytes'):
+        rsyncStats.parse(line)
+    assert rsyncStats.stats == {'files': 1240, 'bytes': 2000000, 'sent': 12}
+
+
+def test_send_ingest_retries(monkeypatch, log):
+    responses = [None, None, '{"stat": "OK"}']
+    monkeypatch.setattr(koaxfr, 'get_api_data', lambda url, timeout=None: responses.pop(0))
+    assert koaxfr.send_ingest('url', log, retries=3, timeout=1, waitSecs=0) == {'stat': 'OK'}
+    responses = [None, None]
+    assert koaxfr.send_ingest('url', log, retries=2, timeout=1, waitSecs=0) is None
+
+
+class InstrObj:
+    def __init__(self, root, log):
+        self.instr = 'hires'
+        self.utDate = '2020-01-01'
+        self.utDateDir = '20200101'
+        self.log = log
+        self.dirs = {'output': str(root / 'HIRES' / '20200101'), 'lev0': str(root / 'HIRES' / '20200101' / 'lev0'),
+                     'stage': str(root / 'stage')}
+        os.makedirs(self.dirs['stage'], exist_ok=True)
+
+
+def test_delta_transfer(outputDir, tmp_path, monkeypatch, log):
+    import json
+    import yaml
+    import koaxfr_manifest
+    monkeypatch.chdir(tmp_path)
+    target = tmp_path / 'target'
+    with open('config.live.ini', 'w') as f:
+        yaml.safe_dump({'KOAXFR': {'EMAILTO': '', 'EMAILFROM': '', 'EMAILERROR': '', 'SERVER': '', 'ACCOUNT': '',
+                                   'DIR': str(target)}, 'API': {'INGESTAPI': 'url?'}}, f)
+    monkeypatch.setattr(koaxfr, 'get_api_data', lambda url, timeout=None: '{"stat": "OK"}')
+    lev0 = os.path.join(outputDir, 'lev0')
+    with open(os.path.join(lev0, '20200101.FITS.md5sum.table'), 'w') as f:
+        f.write('aaa  HI.20200101.1.fits\nbbb  HI.20200101.2.fits\n')
+    instrObj = InstrObj(tmp_path, log)
+    tpxSets = []
+    class FakeTpxRecord:
+        def __init__(self, instr, utDate, log): pass
+        def set(self, col, val): tpxSets.append((col, val))
+        def flush(self): pass
+    monkeypatch.setattr(koaxfr, 'KoaTpxRecord', FakeTpxRecord)
+
+    #full, then no-op (koatpx still marked sent)
+    assert koaxfr.koaxfr(instrObj, tpx=1)
+    assert koaxfr.koaxfr(instrObj, tpx=1)
+    assert [val for col, val in tpxSets if col == 'dvdsent_stat'] == ['DONE', 'DONE']
+    #re-gzipped file with same table md5 is not resent, changed table md5 and new file are
+    with open(os.path.join(lev0, 'HI.20200101.1.fits.gz'), 'wb') as f: f.write(b'y' * 100)
+    with open(os.path.join(lev0, '20200101.FITS.md5sum.table'), 'w') as f:
+        f.write('aaa  HI.20200101.1.fits\nccc  HI.20200101.2.fits\n')
+    with open(os.path.join(outputDir, 'lev1.txt'), 'w') as f: f.write('new')
+    assert koaxfr.koaxfr(instrObj)
+
+    with open(os.path.join(instrObj.dirs['stage'], koaxfr_manifest.RECEIPTS_FILE)) as f:
+        receipts = [json.loads(line) for line in f]
+    assert [r['mode'] for r in receipts] == ['full', 'noop', 'delta']
+    assert receipts[0]['files'] == 5 and receipts[0]['ingest']
+    assert receipts[1]['tpx'] == 'DONE' and 'tpx' not in receipts[2]
+    assert receipts[2]['changed'] == 3 and receipts[2]['files'] == 3
+    night = target / 'HIRES' / '20200101'
+    assert (night / 'lev1.txt').read_text() == 'new'
+    assert (night / 'lev0' / 'HI.20200101.1.fits.gz').read_bytes() == b'x' * 100
+    assert koaxfr_manifest.load(instrObj.dirs['stage'])['files']['lev0/HI.20200101.2.fits.gz']['md5'] == 'ccc'
+
+
+def test_noop_resends_failed_ingest(outputDir, tmp_path, monkeypatch, log):
+    import json
+    import yaml
+    import koaxfr_manifest
+    monkeypatch.chdir(tmp_path)
+    with open('config.live.ini', 'w') as f:
+        yaml.safe_dump({'KOAXFR': {'EMAILTO': '', 'EMAILFROM': '', 'EMAILERROR': '', 'SERVER': '', 'ACCOUNT': '',
+                                   'DIR': str(tmp_path / 'target'), 'API_RETRIES': 1}, 'API': {'INGESTAPI': 'url?'}}, f)
+    responses = ['{"stat": "ERROR"}', '{"stat": "OK"}', None]
+    monkeypatch.setattr(koaxfr, 'get_api_data', lambda url, timeout=None: responses.pop(0))
+    monkeypatch.setattr(koaxfr, 'send_email', lambda *args: None)
+    instrObj = InstrObj(tmp_path, log)
+    tpxSets = []
+    class FakeTpxRecord:
+        def __init__(self, instr, utDate, log): pass
+        def set(self, col, val): tpxSets.append((col, val))
+        def flush(self): pass
+    monkeypatch.setattr(koaxfr, 'KoaTpxRecord', FakeTpxRecord)
+
+    #ingest fails, then no-op resends it, then no-op with ingest done does not call the API
+    for i in range(3): assert koaxfr.koaxfr(instrObj, tpx=1)
+    assert responses == [None]
+    assert [val for col, val in tpxSets if col == 'dvdsent_stat'] == ['ERROR', 'DONE', 'DONE']
+    with open(os.path.join(instrObj.dirs['stage'], koaxfr_manifest.RECEIPTS_FILE)) as f:
+        receipts = [json.loads(line) for line in f]
+    assert [(r['mode'], r.get('ingest')) for r in receipts] == [('full', False), ('noop', True), ('noop', None)]
+    assert koaxfr_manifest.load(instrObj.dirs['stage'])['ingest']
@@ -0,0 +1,76 @@
+import pytest
+import sys
+import os
+import threading
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+import lev0_manifest
+"""
+test_lev0_manifest.py checks manifest publishing, resume after a crash and tailing with the consumer helper.
+"""
+
+
+def write_file(lev0Dir, path, data):
+    filepath = os.path.join(lev0Dir, path)
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    with open(filepath, 'wb') as f:
+        f.write(data)
+
+
+def test_publish_and_read(tmp_path):
+    lev0Dir = str(tmp_path)
+    write_file(lev0Dir, 'HI.20200101.00001.fits', b'a' * 100)
+    write_file(lev0Dir, 'scam/NC.20200101.00002.fits', b'b' * 50)
+    manifest = lev0_manifest.Lev0Manifest(lev0Dir)
+    rec = manifest.add('HI.20200101.00001.fits', 'HI.20200101.00001.fits')
+    assert rec['size'] == 100 and rec['md5'] == lev0_manifest.get_md5(os.path.join(lev0Dir, rec['path']))
+
+    reader = lev0_manifest.ManifestReader(lev0Dir)
+    assert [r['koaid'] for r in reader.read_new()] == ['HI.20200101.00001.fits']
+    assert reader.status is None
+
+    manifest.add('NC.20200101.00002.fits', 'scam/NC.20200101.00002.fits')
+    manifest.end()
+    assert [r['path'] for r in reader.read_new()] == ['scam/NC.20200101.00002.fits']
+    assert reader.status == 'ok'
+
+
+def test_resume(tmp_path):
+    lev0Dir = str(tmp_path)
+    write_file(lev0Dir, 'HI.20200101.00001.fits', b'a' * 100)
+    manifest = lev0_manifest.Lev0Manifest(lev0Dir)
+    manifest.add('HI.20200101.00001.fits', 'HI.20200101.00001.fits')
+
+    #crash mid record
+    with open(lev0_manifest.get_manifest_file(lev0Dir), 'a') as f:
+        f.write('{"event": "file", "ko')
+
+    manifest = lev0_manifest.Lev0Manifest(lev0Dir)
+    assert list(manifest.files) == ['HI.20200101.00001.fits']
+    manifest.add('HI.20200101.00001.fits', 'HI.20200101.00001.fits')
+    manifest.end('error')
+
+    records, offset = lev0_manifest.read_records(lev0_manifest.get_manifest_file(lev0Dir))
+    assert [r['event'] for r in records] == ['start', 'file', 'start', 'end']
+    assert [r['seq'] for r in records] == [0, 1, 2, 3]
+    assert offset == os.path.getsize(lev0_manifest.get_manifest_file(lev0Dir))
+
+
+def test_follow(tmp_path):
+    lev0Dir = str(tmp_path)
+    manifest = lev0_manifest.Lev0Manifest(lev0Dir)
+
+    def writer():
+        for i in range(3):
+            path = f'HI.20200101.0000{i}.fits'
+            write_file(lev0Dir, path, bytes([i]) * 10)
+            manifest.add(path, path)
+        manifest.end()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    recs = list(lev0_manifest.ManifestReader(lev0Dir).follow(pollSecs=0.01, timeout=10))
+    thread.join()
+    assert [r['koaid'] for r in recs] == [f'HI.20200101.0000{i}.fits' for i in range(3)]
+
+    with pytest.raises(TimeoutError):
+        list(lev0_manifest.ManifestReader(str(tmp_path / 'none')).follow(pollSecs=0.01, timeout=0.05))
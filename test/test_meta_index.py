@@ -0,0 +1,61 @@
+import pytest
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+pytest.importorskip('pandas')
+pytest.importorskip('astropy')
+import meta_index
+"""
+test_meta_index.py checks incremental ingest of metadata.table files and cross-night queries.
+"""
+
+
+def write_meta_table(outFile, rows):
+    cols = [('KOAID', 24, 'char'), ('SEMID', 12, 'char'), ('OBJECT', 12, 'char'), ('NPIXSAT', 10, 'integer')]
+    with open(outFile, 'w') as f:
+        f.write(''.join('|' + c.ljust(w) for c, w, t in cols) + '|\n')
+        f.write(''.join('|' + t.ljust(w) for c, w, t in cols) + '|\n')
+        f.write(''.join('|' + ''.ljust(w) for c, w, t in cols) + '|\n')
+        f.write(''.join('|' + 'null'.ljust(w) for c, w, t in cols) + '|\n')
+        for row in rows:
+            f.write(''.join(' ' + str(v).ljust(w) for v, (c, w, t) in zip(row, cols)) + '\n')
+
+
+def test_meta_index(tmp_path):
+    night1 = str(tmp_path / '20190101.metadata.table')
+    night2 = str(tmp_path / '20190102.metadata.table')
+    write_meta_table(night1, [('HI.20190101.00001.fits', '2018B_H1', 'star1', 10),
+                              ('HI.20190101.00002.fits', '2018B_H1', 'star2', 5000)])
+    write_meta_table(night2, [('HI.20190102.00001.fits', '2018B_H2', 'star3', 2000)])
+
+    index = meta_index.MetaIndex(str(tmp_path / 'index.sqlite'))
+    assert index.ingest(night1) == 2
+    assert index.ingest(night2) == 1
+    assert index.ingest(night1) == 0
+
+    rows = index.query(instr='HIRES', utDateFrom='2019-01-01', utDateTo='2019-12-31',
+                       where=['NPIXSAT>1000'], keywords=['OBJECT'])
+    assert [r['koaid'] for r in rows] == ['HI.20190101.00002.fits', 'HI.20190102.00001.fits']
+    assert rows[0]['OBJECT'] == 'star2'
+    assert len(index.query(semid='2018B_H2')) == 1
+    assert len(index.query(where=[('OBJECT', 'LIKE', 'star%'), ('NPIXSAT', '<', 3000)])) == 2
+    with pytest.raises(ValueError): index.query(where=[('NPIXSAT', '> 0 or 1=1 or 1 >', 0)])
+    with pytest.raises(ValueError): index.query(where=[('NPIXSAT" or 1=1 --', '>', 0)])
+
+    #re-ingest replaces the night
+    write_meta_table(night1, [('HI.20190101.00001.fits', '2018B_H1', 'star1', 10)])
+    assert index.ingest(night1, force=True) == 1
+    assert len(index.query(utDateTo='2019-01-01')) == 1
+    assert index.get_night_df('HIRES', '2019-01-02').loc['HI.20190102.00001.fits', 'NPIXSAT'] == 2000
+    index.close()
+
+
+def test_parse_condition():
+    assert meta_index.parse_condition('NPIXSAT >= 10') == ('NPIXSAT', '>=', '10')
+    assert meta_index.parse_condition('OBJECT like star%') == ('OBJECT', ' like ', 'star%')
+    with pytest.raises(ValueError): meta_index.parse_condition('NPIXSAT')
+    assert meta_index.check_op(' LIKE ') == 'like'
+    for op in ('= 1 or 1=1 --', 'is not', '; drop table vals;', None):
+        with pytest.raises(ValueError): meta_index.check_op(op)
+    for kw in ('OBJECT"', 'NPIXSAT\n', ''):
+        with pytest.raises(ValueError): meta_index.check_keyword(kw)
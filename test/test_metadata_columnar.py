@@ -0,0 +1,64 @@
+import pytest
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+pytest.importorskip('pyarrow')
+fits = pytest.importorskip('astropy.io.fits')
+import metadata
+"""
+test_metadata_columnar.py checks the Parquet metadata sidecar has the same values as the
+metadata.table with typed columns.
+"""
+
+
+def write_keyword_table(outFile):
+    cols = ['FITSKeyword', 'MetadataDatatype', 'NullsAllowed', 'MetadataWidth', 'MinValue', 'MaxValue',
+            'Source', 'InputFormat', 'ValidateFormat', 'CheckValues', 'DiscreteValues']
+    keys = [('KOAID', 'char', '24'), ('OBJECT', 'char', '20'), ('FRAMENO', 'integer', '20'),
+            ('ELAPTIME', 'double', '20'), ('MISSING', 'double', '20')]
+    with open(outFile, 'w') as f:
+        f.write('\t'.join(cols) + '\n')
+        for key, dtype, width in keys:
+            f.write('\t'.join([key, dtype, 'Y', width, '', '', 'FITS', dtype, 'N', 'N', '']) + '\n')
+
+
+def test_columnar(tmp_path):
+    for i in range(3):
+        hdr = fits.Header({'KOAID': f'HI.20200101.0000{i}.fits', 'OBJECT': f'star {i}', 'FRAMENO': i, 'ELAPTIME': i * 1.5})
+        fits.PrimaryHDU(header=hdr).writeto(str(tmp_path / f'HI.20200101.0000{i}.fits'))
+    keyFile = str(tmp_path / 'KOA_HIRES_Keyword_Table.txt')
+    write_keyword_table(keyFile)
+
+    metaFile = str(tmp_path / '20200101.metadata.table')
+    metadata.make_metadata(keyFile, metaFile, str(tmp_path), dev=True, columnar=True)
+    assert os.path.isfile(str(tmp_path / '20200101.metadata.parquet'))
+
+    df = metadata.load_metadata_file_as_df(metaFile)
+    assert df['KOAID'].tolist() == [f'HI.20200101.0000{i}.fits' for i in range(3)]
+    assert str(df['FRAMENO'].dtype) == 'int64'
+    assert df['ELAPTIME'].tolist() == [0.0, 1.5, 3.0]
+    assert df['MISSING'].isnull().all()
+
+    os.remove(str(tmp_path / '20200101.metadata.parquet'))
+    assert metadata.compare_meta_files([metaFile, metaFile])[0]['warnings'] == []
+
+
+def test_columnar_error(tmp_path, monkeypatch):
+    #FRAMENO overflows int64
+    fits.PrimaryHDU(header=fits.Header({'KOAID': 'HI.20200101.00000.fits', 'FRAMENO': 2**70})).writeto(
+        str(tmp_path / 'HI.20200101.00000.fits'))
+    keyFile = str(tmp_path / 'KOA_HIRES_Keyword_Table.txt')
+    write_keyword_table(keyFile)
+    metaFile = str(tmp_path / '20200101.metadata.table')
+    colFile = str(tmp_path / '20200101.metadata.parquet')
+    assert metadata.make_metadata(keyFile, metaFile, str(tmp_path), dev=True, columnar=True)
+    assert not os.path.isfile(colFile)
+
+    #partial file from a failed write is removed
+    def write_partial(table, outFile):
+        with open(outFile, 'w') as f: f.write('partial')
+        raise OSError('disk full')
+    monkeypatch.setattr(metadata.pq, 'write_table', write_partial)
+    assert metadata.make_metadata(keyFile, metaFile, str(tmp_path), dev=True, columnar=True)
+    assert not os.path.isfile(colFile)
+    assert metadata.load_metadata_file_as_df(metaFile)['KOAID'].tolist() == ['HI.20200101.00000.fits']
@@ -0,0 +1,30 @@
+import pytest
+import sys
+import os
+import logging
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+pytest.importorskip('astropy')
+import getProgInfo
+"""
+test_observer_match.py checks split night assignment by observer names and the per-string memo.
+"""
+
+
+def get_prog_split(programs):
+    ps = getProgInfo.ProgSplit.__new__(getProgInfo.ProgSplit)
+    ps.programs = programs
+    ps.log = logging.getLogger('test_observer_match')
+    ps.progObserverSets = None
+    ps.observerMatches = {}
+    return ps
+
+
+def test_observer_match():
+    ps = get_prog_split([{'Observer': 'Ellis, Konidaris', 'Principal': 'Ellis'},
+                         {'Observer': 'Smith / Jones', 'Principal': 'Jones'},
+                         {'Observer': 'Jones-Brown', 'Principal': 'Brown'}])
+    assert ps.get_observer_array('Ellis, Konidaris, Belli, & Newman (UCLA)') == ['ellis', 'konidaris', 'belli', 'newman']
+    assert ps.get_observer_match('Konidaris et al.') == 0
+    assert ps.get_observer_match('Jones') == -1
+    assert ps.get_observer_match('unknown') == -1
+    assert ps.observerMatches == {'Konidaris et al.': 0, 'Jones': -1, 'unknown': -1}
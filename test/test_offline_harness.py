@@ -0,0 +1,67 @@
+import pytest
+import sys
+import os
+import json
+import sqlite3
+import subprocess
+from urllib.request import urlopen
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir, 'cit'))
+import offline_harness
+"""
+test_offline_harness.py checks the offline harness stand-ins (replay server, koa sqlite DB and
+fake rsync).  The full obtain -> koaxfr run is skipped without astropy/numpy.
+"""
+
+
+PROGRAM = {'semid': '2019B_H123', 'account': 'hires1', 'inst': 'UC', 'lastname': 'Harness',
+           'firstname': 'Test', 'title': 'Harness', 'utdate': '2020-01-01', 'propmin': 18}
+
+
+def get_json(url):
+    return json.loads(urlopen(url, timeout=5).read().decode('utf8'))
+
+
+def test_replay_server():
+    recordings = offline_harness.get_default_recordings('HIRES', '2020-01-01', 1, PROGRAM)
+    server = offline_harness.ReplayServer(recordings).start()
+    try:
+        d = get_json(f'{server.url}/telSchedule.php?cmd=getSchedule&date=2020-01-01&instr=HIRES')
+        assert d[0]['ProjCode'] == 'H123'
+        d = get_json(f'{server.url}/metrics.php?date=2020-01-01')
+        assert d[0]['sunrise'] == '16:10'
+        d = get_json(f'{server.url}/retrieval/data/getData.json?pv=k1:met:tempRaw'
+                     f'&from=2020-01-01T06:00:00Z&to=2020-01-01T06:10:00Z')
+        assert len(d[0]['data']) == 11
+        with pytest.raises(Exception): urlopen(f'{server.url}/unknown.php?cmd=x', timeout=5)
+    finally:
+        server.stop()
+    assert server.counts['telSchedule.php:getSchedule'] == 1
+    assert server.counts['getData.json'] == 1
+
+
+def test_standin_db(tmp_path):
+    dbFile = offline_harness.create_standin_db(str(tmp_path / 'koa.sqlite'), [PROGRAM])
+    conn = sqlite3.connect(dbFile)
+    row = conn.execute('select p.semid, pi.pi_lastname from koa_program p, koa_pi pi where p.piID=pi.piID').fetchone()
+    assert row == ('2019B_H123', 'Harness')
+    assert conn.execute('select count(*) from koatpx').fetchone()[0] == 0
+
+
+def test_fake_rsync(tmp_path):
+    rsync = offline_harness.write_fake_rsync(str(tmp_path / 'bin'))
+    src = tmp_path / 'HIRES' / '20200101'
+    src.mkdir(parents=True)
+    (src / 'a.fits').write_text('a')
+    target = tmp_path / 'target'
+    subprocess.run([rsync, '-avz', str(src), f'koa@localhost:{target}'], check=True, capture_output=True)
+    assert (target / '20200101' / 'a.fits').read_text() == 'a'
+
+
+def test_full_run(tmp_path):
+    pytest.importorskip('numpy')
+    pytest.importorskip('astropy')
+    args = offline_harness.argparse.Namespace(instr='HIRES', utDate='2020-01-01', telnr=1, nfiles=3,
+            workDir=str(tmp_path / 'run'), template=None, recordings=None, keywordTables=None, clean=False)
+    result = offline_harness.run_harness(args)
+    assert result['ok']
+    assert result['lev0_files'] >= 3
@@ -0,0 +1,63 @@
+import pytest
+import sys
+import os
+import socket
+import subprocess
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+pytest.importorskip('yaml')
+import dep_go_reprocess
+"""
+test_reprocess_queue.py checks that only RUNNING jobs of dead schedulers are requeued and a job can only be claimed once.
+"""
+
+
+def dead_pid():
+    proc = subprocess.Popen([sys.executable, '-c', 'pass'])
+    proc.wait()
+    return proc.pid
+
+
+def test_reset_stale_keeps_live_owners(tmp_path):
+    queue = dep_go_reprocess.ReprocessQueue(str(tmp_path / 'queue.sqlite'))
+    host = socket.gethostname()
+    jobs = {'2024-01-01': (host, os.getpid()),
+            '2024-01-02': (host, dead_pid()),
+            '2024-01-03': ('some-other-host', dead_pid()),
+            '2024-01-04': (None, None)}
+    for utDate, (ownerHost, ownerPid) in jobs.items():
+        queue.add('HIRES', utDate)
+        queue.set_status('HIRES', utDate, 'RUNNING', owner_host=ownerHost, owner_pid=ownerPid)
+
+    queue.reset_stale()
+    status = {job['utdate']: job['status'] for job in queue.get_jobs()}
+    assert status == {'2024-01-01': 'RUNNING', '2024-01-02': 'QUEUED',
+                      '2024-01-03': 'RUNNING', '2024-01-04': 'QUEUED'}
+
+
+def test_claim_once(tmp_path):
+    queueFile = str(tmp_path / 'queue.sqlite')
+    queue = dep_go_reprocess.ReprocessQueue(queueFile)
+    queue.add('HIRES', '2024-01-01')
+    other = dep_go_reprocess.ReprocessQueue(queueFile)
+    assert queue.claim('HIRES', '2024-01-01')
+    assert not other.claim('HIRES', '2024-01-01')
+    job = queue.get_jobs()[0]
+    assert job['status'] == 'RUNNING' and job['attempts'] == 1
+    assert job['owner_host'] == socket.gethostname() and job['owner_pid'] == os.getpid()
+
+
+def test_old_queue_file(tmp_path):
+    import sqlite3
+    queueFile = str(tmp_path / 'queue.sqlite')
+    conn = sqlite3.connect(queueFile)
+    conn.execute("create table jobs (instr varchar(15) not null, utdate varchar(10) not null, "
+                 "status varchar(10) not null default 'QUEUED', attempts int not null default 0, "
+                 "start_time varchar(20), end_time varchar(20), duration float, returncode int, "
+                 "logfile varchar(255), note varchar(255), primary key (instr, utdate))")
+    conn.execute("insert into jobs (instr, utdate, status) values ('HIRES', '2024-01-01', 'RUNNING')")
+    conn.commit()
+    conn.close()
+
+    queue = dep_go_reprocess.ReprocessQueue(queueFile)
+    queue.reset_stale()
+    assert queue.get_queued('HIRES') == ['2024-01-01']
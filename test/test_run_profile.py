@@ -0,0 +1,41 @@
+import pytest
+import sys
+import os
+import json
+sys.path.append(os.path.pardir)
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+import run_profile
+"""
+test_run_profile.py checks step records, call counts and per-file DQA substep timings.
+"""
+
+
+def test_profile(tmp_path):
+    profile = run_profile.RunProfile()
+    with profile.step('dqa'):
+        for filename in ('a.fits', 'b.fits', 'c.fits'):
+            profile.start_file(filename)
+            with profile.timer('run_dqa_checks'):
+                profile.add_time('set_a', 0.5)
+                profile.add_time('set_b', 0.25)
+                profile.add_time('set_b', 0.25)
+    profile.count('db')
+    profile.count('db', 2)
+
+    outFile = tmp_path / 'dep_TEST_20200101.profile.json'
+    profile.write(outFile)
+    with open(outFile) as f: d = json.load(f)
+
+    assert set(d['steps']['dqa']) >= {'wall', 'cpu', 'peak_rss_mb', 'bytes_read', 'bytes_written'}
+    assert d['counts'] == {'db': 3}
+    assert set(d['dqa_files']) == {'a.fits', 'b.fits', 'c.fits'}
+    assert d['dqa_summary']['set_a']['count'] == 3
+    assert d['dqa_summary']['set_b']['total'] == 1.5
+    assert d['dqa_summary']['set_b']['p95'] == 0.5
+    assert 'set_a' in profile.get_summary_table()
+
+
+def test_percentile():
+    assert run_profile.percentile([], 95) == 0
+    assert run_profile.percentile([1, 2, 3, 4, 5], 50) == 3
+    assert run_profile.percentile([1.0, 2.0], 100) == 2.0
@@ -0,0 +1,62 @@
+import pytest
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+import spectral_config
+"""
+test_spectral_config.py checks the memoized wavelength and spectral resolution calculators against known configurations.
+"""
+
+
+def test_hires_wavelengths():
+    assert spectral_config.get_hires_wavelengths('RED', 250.0, 0.5, 0.1) == (6480, 4460, 8910)
+    assert spectral_config.get_hires_wavelengths('UV', 400.0, -1.2, 0.3) == (2600, 'null', 4110)
+    assert spectral_config.get_hires_wavelengths('', 250.0, 0.5, 0.1) is None
+
+
+def test_lris_wavelengths():
+    for dateobs, waves in (('2016-07-20', (5860, 7500, 9140)), ('2014-07-20', (6190, 7500, 8810))):
+        args = ('LRIS', 'SPEC', '', '', '600/7500', '', 7500.0, dateobs, 'long_1.0', '560')
+        assert spectral_config.get_lris_wavelengths(*args) == waves
+
+
+def test_deimos():
+    assert spectral_config.get_deimos_wavelengths('longslit', 'GG455', '600ZD', 7500.0) == (4850, 7500, 10150)
+    assert spectral_config.get_deimos_specres('600ZD', 0.1185) == 1370.0
+
+
+def test_esi():
+    assert spectral_config.get_esi_wavelengths('image', 'V') == (4900, 5200, 6450)
+    assert spectral_config.get_esi_wavelengths('high', 'x') == spectral_config.ESI_SPEC_WAVES
+    assert spectral_config.get_esi_specres('high', 0.75) == 5500.0
+
+
+def test_nirspec():
+    assert spectral_config.get_nirspec_wavelengths('NIRSPEC-1') == (0.947, 1.034, 1.121)
+
+
+def test_cache():
+    spectral_config.clear_caches()
+    for i in range(3):
+        spectral_config.get_deimos_specres('600ZD', 0.1185)
+    info = spectral_config.get_deimos_specres.cache_info()
+    assert (info.hits, info.misses) == (2, 1)
+
+
+def test_batch():
+    calls = []
+    def func(a, b):
+        calls.append((a, b))
+        return a + b
+    assert spectral_config.get_batch(func, [1, 1, 2], [3, 3, 3]) == [4, 4, 5]
+    assert calls == [(1, 3), (2, 3)]
+
+
+def test_hires_batch():
+    pytest.importorskip('numpy')
+    xdispers = ['RED', 'UV', '', 'RED']
+    xdsigmai = [250.0, 400.0, 250.0, 250.0]
+    xdangl   = [0.5, -1.2, 0.5, 0.5]
+    echangl  = [0.1, 0.3, 0.1, 0.1]
+    expected = [spectral_config.get_hires_wavelengths(*row) for row in zip(xdispers, xdsigmai, xdangl, echangl)]
+    assert spectral_config.get_hires_wavelengths_batch(xdispers, xdsigmai, xdangl, echangl) == expected
@@ -0,0 +1,81 @@
+import pytest
+import sys
+import os
+import time
+import logging
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+import supervisor
+import run_profile
+"""
+test_supervisor.py checks supervised jobs: output streamed to log, exit status, timeout kill and run profile records.
+"""
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+    def emit(self, record):
+        self.lines.append(record.getMessage())
+
+
+@pytest.fixture
+def log():
+    log = logging.getLogger('test_supervisor')
+    log.setLevel(logging.INFO)
+    handler = ListHandler()
+    log.addHandler(handler)
+    yield log
+    log.removeHandler(handler)
+
+
+def test_job_ok(log):
+    profile = run_profile.reset()
+    job = supervisor.start('drp', [sys.executable, '-c', 'print("line1"); print("line2")'], log, timeout=30)
+    assert job.wait()
+    lines = log.handlers[0].lines
+    assert 'supervisor: drp: line1' in lines and 'supervisor: drp: line2' in lines
+    assert profile.jobs['drp']['status'] == 'ok'
+    assert profile.jobs['drp']['returncode'] == 0
+
+
+def test_job_failed_and_timeout(log):
+    profile = run_profile.reset()
+    failed = supervisor.start('bad', [sys.executable, '-c', 'import sys; sys.exit(3)'], log)
+    slow = supervisor.start('psfr', [sys.executable, '-c', 'import time; time.sleep(30)'], log, timeout=0.5)
+    missing = supervisor.start('missing', ['/nonexistent/drp'], log)
+    assert not supervisor.wait_all(timeout=20)
+    assert profile.jobs['bad']['returncode'] == 3
+    assert profile.jobs['psfr']['status'] == 'timeout'
+    assert slow.secs < 20
+    assert missing.status == 'error'
+    assert 'JOB psfr: timeout' in profile.get_summary_table()
+
+
+def test_wait_all_bounded_and_kill_all(log):
+    run_profile.reset()
+    job = supervisor.start('psfr', [sys.executable, '-c', 'import time; time.sleep(30)'], log, timeout=60)
+    start = time.time()
+    assert not supervisor.wait_all(timeout=0.5)
+    assert time.time() - start < 5
+    assert supervisor.kill_all() == 1
+    assert not job.wait(timeout=20)
+    assert job.done.is_set() and time.time() - start < 20
+    assert supervisor.kill_all() == 0
+
+
+def test_limits(log, monkeypatch):
+    job = supervisor.Job('drp', ['drp', 'out'], log, maxMemMb=100, maxCpuSecs=60, nice=5)
+    assert job.get_cmd('/usr/bin/prlimit') == ['/usr/bin/prlimit', f'--as={100*1024*1024}', '--cpu=60', '--',
+                                               'nice', '-n', '5', '--', 'drp', 'out']
+    assert job.get_cmd() == ['nice', '-n', '5', '--', 'drp', 'out']
+    assert supervisor.Job('drp', ['drp'], log).get_cmd('/usr/bin/prlimit') == ['drp']
+
+    #limits applied to the running job, with or without the prlimit command
+    code = 'import resource, os, time; time.sleep(0.5); print("limits", resource.getrlimit(resource.RLIMIT_CPU)[0], os.nice(0))'
+    which = supervisor.shutil.which
+    for prlimit in (which, lambda cmd: None):
+        monkeypatch.setattr(supervisor.shutil, 'which', prlimit)
+        job = supervisor.start('limits', [sys.executable, '-c', code], log, timeout=30, maxCpuSecs=60, nice=5)
+        assert job.wait()
+        assert log.handlers[0].lines.count('supervisor: limits: limits 60 5') == (1 if prlimit is which else 2)
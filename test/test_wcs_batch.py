@@ -0,0 +1,48 @@
+import pytest
+import sys
+import os
+import math
+sys.path.append(os.path.join(os.path.dirname(__file__), os.path.pardir))
+import wcs_batch
+"""
+test_wcs_batch.py checks the WCS calculations and the night WcsTable.
+"""
+
+
+def test_cd_matrix():
+    cd1_1, cd1_2, cd2_1, cd2_2 = wcs_batch.get_cd_matrix(0.0, 3600.0)
+    assert (cd1_1, cd1_2, cd2_1, cd2_2) == (-1.0, 0.0, 0.0, 1.0)
+    cd1_1, cd1_2, cd2_1, cd2_2 = wcs_batch.get_cd_matrix(90.0, 3600.0)
+    assert cd1_1 == pytest.approx(0.0, abs=1e-15) and cd2_2 == pytest.approx(0.0, abs=1e-15)
+    assert cd1_2 == pytest.approx(1.0) and cd2_1 == pytest.approx(1.0)
+
+
+def test_osiris_spec_crval():
+    ra, dec = wcs_batch.get_osiris_spec_crval(150.0, 0.0, 47.5 - 90)
+    assert ra == pytest.approx(150.0 + 15.42/3600.0)
+    assert dec == pytest.approx(-14.12/3600.0)
+
+
+def test_lris_center():
+    assert wcs_batch.get_lris_center('REF') == (485, 520)
+    assert wcs_batch.get_lris_center('bogus') == wcs_batch.get_lris_center('UNDEFINED')
+
+
+def test_table_lookup():
+    table = wcs_batch.WcsTable()
+    for i in range(3):
+        assert table.get_cd_matrix(12.0, 0.01) == wcs_batch.get_cd_matrix(12.0, 0.01)
+    assert (table.hits, table.misses) == (2, 1)
+
+
+def test_table_add():
+    pytest.importorskip('numpy')
+    table = wcs_batch.WcsTable()
+    pa = [12.0, 12.0, -33.3, 'bad']
+    pixscale = [0.01, 0.01, 0.04, 0.01]
+    assert table.add_cd(pa, pixscale) == 2
+    for args in ((12.0, 0.01), (-33.3, 0.04)):
+        assert table.get_cd_matrix(*args) == pytest.approx(wcs_batch.get_cd_matrix(*args), rel=1e-14)
+    assert (table.hits, table.misses) == (2, 0)
+    assert table.add_offsets([150.0], [20.0], [10.0]) == 1
+    assert table.get_osiris_spec_crval(150.0, 20.0, 10.0) == pytest.approx(wcs_batch.get_osiris_spec_crval(150.0, 20.0, 10.0))
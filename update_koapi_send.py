@@ -13,14 +13,17 @@ def update_koapi_send(utdate, semid, instr=None):
     print(f"updateKoapiSend: {utdate}, {semid}, {instr}")
 
     # db connect
-    db = db_conn.db_conn('config.live.ini', configKey='DATABASE')
+    db = db_conn.get_db('config.live.ini', configKey='DATABASE')
 
     #Get latest entry (by utdate_beg) matching semid and instr
-    query = f"select * from koapi_send where semid='{semid}' "
-    if instr: query += f" and instr='{instr}' " 
+    query = "select * from koapi_send where semid=%s "
+    params = [semid]
+    if instr:
+        query += " and instr=%s "
+        params.append(instr)
     query += " order by utdate_beg desc limit 1"
-    rows = db.query('koa', query)
-    print(query, rows)
+    rows = db.query('koa', query, params=params)
+    print(query, params, rows)
 
     #If no entry, then create one
     if (len(rows) == 0):
@@ -37,16 +40,7 @@ def update_koapi_send(utdate, semid, instr=None):
             pass
         else:
             #print("updateKoapiSend: New entry - first for semid")
-            query = "insert into koapi_send set "
-            query += f" semid='{semid}' "
-            query += f", utdate_beg='{utdate}' "
-            query += f", utdate_end='{utdate}' "
-            query += f", send_data=1 "
-            query += f", data_notified=0 "
-            query += f", send_dvd=1 "
-            query += f", dvd_notified=0 "
-            if instr: query += f", instr='{instr}' "
-            result = db.query('koa', query)
+            result = insert_koapi_send(db, utdate, semid, instr)
 
     # if existing entry see if we need to update (next day DEP only) or add a new one
     else:
@@ -62,10 +56,13 @@ def update_koapi_send(utdate, semid, instr=None):
                 break
             elif (diff_day == 1):
                 #print("updateKoapiSend: Updating entry for semid")
-                query = f"update koapi_send set utdate_end='{utdate}', send_data=1, send_dvd=1 "
-                query += f" where semid='{semid}' and utdate_beg='{row['utdate_beg']}' "
-                if instr: query += f" and instr='{instr}' " 
-                result = db.query('koa', query)
+                query = "update koapi_send set utdate_end=%s, send_data=1, send_dvd=1 "
+                query += " where semid=%s and utdate_beg=%s "
+                params = [utdate, semid, row['utdate_beg']]
+                if instr:
+                    query += " and instr=%s "
+                    params.append(instr)
+                result = db.query('koa', query, params=params)
                 break
             else:
                 if (diff_day < 0):
@@ -73,17 +70,21 @@ def update_koapi_send(utdate, semid, instr=None):
                     break
                 else:
                     #print ("updateKoapiSend: New entry for semid")
-                    query = "insert into koapi_send set "
-                    query += f" semid='{semid}' "
-                    query += f", utdate_beg='{utdate}' "
-                    query += f", utdate_end='{utdate}' "
-                    query += f", send_data=1 "
-                    query += f", data_notified=0 "
-                    query += f", send_dvd=1 "
-                    query += f", dvd_notified=0 "
-                    if instr: query += f", instr='{instr}' "
-                    result = db.query('koa', query)
+                    result = insert_koapi_send(db, utdate, semid, instr)
                     break
 
     return True
 
+
+def insert_koapi_send(db, utdate, semid, instr=None):
+    """
+    Inserts new koa.koapi_send record starting and ending on utdate.
+    """
+    cols = ['semid', 'utdate_beg', 'utdate_end', 'send_data', 'data_notified', 'send_dvd', 'dvd_notified']
+    params = [semid, utdate, utdate, 1, 0, 1, 0]
+    if instr:
+        cols.append('instr')
+        params.append(instr)
+    vals = ', '.join(['%s'] * len(cols))
+    query = f"insert into koapi_send ({', '.join(cols)}) values ({vals})"
+    return db.query('koa', query, params=params)
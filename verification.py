@@ -1,9 +1,11 @@
+import instrument_registry
+
+
 def verify_instrument(instr=''):
     """ Verify the instrument is an allowed value """
 
-    #todo: move this to instrument classes?
     assert instr != '', 'instrument value is blank'
-    allowed_instruments = ['DEIMOS', 'ESI', 'HIRES', 'KCWI', 'LRIS', 'MOSFIRE', 'NIRC2', 'NIRES', 'NIRSPEC', 'OSIRIS'];
+    allowed_instruments = instrument_registry.get_instruments()
     assert instr in allowed_instruments, 'unknown instrument value'
 
 def verify_date(date=''):
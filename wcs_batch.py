@@ -0,0 +1,149 @@
+'''
+WCS keyword calculations as functions of arrays of a night's values.
+
+get_cd_matrix() computes CD1_1..CD2_2 from sky PA and pixel scale, and get_osiris_spec_crval() the
+OSIRIS imager pointing offset from RA/Dec and rotator position.  Both take scalars (math) or arrays
+(xp=np), so a whole night can be done in one NumPy call.  WcsTable holds the results for a night keyed
+by their inputs; the per-file WCS setters (ie Nirc2.set_wcs) read from the table and only compute
+inputs the table has not seen.  Since the table is keyed by input values, a setter gets the same
+result (to float rounding) with or without a prefetched table (see Instrument.load_wcs_table).
+'''
+
+import math
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+#NIRC2 pixel scale (arcsec) and PA offset (deg) by camera
+#narrow = 0.7-0.252, correction from Yelda etal 2010
+NIRC2_PIXSCALE = {'narrow': 0.009952, 'medium': 0.019829, 'wide': 0.039686}
+NIRC2_PAZERO   = {'narrow': 0.448, 'medium': 0.7, 'wide': 0.7}
+
+#KCWI FPC pixel scale per binned pixel (arcsec) and PA offset (deg)
+KCWI_PIXSCALE = 0.0075
+KCWI_PAZERO   = 0.7
+
+#OSIRIS spec pickoff offset from imager: PA offset (deg) and x, y offset (arcsec)
+OSIRIS_SPEC_OFFSET = (47.5, 15.42, 14.12)
+OSIRIS_CDELT       = 0.0000055555556
+
+#LRIS pixel scale (arcsec) and pointing origin xim/yim by PONAME
+LRIS_PIXSCALE = 0.135
+LRIS_PONAMES  = {'REF':[380.865,71.44],
+                 'REFO':[-377.22,72.52],
+                 'LRIS':[3.97,-309.82],
+                 'slitb':[-14.41,-263.74],
+                 'slitc':[31.85,-262.58],
+                 'POL':[3.91,-273.12],
+                 'LRISB':[-53.11,-310.54],
+                 'PICKOFF':[27.95,-260.63],
+                 'MIRA':[3.67,-300.34],
+                 'BEDGE':[20.25,-260.68],
+                 'TEDGE':[-0.65,-263.68],
+                 'UNDEFINED':[-53.11,-320.54]}
+
+
+def get_cd_matrix(pa, pixscale, xp=math):
+    '''
+    Returns (CD1_1, CD1_2, CD2_1, CD2_2) for sky PA (deg) and pixel scale (arcsec).
+    '''
+    pa = -pa * xp.pi / 180.0
+    cos = xp.cos(pa)
+    sin = xp.sin(pa)
+    return (-pixscale * cos / 3600.0,
+            -pixscale * sin / 3600.0,
+            -pixscale * sin / 3600.0,
+             pixscale * cos / 3600.0)
+
+
+def get_osiris_spec_crval(ra, dec, rotposn, xp=math):
+    '''
+    Returns (CRVAL1, CRVAL2) of the OSIRIS imager when the spec pickoff is the pointing origin.
+    '''
+    offset, x, y = OSIRIS_SPEC_OFFSET
+    theta = (offset - (rotposn+90)) * xp.pi / 180.0
+    deltaRA = (x * xp.cos(theta) + y * xp.sin(theta)) / (xp.cos(dec*xp.pi/180.0)*3600.0)
+    deltaDEC = (x * xp.sin(theta) - y * xp.cos(theta)) / 3600.0
+    return ra + deltaRA, dec + deltaDEC
+
+
+def get_lris_center(poname):
+    '''
+    Returns LRIS pointing origin (xcen, ycen) in pixels for PONAME.
+    '''
+    if poname == 'REF':  return 485, 520
+    if poname == 'REFO': return 512, 512
+    xim, yim = LRIS_PONAMES.get(poname, LRIS_PONAMES['UNDEFINED'])
+    pixcorrect = lambda x: (x/LRIS_PIXSCALE) + 1024
+    return pixcorrect(yim+308.1), pixcorrect(3.4-xim)
+
+
+def get_lris_ext_wcs(xcen, ycen, crpix1, crpix2, crval1, crval2, cd11, cd22, xp=math):
+    '''
+    Returns (CRPIX1, CRPIX2, CDELT1, CDELT2) for LRIS extensions with original CRPIX, CRVAL and CD values.
+    '''
+    if xp is not math:
+        crpix1, crpix2, crval1, crval2, cd11, cd22 = (xp.asarray(v, dtype=xp.float64)
+                                                     for v in (crpix1, crpix2, crval1, crval2, cd11, cd22))
+    return (crpix1 + ((xcen - crval1)/cd11),
+            crpix2 + ((ycen - crval2)/cd22),
+            cd11 * LRIS_PIXSCALE,
+            cd22 * LRIS_PIXSCALE)
+
+
+class WcsTable:
+    '''
+    Night table of CD matrices keyed by (pa, pixscale) and OSIRIS offsets keyed by (ra, dec, rotposn).
+    '''
+
+    def __init__(self):
+        self.cd      = {}
+        self.offsets = {}
+        self.hits    = 0
+        self.misses  = 0
+
+
+    def add(self, table, func, rows):
+        '''
+        Computes func for rows (tuples of args) not yet in table, in one NumPy call if available.
+        '''
+        #non-numeric rows are left for the per-file lookup
+        keys = [key for key in dict.fromkeys(rows) if key not in table
+                and all(isinstance(v, (int, float)) for v in key)]
+        if not keys: return 0
+        if np is None:
+            for key in keys: table[key] = func(*key)
+            return len(keys)
+        columns = [np.array(col, dtype=np.float64) for col in zip(*keys)]
+        results = [np.broadcast_to(res, (len(keys),)).tolist() for res in func(*columns, xp=np)]
+        for key, row in zip(keys, zip(*results)):
+            table[key] = row
+        return len(keys)
+
+
+    def add_cd(self, pa, pixscale):
+        return self.add(self.cd, get_cd_matrix, zip(pa, pixscale))
+
+
+    def add_offsets(self, ra, dec, rotposn):
+        return self.add(self.offsets, get_osiris_spec_crval, zip(ra, dec, rotposn))
+
+
+    def lookup(self, table, func, key):
+        val = table.get(key)
+        if val is None:
+            self.misses += 1
+            val = table[key] = func(*key)
+        else:
+            self.hits += 1
+        return val
+
+
+    def get_cd_matrix(self, pa, pixscale):
+        return self.lookup(self.cd, get_cd_matrix, (pa, pixscale))
+
+
+    def get_osiris_spec_crval(self, ra, dec, rotposn):
+        return self.lookup(self.offsets, get_osiris_spec_crval, (ra, dec, rotposn))